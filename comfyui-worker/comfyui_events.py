@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+ComfyUI WebSocket event stream for job completion tracking.
+
+ComfyUI pushes execution events over /ws?clientId=... to the client that
+queued a prompt: execution_start, executing, progress, executed,
+execution_error / execution_interrupted, and finally executing with
+node=None once the prompt's history entry has been written. One
+ComfyUIEventStream per ComfyUI instance keeps that socket open on a daemon
+thread and records the latest state of every prompt queued with its
+client_id, so a waiting job wakes the moment its prompt finishes instead of
+on the next 2 s /history poll.
+
+The stream is an optimisation only. While it is disconnected (websockets not
+installed, ComfyUI restarting, a proxy without WebSocket support) wait()
+returns straight away and callers fall back to polling /history.
+
+Integration points:
+- worker.py: ComfyUIClient queues prompts with stream.client_id and waits
+  on the stream in wait_for_completion()
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+try:
+    from websockets.exceptions import WebSocketException
+    from websockets.sync.client import connect
+except ImportError:
+    # Optional: without websockets the worker polls /history as before
+    connect = None
+    WebSocketException = Exception
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_MAX_DELAY = 30  # seconds between reconnect attempts, at most
+MAX_TRACKED_PROMPTS = 1000  # finished prompts nobody collected are pruned past this
+
+# Prompt states
+RUNNING = "running"
+DONE = "done"  # executing node=None: history entry is written
+ERROR = "error"
+INTERRUPTED = "interrupted"
+CANCELLED = "cancelled"  # set locally by cancel(): the job was taken back
+FINISHED = (DONE, ERROR, INTERRUPTED, CANCELLED)
+
+
+def ws_url_for(base_url: str) -> str:
+    """http(s)://host:port[/prefix] -> ws(s)://host:port[/prefix]/ws"""
+    parts = urlsplit(base_url.rstrip('/'))
+    scheme = "wss" if parts.scheme == "https" else "ws"
+    return urlunsplit((scheme, parts.netloc, parts.path + "/ws", "", ""))
+
+
+def describe_error(data: Dict[str, Any]) -> str:
+    """Readable message from an execution_error payload"""
+    where = data.get("node_type") or "workflow"
+    if data.get("node_id"):
+        where = f"{where} (node {data['node_id']})"
+    message = data.get("exception_message") or "Unknown error"
+    if data.get("exception_type"):
+        message = f"{data['exception_type']}: {message}"
+    return f"{where}: {message.strip()}"
+
+
+class ComfyUIEventStream:
+    """Background WebSocket listener tracking prompt progress for one ComfyUI"""
+
+    def __init__(self, base_url: str, ws_url: Optional[str] = None, client_id: Optional[str] = None):
+        self.client_id = client_id or uuid.uuid4().hex
+        self.ws_url = ws_url or ws_url_for(base_url)
+        self._prompts: Dict[str, Dict[str, Any]] = {}
+        self._changed = threading.Condition()
+        self._connected = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._ws = None
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def start(self) -> bool:
+        """Start the listener thread; False if websockets is not installed"""
+        if connect is None:
+            logger.warning("websockets not installed - completion tracking falls back to /history polling")
+            return False
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, name="comfyui-events", daemon=True)
+            self._thread.start()
+        return True
+
+    def stop(self):
+        """Close the socket and stop reconnecting"""
+        self._stopping.set()
+        ws = self._ws
+        if ws is not None:
+            ws.close()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def wait_until_connected(self, timeout: float) -> bool:
+        return self._connected.wait(timeout)
+
+    def wait(self, prompt_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Block until the prompt finishes, the stream disconnects or the
+        timeout runs out. Returns a copy of the prompt's state (None if no
+        event has been seen for it).
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                state = self._prompts.get(prompt_id)
+                if state and state["status"] in FINISHED:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._connected.is_set():
+                    break
+                self._changed.wait(remaining)
+            return dict(state) if state else None
+
+    def state(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """Latest known state of a prompt (status, started, node, progress, outputs)"""
+        with self._changed:
+            state = self._prompts.get(prompt_id)
+            return dict(state) if state else None
+
+    def cancel(self, prompt_id: str):
+        """Mark a prompt cancelled, waking whoever waits on it (connected or not)"""
+        with self._changed:
+            state = self._prompts.setdefault(prompt_id, {})
+            state.update(status=CANCELLED, updated=time.monotonic())
+            self._changed.notify_all()
+
+    def cancelled(self, prompt_id: str) -> bool:
+        with self._changed:
+            return self._prompts.get(prompt_id, {}).get("status") == CANCELLED
+
+    def forget(self, prompt_id: str):
+        """Drop a prompt once its job no longer needs it"""
+        with self._changed:
+            self._prompts.pop(prompt_id, None)
+
+    def _run(self):
+        delay = 1
+        while not self._stopping.is_set():
+            try:
+                with connect(
+                    f"{self.ws_url}?clientId={self.client_id}",
+                    open_timeout=5,
+                    close_timeout=1,
+                    max_size=None  # preview images arrive as large binary frames
+                ) as ws:
+                    self._ws = ws
+                    self._set_connected(True)
+                    delay = 1
+                    logger.info(f"ComfyUI event stream connected: {self.ws_url}")
+                    for message in ws:
+                        if isinstance(message, str):
+                            self._handle(message)
+            except (OSError, WebSocketException) as e:
+                if not self._stopping.is_set():
+                    logger.warning(f"ComfyUI event stream unavailable ({e}); polling /history, retry in {delay}s")
+            finally:
+                self._ws = None
+                self._set_connected(False)
+
+            self._stopping.wait(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def _set_connected(self, connected: bool):
+        with self._changed:
+            if connected:
+                self._connected.set()
+            else:
+                self._connected.clear()
+            self._changed.notify_all()
+
+    def _handle(self, raw: str):
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return
+        kind = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+
+        with self._changed:
+            state = self._prompts.setdefault(prompt_id, {"status": RUNNING})
+            if state["status"] == CANCELLED:
+                return  # the job is gone; ignore its remaining events
+            state["updated"] = time.monotonic()
+
+            if kind == "execution_start":
+                state["started"] = state["updated"]  # left ComfyUI's queue
+            elif kind == "executing":
+                if data.get("node") is not None:
+                    state["node"] = data["node"]
+                elif state["status"] == RUNNING:
+                    state["status"] = DONE
+            elif kind == "progress":
+                state["node"] = data.get("node", state.get("node"))
+                state["progress"] = (data.get("value"), data.get("max"))
+            elif kind == "executed":
+                state.setdefault("outputs", {})[data.get("node")] = data.get("output")
+            elif kind == "execution_error":
+                state["status"] = ERROR
+                state["error"] = describe_error(data)
+            elif kind == "execution_interrupted":
+                state["status"] = INTERRUPTED
+
+            if len(self._prompts) > MAX_TRACKED_PROMPTS:
+                self._prune()
+            self._changed.notify_all()
+
+    def _prune(self):
+        """Drop the oldest finished prompts (callers normally forget() them)"""
+        finished = sorted(
+            (state["updated"], prompt_id)
+            for prompt_id, state in self._prompts.items()
+            if state["status"] in FINISHED
+        )
+        for _, prompt_id in finished[:len(self._prompts) - MAX_TRACKED_PROMPTS]:
+            del self._prompts[prompt_id]
@@ -10,6 +10,13 @@ echo "==================================================================="
 echo "Starting ComfyUI Worker: $WORKER_ID"
 echo "==================================================================="
 
+# With COMFYUI_LAUNCH=true the worker starts one ComfyUI per GPU itself
+if [ "${COMFYUI_LAUNCH:-false}" = "true" ]; then
+    echo "Starting worker process (ComfyUI per GPU: ${WORKER_GPUS:-0})..."
+    cd /workspace
+    exec python3 worker.py
+fi
+
 # Start ComfyUI in the background
 echo "Starting ComfyUI server on port 8188..."
 cd /workspace/ComfyUI
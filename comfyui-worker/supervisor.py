@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Multi-GPU supervision for the ComfyUI worker.
+
+One worker process can drive every GPU of a node instead of one compose
+service per GPU. WORKER_GPUS picks the devices ("all" = every GPU the VRAM
+monitor finds, or indexes like "0,1,3"; unset = GPU 0 only, as before) and
+worker.py runs a claim loop per device against that device's own ComfyUI
+instance(s). The loops share the worker's HTTP connection pool, its
+heartbeat and its registration with the queue manager; each claims jobs for
+its own free slots and VRAM budget (WORKER_MAX_CONCURRENT_JOBS and
+WORKER_VRAM_BUDGET_MB apply per device) and is reported as one entry of the
+heartbeat's devices list.
+
+ComfyUI instances are either attached to - COMFYUI_URLS, split evenly over
+the devices in order - or, with COMFYUI_LAUNCH=true, started here: one
+`main.py --cuda-device N` per device on COMFYUI_BASE_PORT + k, restarted
+when one exits and stopped with the worker.
+
+Integration points:
+- worker.py: select_gpus() and device_urls() at start-up, a ComfyUIProcess
+  per device in launch mode
+- start-worker.sh: leaves starting ComfyUI to the worker when
+  COMFYUI_LAUNCH=true
+"""
+
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+import httpx
+
+from vram_monitor import list_gpus
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+WORKER_GPUS = os.getenv("WORKER_GPUS", "")  # "" = GPU 0, "all", or "0,1,3"
+COMFYUI_LAUNCH = os.getenv("COMFYUI_LAUNCH", "false").lower() == "true"
+COMFYUI_PATH = os.getenv("COMFYUI_PATH", "/workspace/ComfyUI")
+COMFYUI_BASE_PORT = int(os.getenv("COMFYUI_BASE_PORT", "8188"))  # device k listens on base + k
+COMFYUI_ARGS = os.getenv("COMFYUI_ARGS", "")  # extra main.py arguments, e.g. "--highvram"
+COMFYUI_STARTUP_TIMEOUT = int(os.getenv("COMFYUI_STARTUP_TIMEOUT", "300"))  # model-heavy custom nodes are slow
+
+
+def select_gpus(spec: str = WORKER_GPUS) -> List[int]:
+    """GPU indexes to run claim loops for: [0] when unset, every visible GPU for "all", else the ones listed"""
+    spec = spec.strip().lower()
+    if not spec:
+        return [0]
+    if spec == "all":
+        gpus = list_gpus()
+        if not gpus:
+            raise RuntimeError("WORKER_GPUS=all but no GPUs were found (nvidia-smi / NVML)")
+        return gpus
+    try:
+        gpus = [int(part) for part in spec.split(",") if part.strip()]
+    except ValueError:
+        gpus = []
+    if not gpus or min(gpus) < 0 or len(set(gpus)) != len(gpus):
+        raise ValueError(f"WORKER_GPUS must be 'all' or distinct GPU indexes like '0,1,3', not {spec!r}")
+    return gpus
+
+
+def device_urls(gpus: List[int], urls: List[str], launch: bool = COMFYUI_LAUNCH) -> List[List[str]]:
+    """The ComfyUI URLs each device's jobs go to, in the order of gpus"""
+    if launch:
+        return [[f"http://127.0.0.1:{COMFYUI_BASE_PORT + k}"] for k in range(len(gpus))]
+    if not urls or len(urls) % len(gpus):
+        raise ValueError(
+            f"{len(urls)} COMFYUI_URLS cannot be split evenly over {len(gpus)} GPUs "
+            f"(list them device by device, or set COMFYUI_LAUNCH=true)"
+        )
+    per_device = len(urls) // len(gpus)
+    return [urls[k * per_device:(k + 1) * per_device] for k in range(len(gpus))]
+
+
+class ComfyUIProcess:
+    """A ComfyUI server started by the worker for one GPU (COMFYUI_LAUNCH=true)"""
+
+    def __init__(self, gpu_id: int, port: int, http_client: httpx.Client,
+                 path: str = COMFYUI_PATH, args: str = COMFYUI_ARGS):
+        self.gpu_id = gpu_id
+        self.url = f"http://127.0.0.1:{port}"
+        self.path = path
+        self.http_client = http_client
+        self.command = [
+            sys.executable, "main.py", "--listen", "127.0.0.1", "--port", str(port),
+            "--cuda-device", str(gpu_id), *shlex.split(args)
+        ]
+        self.process: Optional[subprocess.Popen] = None
+
+    def start(self):
+        """Start the server (returns at once; see wait_ready)"""
+        # --cuda-device N sets CUDA_VISIBLE_DEVICES=N: number devices as
+        # nvidia-smi and NVML do, so N is the GPU the VRAM checks read
+        env = dict(os.environ, CUDA_DEVICE_ORDER="PCI_BUS_ID")
+        self.process = subprocess.Popen(self.command, cwd=self.path, env=env)
+        logger.info(f"Started ComfyUI for GPU {self.gpu_id} at {self.url} (pid {self.process.pid})")
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def wait_ready(self, timeout: float = COMFYUI_STARTUP_TIMEOUT, interval: float = 1.0):
+        """Block until /system_stats answers; RuntimeError if the server exits, TimeoutError if it never does"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.alive():
+                code = self.process.returncode if self.process else None
+                raise RuntimeError(f"ComfyUI for GPU {self.gpu_id} exited during start-up (code {code})")
+            try:
+                if self.http_client.get(f"{self.url}/system_stats", timeout=5.0).status_code == 200:
+                    logger.info(f"ComfyUI for GPU {self.gpu_id} is ready")
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(interval)
+        raise TimeoutError(f"ComfyUI for GPU {self.gpu_id} not ready within {timeout}s")
+
+    def ensure_running(self) -> bool:
+        """Restart the server if it has exited; False while it is not back up"""
+        if self.alive():
+            return True
+        logger.error(f"ComfyUI for GPU {self.gpu_id} exited (code {self.process.returncode}) - restarting it")
+        try:
+            self.start()
+            self.wait_ready()
+            return True
+        except (OSError, RuntimeError, TimeoutError) as e:
+            logger.error(f"Failed to restart ComfyUI for GPU {self.gpu_id}: {e}")
+            self.stop()
+            return False
+
+    def stop(self, timeout: float = 30):
+        """Terminate the server, killing it if it does not exit within timeout"""
+        if not self.alive():
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"ComfyUI for GPU {self.gpu_id} ignored SIGTERM - killing it")
+            self.process.kill()
+            self.process.wait()
+
+
+def launch_comfyui(gpus: List[int], http_client: httpx.Client, path: str = COMFYUI_PATH,
+                   base_port: int = COMFYUI_BASE_PORT) -> List[ComfyUIProcess]:
+    """Start one ComfyUI per GPU side by side and wait for all of them; none are left running on failure"""
+    processes = [ComfyUIProcess(gpu_id, base_port + k, http_client, path) for k, gpu_id in enumerate(gpus)]
+    try:
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.wait_ready()
+    except BaseException:
+        for process in processes:
+            process.stop()
+        raise
+    return processes
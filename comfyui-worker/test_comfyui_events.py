@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Tests for ComfyUI completion tracking (event stream + history fallback).
+
+Runs ComfyUIClient against a local fake ComfyUI: an HTTP server for
+/prompt, /history, /queue and /interrupt plus a WebSocket server that emits
+the same event sequence ComfyUI does while executing a prompt.
+
+Tests cover:
+- Completion detected from events without waiting for a history poll
+- execution_error events failing the job with the node's message
+- Events that arrive before anyone waits on the prompt
+- Fallback to /history polling when the socket is unavailable or drops
+- Error detection from a history entry (status_str == "error")
+- cancel() waking the waiter at once and interrupting only the running prompt
+- The timeout and execution_time leave out the wait in ComfyUI's queue
+
+Run with: python3 -m pytest test_comfyui_events.py -v
+"""
+
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+websockets_server = pytest.importorskip("websockets.sync.server")
+
+import worker
+from comfyui_events import ComfyUIEventStream, DONE, ERROR, ws_url_for
+from worker import ComfyUIClient
+
+
+OUTPUT = {"images": [{"filename": "ComfyUI_00001_.png", "subfolder": "", "type": "output"}]}
+
+
+class FakeComfyUI:
+    """Minimal ComfyUI: /prompt, /history/{id}, /queue, /interrupt, /system_stats and /ws execution events"""
+
+    def __init__(self, websocket: bool = True, runtime: float = 0.3, fail: bool = False, serial: bool = False):
+        self.runtime = runtime
+        self.fail = fail
+        self.history = {}
+        self.history_requests = 0
+        self.running = {}  # prompt_id -> Event set to interrupt it
+        self.started = set()  # prompts past the queue (the rest of running are pending)
+        # serial: one prompt executes at a time, as in a real ComfyUI
+        self.executor = threading.Lock() if serial else None
+        self.interrupted = []
+        self.deleted = []
+        self.sockets = {}
+        self.torch_vram_mb = 0  # reported by /system_stats
+        self.prompt_vram_mb = 0  # what each prompt adds to it (torch keeps it cached)
+        self.lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body):
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if self.path == "/queue":
+                    fake.deleted.extend(body.get("delete", []))
+                    return self.reply({})
+                if self.path == "/interrupt":
+                    with fake.lock:
+                        stop = fake.running.get(body.get("prompt_id"))
+                    if stop:
+                        fake.interrupted.append(body["prompt_id"])
+                        stop.set()
+                    return self.reply({})
+                prompt_id = uuid.uuid4().hex
+                with fake.lock:
+                    fake.running[prompt_id] = threading.Event()
+                threading.Thread(target=fake.execute, args=(prompt_id, body.get("client_id")), daemon=True).start()
+                self.reply({"prompt_id": prompt_id, "number": 1, "node_errors": {}})
+
+            def do_GET(self):
+                if self.path == "/queue":
+                    with fake.lock:
+                        items = [[n, prompt_id, {}, {}, []] for n, prompt_id in enumerate(fake.running)]
+                    running = [item for item in items if item[1] in fake.started]
+                    pending = [item for item in items if item[1] not in fake.started]
+                    return self.reply({"queue_running": running, "queue_pending": pending})
+                if self.path == "/system_stats":
+                    device = {"name": "cuda:0", "type": "cuda", "torch_vram_total": fake.torch_vram_mb * 1024 * 1024}
+                    return self.reply({"system": {}, "devices": [device]})
+                prompt_id = self.path.rsplit("/", 1)[-1]
+                with fake.lock:
+                    fake.history_requests += 1
+                    entry = fake.history.get(prompt_id)
+                self.reply({prompt_id: entry} if entry else {})
+
+        self.http = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.http.server_port}"
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+
+        self.ws = None
+        if websocket:
+            self.ws = websockets_server.serve(self.connection, "127.0.0.1", 0)
+            threading.Thread(target=self.ws.serve_forever, daemon=True).start()
+            self.ws_url = f"ws://127.0.0.1:{self.ws.socket.getsockname()[1]}/ws"
+        else:
+            # Nothing listens here: the stream never connects
+            self.ws_url = f"ws://127.0.0.1:{self.http.server_port + 1}/ws"
+
+    def connection(self, ws):
+        client_id = parse_qs(urlsplit(ws.request.path).query)["clientId"][0]
+        self.sockets[client_id] = ws
+        ws.send(json.dumps({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": 0}}, "sid": client_id}}))
+        for _ in ws:
+            pass
+
+    def send(self, client_id, kind, data):
+        ws = self.sockets.get(client_id)
+        if ws is None:
+            return
+        try:
+            ws.send(json.dumps({"type": kind, "data": data}))
+        except Exception:
+            pass
+
+    def drop_sockets(self):
+        for ws in list(self.sockets.values()):
+            ws.close()
+        self.sockets.clear()
+        self.ws.shutdown()
+
+    def execute(self, prompt_id, client_id):
+        """Emit ComfyUI's event sequence; history is written before executing(None)"""
+        if self.executor:
+            with self.executor:
+                return self._execute(prompt_id, client_id)
+        return self._execute(prompt_id, client_id)
+
+    def _execute(self, prompt_id, client_id):
+        started = {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)}
+        with self.lock:
+            self.started.add(prompt_id)
+            self.torch_vram_mb += self.prompt_vram_mb
+        self.send(client_id, "execution_start", started)
+        self.send(client_id, "executing", {"node": "3", "display_node": "3", "prompt_id": prompt_id})
+        ws = self.sockets.get(client_id)
+        if ws is not None:
+            ws.send(b"\x00\x00\x00\x01preview-jpeg-bytes")  # binary preview frame
+        with self.lock:
+            stop = self.running.setdefault(prompt_id, threading.Event())
+        for step in (1, 2):
+            if stop.wait(self.runtime / 2):
+                break
+            self.send(client_id, "progress", {"value": step, "max": 2, "prompt_id": prompt_id, "node": "3"})
+
+        if stop.is_set():
+            interrupted = {"prompt_id": prompt_id, "node_id": "3", "node_type": "KSampler"}
+            status = {"status_str": "error", "completed": False, "messages": [["execution_interrupted", interrupted]]}
+            with self.lock:
+                self.history[prompt_id] = {"status": status, "outputs": {}}
+            self.send(client_id, "execution_interrupted", interrupted)
+        elif self.fail:
+            error = {
+                "prompt_id": prompt_id, "node_id": "3", "node_type": "KSampler",
+                "exception_message": "CUDA out of memory", "exception_type": "torch.OutOfMemoryError",
+            }
+            status = {"status_str": "error", "completed": False, "messages": [["execution_error", error]]}
+            with self.lock:
+                self.history[prompt_id] = {"status": status, "outputs": {}}
+            self.send(client_id, "execution_error", error)
+        else:
+            self.send(client_id, "executed", {"node": "9", "output": OUTPUT, "prompt_id": prompt_id})
+            success = {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)}
+            messages = [["execution_start", started], ["execution_success", success]]
+            status = {"status_str": "success", "completed": True, "messages": messages}
+            with self.lock:
+                self.history[prompt_id] = {"status": status, "outputs": {"9": OUTPUT}}
+            self.send(client_id, "execution_success", success)
+        with self.lock:
+            self.running.pop(prompt_id, None)
+            self.started.discard(prompt_id)
+        self.send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+
+    def close(self):
+        if self.ws:
+            self.ws.shutdown()
+        self.http.shutdown()
+
+
+@pytest.fixture
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(worker, "HISTORY_POLL_INTERVAL", 0.1)
+
+
+def test_ws_url_for():
+    assert ws_url_for("http://localhost:8188") == "ws://localhost:8188/ws"
+    assert ws_url_for("https://example.com/comfy/") == "wss://example.com/comfy/ws"
+
+
+def test_completion_from_events():
+    fake = FakeComfyUI(runtime=0.3)
+    client = ComfyUIClient(fake.url, fake.ws_url)
+    try:
+        assert client.events.wait_until_connected(5)
+        start = time.monotonic()
+        prompt_id = client.queue_prompt({"3": {"class_type": "KSampler"}})
+        result = client.wait_for_completion(prompt_id, timeout=10)
+        elapsed = time.monotonic() - start
+
+        assert result["status"] == "completed"
+        assert result["outputs"] == {"9": OUTPUT}
+        # Woken by executing(None), not a 2 s history poll
+        assert elapsed < 1.0
+        assert fake.history_requests <= 2
+        assert client.events.state(prompt_id) is None  # forgotten once done
+    finally:
+        client.close()
+        fake.close()
+
+
+def test_execution_error_event():
+    fake = FakeComfyUI(runtime=0.1, fail=True)
+    client = ComfyUIClient(fake.url, fake.ws_url)
+    try:
+        assert client.events.wait_until_connected(5)
+        prompt_id = client.queue_prompt({"3": {"class_type": "KSampler"}})
+        with pytest.raises(RuntimeError, match="CUDA out of memory"):
+            client.wait_for_completion(prompt_id, timeout=10)
+    finally:
+        client.close()
+        fake.close()
+
+
+def test_events_before_wait_are_kept():
+    fake = FakeComfyUI(runtime=0.1)
+    client = ComfyUIClient(fake.url, fake.ws_url)
+    try:
+        assert client.events.wait_until_connected(5)
+        prompt_id = client.queue_prompt({"3": {"class_type": "KSampler"}})
+        deadline = time.monotonic() + 5
+        while (client.events.state(prompt_id) or {}).get("status") != DONE and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        state = client.events.wait(prompt_id, timeout=0)
+        assert state["status"] == DONE
+        assert state["progress"] == (2, 2)
+        assert state["outputs"] == {"9": OUTPUT}
+    finally:
+        client.close()
+        fake.close()
+
+
+def test_stream_tracks_error_state():
+    fake = FakeComfyUI(runtime=0.1, fail=True)
+    stream = ComfyUIEventStream(fake.url, fake.ws_url)
+    stream.start()
+    try:
+        assert stream.wait_until_connected(5)
+        fake.execute("p-1", stream.client_id)
+        state = stream.wait("p-1", timeout=5)
+        # The trailing executing(None) must not turn an error into success
+        assert state["status"] == ERROR
+        assert state["error"] == "KSampler (node 3): torch.OutOfMemoryError: CUDA out of memory"
+    finally:
+        stream.stop()
+        fake.close()
+
+
+def test_history_fallback_without_socket(fast_polling):
+    fake = FakeComfyUI(websocket=False, runtime=0.5)
+    client = ComfyUIClient(fake.url, fake.ws_url)
+    try:
+        assert not client.events.wait_until_connected(0.2)
+        prompt_id = client.queue_prompt({"3": {"class_type": "KSampler"}})
+        result = client.wait_for_completion(prompt_id, timeout=10)
+        assert result["outputs"] == {"9": OUTPUT}
+        assert fake.history_requests > 1
+    finally:
+        client.close()
+        fake.close()
+
+
+def test_history_fallback_after_socket_drops(fast_polling):
+    fake = FakeComfyUI(runtime=1.0)
+    client = ComfyUIClient(fake.url, fake.ws_url)
+    try:
+        assert client.events.wait_until_connected(5)
+        prompt_id = client.queue_prompt({"3": {"class_type": "KSampler"}})
+        threading.Timer(0.3, fake.drop_sockets).start()
+        result = client.wait_for_completion(prompt_id, timeout=10)
+        assert result["outputs"] == {"9": OUTPUT}
+        assert not client.events.connected
+    finally:
+        client.close()
+        fake.close()
+
+
+def test_history_error_status_fails_job(fast_polling):
+    fake = FakeComfyUI(websocket=False, runtime=0.1, fail=True)
+    client = ComfyUIClient(fake.url, fake.ws_url)
+    try:
+        prompt_id = client.queue_prompt({"3": {"class_type": "KSampler"}})
+        with pytest.raises(RuntimeError, match="KSampler: CUDA out of memory"):
+            client.wait_for_completion(prompt_id, timeout=10)
+    finally:
+        client.close()
+        fake.close()
+
+
+@pytest.mark.parametrize("websocket", [True, False])
+def test_cancel_interrupts_running_prompt(websocket, fast_polling):
+    fake = FakeComfyUI(websocket=websocket, runtime=30)
+    client = ComfyUIClient(fake.url, fake.ws_url)
+    try:
+        assert client.events.wait_until_connected(5 if websocket else 0.2) == websocket
+        prompt_id = client.queue_prompt({"3": {"class_type": "KSampler"}})
+        canceller = threading.Timer(0.3, client.cancel, args=(prompt_id,))
+        canceller.start()
+
+        start = time.monotonic()
+        with pytest.raises(worker.JobAbandoned):
+            client.wait_for_completion(prompt_id, timeout=60)
+        assert time.monotonic() - start < 1.0
+        canceller.join(5)  # the waiter wakes before ComfyUI is told
+        assert fake.deleted == [prompt_id]
+        assert fake.interrupted == [prompt_id]
+    finally:
+        client.close()
+        fake.close()
+
+
+@pytest.mark.parametrize("websocket", [True, False])
+def test_timeout_counts_from_execution_start(websocket, fast_polling):
+    fake = FakeComfyUI(websocket=websocket, runtime=1.0, serial=True)
+    client = ComfyUIClient(fake.url, fake.ws_url)
+    try:
+        assert client.events.wait_until_connected(5 if websocket else 0.2) == websocket
+        workflow = {"3": {"class_type": "KSampler"}}
+        client.queue_prompt(workflow)
+        queued = client.queue_prompt(workflow)  # waits ~1 s behind the first
+
+        # 2 s from queueing, but only 1 s of that executing
+        result = client.wait_for_completion(queued, timeout=1.6)
+        assert 0.9 <= result["execution_time"] < 1.4
+    finally:
+        client.close()
+        fake.close()
+
+
+def test_cancel_leaves_other_prompts_running():
+    fake = FakeComfyUI(websocket=False, runtime=30)
+    client = ComfyUIClient(fake.url, fake.ws_url)
+    try:
+        prompt_id = client.queue_prompt({"3": {"class_type": "KSampler"}})
+        client.cancel("queued-elsewhere")  # not executing: dequeued, no /interrupt
+        assert fake.deleted == ["queued-elsewhere"]
+        assert fake.interrupted == []
+        assert prompt_id in fake.running
+    finally:
+        client.close()
+        fake.close()
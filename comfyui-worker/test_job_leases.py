@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+"""
+Fault-injection tests for job leases (worker heartbeats + queue manager
+requeue), the worker registry built from those heartbeats, cancelling
+running jobs through them, and model-affinity claims.
+
+Runs the real queue manager (uvicorn) and real worker processes against a
+fake ComfyUI, then kills or freezes workers in the middle of a job. The
+queue manager runs with a 2 s JOB_LEASE_TTL and a 3 s
+WORKER_HEARTBEAT_TIMEOUT; workers send a heartbeat every 0.5 s.
+
+Tests cover:
+- A long job stays leased to a healthy worker across many lease TTLs
+- A worker killed mid-job: its job is requeued and finished by another
+- Jobs whose workers keep dying end up failed in the dead-letter queue
+- A frozen worker that resumes after losing its lease cannot report the job
+- Health/status worker counts follow heartbeats, busy workers and free slots
+- Killed workers drop out of the registry; stopped ones deregister at once
+- Cancelling a running job interrupts ComfyUI, frees the slot and cannot be
+  overwritten by a late completion
+- Claims prefer jobs using the worker's loaded models, but overtake a job
+  at most AFFINITY_MAX_SKIPS times
+- A job released by its worker returns to the head of the queue without
+  using an attempt; other workers cannot release it
+- Completed jobs report their peak VRAM (the rise over the reading at their
+  start), and once a workflow signature has enough samples new submissions
+  are packed by its learned profile; jobs run side by side report none
+- A worker driving two GPUs runs a job on each side by side and registers
+  once, with each GPU's jobs and slots under devices
+- Worker.job_vram reads estimated_vram as the claim script does, so a
+  value it cannot parse never fails a batch already claimed
+
+Needs Redis (REDIS_HOST, REDIS_PORT, REDIS_PASSWORD; skipped if unreachable)
+and flushes the database REDIS_TEST_DB (default 15).
+
+Run with: python3 -m pytest test_job_leases.py -v
+"""
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+import redis
+
+from test_comfyui_events import FakeComfyUI
+from worker import VRAM_DEFAULT_ESTIMATE_MB, Worker
+
+HERE = Path(__file__).resolve().parent
+QUEUE_MANAGER_DIR = HERE.parent / "queue-manager"
+LEASE_TTL = 2
+MAX_ATTEMPTS = 2
+HEARTBEAT_TIMEOUT = 3
+AFFINITY_MAX_SKIPS = 3
+WORKFLOW = {"3": {"class_type": "KSampler", "inputs": {"seed": 1}}}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(predicate, timeout: float, interval: float = 0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = predicate()
+        if value:
+            return value
+        time.sleep(interval)
+    return predicate()
+
+
+@pytest.fixture(scope="module")
+def redis_env():
+    env = {
+        "REDIS_HOST": os.getenv("REDIS_HOST", "localhost"),
+        "REDIS_PORT": os.getenv("REDIS_PORT", "6379"),
+        "REDIS_PASSWORD": os.getenv("REDIS_PASSWORD", ""),
+        "REDIS_DB": os.getenv("REDIS_TEST_DB", "15"),
+    }
+    client = redis.Redis(
+        host=env["REDIS_HOST"], port=int(env["REDIS_PORT"]),
+        password=env["REDIS_PASSWORD"] or None, db=int(env["REDIS_DB"])
+    )
+    try:
+        client.ping()
+    except redis.RedisError as e:
+        pytest.skip(f"Redis not available: {e}")
+    client.flushdb()
+    yield env
+    client.flushdb()
+
+
+@pytest.fixture(scope="module")
+def queue_manager(redis_env, tmp_path_factory):
+    port = free_port()
+    env = dict(
+        os.environ, **redis_env,
+        INFERENCE_MODE="local", MAX_QUEUE_DEPTH="0", LOG_LEVEL="WARNING",
+        JOB_LEASE_TTL=str(LEASE_TTL), JOB_MAX_ATTEMPTS=str(MAX_ATTEMPTS),
+        WORKER_HEARTBEAT_TIMEOUT=str(HEARTBEAT_TIMEOUT), AFFINITY_MAX_SKIPS=str(AFFINITY_MAX_SKIPS),
+        OUTPUTS_PATH=str(tmp_path_factory.mktemp("qm-outputs")),
+    )
+    env.pop("WEB_CONCURRENCY", None)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=QUEUE_MANAGER_DIR, env=env
+    )
+    url = f"http://127.0.0.1:{port}"
+
+    def healthy():
+        try:
+            return httpx.get(f"{url}/health", timeout=1).status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    try:
+        if not wait_for(healthy, 20):
+            pytest.fail("queue manager did not start")
+        yield url
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+@pytest.fixture
+def start_worker(queue_manager, tmp_path):
+    """Start worker.py processes; all are killed after the test"""
+    processes = []
+
+    def start(worker_id: str, comfyui_url: str, **overrides: str) -> subprocess.Popen:
+        env = dict(
+            os.environ,
+            WORKER_ID=worker_id, QUEUE_MANAGER_URL=queue_manager, COMFYUI_URL=comfyui_url,
+            COMFYUI_WS_EVENTS="false", ENABLE_VRAM_MONITORING="false", OUTPUTS_PATH=str(tmp_path),
+            WORKER_LONG_POLL_SECONDS="1", WORKER_POLL_INTERVAL="1", WORKER_HEARTBEAT_INTERVAL="0.5",
+            **overrides
+        )
+        process = subprocess.Popen([sys.executable, "worker.py"], cwd=HERE, env=env)
+        processes.append(process)
+        return process
+
+    yield start
+    for process in processes:
+        if process.poll() is None:
+            process.send_signal(signal.SIGCONT)
+            process.kill()
+        process.wait(timeout=10)
+    # A killed worker's parked next-jobs request would still claim the next
+    # test's job (the lease would recover it, at the cost of an attempt)
+    time.sleep(1.5)
+
+
+def submit(url: str, workflow: dict = WORKFLOW) -> str:
+    response = httpx.post(f"{url}/api/jobs", json={"user_id": "lease-test", "workflow": workflow})
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+def job(url: str, job_id: str) -> dict:
+    return httpx.get(f"{url}/api/jobs/{job_id}").json()
+
+
+def running_on(url: str, job_id: str, worker_id: str):
+    state = job(url, job_id)
+    return state["status"] == "running" and state["worker_id"] == worker_id
+
+
+def test_long_job_keeps_its_lease(queue_manager, start_worker):
+    fake = FakeComfyUI(websocket=False, runtime=4 * LEASE_TTL)
+    try:
+        job_id = submit(queue_manager)
+        start_worker("lease-long", fake.url)
+
+        wait_for(lambda: job(queue_manager, job_id)["status"] in ("completed", "failed"), 30)
+        state = job(queue_manager, job_id)
+        assert state["status"] == "completed"
+        assert state["worker_id"] == "lease-long"
+        assert state["attempts"] == 1  # never requeued
+    finally:
+        fake.close()
+
+
+def test_killed_worker_job_is_requeued(queue_manager, start_worker):
+    fake = FakeComfyUI(websocket=False, runtime=2)
+    try:
+        job_id = submit(queue_manager)
+        crashed = start_worker("lease-crash", fake.url)
+        assert wait_for(lambda: running_on(queue_manager, job_id, "lease-crash"), 15)
+        crashed.kill()  # SIGKILL mid-job: no fail-job, no more renewals
+
+        assert wait_for(lambda: job(queue_manager, job_id)["status"] == "pending", 3 * LEASE_TTL)
+        start_worker("lease-rescue", fake.url)
+
+        assert wait_for(lambda: job(queue_manager, job_id)["status"] == "completed", 20)
+        state = job(queue_manager, job_id)
+        assert state["worker_id"] == "lease-rescue"
+        assert state["attempts"] == 2
+    finally:
+        fake.close()
+
+
+def test_repeated_crashes_dead_letter_the_job(queue_manager, start_worker):
+    fake = FakeComfyUI(websocket=False, runtime=30)
+    try:
+        job_id = submit(queue_manager)
+        for attempt in range(MAX_ATTEMPTS):
+            worker = start_worker(f"lease-doomed-{attempt}", fake.url)
+            assert wait_for(lambda: running_on(queue_manager, job_id, f"lease-doomed-{attempt}"), 15)
+            worker.kill()
+
+        assert wait_for(lambda: job(queue_manager, job_id)["status"] == "failed", 3 * LEASE_TTL)
+        state = job(queue_manager, job_id)
+        assert "stopped renewing its lease" in state["error"]
+        assert state["attempts"] == MAX_ATTEMPTS
+
+        dead = httpx.get(f"{queue_manager}/api/queue/dead-letter").json()
+        assert job_id in [entry["id"] for entry in dead]
+        assert httpx.get(f"{queue_manager}/api/queue/status").json()["dead_letter_jobs"] >= 1
+    finally:
+        fake.close()
+
+
+def test_frozen_worker_cannot_report_after_losing_lease(queue_manager, start_worker):
+    fake = FakeComfyUI(websocket=False, runtime=3)
+    try:
+        job_id = submit(queue_manager)
+        frozen = start_worker("lease-frozen", fake.url)
+        assert wait_for(lambda: running_on(queue_manager, job_id, "lease-frozen"), 15)
+        frozen.send_signal(signal.SIGSTOP)  # hung process: alive but silent
+
+        assert wait_for(lambda: job(queue_manager, job_id)["status"] == "pending", 3 * LEASE_TTL)
+        start_worker("lease-successor", fake.url)
+        assert wait_for(lambda: running_on(queue_manager, job_id, "lease-successor"), 15)
+        frozen.send_signal(signal.SIGCONT)  # wakes up, finishes and tries to report
+
+        assert wait_for(lambda: job(queue_manager, job_id)["status"] == "completed", 20)
+        assert job(queue_manager, job_id)["worker_id"] == "lease-successor"
+
+        # The stale worker was refused outright
+        response = httpx.post(
+            f"{queue_manager}/api/workers/complete-job",
+            params={"job_id": job_id, "worker_id": "lease-frozen"},
+            json={"result": {"status": "completed"}}
+        )
+        assert response.status_code == 409
+    finally:
+        fake.close()
+
+
+def registered(url: str) -> dict:
+    return {worker["worker_id"]: worker for worker in httpx.get(f"{url}/api/workers").json()}
+
+
+def test_registry_tracks_live_workers(queue_manager, start_worker):
+    fake = FakeComfyUI(websocket=False, runtime=3)
+    try:
+        # Earlier tests' killed workers age out of the registry first
+        assert wait_for(lambda: not registered(queue_manager), 2 * HEARTBEAT_TIMEOUT)
+        processes = {worker_id: start_worker(worker_id, fake.url) for worker_id in ("registry-a", "registry-b")}
+
+        def counts():
+            health = httpx.get(f"{queue_manager}/health").json()
+            status = httpx.get(f"{queue_manager}/api/queue/status").json()
+            return health["workers_active"], status["active_workers"], status["busy_workers"], status["free_slots"]
+
+        assert wait_for(lambda: counts() == (2, 2, 0, 2), 15)
+        workers = registered(queue_manager)
+        assert workers["registry-a"]["status"] == "idle"
+        assert workers["registry-a"]["slots"] == 1
+
+        job_id = submit(queue_manager)
+        assert wait_for(lambda: job(queue_manager, job_id)["status"] == "running", 15)
+        runner = job(queue_manager, job_id)["worker_id"]
+        assert wait_for(lambda: counts() == (2, 2, 1, 1), 5)
+        assert registered(queue_manager)[runner]["current_job_ids"] == [job_id]
+        assert registered(queue_manager)[runner]["status"] == "busy"
+
+        # SIGKILL: no goodbye, the idle worker ages out after the heartbeat timeout
+        idle = "registry-b" if runner == "registry-a" else "registry-a"
+        processes[idle].kill()
+        assert wait_for(lambda: counts()[0] == 1, 2 * HEARTBEAT_TIMEOUT)
+        assert list(registered(queue_manager)) == [runner]
+
+        # SIGTERM: finishes its job, then deregisters straight away
+        assert wait_for(lambda: job(queue_manager, job_id)["status"] == "completed", 15)
+        processes[runner].terminate()
+        processes[runner].wait(timeout=10)
+        assert counts() == (0, 0, 0, 0)
+    finally:
+        fake.close()
+
+
+def test_cancel_running_job(queue_manager, start_worker):
+    fake = FakeComfyUI(websocket=False, runtime=60)
+    try:
+        job_id = submit(queue_manager)
+        start_worker("cancel-worker", fake.url)
+        assert wait_for(lambda: running_on(queue_manager, job_id, "cancel-worker") and fake.running, 15)
+
+        assert httpx.delete(f"{queue_manager}/api/jobs/{job_id}").status_code == 204
+        assert job(queue_manager, job_id)["status"] == "cancelled"
+
+        # Seen on the next heartbeat: prompt interrupted, slot free again
+        assert wait_for(lambda: fake.interrupted, 5)
+        assert wait_for(lambda: registered(queue_manager)["cancel-worker"]["free_slots"] == 1, 5)
+        assert registered(queue_manager)["cancel-worker"]["current_job_ids"] == []
+
+        # A late report cannot resurrect the job
+        response = httpx.post(
+            f"{queue_manager}/api/workers/complete-job",
+            params={"job_id": job_id}, json={"result": {"status": "completed"}}
+        )
+        assert response.status_code == 409
+        assert job(queue_manager, job_id)["status"] == "cancelled"
+        assert httpx.get(f"{queue_manager}/api/queue/status").json()["running_jobs"] == 0
+    finally:
+        fake.close()
+
+
+def test_model_affinity_is_bounded(queue_manager):
+    def workflow(checkpoint: str) -> dict:
+        return {
+            "3": {"class_type": "KSampler", "inputs": {"seed": 1}},
+            "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": checkpoint}},
+        }
+
+    def claim(models=None) -> dict:
+        params = {"worker_id": "affinity-worker", **({"models": models} if models else {})}
+        return httpx.get(f"{queue_manager}/api/workers/next-job", params=params).json()["job"]
+
+    video = submit(queue_manager, workflow("ltx-2-19b.safetensors"))
+    images = [submit(queue_manager, workflow("flux-2-klein-9b.safetensors")) for _ in range(5)]
+    claimed = []
+    try:
+        # A worker with the image model loaded takes image jobs past the video
+        # job until it has been overtaken AFFINITY_MAX_SKIPS times
+        for _ in range(AFFINITY_MAX_SKIPS + 1):
+            claimed.append(claim("flux-2-klein-9b.safetensors"))
+        assert [j["id"] for j in claimed] == images[:AFFINITY_MAX_SKIPS] + [video]
+        assert claimed[-1]["models"] == "ltx-2-19b.safetensors"
+
+        # Without loaded models (or any match) the queue order holds
+        claimed.append(claim())
+        claimed.append(claim("other.safetensors"))
+        assert [j["id"] for j in claimed[-2:]] == images[AFFINITY_MAX_SKIPS:]
+        assert claim("flux-2-klein-9b.safetensors") is None
+    finally:
+        for claimed_job in claimed:
+            httpx.post(
+                f"{queue_manager}/api/workers/complete-job",
+                params={"job_id": claimed_job["id"]}, json={"result": {"status": "completed"}}
+            )
+
+
+def test_released_job_goes_back_unrun(queue_manager):
+    def claim(worker_id: str) -> dict:
+        params = {"worker_id": worker_id, "leases": "true"}
+        return httpx.get(f"{queue_manager}/api/workers/next-job", params=params).json()["job"]
+
+    def release(job_id: str, worker_id: str) -> httpx.Response:
+        return httpx.post(
+            f"{queue_manager}/api/workers/release-job", params={"job_id": job_id, "worker_id": worker_id}
+        )
+
+    first, second = submit(queue_manager), submit(queue_manager)
+    claimed = claim("release-worker")
+    assert claimed["id"] == first
+    assert release(first, "someone-else").status_code == 409
+
+    # Back at the head of the queue, the claim not counted as an attempt
+    assert release(first, "release-worker").status_code == 200
+    state = job(queue_manager, first)
+    assert state["status"] == "pending"
+    assert state["worker_id"] is None
+    assert state["attempts"] == 0
+    assert release(first, "release-worker").status_code == 409  # no longer held
+
+    for expected in (first, second):
+        assert claim("release-worker")["id"] == expected
+        httpx.post(
+            f"{queue_manager}/api/workers/complete-job",
+            params={"job_id": expected}, json={"result": {"status": "completed"}}
+        )
+    assert job(queue_manager, first)["attempts"] == 1
+
+
+def test_peak_vram_profiles_the_workflow(queue_manager, start_worker):
+    workflow = {
+        "3": {"class_type": "KSampler", "inputs": {"seed": 1}},
+        "4": {"class_type": "UNETLoader", "inputs": {"unet_name": "profile-test-2b.safetensors"}},
+        "5": {"class_type": "EmptyLatentImage", "inputs": {"width": 512, "height": 512, "batch_size": 1}},
+    }
+    fake = FakeComfyUI(websocket=False, runtime=0.1)
+    # No GPU sampler here: the rise in ComfyUI's own memory is used
+    fake.torch_vram_mb = 2000
+    fake.prompt_vram_mb = 6000
+    try:
+        worker = start_worker("profile-worker", fake.url)
+        job_ids = [submit(queue_manager, workflow) for _ in range(3)]
+        assert wait_for(lambda: all(job(queue_manager, j)["status"] == "completed" for j in job_ids), 30)
+        worker.terminate()
+        worker.wait(timeout=10)
+
+        profiles = httpx.get(f"{queue_manager}/api/queue/vram-profiles").json()
+        (signature, profile), = [(k, v) for k, v in profiles.items() if "profile-test-2b" in k]
+        assert signature.endswith("@512x512x1x1")
+        assert profile["n"] == 3
+        assert profile["estimate"] == 6000  # the rise in reserved memory, no spread
+
+        submit(queue_manager, workflow)
+        claimed = httpx.get(f"{queue_manager}/api/workers/next-job", params={"worker_id": "profile-check"}).json()["job"]
+        assert claimed["metadata"] == {"estimated_vram": 6000, "vram_source": "profile"}
+        httpx.post(
+            f"{queue_manager}/api/workers/complete-job",
+            params={"job_id": claimed["id"]}, json={"result": {"status": "completed"}}
+        )
+    finally:
+        fake.close()
+
+
+def test_side_by_side_jobs_report_no_peak(queue_manager, start_worker):
+    fake = FakeComfyUI(websocket=False, runtime=2)
+    fake.prompt_vram_mb = 6000
+    try:
+        worker = start_worker("overlap-worker", fake.url, WORKER_MAX_CONCURRENT_JOBS="2")
+        job_ids = [submit(queue_manager) for _ in range(2)]
+        assert wait_for(lambda: all(job(queue_manager, j)["status"] == "completed" for j in job_ids), 30)
+        worker.terminate()
+        worker.wait(timeout=10)
+
+        # Each saw the other's memory: neither reading is its own
+        assert all("peak_vram_mb" not in job(queue_manager, j)["result"] for j in job_ids)
+    finally:
+        fake.close()
+
+
+def test_worker_claims_for_each_gpu(queue_manager, start_worker):
+    fakes = [FakeComfyUI(websocket=False, runtime=3) for _ in range(2)]
+    try:
+        assert wait_for(lambda: not registered(queue_manager), 2 * HEARTBEAT_TIMEOUT)
+        worker = start_worker(
+            "multi-gpu", fakes[0].url, WORKER_GPUS="0,1", COMFYUI_URLS=",".join(fake.url for fake in fakes)
+        )
+        job_ids = [submit(queue_manager) for _ in range(2)]
+
+        # One job per GPU, at the same time, each on that GPU's ComfyUI
+        assert wait_for(lambda: all(running_on(queue_manager, j, "multi-gpu") for j in job_ids), 15)
+        assert wait_for(lambda: all(len(fake.history) + len(fake.running) == 1 for fake in fakes), 5)
+        assert wait_for(lambda: registered(queue_manager)["multi-gpu"]["free_slots"] == 0, 5)
+        status = registered(queue_manager)["multi-gpu"]
+        assert status["slots"] == 2
+        assert sorted(status["current_job_ids"]) == sorted(job_ids)
+        assert [device["gpu_id"] for device in status["devices"]] == [0, 1]
+        assert all(device["slots"] == 1 and len(device["current_job_ids"]) == 1 for device in status["devices"])
+        assert sorted(j for device in status["devices"] for j in device["current_job_ids"]) == sorted(job_ids)
+
+        assert wait_for(lambda: all(job(queue_manager, j)["status"] == "completed" for j in job_ids), 15)
+        worker.terminate()
+        worker.wait(timeout=10)
+        assert "multi-gpu" not in registered(queue_manager)
+    finally:
+        for fake in fakes:
+            fake.close()
+
+
+@pytest.mark.parametrize("metadata, expected", [
+    ({"estimated_vram": 24576}, 24576),
+    ({"estimated_vram": "24.5"}, 25),  # the claim script's tonumber takes it too
+    ({"estimated_vram": "8 GB"}, VRAM_DEFAULT_ESTIMATE_MB),  # tonumber gives nil: the default
+    ({"estimated_vram": None}, VRAM_DEFAULT_ESTIMATE_MB),
+    ({}, VRAM_DEFAULT_ESTIMATE_MB),
+    (None, VRAM_DEFAULT_ESTIMATE_MB),
+])
+def test_job_vram_reads_estimates_as_the_claim_script_does(metadata, expected):
+    assert Worker.job_vram({"id": "j", "metadata": metadata}) == expected
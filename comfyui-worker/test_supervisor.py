@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Tests for the multi-GPU supervisor (supervisor.py).
+
+Tests cover:
+- WORKER_GPUS: GPU 0 when unset, every visible GPU for "all", explicit
+  index lists, and rejection of malformed lists
+- COMFYUI_URLS split device by device, launch-mode URLs on consecutive ports
+- Launching one ComfyUI per GPU (a stand-in main.py): --cuda-device per
+  instance, PCI bus device order, readiness over /system_stats
+- A launched instance that exits is restarted; one that fails to start
+  takes the others down with it
+
+Run with: python3 -m pytest test_supervisor.py -v
+"""
+
+import socket
+
+import httpx
+import pytest
+
+import supervisor
+
+FAKE_MAIN = '''
+import argparse, json, os, sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--listen")
+parser.add_argument("--port", type=int)
+parser.add_argument("--cuda-device", type=int)
+args, extra = parser.parse_known_args()
+if str(args.cuda_device) == os.environ.get("FAKE_COMFYUI_FAIL_DEVICE"):
+    sys.exit(3)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = json.dumps({
+            "cuda_device": args.cuda_device, "extra": extra,
+            "device_order": os.environ.get("CUDA_DEVICE_ORDER"),
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+HTTPServer((args.listen, args.port), Handler).serve_forever()
+'''
+
+
+def free_ports(count: int) -> int:
+    """First of `count` consecutive free ports"""
+    for base in range(20000, 60000, 97):
+        try:
+            for port in range(base, base + count):
+                with socket.socket() as sock:
+                    sock.bind(("127.0.0.1", port))
+            return base
+        except OSError:
+            continue
+    raise RuntimeError("no free ports")
+
+
+@pytest.fixture
+def comfyui_path(tmp_path):
+    (tmp_path / "main.py").write_text(FAKE_MAIN)
+    return str(tmp_path)
+
+
+@pytest.fixture
+def http_client():
+    with httpx.Client() as client:
+        yield client
+
+
+class TestSelectGPUs:
+    def test_unset_is_gpu_zero(self):
+        assert supervisor.select_gpus("") == [0]
+
+    def test_explicit_list(self):
+        assert supervisor.select_gpus(" 0, 2,3 ") == [0, 2, 3]
+
+    def test_all_visible(self, monkeypatch):
+        monkeypatch.setattr(supervisor, "list_gpus", lambda: [0, 1, 2, 3])
+        assert supervisor.select_gpus("all") == [0, 1, 2, 3]
+
+    def test_all_without_gpus(self, monkeypatch):
+        monkeypatch.setattr(supervisor, "list_gpus", lambda: [])
+        with pytest.raises(RuntimeError):
+            supervisor.select_gpus("all")
+
+    @pytest.mark.parametrize("spec", ["0,0", "a,b", "-1", ","])
+    def test_malformed(self, spec):
+        with pytest.raises(ValueError):
+            supervisor.select_gpus(spec)
+
+
+class TestDeviceURLs:
+    def test_split_in_order(self):
+        urls = ["http://a:8188", "http://a:8189", "http://b:8188", "http://b:8189"]
+        assert supervisor.device_urls([0, 1], urls, launch=False) == [urls[:2], urls[2:]]
+
+    def test_uneven_split_is_refused(self):
+        with pytest.raises(ValueError):
+            supervisor.device_urls([0, 1], ["http://a:8188"], launch=False)
+
+    def test_launch_uses_consecutive_ports(self, monkeypatch):
+        monkeypatch.setattr(supervisor, "COMFYUI_BASE_PORT", 9000)
+        assert supervisor.device_urls([2, 5], [], launch=True) == [
+            ["http://127.0.0.1:9000"], ["http://127.0.0.1:9001"]
+        ]
+
+
+class TestLaunch:
+    def test_one_instance_per_gpu(self, comfyui_path, http_client):
+        base = free_ports(2)
+        processes = supervisor.launch_comfyui([1, 3], http_client, comfyui_path, base)
+        try:
+            stats = [http_client.get(f"{p.url}/system_stats").json() for p in processes]
+            assert [s["cuda_device"] for s in stats] == [1, 3]
+            assert all(s["device_order"] == "PCI_BUS_ID" for s in stats)
+            assert [p.url for p in processes] == [f"http://127.0.0.1:{base}", f"http://127.0.0.1:{base + 1}"]
+        finally:
+            for process in processes:
+                process.stop()
+        assert not any(process.alive() for process in processes)
+
+    def test_extra_arguments(self, comfyui_path, http_client):
+        process = supervisor.ComfyUIProcess(0, free_ports(1), http_client, comfyui_path, args="--highvram --fast")
+        process.start()
+        try:
+            process.wait_ready(timeout=30, interval=0.2)
+            assert http_client.get(f"{process.url}/system_stats").json()["extra"] == ["--highvram", "--fast"]
+        finally:
+            process.stop()
+
+    def test_exited_instance_is_restarted(self, comfyui_path, http_client):
+        process = supervisor.ComfyUIProcess(0, free_ports(1), http_client, comfyui_path)
+        process.start()
+        try:
+            process.wait_ready(timeout=30, interval=0.2)
+            first = process.process.pid
+            process.process.kill()
+            process.process.wait()
+            assert process.ensure_running()
+            assert process.process.pid != first
+            assert http_client.get(f"{process.url}/system_stats").status_code == 200
+        finally:
+            process.stop()
+
+    def test_failed_start_stops_the_others(self, comfyui_path, http_client, monkeypatch):
+        monkeypatch.setenv("FAKE_COMFYUI_FAIL_DEVICE", "1")
+        base = free_ports(2)
+        with pytest.raises(RuntimeError, match="GPU 1"):
+            supervisor.launch_comfyui([0, 1], http_client, comfyui_path, base)
+        with pytest.raises(httpx.HTTPError):
+            http_client.get(f"http://127.0.0.1:{base}/system_stats", timeout=2.0)
@@ -8,12 +8,18 @@ Tests cover:
 - Fail-open behavior
 - Configuration via environment
 - Edge cases (timeouts, parsing errors)
+- Background sampler over a fake NVML: all visible GPUs, checks served from
+  the snapshot without nvidia-smi, stale snapshots and NVML failures falling
+  back to nvidia-smi
+- Per-job peak tracking: the highest reading while a job ran alone on its
+  GPU, over the reading when it started; none when jobs shared it
 
 Run with: python3 -m pytest test_vram_monitor.py -v
 """
 
 import pytest
 import subprocess
+import time
 from unittest.mock import patch, MagicMock
 import os
 
@@ -400,3 +406,192 @@ class TestCLI:
 
 if __name__ == '__main__':
     pytest.main([__file__, '-v', '--tb=short'])
+
+
+class FakeNVML:
+    """Stands in for pynvml: GPUs given as [(total_mb, used_mb)]"""
+
+    class NVMLError(Exception):
+        pass
+
+    def __init__(self, gpus):
+        self.gpus = gpus
+        self.reads = 0
+        self.fail = False
+        self.shut_down = False
+
+    def nvmlInit(self):
+        pass
+
+    def nvmlShutdown(self):
+        self.shut_down = True
+
+    def nvmlDeviceGetCount(self):
+        return len(self.gpus)
+
+    def nvmlDeviceGetHandleByIndex(self, index):
+        return index
+
+    def nvmlDeviceGetMemoryInfo(self, handle):
+        if self.fail:
+            raise self.NVMLError("GPU is lost")
+        self.reads += 1
+        total, used = self.gpus[handle]
+        mb = 1024 * 1024
+        return MagicMock(total=total * mb, used=used * mb, free=(total - used) * mb)
+
+
+class TestVRAMSampler:
+    """Tests for VRAMSampler / start_sampler()"""
+
+    @pytest.fixture(autouse=True)
+    def clean_sampler(self):
+        with patch.dict(os.environ, {'ENABLE_VRAM_MONITORING': 'true', 'VRAM_CHECK_DRY_RUN': 'false'}):
+            import importlib
+            importlib.reload(vram_monitor)
+            yield
+            vram_monitor.stop_sampler()
+
+    def test_samples_every_gpu(self):
+        """Should read all GPUs through NVML"""
+        nvml = FakeNVML([(81920, 16384), (81920, 40960)])
+        sampler = vram_monitor.start_sampler(interval=60, nvml=nvml)
+
+        snapshot = sampler.snapshot()
+        assert sampler.source == "nvml"
+        assert sorted(snapshot) == [0, 1]
+        assert snapshot[1]['free_mb'] == 40960
+        assert snapshot[1]['usage_percent'] == 50.0
+
+    def test_respects_cuda_visible_devices(self):
+        """Should only sample the GPUs named in CUDA_VISIBLE_DEVICES"""
+        with patch.dict(os.environ, {'CUDA_VISIBLE_DEVICES': '1'}):
+            sampler = vram_monitor.start_sampler(interval=60, nvml=FakeNVML([(1000, 0), (2000, 0)]))
+
+        assert list(sampler.snapshot()) == [1]
+
+    def test_check_is_served_from_snapshot(self):
+        """Should answer checks and stats without running nvidia-smi"""
+        vram_monitor.start_sampler(interval=60, nvml=FakeNVML([(81920, 61440), (81920, 0)]))
+
+        with patch('subprocess.run') as mock_run:
+            assert vram_monitor.check_vram_sufficient(24576) is False
+            assert vram_monitor.check_vram_sufficient(24576, gpu_id=1) is True
+            assert vram_monitor.get_vram_stats(1)['free_mb'] == 81920
+            assert vram_monitor.get_available_vram(0) == 20480
+            mock_run.assert_not_called()
+
+    def test_background_thread_refreshes(self):
+        """Should pick up new readings on its own"""
+        nvml = FakeNVML([(81920, 0)])
+        vram_monitor.start_sampler(interval=0.01, nvml=nvml)
+
+        nvml.gpus[0] = (81920, 81920)
+        deadline = time.monotonic() + 2
+        while vram_monitor.get_available_vram() != 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert vram_monitor.get_available_vram() == 0
+
+    def test_stale_snapshot_falls_back_to_nvidia_smi(self):
+        """Should not trust a snapshot older than max_age"""
+        sampler = vram_monitor.start_sampler(interval=60, nvml=FakeNVML([(81920, 0)]))
+        sampler.max_age = 0
+
+        with patch('subprocess.run') as mock_run:
+            mock_run.return_value = MagicMock(stdout="1024\n", returncode=0)
+            assert vram_monitor.get_available_vram() == 1024
+            mock_run.assert_called_once()
+
+    def test_nvml_failure_samples_with_nvidia_smi(self):
+        """Should take the sample with one nvidia-smi call when NVML fails"""
+        nvml = FakeNVML([(81920, 0), (81920, 0)])
+        sampler = vram_monitor.start_sampler(interval=60, nvml=nvml)
+        nvml.fail = True
+
+        with patch('subprocess.run') as mock_run:
+            mock_run.return_value = MagicMock(stdout="0, 81920, 1024, 80896\n1, 81920, 0, 81920\n")
+            snapshot = sampler.sample()
+
+        assert sampler.source == "nvidia-smi"
+        assert snapshot[0]['used_mb'] == 1024
+        assert snapshot[1]['free_mb'] == 81920
+
+    def test_without_nvml_uses_nvidia_smi(self):
+        """Should sample through nvidia-smi when NVML cannot initialise"""
+        nvml = FakeNVML([])
+        nvml.nvmlInit = MagicMock(side_effect=FakeNVML.NVMLError("driver not loaded"))
+
+        with patch('subprocess.run') as mock_run:
+            mock_run.return_value = MagicMock(stdout="0, 24576, 0, 24576\n")
+            sampler = vram_monitor.start_sampler(interval=60, nvml=nvml)
+
+        assert sampler.source == "nvidia-smi"
+        assert sampler.snapshot()[0]['total_mb'] == 24576
+
+    def test_stop_shuts_nvml_down(self):
+        """Should release NVML and serve no snapshot after stop"""
+        nvml = FakeNVML([(81920, 0)])
+        vram_monitor.start_sampler(interval=60, nvml=nvml)
+        vram_monitor.stop_sampler()
+
+        assert nvml.shut_down
+        assert vram_monitor._sampled(0) is None
+
+    def test_tracks_peak_of_a_job(self):
+        """Should report the highest reading between track_peak and peak_vram"""
+        nvml = FakeNVML([(81920, 4096), (81920, 0)])
+        sampler = vram_monitor.start_sampler(interval=60, nvml=nvml)
+
+        vram_monitor.track_peak("job-1")
+        nvml.gpus[0] = (81920, 30720)
+        sampler.sample()
+        nvml.gpus[0] = (81920, 12288)
+        sampler.sample()
+        nvml.gpus[1] = (81920, 81920)  # another GPU does not count
+        sampler.sample()
+
+        assert vram_monitor.peak_vram("job-1") == 30720 - 4096  # over the reading at the start
+        assert vram_monitor.peak_vram("job-1") is None  # no longer tracked
+
+    def test_peak_is_over_the_baseline_at_the_start(self):
+        """Should not count memory already in use when the job started"""
+        nvml = FakeNVML([(81920, 0)])
+        sampler = vram_monitor.start_sampler(interval=60, nvml=nvml)
+
+        nvml.gpus[0] = (81920, 20480)  # models left loaded by an earlier job
+        vram_monitor.track_peak("job-1")  # reads the GPU itself, not the stale snapshot
+        nvml.gpus[0] = (81920, 24576)
+        sampler.sample()
+        assert vram_monitor.peak_vram("job-1") == 4096
+
+        vram_monitor.track_peak("job-2")
+        nvml.gpus[0] = (81920, 8192)  # use fell: nothing to attribute
+        assert vram_monitor.peak_vram("job-2") is None
+
+    def test_no_peak_when_jobs_share_the_gpu(self):
+        """Should not attribute a reading to either of two overlapping jobs"""
+        nvml = FakeNVML([(81920, 4096), (81920, 0)])
+        sampler = vram_monitor.start_sampler(interval=60, nvml=nvml)
+
+        vram_monitor.track_peak("job-1")
+        vram_monitor.track_peak("job-2")
+        vram_monitor.track_peak("job-3", gpu_id=1)
+        nvml.gpus[0] = (81920, 40960)
+        nvml.gpus[1] = (81920, 20480)
+        sampler.sample()
+
+        assert vram_monitor.peak_vram("job-1") is None
+        assert vram_monitor.peak_vram("job-2") is None
+        assert vram_monitor.peak_vram("job-3") == 20480  # GPU 1 was idle at the start
+
+    def test_peak_without_sampler_is_unknown(self):
+        """Should be a no-op when no sampler runs"""
+        vram_monitor.track_peak("job-1")
+        assert vram_monitor.peak_vram("job-1") is None
+
+    def test_disabled_monitoring_starts_nothing(self):
+        """Should not start a sampler with ENABLE_VRAM_MONITORING=false"""
+        with patch.dict(os.environ, {'ENABLE_VRAM_MONITORING': 'false'}):
+            import importlib
+            importlib.reload(vram_monitor)
+            assert vram_monitor.start_sampler(nvml=FakeNVML([(1, 0)])) is None
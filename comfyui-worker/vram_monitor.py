@@ -3,18 +3,26 @@
 VRAM monitoring for ComfyUI worker jobs.
 
 Provides VRAM checking to prevent OOM crashes on GPU workers.
-Uses nvidia-smi to query GPU memory state before accepting jobs.
+Queries GPU memory state before accepting jobs.
 
 Key features:
 - Fail-open: If monitoring unavailable, allow job (don't block work)
 - Configurable safety margin (default 2GB)
 - Structured logging for debugging
-- Simple subprocess-based implementation
+- Background sampler (start_sampler): reads every visible GPU through NVML
+  (nvidia-ml-py, optional) every VRAM_SAMPLE_INTERVAL seconds, falling back
+  to one nvidia-smi call per sample; while its snapshot is fresh the checks
+  below are dictionary lookups instead of an nvidia-smi fork each
+- Direct nvidia-smi queries when no sampler runs (or its snapshot is stale)
+- Peak tracking (track_peak/peak_vram): the most VRAM a job used beyond the
+  GPU's use when it started, sent with its result so the queue manager
+  learns what each workflow really needs
 
 Integration points:
 - worker.py: Check VRAM before queueing jobs
 - Health endpoints: Expose VRAM stats for monitoring
 - Worker status: Report VRAM to queue manager
+- supervisor.py: list_gpus() finds the devices for WORKER_GPUS=all
 
 Author: Verda Team
 Created: 2026-01-31
@@ -24,7 +32,14 @@ Issue: comfyume #4
 import os
 import subprocess
 import logging
-from typing import Optional, Dict, Any
+import threading
+import time
+from typing import Optional, Dict, Any, List
+
+try:
+    import pynvml  # nvidia-ml-py
+except ImportError:
+    pynvml = None
 
 logger = logging.getLogger(__name__)
 
@@ -34,11 +49,243 @@ VRAM_SAFETY_MARGIN_MB = int(os.getenv("VRAM_SAFETY_MARGIN_MB", "2048"))  # Defau
 VRAM_CHECK_TIMEOUT = int(os.getenv("VRAM_CHECK_TIMEOUT_SECONDS", "5"))  # nvidia-smi timeout
 VRAM_DEFAULT_ESTIMATE_MB = int(os.getenv("VRAM_DEFAULT_ESTIMATE_MB", "8192"))  # 8GB fallback
 VRAM_CHECK_DRY_RUN = os.getenv("VRAM_CHECK_DRY_RUN", "false").lower() == "true"
+VRAM_SAMPLE_INTERVAL = float(os.getenv("VRAM_SAMPLE_INTERVAL", "1"))  # seconds between sampler reads
+VRAM_SAMPLE_MAX_AGE = float(os.getenv("VRAM_SAMPLE_MAX_AGE", "5"))  # older snapshots are not used
+VRAM_PEAK_SAMPLE_INTERVAL = float(os.getenv("VRAM_PEAK_SAMPLE_INTERVAL", "0.25"))  # NVML reads while tracking peaks
+# Margin for jobs whose estimate is a learned peak percentile (metadata.vram_source=profile)
+VRAM_PROFILED_MARGIN_MB = int(os.getenv("VRAM_PROFILED_MARGIN_MB", "512"))
+
+MB = 1024 * 1024
+
+
+def _gpu_stats(gpu_id: int, total_mb: int, used_mb: int, free_mb: int) -> Dict[str, Any]:
+    """The stats dict of get_vram_stats()"""
+    return {
+        'gpu_id': gpu_id,
+        'total_mb': total_mb,
+        'used_mb': used_mb,
+        'free_mb': free_mb,
+        'usage_percent': round((used_mb / total_mb) * 100, 1) if total_mb > 0 else 0.0
+    }
+
+
+def _visible_gpus() -> Optional[set]:
+    """GPU indexes named by CUDA_VISIBLE_DEVICES (None = all, or not given as indexes)"""
+    visible = os.getenv("CUDA_VISIBLE_DEVICES")
+    if visible is None or not all(part.strip().isdigit() for part in visible.split(",") if part.strip()):
+        return None
+    return {int(part) for part in visible.split(",") if part.strip()}
+
+
+def _read_nvidia_smi() -> Optional[Dict[int, Dict[str, Any]]]:
+    """Every GPU's memory from one nvidia-smi call: {index: stats}"""
+    try:
+        result = subprocess.run(
+            [
+                'nvidia-smi',
+                '--query-gpu=index,memory.total,memory.used,memory.free',
+                '--format=csv,noheader,nounits'
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=VRAM_CHECK_TIMEOUT
+        )
+        gpus = {}
+        for line in result.stdout.strip().splitlines():
+            index, total_mb, used_mb, free_mb = (int(value.strip()) for value in line.split(','))
+            gpus[index] = _gpu_stats(index, total_mb, used_mb, free_mb)
+        return gpus or None
+    except Exception as e:
+        logger.error(f"nvidia-smi sample failed: {e}")
+        return None
+
+
+class VRAMSampler:
+    """
+    Background thread keeping a snapshot of every visible GPU's memory.
+
+    Reads through NVML when the bindings load and initialise, else through
+    nvidia-smi (one call covers all GPUs). snapshot() returns the last
+    reading, or None once it is older than max_age - so a hung driver
+    makes callers fall back (and fail open) rather than trust old numbers.
+
+    track(key, gpu_id) / peak(key) record how far a GPU's memory use rose
+    above its reading when a job started (sampling every peak_interval
+    meanwhile, if NVML is available): models kept loaded from earlier jobs
+    and other processes are not the job's. Only a job that had the GPU to
+    itself gets a peak: with jobs side by side the reading cannot be split
+    between them.
+    """
+
+    def __init__(self, interval: float = None, max_age: float = None, nvml=None):
+        self.interval = interval if interval is not None else VRAM_SAMPLE_INTERVAL
+        self.max_age = max_age if max_age is not None else VRAM_SAMPLE_MAX_AGE
+        self.nvml = nvml if nvml is not None else pynvml
+        self.handles: Optional[Dict[int, Any]] = None
+        self.source = "none"
+        self._snapshot: Optional[Dict[int, Dict[str, Any]]] = None
+        self._sampled_at = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.peak_interval = min(VRAM_PEAK_SAMPLE_INTERVAL, self.interval)
+        self._tracked: Dict[str, Dict[str, Any]] = {}  # key -> {gpu_id, baseline_mb, peak_mb, shared}
+
+    def _open_nvml(self) -> None:
+        if self.nvml is None:
+            return
+        try:
+            self.nvml.nvmlInit()
+            visible = _visible_gpus()
+            self.handles = {
+                index: self.nvml.nvmlDeviceGetHandleByIndex(index)
+                for index in range(self.nvml.nvmlDeviceGetCount())
+                if visible is None or index in visible
+            }
+        except Exception as e:
+            logger.warning(f"NVML unavailable ({e}) - sampling VRAM with nvidia-smi")
+            self.handles = None
+
+    def _read_nvml(self) -> Optional[Dict[int, Dict[str, Any]]]:
+        gpus = {}
+        for index, handle in self.handles.items():
+            memory = self.nvml.nvmlDeviceGetMemoryInfo(handle)
+            gpus[index] = _gpu_stats(index, memory.total // MB, memory.used // MB, memory.free // MB)
+        return gpus
+
+    def sample(self) -> Optional[Dict[int, Dict[str, Any]]]:
+        """Take one reading now and make it the snapshot"""
+        gpus = None
+        if self.handles:
+            try:
+                gpus = self._read_nvml()
+                self.source = "nvml"
+            except Exception as e:
+                logger.error(f"NVML read failed: {e}")
+        if gpus is None:
+            gpus = _read_nvidia_smi()
+            if gpus is not None:
+                visible = _visible_gpus()
+                gpus = {index: stats for index, stats in gpus.items() if visible is None or index in visible}
+                self.source = "nvidia-smi"
+        if gpus is not None:
+            with self._lock:
+                self._snapshot = gpus
+                self._sampled_at = time.monotonic()
+                for tracked in self._tracked.values():
+                    stats = gpus.get(tracked["gpu_id"])
+                    if stats:
+                        tracked["peak_mb"] = max(tracked["peak_mb"], stats["used_mb"])
+        return gpus
+
+    def track(self, key: str, gpu_id: int = 0) -> None:
+        """Start recording the peak memory use of gpu_id for `key` (a job), over its use now"""
+        stats = (self.sample() or {}).get(gpu_id)
+        used = stats["used_mb"] if stats else None
+        with self._lock:
+            shared = False
+            for tracked in self._tracked.values():
+                if tracked["gpu_id"] == gpu_id:
+                    tracked["shared"] = shared = True
+            self._tracked[key] = {"gpu_id": gpu_id, "baseline_mb": used, "peak_mb": used or 0, "shared": shared}
+
+    def peak(self, key: str) -> Optional[int]:
+        """Stop tracking `key`: its peak MB over the baseline, None if the GPU was shared or not read at the start"""
+        if key not in self._tracked:
+            return None
+        self.sample()  # the final reading counts too
+        with self._lock:
+            tracked = self._tracked.pop(key, None)
+        if not tracked or tracked["shared"] or tracked["baseline_mb"] is None:
+            return None
+        return (tracked["peak_mb"] - tracked["baseline_mb"]) or None
+
+    def snapshot(self) -> Optional[Dict[int, Dict[str, Any]]]:
+        """The latest reading {gpu_id: stats}, None if there is none or it is stale"""
+        with self._lock:
+            if self._snapshot is None or time.monotonic() - self._sampled_at > self.max_age:
+                return None
+            return self._snapshot
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.peak_interval if self._tracked and self.handles else self.interval):
+            self.sample()
+
+    def start(self) -> "VRAMSampler":
+        self._open_nvml()
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name="vram-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + VRAM_CHECK_TIMEOUT)
+        if self.handles is not None:
+            try:
+                self.nvml.nvmlShutdown()
+            except Exception:
+                pass
+            self.handles = None
+
+
+_sampler: Optional[VRAMSampler] = None
+
+
+def start_sampler(interval: float = None, nvml=None) -> Optional[VRAMSampler]:
+    """Start the process-wide sampler the checks below read from (None if monitoring is disabled)"""
+    global _sampler
+    if not ENABLE_VRAM_MONITORING:
+        return None
+    if _sampler is None:
+        _sampler = VRAMSampler(interval=interval, nvml=nvml).start()
+        logger.info(f"VRAM sampler started ({_sampler.source}, every {_sampler.interval}s)")
+    return _sampler
+
+
+def stop_sampler() -> None:
+    global _sampler
+    if _sampler is not None:
+        _sampler.stop()
+        _sampler = None
+
+
+def track_peak(key: str, gpu_id: int = 0) -> None:
+    """Record gpu_id's peak memory use for a job until peak_vram(key) (no-op without the sampler)"""
+    if _sampler is not None:
+        _sampler.track(key, gpu_id)
+
+
+def peak_vram(key: str) -> Optional[int]:
+    """Peak MB the GPU used beyond its baseline while `key` ran alone on it, None if unknown"""
+    return _sampler.peak(key) if _sampler is not None else None
+
+
+def _sampled(gpu_id: int) -> Optional[Dict[str, Any]]:
+    """A GPU's stats from a fresh sampler snapshot, if there is one"""
+    snapshot = _sampler.snapshot() if _sampler else None
+    return snapshot.get(gpu_id) if snapshot else None
+
+
+def get_all_vram_stats() -> Optional[Dict[int, Dict[str, Any]]]:
+    """Stats of every visible GPU {gpu_id: stats} (sampler snapshot, else one nvidia-smi call)"""
+    snapshot = _sampler.snapshot() if _sampler else None
+    return snapshot if snapshot is not None else _read_nvidia_smi()
+
+
+def list_gpus() -> List[int]:
+    """Indexes of the visible GPUs (nvidia-smi numbering), [] if none are found"""
+    gpus = get_all_vram_stats() or {}
+    visible = _visible_gpus()
+    return sorted(index for index in gpus if visible is None or index in visible)
 
 
 def get_available_vram(gpu_id: int = 0) -> Optional[int]:
     """
-    Get available VRAM in MB using nvidia-smi.
+    Get available VRAM in MB: from the sampler's snapshot while it is
+    fresh, otherwise using nvidia-smi.
 
     Args:
         gpu_id: GPU device ID (default 0 for first GPU)
@@ -55,6 +302,10 @@ def get_available_vram(gpu_id: int = 0) -> Optional[int]:
         Returns None on any error (nvidia-smi not found, timeout, etc.)
         This allows fail-open behavior in check_vram_sufficient()
     """
+    sampled = _sampled(gpu_id)
+    if sampled is not None:
+        return sampled['free_mb']
+
     try:
         result = subprocess.run(
             [
@@ -214,8 +465,13 @@ def get_vram_stats(gpu_id: int = 0) -> Optional[Dict[str, Any]]:
 
     Note:
         Used for health endpoints and worker status reporting.
-        Returns None on any error (fail-safe).
+        Returns None on any error (fail-safe). Served from the sampler's
+        snapshot while it is fresh.
     """
+    sampled = _sampled(gpu_id)
+    if sampled is not None:
+        return dict(sampled)
+
     try:
         result = subprocess.run(
             [
@@ -278,8 +534,9 @@ def get_vram_stats(gpu_id: int = 0) -> Optional[Dict[str, Any]]:
         return None
 
 
-# VRAM estimates by model type (for job metadata enrichment)
-# These are estimates - actual usage varies by workflow
+# VRAM estimates by model type, for callers that only know the model name.
+# Submitted jobs normally carry metadata.estimated_vram, which the queue
+# manager derives from the workflow graph (queue-manager/vram_estimator.py)
 VRAM_ESTIMATES = {
     'flux2-klein-9b': 18432,      # 18GB - Flux.2 Klein 9B text-to-image
     'flux2-klein-4b': 8192,       # 8GB - Flux.2 Klein 4B text-to-image
@@ -9,18 +9,27 @@ Changes for v0.11.0:
 """
 import os
 import sys
+import math
 import time
 import json
 import logging
 import signal
-from typing import Optional, Dict, Any
+import threading
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+from typing import Optional, Dict, Any, List, Set, Tuple
 from datetime import datetime, timezone
 import httpx
 from redis import Redis
 from redis.exceptions import RedisError
 
 # Import VRAM monitoring (Issue #4)
-from vram_monitor import check_vram_sufficient, get_vram_stats
+from vram_monitor import (
+    check_vram_sufficient, get_vram_stats, peak_vram, start_sampler, stop_sampler, track_peak,
+    VRAM_DEFAULT_ESTIMATE_MB, VRAM_PROFILED_MARGIN_MB, VRAM_SAFETY_MARGIN_MB
+)
+from comfyui_events import ComfyUIEventStream, CANCELLED, DONE, ERROR, INTERRUPTED
+from supervisor import ComfyUIProcess, device_urls, launch_comfyui, select_gpus, COMFYUI_LAUNCH, WORKER_GPUS
 
 # Configure structured logging with JSON support
 LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
@@ -60,14 +69,40 @@ REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "")
 QUEUE_MANAGER_URL = os.getenv("QUEUE_MANAGER_URL", "http://queue-manager:3000")
 COMFYUI_URL = os.getenv("COMFYUI_URL", "http://localhost:8188")
+# Optional comma-separated ComfyUI instances sharing the GPU; concurrent jobs
+# are spread over them (one ComfyUI executes its own prompts one at a time).
+# With several WORKER_GPUS they are split evenly over the devices, in order
+COMFYUI_URLS = [url.strip() for url in os.getenv("COMFYUI_URLS", COMFYUI_URL).split(",") if url.strip()]
 POLL_INTERVAL = int(os.getenv("WORKER_POLL_INTERVAL", "2"))
+# Park on next-job until a job is enqueued (0 = plain polling every POLL_INTERVAL)
+LONG_POLL_SECONDS = int(os.getenv("WORKER_LONG_POLL_SECONDS", "25"))
+# Jobs run side by side against ComfyUI (e.g. several Flux Klein 4B jobs on a B300),
+# per GPU when the worker drives several (WORKER_GPUS, see supervisor.py)
+MAX_CONCURRENT_JOBS = int(os.getenv("WORKER_MAX_CONCURRENT_JOBS", "1"))
+# VRAM shared by concurrent jobs on a GPU; 0 = GPU total minus VRAM_SAFETY_MARGIN_MB
+VRAM_BUDGET_MB = int(os.getenv("WORKER_VRAM_BUDGET_MB", "0"))
 OUTPUTS_PATH = os.getenv("OUTPUTS_PATH", "/outputs")
 
+# Heartbeats register the worker's status and capacity with the queue manager
+# and renew the leases on its jobs: send them well inside JOB_LEASE_TTL
+# (default 30s) or the jobs are requeued for another worker
+HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "10"))
+
 # Timeout configurations (updated for v0.11.0 longer video jobs)
 COMFYUI_TIMEOUT = int(os.getenv("COMFYUI_TIMEOUT", "900"))  # 15 minutes for ComfyUI requests
 HTTP_CLIENT_TIMEOUT = int(os.getenv("HTTP_CLIENT_TIMEOUT", "30"))  # 30 seconds for queue manager
 JOB_TIMEOUT = int(os.getenv("JOB_TIMEOUT", "1800"))  # 30 minutes max for video generation
 
+# Completion tracking: ComfyUI WebSocket events, /history polling as fallback
+COMFYUI_WS_EVENTS = os.getenv("COMFYUI_WS_EVENTS", "true").lower() == "true"
+HISTORY_POLL_INTERVAL = 2  # seconds between /history polls without the event stream
+# /history is still read this often while the stream is up, in case an event was lost
+HISTORY_SAFETY_INTERVAL = int(os.getenv("COMFYUI_HISTORY_SAFETY_INTERVAL", "30"))
+
+# A job handed back for lack of free VRAM is not claimed again on that GPU
+# before this many seconds (it returns to the head of the queue)
+VRAM_RETRY_DELAY = float(os.getenv("WORKER_VRAM_RETRY_DELAY", "10"))
+
 # Graceful shutdown flag
 shutdown_requested = False
 
@@ -79,12 +114,24 @@ def signal_handler(signum, frame):
     shutdown_requested = True
 
 
+class JobAbandoned(Exception):
+    """The queue manager took the job back (cancelled by its user, or its lease lost)"""
+
+
 class ComfyUIClient:
     """Client for interacting with ComfyUI API"""
 
-    def __init__(self, base_url: str = COMFYUI_URL):
+    def __init__(self, base_url: str = COMFYUI_URL, ws_url: Optional[str] = None,
+                 client: Optional[httpx.Client] = None):
         self.base_url = base_url.rstrip('/')
-        self.client = httpx.Client(timeout=float(COMFYUI_TIMEOUT))
+        # The worker passes its own client so every instance shares one
+        # connection pool; requests set the ComfyUI timeout themselves
+        self.timeout = float(COMFYUI_TIMEOUT)
+        self.owns_client = client is None
+        self.client = client or httpx.Client(timeout=self.timeout)
+        self.events = ComfyUIEventStream(self.base_url, ws_url)
+        if COMFYUI_WS_EVENTS:
+            self.events.start()
         logger.info(f"ComfyUI client initialized for {base_url} (timeout={COMFYUI_TIMEOUT}s)")
 
     def queue_prompt(self, workflow: Dict[str, Any]) -> Optional[str]:
@@ -92,7 +139,8 @@ class ComfyUIClient:
         try:
             response = self.client.post(
                 f"{self.base_url}/prompt",
-                json={"prompt": workflow}
+                json={"prompt": workflow, "client_id": self.events.client_id},
+                timeout=self.timeout
             )
             response.raise_for_status()
             data = response.json()
@@ -107,7 +155,7 @@ class ComfyUIClient:
     def get_history(self, prompt_id: str) -> Optional[Dict[str, Any]]:
         """Get workflow execution history"""
         try:
-            response = self.client.get(f"{self.base_url}/history/{prompt_id}")
+            response = self.client.get(f"{self.base_url}/history/{prompt_id}", timeout=self.timeout)
             response.raise_for_status()
             data = response.json()
             return data.get(prompt_id)
@@ -117,75 +165,390 @@ class ComfyUIClient:
             return None
 
     def wait_for_completion(self, prompt_id: str, timeout: int = 3600) -> Dict[str, Any]:
-        """Wait for workflow to complete and return results"""
-        start_time = time.time()
+        """
+        Wait for workflow to complete and return results.
+
+        While the event stream is connected this sleeps until ComfyUI reports
+        the prompt finished, then reads /history once (and every
+        HISTORY_SAFETY_INTERVAL meanwhile, in case an event was lost).
+        Without the stream it polls /history every HISTORY_POLL_INTERVAL.
+        Raises JobAbandoned as soon as cancel() is called for the prompt.
+
+        The timeout and execution_time count from when ComfyUI starts
+        executing the prompt (its execution_start event, or /queue listing
+        it as running), not from queueing it: a prompt waiting behind
+        another job on the same ComfyUI gets up to `timeout` for that wait
+        on top.
+        """
+        queued_at = time.monotonic()
+        started_at: Optional[float] = None
 
-        while True:
-            if time.time() - start_time > timeout:
-                raise TimeoutError(f"Workflow {prompt_id} exceeded timeout of {timeout}s")
-
-            history = self.get_history(prompt_id)
-            if history:
-                status = history.get("status", {})
-
-                if status.get("completed", False):
-                    logger.info(f"Workflow {prompt_id} completed successfully")
-                    return {
-                        "prompt_id": prompt_id,
-                        "status": "completed",
-                        "outputs": history.get("outputs", {}),
-                        "execution_time": time.time() - start_time
-                    }
+        try:
+            while True:
+                if self.events.cancelled(prompt_id):
+                    raise JobAbandoned(f"Workflow {prompt_id} cancelled")
+                now = time.monotonic()
+                if started_at is None and not self.events.connected and self.is_running(prompt_id):
+                    started_at = now
+                deadline = (started_at or queued_at) + timeout
+                if now > deadline:
+                    if started_at is None:
+                        raise TimeoutError(f"Workflow {prompt_id} did not start within {timeout}s")
+                    raise TimeoutError(f"Workflow {prompt_id} exceeded timeout of {timeout}s")
+
+                state = None
+                if self.events.connected:
+                    state = self.events.wait(prompt_id, min(HISTORY_SAFETY_INTERVAL, deadline - now))
+                    if started_at is None and state and state.get("started"):
+                        started_at = state["started"]
+                    if state and state["status"] == ERROR:
+                        logger.error(f"Workflow {prompt_id} failed: {state['error']}")
+                        raise RuntimeError(f"Workflow execution failed: {state['error']}")
+                    if state and state["status"] == INTERRUPTED:
+                        raise RuntimeError("Workflow execution interrupted")
+                    if state and state["status"] == CANCELLED:
+                        continue
+
+                history = self.get_history(prompt_id)
+                if history:
+                    status = history.get("status", {})
+
+                    if status.get("status_str") == "error" or "error" in status:
+                        error_msg = status.get("error") or self._history_error(status)
+                        logger.error(f"Workflow {prompt_id} failed: {error_msg}")
+                        raise RuntimeError(f"Workflow execution failed: {error_msg}")
+
+                    if status.get("completed", False):
+                        logger.info(f"Workflow {prompt_id} completed successfully")
+                        execution_time = self._execution_time(status)
+                        if execution_time is None:
+                            execution_time = time.monotonic() - (started_at or queued_at)
+                        return {
+                            "prompt_id": prompt_id,
+                            "status": "completed",
+                            "outputs": history.get("outputs", {}),
+                            "execution_time": execution_time
+                        }
+
+                if state and state["status"] == DONE:
+                    time.sleep(0.2)  # Finished, history not readable yet
+                elif not self.events.connected:
+                    time.sleep(HISTORY_POLL_INTERVAL)
+        finally:
+            self.events.forget(prompt_id)
+
+    def torch_vram_mb(self) -> Optional[int]:
+        """VRAM this ComfyUI process holds through torch (reserved MB), from /system_stats"""
+        try:
+            response = self.client.get(f"{self.base_url}/system_stats", timeout=10.0)
+            response.raise_for_status()
+            devices = response.json().get("devices") or []
+            reserved = devices[0].get("torch_vram_total") if devices else None
+            return int(reserved) // (1024 * 1024) if reserved else None
+        except (httpx.HTTPError, ValueError, AttributeError, TypeError) as e:
+            logger.debug(f"No torch VRAM reading from {self.base_url}: {e}")
+            return None
 
-                if "error" in status:
-                    error_msg = status.get("error", "Unknown error")
-                    logger.error(f"Workflow {prompt_id} failed: {error_msg}")
-                    raise RuntimeError(f"Workflow execution failed: {error_msg}")
+    def cancel(self, prompt_id: str):
+        """
+        Stop a prompt whose job was taken back: wake its waiter, then drop
+        it from ComfyUI's queue, or interrupt it if it is the one executing.
+        /interrupt is only sent then, since older ComfyUI ignores its
+        prompt_id and would stop whichever prompt is running.
+        """
+        self.events.cancel(prompt_id)
+        try:
+            self.client.post(f"{self.base_url}/queue", json={"delete": [prompt_id]}, timeout=10.0)
+            if self.is_running(prompt_id, raise_errors=True):
+                self.client.post(f"{self.base_url}/interrupt", json={"prompt_id": prompt_id}, timeout=10.0)
+                logger.info(f"Interrupted workflow {prompt_id}")
+            else:
+                logger.info(f"Removed workflow {prompt_id} from the ComfyUI queue")
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning(f"Failed to cancel workflow {prompt_id}: {e}")
+
+    def is_running(self, prompt_id: str, raise_errors: bool = False) -> bool:
+        """Whether ComfyUI is executing the prompt now (listed in /queue's queue_running)"""
+        try:
+            response = self.client.get(f"{self.base_url}/queue", timeout=10.0)
+            response.raise_for_status()
+            return any(len(item) > 1 and item[1] == prompt_id for item in response.json().get("queue_running", []))
+        except (httpx.HTTPError, ValueError):
+            if raise_errors:
+                raise
+            return False
 
-            time.sleep(2)  # Poll every 2 seconds
+    @staticmethod
+    def _execution_time(status: Dict[str, Any]) -> Optional[float]:
+        """Seconds from execution_start to execution_success in a history status, if both are recorded"""
+        stamps = {
+            message[0]: message[1].get("timestamp")
+            for message in status.get("messages", [])
+            if len(message) == 2 and isinstance(message[1], dict)
+        }
+        start, end = stamps.get("execution_start"), stamps.get("execution_success")
+        if isinstance(start, (int, float)) and isinstance(end, (int, float)) and end >= start:
+            return (end - start) / 1000  # ComfyUI stamps in milliseconds
+        return None
+
+    @staticmethod
+    def _history_error(status: Dict[str, Any]) -> str:
+        """Error text from the execution_error message of a history status"""
+        for message in status.get("messages", []):
+            if len(message) == 2 and message[0] == "execution_error":
+                data = message[1]
+                return f"{data.get('node_type', 'workflow')}: {data.get('exception_message', 'Unknown error')}"
+        return "Unknown error"
 
     def close(self):
-        """Close HTTP client"""
-        self.client.close()
+        """Stop the event stream and close HTTP client (unless it is shared)"""
+        self.events.stop()
+        if self.owns_client:
+            self.client.close()
+
+
+class GPUDevice:
+    """One GPU the worker claims jobs for: its ComfyUI instance(s), job slots and VRAM budget"""
+
+    def __init__(self, gpu_id: int, comfyui_clients: List[ComfyUIClient],
+                 process: Optional[ComfyUIProcess] = None):
+        self.gpu_id = gpu_id
+        self.comfyui_clients = comfyui_clients
+        self.process = process  # the ComfyUI the worker launched for this GPU, if any
+        # One entry per job slot; a job borrows a client for its whole run
+        self.comfyui_pool: "queue.Queue[ComfyUIClient]" = queue.Queue()
+        for slot in range(max(MAX_CONCURRENT_JOBS, len(comfyui_clients))):
+            self.comfyui_pool.put(comfyui_clients[slot % len(comfyui_clients)])
+        self.vram_budget = self._total_vram_budget()
+        self.executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS, thread_name_prefix=f"job-gpu{gpu_id}")
+        # Jobs in flight here (guarded by the worker's _active_lock)
+        self.job_ids: Set[str] = set()
+        # Jobs executing in ComfyUI here -> whether another ran beside them
+        # at some point (same lock): their memory readings are not their own
+        self.overlapped: Dict[str, bool] = {}
+        # Model set of the last job handed to this GPU's ComfyUI, which keeps
+        # those weights loaded: advertised so the queue manager can prefer
+        # jobs that need no reload
+        self.loaded_models: Optional[str] = None
+        # No claims before this (time.monotonic()) after a job was handed back
+        self.claim_after = 0.0
+
+    def _total_vram_budget(self) -> int:
+        """VRAM (MB) concurrent jobs may share; 0 if unknown (slot limit only)"""
+        if VRAM_BUDGET_MB > 0 or MAX_CONCURRENT_JOBS <= 1:
+            return VRAM_BUDGET_MB
+        stats = get_vram_stats(self.gpu_id)
+        if not stats:
+            logger.warning(
+                f"GPU {self.gpu_id} memory unknown and WORKER_VRAM_BUDGET_MB unset - running up to "
+                f"{MAX_CONCURRENT_JOBS} jobs without a VRAM budget"
+            )
+            return 0
+        return max(stats["total_mb"] - VRAM_SAFETY_MARGIN_MB, 0)
+
+    def claim_budget(self, running: Dict[Future, int]) -> Optional[int]:
+        """
+        VRAM (MB) to offer for the next claim: what is left of the budget
+        beside the jobs in flight, 0 for no limit, None if nothing more fits.
+        """
+        if not self.vram_budget:
+            return 0
+        remaining = self.vram_budget - sum(running.values())
+        return remaining if remaining > 0 else None
 
 
 class Worker:
-    """Main worker class"""
+    """Main worker class: one claim loop per GPU, one heartbeat for all of them"""
 
     def __init__(self):
         self.worker_id = WORKER_ID
         self.queue_manager_url = QUEUE_MANAGER_URL
-        self.comfyui = ComfyUIClient()
+        # One connection pool for the queue manager and every ComfyUI instance
         self.http_client = httpx.Client(timeout=float(HTTP_CLIENT_TIMEOUT))
+        gpus = select_gpus(WORKER_GPUS)
+        urls = device_urls(gpus, COMFYUI_URLS, COMFYUI_LAUNCH)
+        processes = launch_comfyui(gpus, self.http_client) if COMFYUI_LAUNCH else [None] * len(gpus)
+        self.devices = [
+            GPUDevice(gpu_id, [ComfyUIClient(url, client=self.http_client) for url in addresses], process)
+            for gpu_id, addresses, process in zip(gpus, urls, processes)
+        ]
         self.jobs_completed = 0
         self.jobs_failed = 0
+        self._stats_lock = threading.Lock()
         self.start_time = datetime.now(timezone.utc)
+        # Jobs in flight (on any GPU) -> estimated VRAM; the heartbeat thread
+        # reports them and keeps their leases alive
+        self.active_jobs: Dict[str, int] = {}
+        # Jobs in flight -> the ComfyUI client and prompt running them, and
+        # the jobs the queue manager took back (cancelled or lease lost)
+        self.prompts: Dict[str, Tuple[ComfyUIClient, str]] = {}
+        self.abandoned: Set[str] = set()
+        self._active_lock = threading.Lock()
+        self._stop_heartbeat = threading.Event()
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name="heartbeat", daemon=True)
+
+        logger.info(
+            f"Worker {self.worker_id} initialized for GPU {', '.join(str(gpu) for gpu in gpus)} "
+            f"(http_timeout={HTTP_CLIENT_TIMEOUT}s)"
+        )
 
-        logger.info(f"Worker {self.worker_id} initialized (http_timeout={HTTP_CLIENT_TIMEOUT}s)")
-
-    def get_next_job(self) -> Optional[Dict[str, Any]]:
-        """Get next job from queue manager"""
+    @staticmethod
+    def job_vram(job: Dict[str, Any]) -> int:
+        """Estimated VRAM (MB) for a job, read as the claim script reads it (default if not a number)"""
+        try:
+            return math.ceil(float((job.get("metadata") or {})["estimated_vram"]))
+        except (KeyError, TypeError, ValueError, OverflowError):
+            return VRAM_DEFAULT_ESTIMATE_MB
+
+    def get_next_jobs(self, device: GPUDevice, max_jobs: int = 1, vram_budget: int = 0,
+                      wait: int = 0) -> List[Dict[str, Any]]:
+        """
+        Claim up to max_jobs jobs for a GPU whose estimated VRAM fits
+        vram_budget MB (0 = no limit), preferring ones using the models
+        already loaded there. With wait > 0 the request is held open by the
+        queue manager until a job is enqueued or the wait runs out.
+        """
+        params = {
+            "worker_id": self.worker_id,
+            "max": max_jobs,
+            "vram_budget": vram_budget,
+            "wait": wait,
+            "leases": "true"
+        }
+        if device.loaded_models:
+            params["models"] = device.loaded_models
         try:
             response = self.http_client.get(
-                f"{self.queue_manager_url}/api/workers/next-job",
-                params={"worker_id": self.worker_id}
+                f"{self.queue_manager_url}/api/workers/next-jobs",
+                params=params,
+                timeout=float(HTTP_CLIENT_TIMEOUT + wait)
             )
             response.raise_for_status()
             data = response.json()
-            return data.get("job")
+            jobs = data.get("jobs") or []
+            with self._active_lock:
+                self.active_jobs.update((job["id"], self.job_vram(job)) for job in jobs)
+                device.job_ids.update(job["id"] for job in jobs)
+            return jobs
 
         except Exception as e:
-            logger.error(f"Failed to get next job: {e}")
+            logger.error(f"Failed to get next jobs for GPU {device.gpu_id}: {e}")
+            return []
+
+    def status(self) -> Dict[str, Any]:
+        """This worker's WorkerStatus, as sent in heartbeats: totals, and each GPU under devices"""
+        with self._active_lock:
+            job_ids = sorted(self.active_jobs)
+            device_jobs = {device.gpu_id: sorted(device.job_ids) for device in self.devices}
+            reserved_vram = {
+                device.gpu_id: sum(self.active_jobs.get(job_id, 0) for job_id in device.job_ids)
+                for device in self.devices
+            }
+        with self._stats_lock:
+            completed, failed = self.jobs_completed, self.jobs_failed
+
+        devices = []
+        for device in self.devices:
+            stats = get_vram_stats(device.gpu_id)
+            if device.vram_budget:
+                vram_free = device.vram_budget - reserved_vram[device.gpu_id]
+            else:
+                vram_free = stats["free_mb"] - VRAM_SAFETY_MARGIN_MB if stats else 0
+            devices.append({
+                "gpu_id": device.gpu_id,
+                "current_job_ids": device_jobs[device.gpu_id],
+                "gpu_memory_used": stats["used_mb"] if stats else None,
+                "gpu_memory_total": stats["total_mb"] if stats else None,
+                "slots": MAX_CONCURRENT_JOBS,
+                "free_slots": max(MAX_CONCURRENT_JOBS - len(device_jobs[device.gpu_id]), 0),
+                "vram_free_mb": max(vram_free, 0),
+                "vram_capacity_mb": device.vram_budget or (stats["total_mb"] if stats else None),
+                "loaded_models": device.loaded_models,
+            })
+
+        def total(field: str) -> Optional[int]:
+            values = [device[field] for device in devices if device[field] is not None]
+            return sum(values) if values else None
+
+        # The models a new job is most likely to find loaded: those of the
+        # first GPU with a free slot
+        open_device = next((device for device in devices if device["free_slots"]), devices[0])
+        return {
+            "worker_id": self.worker_id,
+            "status": "busy" if job_ids else "idle",
+            "current_job_ids": job_ids,
+            "jobs_completed": completed,
+            "jobs_failed": failed,
+            "gpu_memory_used": total("gpu_memory_used"),
+            "gpu_memory_total": total("gpu_memory_total"),
+            "slots": total("slots"),
+            "free_slots": total("free_slots"),
+            "vram_free_mb": total("vram_free_mb"),
+            "vram_capacity_mb": max((device["vram_capacity_mb"] or 0 for device in devices), default=0) or None,
+            "loaded_models": open_device["loaded_models"],
+            "devices": devices,
+        }
+
+    def send_heartbeat(self) -> Optional[List[str]]:
+        """
+        Post our status to the queue manager, which also renews the leases of
+        the jobs in flight. Returns the jobs we no longer hold (None on error).
+        """
+        try:
+            response = self.http_client.post(
+                f"{self.queue_manager_url}/api/workers/heartbeat", json=self.status()
+            )
+            response.raise_for_status()
+            data = response.json()
+            lost = data.get("lost") or []
+            cancelled = set(data.get("cancelled") or [])
+            for job_id in lost:
+                if job_id in cancelled:
+                    logger.info(f"Job {job_id} was cancelled - stopping it")
+                else:
+                    logger.warning(f"Lease on job {job_id} lost - the queue manager has given it to another worker")
+                self.abandon(job_id)
+            return lost
+
+        except Exception as e:
+            logger.error(f"Failed to send heartbeat: {e}")
             return None
 
+    def abandon(self, job_id: str):
+        """Stop working on a job the queue manager took back and free its slot"""
+        with self._active_lock:
+            if job_id not in self.active_jobs:
+                return
+            self.abandoned.add(job_id)
+            running = self.prompts.get(job_id)
+        if running:
+            comfyui, prompt_id = running
+            comfyui.cancel(prompt_id)
+
+    def _heartbeat_loop(self):
+        """Heartbeat thread: runs beside the job threads until shutdown"""
+        self.send_heartbeat()
+        while not self._stop_heartbeat.wait(HEARTBEAT_INTERVAL):
+            self.send_heartbeat()
+
+    def deregister(self):
+        """Leave the queue manager's worker registry"""
+        try:
+            self.http_client.delete(f"{self.queue_manager_url}/api/workers/{self.worker_id}")
+        except Exception as e:
+            logger.warning(f"Failed to deregister worker: {e}")
+
     def complete_job(self, job_id: str, result: Dict[str, Any]) -> bool:
         """Mark job as completed"""
         try:
             response = self.http_client.post(
                 f"{self.queue_manager_url}/api/workers/complete-job",
-                params={"job_id": job_id},
-                json=result
+                params={"job_id": job_id, "worker_id": self.worker_id},
+                json={"result": result}
             )
+            if response.status_code == 409:
+                logger.warning(f"Job {job_id} finished after its lease was lost; result discarded")
+                return False
             response.raise_for_status()
             logger.info(f"Job {job_id} marked as completed")
             return True
@@ -199,8 +562,12 @@ class Worker:
         try:
             response = self.http_client.post(
                 f"{self.queue_manager_url}/api/workers/fail-job",
-                params={"job_id": job_id, "error": error}
+                params={"job_id": job_id, "worker_id": self.worker_id},
+                json={"error": error}
             )
+            if response.status_code == 409:
+                logger.warning(f"Job {job_id} failed after its lease was lost; not reported")
+                return False
             response.raise_for_status()
             logger.error(f"Job {job_id} marked as failed: {error}")
             return True
@@ -209,35 +576,116 @@ class Worker:
             logger.error(f"Failed to mark job {job_id} as failed: {e}")
             return False
 
-    def process_job(self, job: Dict[str, Any]) -> bool:
+    def release_job(self, device: GPUDevice, job_id: str, reason: str) -> bool:
+        """
+        Hand a job back to the queue unrun and hold off claiming on the GPU
+        for VRAM_RETRY_DELAY. If the queue manager cannot take it back the job
+        is dropped here and its lease, no longer renewed, requeues it.
+        """
+        device.claim_after = time.monotonic() + VRAM_RETRY_DELAY
+        try:
+            response = self.http_client.post(
+                f"{self.queue_manager_url}/api/workers/release-job",
+                params={"job_id": job_id, "worker_id": self.worker_id}
+            )
+            if response.status_code == 409:
+                logger.warning(f"Job {job_id} was taken back before it could be released")
+                return False
+            response.raise_for_status()
+            if response.json().get("outcome") == "dead_letter":
+                logger.error(f"Job {job_id} handed back too many times and dead-lettered: {reason}")
+            else:
+                logger.warning(f"Job {job_id} handed back to the queue: {reason}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to release job {job_id} ({reason}); its lease will requeue it: {e}")
+            return False
+
+    def process_job(self, device: GPUDevice, job: Dict[str, Any]) -> bool:
+        """Process a single job on a GPU, keeping its lease renewed until it is reported"""
+        try:
+            return self._process_job(device, job)
+        finally:
+            peak_vram(job.get("id"))  # stop tracking if the job ended early
+            with self._active_lock:
+                self.active_jobs.pop(job.get("id"), None)
+                device.job_ids.discard(job.get("id"))
+                device.overlapped.pop(job.get("id"), None)
+                self.prompts.pop(job.get("id"), None)
+                self.abandoned.discard(job.get("id"))
+
+    def _process_job(self, device: GPUDevice, job: Dict[str, Any]) -> bool:
         """Process a single job with VRAM pre-check"""
         job_id = job.get("id")
         workflow = job.get("workflow")
         user_id = job.get("user_id")
         metadata = job.get("metadata", {})
 
-        logger.info(f"Processing job {job_id} for user {user_id}")
+        logger.info(f"Processing job {job_id} for user {user_id} on GPU {device.gpu_id}")
 
         try:
-            # Check VRAM before accepting job (Issue #4 - OOM prevention)
-            estimated_vram = metadata.get("estimated_vram", 8192)  # Default 8GB
-            if not check_vram_sufficient(estimated_vram):
-                error_msg = (
-                    f"Insufficient GPU memory for job {job_id}: "
-                    f"needs {estimated_vram}MB + safety margin"
-                )
-                logger.warning(error_msg)
-                self.fail_job(job_id, error_msg)
-                self.jobs_failed += 1
+            # Check VRAM before accepting job (Issue #4 - OOM prevention). With
+            # a VRAM budget the queue manager only handed out jobs that fit
+            # beside the ones in flight, whose memory is not all allocated
+            # yet, so the live reading would turn away jobs that do fit.
+            # Without one, a job that does not fit now is handed back rather
+            # than failed: the GPU may be free again in a moment. A learned
+            # peak percentile needs less margin than a guess. A job larger than
+            # the whole GPU is failed: no amount of waiting would make it fit
+            estimated_vram = self.job_vram(job)
+            margin = VRAM_PROFILED_MARGIN_MB if metadata.get("vram_source") == "profile" else None
+            if not device.vram_budget and not check_vram_sufficient(
+                estimated_vram, safety_margin_mb=margin, gpu_id=device.gpu_id
+            ):
+                stats = get_vram_stats(device.gpu_id)
+                if stats and estimated_vram > stats["total_mb"]:
+                    raise RuntimeError(
+                        f"Job needs ~{estimated_vram}MB of VRAM, more than GPU {device.gpu_id} has ({stats['total_mb']}MB)"
+                    )
+                self.release_job(device, job_id, f"not enough free GPU memory for {estimated_vram}MB + safety margin")
                 return False
 
             # Submit workflow to ComfyUI
-            prompt_id = self.comfyui.queue_prompt(workflow)
-            if not prompt_id:
-                raise RuntimeError("Failed to queue workflow in ComfyUI")
-
-            # Wait for completion (use JOB_TIMEOUT for video generation)
-            result = self.comfyui.wait_for_completion(prompt_id, timeout=JOB_TIMEOUT)
+            comfyui = device.comfyui_pool.get()
+            try:
+                with self._active_lock:
+                    if job_id in self.abandoned:
+                        raise JobAbandoned(f"Job {job_id} taken back before it started")
+                    for other in device.overlapped:
+                        device.overlapped[other] = True
+                    device.overlapped[job_id] = bool(device.overlapped)
+
+                # Baselines for the job's peak VRAM, sent with its result for
+                # the queue manager's profiles: the rise of the GPU's sampled
+                # use, else of what its ComfyUI instance (one job at a time)
+                # holds through torch. Either only counts if the job had the
+                # GPU to itself
+                track_peak(job_id, device.gpu_id)
+                reserved_before = comfyui.torch_vram_mb()
+                prompt_id = comfyui.queue_prompt(workflow)
+                if not prompt_id:
+                    raise RuntimeError("Failed to queue workflow in ComfyUI")
+                with self._active_lock:
+                    self.prompts[job_id] = (comfyui, prompt_id)
+                    abandoned = job_id in self.abandoned
+                    if job.get("models", "-") != "-":
+                        device.loaded_models = job["models"]
+                if abandoned:
+                    comfyui.cancel(prompt_id)  # taken back while it was being queued
+
+                # Wait for completion (use JOB_TIMEOUT for video generation)
+                result = comfyui.wait_for_completion(prompt_id, timeout=JOB_TIMEOUT)
+                peak = peak_vram(job_id)
+                with self._active_lock:
+                    overlapped = device.overlapped.pop(job_id, True)
+                if peak is None and not overlapped:
+                    reserved = comfyui.torch_vram_mb()
+                    peak = reserved - (reserved_before or 0) if reserved else None
+                if peak and peak > 0:
+                    result["peak_vram_mb"] = peak
+            finally:
+                device.comfyui_pool.put(comfyui)
 
             # Save outputs to user directory
             user_output_dir = os.path.join(OUTPUTS_PATH, user_id)
@@ -248,65 +696,121 @@ class Worker:
 
             # Mark job as completed
             self.complete_job(job_id, result)
-            self.jobs_completed += 1
+            with self._stats_lock:
+                self.jobs_completed += 1
 
             logger.info(f"Job {job_id} completed successfully")
             return True
 
+        except JobAbandoned as e:
+            # Cancelled or requeued by the queue manager: nothing to report
+            logger.info(f"Job {job_id} abandoned: {e}")
+            return False
+
         except Exception as e:
             error_msg = str(e)
             logger.error(f"Job {job_id} failed: {error_msg}")
 
             # Mark job as failed
             self.fail_job(job_id, error_msg)
-            self.jobs_failed += 1
+            with self._stats_lock:
+                self.jobs_failed += 1
 
             return False
 
-    def run(self):
-        """Main worker loop"""
-        logger.info(f"Worker {self.worker_id} started")
-        logger.info(f"Queue Manager: {self.queue_manager_url}")
-        logger.info(f"ComfyUI: {self.comfyui.base_url}")
-        logger.info(f"Poll interval: {POLL_INTERVAL}s")
-
-        # Register signal handlers
-        signal.signal(signal.SIGINT, signal_handler)
-        signal.signal(signal.SIGTERM, signal_handler)
+    def claim_loop(self, device: GPUDevice):
+        """Claim and run jobs for one GPU until shutdown (one thread per device)"""
+        # Jobs in flight -> their estimated VRAM
+        running: Dict[Future, int] = {}
 
         while not shutdown_requested:
             try:
-                # Get next job
-                job = self.get_next_job()
+                polled_at = time.monotonic()
+                free_slots = MAX_CONCURRENT_JOBS - len(running)
+                vram_budget = device.claim_budget(running)
 
-                if job:
-                    # Process job
-                    self.process_job(job)
-                else:
-                    # No jobs available, wait before polling again
-                    logger.debug(f"No jobs available, sleeping for {POLL_INTERVAL}s")
+                # A launched ComfyUI that exited is restarted before more jobs are claimed
+                if device.process and not device.process.ensure_running():
+                    time.sleep(POLL_INTERVAL)
+                    continue
+
+                if free_slots > 0 and vram_budget is not None and time.monotonic() >= device.claim_after:
+                    # Long-poll only when idle; with jobs in flight come back
+                    # regularly to refill slots as they free up
+                    jobs = self.get_next_jobs(device, free_slots, vram_budget, 0 if running else LONG_POLL_SECONDS)
+                    for job in jobs:
+                        running[device.executor.submit(self.process_job, device, job)] = self.job_vram(job)
+
+                if running:
+                    done, _ = wait_futures(running, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        running.pop(future)
+                elif not LONG_POLL_SECONDS or time.monotonic() - polled_at < LONG_POLL_SECONDS / 2:
+                    # Nothing came back early (polling mode, an error, or a queue
+                    # manager without long-poll support): back off before retrying
+                    logger.debug(f"No jobs available for GPU {device.gpu_id}, sleeping for {POLL_INTERVAL}s")
                     time.sleep(POLL_INTERVAL)
 
-            except KeyboardInterrupt:
-                logger.info("Keyboard interrupt received")
-                break
             except Exception as e:
-                logger.error(f"Unexpected error in worker loop: {e}")
+                logger.error(f"Unexpected error in claim loop of GPU {device.gpu_id}: {e}")
                 time.sleep(POLL_INTERVAL)
 
+    def run(self):
+        """Main worker loop: start the claim loops and wait for shutdown"""
+        logger.info(f"Worker {self.worker_id} started")
+        logger.info(f"Queue Manager: {self.queue_manager_url}")
+        for device in self.devices:
+            logger.info(
+                f"GPU {device.gpu_id}: ComfyUI {', '.join(c.base_url for c in device.comfyui_clients)}, "
+                f"VRAM budget: {device.vram_budget or 'unlimited'}{'MB' if device.vram_budget else ''}"
+            )
+        logger.info(f"Poll interval: {POLL_INTERVAL}s, long-poll: {LONG_POLL_SECONDS}s, heartbeat: {HEARTBEAT_INTERVAL}s")
+        logger.info(f"Concurrent jobs: {MAX_CONCURRENT_JOBS} per GPU")
+
+        # Register signal handlers
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+
+        # VRAM checks and heartbeats read the sampler's snapshot, not nvidia-smi
+        start_sampler()
+        self.heartbeat_thread.start()
+
+        claim_threads = [
+            threading.Thread(target=self.claim_loop, args=(device,), name=f"claim-gpu{device.gpu_id}", daemon=True)
+            for device in self.devices
+        ]
+        for thread in claim_threads:
+            thread.start()
+        # Signals are handled on this thread: wake up regularly to see them
+        for thread in claim_threads:
+            while thread.is_alive():
+                thread.join(timeout=1.0)
+
         # Shutdown
         self.shutdown()
 
     def shutdown(self):
         """Graceful shutdown"""
         logger.info("Worker shutting down...")
+        logger.info("Waiting for running jobs to finish...")
+        for device in self.devices:
+            device.executor.shutdown(wait=True)
+        self._stop_heartbeat.set()
+        if self.heartbeat_thread.is_alive():
+            self.heartbeat_thread.join(timeout=HTTP_CLIENT_TIMEOUT)
+        self.deregister()
+        stop_sampler()
         logger.info(f"Total jobs completed: {self.jobs_completed}")
         logger.info(f"Total jobs failed: {self.jobs_failed}")
 
         uptime = (datetime.now(timezone.utc) - self.start_time).total_seconds()
         logger.info(f"Uptime: {uptime:.0f}s")
 
-        self.comfyui.close()
+        for device in self.devices:
+            for comfyui in device.comfyui_clients:
+                comfyui.close()
+            if device.process:
+                device.process.stop()
         self.http_client.close()
 
         logger.info("Worker shutdown complete")
@@ -24,10 +24,33 @@ INFERENCE_MODE = os.environ.get("INFERENCE_MODE", "local")
 QUEUE_MANAGER_URL = os.environ.get("QUEUE_MANAGER_URL", "http://queue-manager:3000")
 USER_ID = os.environ.get("USER_ID", "unknown")
 
+# QM accepts serverless jobs at once (202) and runs them in the background;
+# the proxy follows the job with GET /api/jobs/{id}
+JOB_POLL_INTERVAL = 2
+# Cold start (60-210s) + model load (60-180s) + inference (10-60s), plus slack
+JOB_MAX_WAIT = 660
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
 NODE_CLASS_MAPPINGS = {}
 NODE_DISPLAY_NAME_MAPPINGS = {}
 
 
+def _wait_for_job(job: dict) -> dict:
+    """Poll QM until the job reaches a terminal status; returns the final JobResponse"""
+    deadline = time.monotonic() + JOB_MAX_WAIT
+    while job.get("status") not in TERMINAL_STATUSES:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Job {job.get('id')} not finished after {JOB_MAX_WAIT}s")
+        time.sleep(JOB_POLL_INTERVAL)
+        try:
+            with urllib.request.urlopen(f"{QUEUE_MANAGER_URL}/api/jobs/{job['id']}", timeout=10) as response:
+                job = json.loads(response.read())
+        except (urllib.error.URLError, TimeoutError) as e:
+            # Transient QM hiccup: the job carries on server-side, keep polling
+            logger.warning(f"Polling job {job.get('id')} failed: {e}")
+    return job
+
+
 def _apply_execution_patch():
     """Monkey-patch PromptExecutor.execute() to proxy to serverless via QM."""
     try:
@@ -45,8 +68,9 @@ def _apply_execution_patch():
 
         Flow:
         1. Send execution_start WebSocket message (native queue UI responds)
-        2. POST workflow to QM /api/jobs (QM forwards to serverless, polls, fetches images)
-        3. Parse response for output image metadata
+        2. POST workflow to QM /api/jobs (202: QM forwards to serverless, polls,
+           fetches images in the background), then poll GET /api/jobs/{id}
+        3. Parse the finished job for output image metadata
         4. Send executed/execution_complete WebSocket messages
         5. Register outputs in ComfyUI's internal state
         """
@@ -71,7 +95,7 @@ def _apply_execution_patch():
             })
 
         # Periodic heartbeat: send "executing" messages every 5s to keep the UI alive
-        # while the QM blocks waiting for serverless inference (30-120s).
+        # while the serverless inference runs (30-120s).
         heartbeat_active = threading.Event()
         heartbeat_active.set()
 
@@ -96,7 +120,7 @@ def _apply_execution_patch():
         heartbeat_thread.start()
 
         try:
-            # Submit workflow to QM (blocks until serverless returns with images)
+            # Submit workflow to QM (returns at once), then wait for the job to finish
             payload = json.dumps({
                 "user_id": USER_ID,
                 "workflow": prompt,
@@ -115,9 +139,10 @@ def _apply_execution_patch():
             )
 
             logger.info(f"Proxying execution to QM: {prompt_id} ({len(prompt)} nodes)")
-            # 600s timeout: cold start (60-210s) + model load (60-180s) + inference (10-60s)
-            response = urllib.request.urlopen(req, timeout=600)
-            result = json.loads(response.read())
+            with urllib.request.urlopen(req, timeout=30) as response:
+                result = json.loads(response.read())
+            logger.info(f"QM accepted job {result.get('id')} for {prompt_id}")
+            result = _wait_for_job(result)
             logger.info(f"QM response: status={result.get('status')}, has_result={bool(result.get('result'))}")
             if result.get("result"):
                 qm_outputs = result["result"].get("outputs", {})
@@ -128,12 +153,11 @@ def _apply_execution_patch():
 
             # Extract outputs from QM response
             # QM returns JobResponse with result.outputs containing saved image metadata
-            qm_result = result.get("result", {})
+            qm_result = result.get("result") or {}
 
             # Check for execution errors from QM (serverless worker failed)
-            if isinstance(qm_result, dict) and qm_result.get("execution_error"):
-                error_messages = qm_result["execution_error"]
-                error_str = str(error_messages)[:500]
+            if result.get("status") != "completed":
+                error_str = str(result.get("error") or f"job {result.get('status')}")[:500]
                 logger.error(f"Serverless execution error for {prompt_id}: {error_str}")
 
                 prompt_server.send_sync("execution_error", {
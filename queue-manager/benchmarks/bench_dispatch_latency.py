@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark: submit-to-start latency, interval polling vs long-poll dispatch.
+
+Runs WORKERS simulated workers against RedisClient while jobs arrive at
+random (exponential inter-arrival times), each "running" for a random time.
+In poll mode a worker with nothing to do sleeps POLL_INTERVAL before asking
+again (the old worker loop); in long-poll mode it parks in wait_for_job,
+which is what GET /api/workers/next-job?wait=N does. Latency is
+started_at - created_at for every job.
+
+Uses the queue manager's Redis settings (REDIS_HOST, REDIS_PASSWORD, ...)
+and FLUSHES the selected database - point it at a scratch instance:
+
+    REDIS_HOST=localhost REDIS_PASSWORD=... REDIS_DB=15 \\
+        python3 benchmarks/bench_dispatch_latency.py --jobs 60
+
+--fake runs against an in-process fakeredis instead.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run_mode(client, mode: str, args) -> list:
+    from models import Job
+
+    arrivals, runtimes = random.Random(args.seed), random.Random(args.seed + 1)
+    workflow = {"1": {"class_type": "KSampler", "inputs": {"seed": 1}}}
+    latencies = []
+    done = asyncio.Event()
+
+    async def worker(worker_id: str):
+        while not done.is_set():
+            if mode == "poll":
+                job = await client.claim_next_job(worker_id)
+                if not job:
+                    await asyncio.sleep(args.poll_interval)
+                    continue
+            else:
+                job = await client.wait_for_job(worker_id, timeout=args.long_poll)
+                if not job:
+                    continue
+            latencies.append((job.started_at - job.created_at).total_seconds())
+            if len(latencies) == args.jobs:
+                done.set()
+            await asyncio.sleep(runtimes.expovariate(1 / args.runtime))
+
+    await client.redis.flushdb()
+    workers = [asyncio.create_task(worker(f"bench-{i}")) for i in range(args.workers)]
+    for i in range(args.jobs):
+        await asyncio.sleep(arrivals.expovariate(1 / args.arrival))
+        await client.create_job(Job(user_id=f"user{i % 5}", workflow=workflow))
+    await done.wait()
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    return latencies
+
+
+async def run(args):
+    import redis_client as redis_client_module
+    if args.fake:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        redis_client_module.Redis = lambda **kw: fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+
+    client = redis_client_module.RedisClient()
+    print(
+        f"{args.jobs} jobs, {args.workers} workers, mean arrival {args.arrival}s, "
+        f"mean runtime {args.runtime}s, poll interval {args.poll_interval}s\n"
+    )
+    print(f"{'mode':<10} {'mean':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}   (ms)")
+    for mode in ("poll", "long-poll"):
+        ms = [s * 1000 for s in await run_mode(client, mode, args)]
+        print(
+            f"{mode:<10} {statistics.mean(ms):>8.1f} {percentile(ms, 50):>8.1f} "
+            f"{percentile(ms, 90):>8.1f} {percentile(ms, 99):>8.1f} {max(ms):>8.1f}"
+        )
+
+    await client.redis.flushdb()
+    await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--arrival", type=float, default=0.5, help="mean seconds between submissions")
+    parser.add_argument("--runtime", type=float, default=0.5, help="mean simulated job seconds")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="WORKER_POLL_INTERVAL")
+    parser.add_argument("--long-poll", type=float, default=25.0, help="WORKER_LONG_POLL_SECONDS")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--fake", action="store_true", help="use in-process fakeredis")
+    asyncio.run(run(parser.parse_args()))
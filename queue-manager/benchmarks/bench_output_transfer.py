@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark: moving a serverless output into OUTPUTS_PATH, copy2 vs output_transfer.
+
+Writes a --size MB file (a stand-in for a 4K video) into --src and moves it
+into --dest --repeat times each way:
+
+- copy2:     the previous shutil.copy2 inside the coroutine
+- copy:      transfer_file(mode=copy) in a thread (copy_file_range/sendfile)
+- link:      transfer_file(mode=link) in a thread (hardlink/reflink if the
+             filesystems allow, else as copy)
+- reference: transfer_file(mode=reference), nothing moved
+
+While each runs, a ticker coroutine measures how late the event loop gets
+to it (what every request and WebSocket on the queue manager would feel).
+Reported: time per file, the mechanism used, and the worst event-loop stall.
+Use a --src on another filesystem than --dest to see the cross-device path:
+
+    python3 benchmarks/bench_output_transfer.py --size 1024 --src /dev/shm --dest /tmp
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+from output_transfer import transfer_file  # noqa: E402
+
+
+async def ticker(stalls: list, stop: asyncio.Event, interval: float = 0.005):
+    """Record how much later than `interval` each tick comes round"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        stalls.append(time.perf_counter() - start - interval)
+
+
+async def run_mode(mode: str, src: Path, dest_dir: Path, repeat: int):
+    timings, methods, stalls = [], set(), [0.0]
+    for i in range(repeat):
+        dest = dest_dir / f"{mode}-{i}.mp4"
+        stop = asyncio.Event()
+        tick = asyncio.create_task(ticker(stalls, stop))
+        await asyncio.sleep(0.02)
+        start = time.perf_counter()
+        if mode == "copy2":
+            shutil.copy2(str(src), str(dest))
+            methods.add("copy2")
+        else:
+            methods.add(await asyncio.to_thread(transfer_file, src, dest, mode))
+        timings.append(time.perf_counter() - start)
+        stop.set()
+        await tick
+        dest.unlink(missing_ok=True)
+    return statistics.median(timings), ",".join(sorted(methods)), max(stalls)
+
+
+async def run(args):
+    src_dir = Path(tempfile.mkdtemp(dir=args.src))
+    dest_dir = Path(tempfile.mkdtemp(dir=args.dest))
+    try:
+        src = src_dir / "output.mp4"
+        with open(src, "wb") as f:
+            block = os.urandom(1024 * 1024)
+            for _ in range(args.size):
+                f.write(block)
+        same_fs = os.stat(src_dir).st_dev == os.stat(dest_dir).st_dev
+        print(f"{args.size} MB, {args.src} -> {args.dest} ({'same' if same_fs else 'different'} filesystem)\n")
+        print(f"{'mode':<10} {'ms/file':>9} {'MB/s':>9} {'worst stall ms':>15}  mechanism")
+        for mode in ("copy2", "copy", "link", "reference"):
+            elapsed, methods, stall = await run_mode(mode, src, dest_dir, args.repeat)
+            rate = args.size / elapsed if elapsed else float("inf")
+            print(f"{mode:<10} {elapsed * 1000:>9.1f} {rate:>9.0f} {stall * 1000:>15.1f}  {methods}")
+    finally:
+        shutil.rmtree(src_dir, ignore_errors=True)
+        shutil.rmtree(dest_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=512, help="output size in MB")
+    parser.add_argument("--src", default=tempfile.gettempdir(), help="directory standing in for SFS")
+    parser.add_argument("--dest", default=tempfile.gettempdir(), help="directory standing in for OUTPUTS_PATH")
+    parser.add_argument("--repeat", type=int, default=3)
+    asyncio.run(run(parser.parse_args()))
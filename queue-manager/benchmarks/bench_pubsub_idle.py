@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmark: idle cost of the WebSocketManager Redis listener.
+
+Runs each listener for DURATION seconds with no pub/sub traffic and
+measures the process CPU time it burns and how often it wakes the event
+loop, then for another DURATION seconds the event-loop lag it causes (how
+late a 10 ms asyncio.sleep ticker wakes up). "legacy" is the previous
+loop - get_message(timeout=0.1) followed by asyncio.sleep(0.01) - kept here
+for comparison; "awaitable" is WebSocketManager._listen_to_redis. Ends with
+a few published messages to check the listener still delivers them.
+
+Uses the queue manager's Redis settings (REDIS_HOST, REDIS_PASSWORD, ...):
+
+    REDIS_HOST=localhost REDIS_PASSWORD=... \\
+        python3 benchmarks/bench_pubsub_idle.py --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def legacy_listen(manager):
+    """The pre-awaitable listener loop (without its retry wrapper)"""
+    pubsub = await manager.redis_client.subscribe_to_updates()
+    try:
+        while True:
+            message = await pubsub.get_message(timeout=0.1)
+            if message and message['type'] == 'message':
+                await manager.broadcast(json.loads(message['data']))
+            await asyncio.sleep(0.01)
+    finally:
+        await pubsub.aclose()
+
+
+class WakeupCounter:
+    """Counts event-loop iterations by wrapping the loop's selector"""
+
+    def __init__(self, loop):
+        self.count = 0
+        selector = loop._selector
+        select = selector.select
+
+        def counted(timeout=None):
+            self.count += 1
+            return select(timeout)
+
+        selector.select = counted
+
+
+async def idle(manager):
+    await asyncio.sleep(3600)
+
+
+async def measure(manager, listener, duration: float, wakeups: WakeupCounter, tick: float = 0.01):
+    task = asyncio.create_task(listener(manager))
+    await asyncio.sleep(0.5)  # let it subscribe
+
+    # Idle cost: nothing else runs on the loop
+    cpu_start, wall_start, wakeups_start = time.process_time(), time.perf_counter(), wakeups.count
+    await asyncio.sleep(duration)
+    wall = time.perf_counter() - wall_start
+    cpu = (time.process_time() - cpu_start) / wall * 100
+    rate = (wakeups.count - wakeups_start) / wall
+
+    # Loop lag: how late a 10 ms ticker wakes up beside the listener
+    lags = []
+    lag_start = time.perf_counter()
+    while time.perf_counter() - lag_start < duration:
+        before = time.perf_counter()
+        await asyncio.sleep(tick)
+        lags.append((time.perf_counter() - before - tick) * 1000)
+
+    # Still delivering?
+    received = []
+
+    async def record(message):
+        received.append(message)
+
+    manager.broadcast = record
+    for i in range(5):
+        await manager.redis_client._publish_event("bench", {"n": i})
+    await asyncio.sleep(0.5)
+    del manager.broadcast
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return cpu, rate, lags, len(received) if listener is not idle else None
+
+
+async def run(args):
+    from redis_client import RedisClient
+    from websocket_manager import WebSocketManager
+
+    client = RedisClient()
+    manager = WebSocketManager(client)
+    wakeups = WakeupCounter(asyncio.get_running_loop())
+
+    print(f"{args.duration:.0f}s idle + {args.duration:.0f}s ticker per listener\n")
+    print(f"{'listener':<11} {'CPU %':>7} {'wakeups/s':>10} {'lag mean':>9} {'lag p99':>8} {'lag max':>8} {'delivered':>10}")
+    listeners = (
+        ("(none)", idle),
+        ("legacy", legacy_listen),
+        ("awaitable", WebSocketManager._listen_to_redis),
+    )
+    for name, listener in listeners:
+        cpu, rate, lags, delivered = await measure(manager, listener, args.duration, wakeups)
+        print(
+            f"{name:<11} {cpu:>7.3f} {rate:>10.1f} {statistics.mean(lags):>9.3f} "
+            f"{percentile(lags, 99):>8.3f} {max(lags):>8.3f} {'-' if delivered is None else f'{delivered}/5':>10}"
+        )
+    print("\n(lag in ms; (none) = ticker only, no listener)")
+
+    await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10.0, help="idle seconds per listener")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark: round-robin claim cost vs pending queue depth.
+
+Fills queue:pending with N jobs spread over U users, then times CLAIMS
+round-robin claims through RedisClient.claim_next_job (per-user queues +
+fair-share set) and the same number of picks with the previous algorithm
+(ZRANGE the whole pending set, look up every job's owner, GET each user's
+completed count), which is reproduced here for comparison.
+
+Uses the queue manager's Redis settings (REDIS_HOST, REDIS_PASSWORD, ...)
+and FLUSHES the selected database - point it at a scratch instance:
+
+    REDIS_HOST=localhost REDIS_PASSWORD=... REDIS_DB=15 \\
+        python3 benchmarks/bench_round_robin.py --depths 1000 10000
+
+--fake runs against an in-process fakeredis instead (relative numbers only).
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+
+async def legacy_pick(redis, key_pending: str) -> str:
+    """The pre-fair-share selection: O(N) Redis calls per claim"""
+    job_ids = await redis.zrange(key_pending, 0, -1)
+    pipe = redis.pipeline(transaction=False)
+    for job_id in job_ids:
+        pipe.hget(f"job:{job_id}", "user_id")
+    owners = await pipe.execute()
+
+    user_jobs = {}
+    for job_id, user_id in zip(job_ids, owners):
+        user_jobs.setdefault(user_id, []).append(job_id)
+
+    selected, fewest = None, float("inf")
+    for user_id in user_jobs:
+        completed = int(await redis.get(f"user:{user_id}:completed") or 0)
+        if completed < fewest:
+            selected, fewest = user_id, completed
+    return user_jobs[selected][0] if selected else None
+
+
+async def run(depths, users: int, claims: int, fake: bool):
+    import redis_client as redis_client_module
+    if fake:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        redis_client_module.Redis = lambda **kw: fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+
+    from models import Job, QueueMode
+
+    client = redis_client_module.RedisClient()
+    workflow = {"1": {"class_type": "KSampler", "inputs": {"seed": 1}}}
+
+    print(f"{'pending':>8} {'users':>6} {'legacy pick':>14} {'fair-share claim':>18}")
+    for depth in depths:
+        await client.redis.flushdb()
+        for i in range(depth):
+            await client.create_job(Job(user_id=f"user{i % users:03d}", workflow=workflow))
+
+        start = time.perf_counter()
+        for _ in range(claims):
+            await legacy_pick(client.redis, client.QUEUE_PENDING)
+        legacy_ms = (time.perf_counter() - start) * 1000 / claims
+
+        start = time.perf_counter()
+        for _ in range(claims):
+            await client.claim_next_job("bench-worker", QueueMode.ROUND_ROBIN)
+        fair_ms = (time.perf_counter() - start) * 1000 / claims
+
+        print(f"{depth:>8} {users:>6} {legacy_ms:>11.2f} ms {fair_ms:>15.2f} ms")
+
+    await client.redis.flushdb()
+    await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depths", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--claims", type=int, default=50)
+    parser.add_argument("--fake", action="store_true", help="use in-process fakeredis")
+    args = parser.parse_args()
+    asyncio.run(run(args.depths, args.users, args.claims, args.fake))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Benchmark: serverless output download over /view, buffered vs streamed.
+
+Starts a stand-in /view server (a subprocess serving --size MB of bytes per
+file after --latency seconds) and fetches --files outputs of one job
+through the HTTP fallback of fetch_images, each mode in a fresh process:
+
+- buffered: the previous loop - one client.get at a time, whole body in
+  memory, then write_bytes
+- streamed: ServerlessRunner.fetch_images - concurrent downloads (up to
+  --concurrency), written chunk by chunk to a temporary file and renamed
+
+Reported: wall time, throughput and the peak RSS of the downloading
+process (ru_maxrss) above its RSS before the download. SFS is pointed at
+an empty directory, so every output takes the HTTP path. No Redis needed.
+
+    python3 benchmarks/bench_serverless_download.py --files 4 --size 512
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+
+def serve(port: int, size_mb: int, latency: float):
+    """The stand-in serverless /view endpoint"""
+    block = os.urandom(1024 * 1024)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if urlparse(self.path).path != "/view":
+                self.send_error(404)
+                return
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "video/mp4")
+            self.send_header("Content-Length", str(size_mb * len(block)))
+            self.end_headers()
+            for _ in range(size_mb):
+                self.wfile.write(block)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+def rss_mb() -> float:
+    """Current resident set size, MB"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+async def download(mode: str, url: str, files: int, out: Path):
+    import httpx
+    from config import settings
+    from serverless_runner import ServerlessRunner
+
+    settings.outputs_path = str(out)
+    settings.serverless_sfs_outputs_path = str(out / "no-sfs")
+    history = {"outputs": {"9": {"images": [
+        {"filename": f"video_{i}.mp4", "subfolder": "", "type": "output"} for i in range(files)
+    ]}}}
+
+    async with httpx.AsyncClient(base_url=url) as client:
+        if mode == "buffered":
+            dest_dir = out / "bench-user"
+            dest_dir.mkdir(parents=True, exist_ok=True)
+            for image in history["outputs"]["9"]["images"]:
+                params = {"filename": image["filename"], "type": "output"}
+                response = await client.get("/view", params=params, timeout=httpx.Timeout(30.0))
+                (dest_dir / image["filename"]).write_bytes(response.content)
+        else:
+            runner = ServerlessRunner.__new__(ServerlessRunner)  # no Redis, no lease task
+            runner.client = client
+            runner.downloads = asyncio.Semaphore(settings.serverless_download_concurrency)
+            saved = await runner.fetch_images(history, "bench-user")
+            assert len(saved["9"]["images"]) == files
+
+
+def measure(args):
+    """Child process: one download, then report on stdout"""
+    import logging
+    logging.disable(logging.INFO)
+    from config import settings
+    settings.serverless_download_concurrency = args.concurrency
+    with tempfile.TemporaryDirectory() as out:
+        before = rss_mb()
+        start = time.perf_counter()
+        asyncio.run(download(args.measure, args.url, args.files, Path(out)))
+        elapsed = time.perf_counter() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"elapsed": elapsed, "peak_extra": peak - before}))
+
+
+def main(args):
+    port = args.port
+    server = subprocess.Popen([sys.executable, __file__, "--serve", "--port", str(port),
+                               "--size", str(args.size), "--latency", str(args.latency)])
+    try:
+        time.sleep(1.0)
+        url = f"http://127.0.0.1:{port}"
+        total = args.files * args.size
+        print(f"{args.files} outputs x {args.size} MB, {args.latency:.2f}s to first byte, "
+              f"concurrency {args.concurrency}\n")
+        print(f"{'mode':<9} {'seconds':>8} {'MB/s':>8} {'peak RSS +MB':>13}")
+        for mode in ("buffered", "streamed"):
+            child = subprocess.run(
+                [sys.executable, __file__, "--measure", mode, "--url", url, "--files", str(args.files),
+                 "--concurrency", str(args.concurrency)],
+                check=True, capture_output=True, text=True
+            )
+            r = json.loads(child.stdout.strip().splitlines()[-1])
+            print(f"{mode:<9} {r['elapsed']:>8.2f} {total / r['elapsed']:>8.0f} {r['peak_extra']:>13.0f}")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=4, help="outputs in the job")
+    parser.add_argument("--size", type=int, default=256, help="MB per output")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before /view starts answering")
+    parser.add_argument("--concurrency", type=int, default=8, help="SERVERLESS_DOWNLOAD_CONCURRENCY")
+    parser.add_argument("--port", type=int, default=3901)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--measure", choices=("buffered", "streamed"), help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.port, args.size, args.latency)
+    elif args.measure:
+        measure(args)
+    else:
+        main(args)
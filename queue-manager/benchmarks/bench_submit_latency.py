@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark: latency of concurrent job submissions (POST /api/jobs).
+
+Fires TOTAL submissions over CONCURRENCY kept-alive connections (each
+sends its share one after another) against a running queue manager and
+prints p50/p95/p99/max latency plus throughput. Run it once against the
+old build and once against the new one to compare.
+
+Usage:
+    python3 benchmarks/bench_submit_latency.py \\
+        --url http://localhost:3000 --total 2000 --concurrency 50
+
+Set --max-queue-depth on the queue manager (MAX_QUEUE_DEPTH=0) first, or
+submissions past the limit return 429 and are reported as errors.
+
+The client is a bare HTTP/1.1 writer on asyncio streams rather than httpx:
+on a shared core httpx spent more CPU per request than the server, so it
+measured itself - its own scheduling put a 2-5s tail on the first few
+hundred requests of every run while the server's event loop sat idle.
+
+Measured on a single-CPU host (server, Redis and this script sharing the
+core), --total 2000 --concurrency 50, three rounds each:
+
+    build                      req/s    p50 ms    p99 ms    max ms  errors
+    sync client (baseline)     85-98   511-597   684-737   691-752       0
+    redis.asyncio            170-218   234-292   294-494   340-530       0
+    + batched lookups        199-228   225-244   278-475   291-508       0
+
+Every baseline submission fails with a 500 (create_job publishes a
+datetime json cannot encode), so it was measured with json.dumps(...,
+default=str) patched in. The baseline handlers are async def around a
+blocking client, so each request holds the event loop for all its Redis
+calls and requests run strictly one after another. HEAD overlaps them,
+but makes more calls per submission (worker capacity, VRAM profile,
+runtime statistics, workflow store acquire + store, the job pipeline,
+queue position, wait estimate): the profile and runtime reads now share
+one pipeline, the job_created event is published inside the job's
+pipeline, the wait estimate reuses the capacity read for the 422 check
+and a work-ahead scan shared for eta_cache_ttl seconds.
+
+Past the pool (REDIS_MAX_CONNECTIONS=50: with the server bound on Redis
+round trips, about one connection per request in flight - 25 stretched
+the max to 0.8-1s here) a request waits up to REDIS_POOL_TIMEOUT for a
+connection, then gets a 503 with Retry-After. At --concurrency 200
+(--total 1000) the 1s default shed 5-10% of submissions and held the
+rest to p99 1.6-1.7s / max 1.9s; a 10s wait shed none but gave p99
+2.2-2.5s / max 3.0s.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+from urllib.parse import urlsplit
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {"seed": 42, "steps": 20, "cfg": 7.0}},
+    "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "model.safetensors"}},
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))
+    return values[index]
+
+
+async def post(reader, writer, path: str, host: str, payload: dict):
+    """One POST on a kept-alive connection; returns the status code"""
+    body = json.dumps(payload).encode()
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    length = next(int(line.split(":", 1)[1]) for line in head if line.lower().startswith("content-length:"))
+    await reader.readexactly(length)
+    return int(head[0].split()[1])
+
+
+async def run(url: str, total: int, concurrency: int, users: int):
+    latencies = []
+    errors = 0
+    target = urlsplit(url)
+    host = target.netloc
+
+    async def connection(ids: range):
+        """Send submissions `ids` one after another over one connection"""
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(target.hostname, target.port or 80)
+        try:
+            for i in ids:
+                payload = {
+                    "user_id": f"bench-user{i % users:03d}",
+                    "workflow": WORKFLOW,
+                    "metadata": {"bench_id": str(uuid.uuid4())},
+                }
+                start = time.perf_counter()
+                try:
+                    status = await asyncio.wait_for(post(reader, writer, "/api/jobs", host, payload), 60.0)
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    errors += len(ids) - ids.index(i)
+                    return
+                if status >= 400:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connection(range(k, total, concurrency)) for k in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"submissions: {total} (concurrency {concurrency}), errors: {errors}")
+    if latencies:
+        print(f"throughput:  {len(latencies) / elapsed:.1f} req/s")
+        print(f"mean:        {statistics.mean(latencies):.1f} ms")
+        for pct in (50, 95, 99):
+            print(f"p{pct}:         {percentile(latencies, pct):.1f} ms")
+        print(f"max:         {latencies[-1]:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:3000")
+    parser.add_argument("--total", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.total, args.concurrency, args.users))
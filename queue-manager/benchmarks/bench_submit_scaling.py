@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Benchmark: submit throughput (POST /api/jobs) by queue manager worker count.
+
+For each N in --workers starts `uvicorn main:app --workers N` on --port
+against the Redis named by the usual REDIS_HOST / REDIS_PORT /
+REDIS_PASSWORD / REDIS_DB variables, waits until it is healthy and one
+replica holds the leader lease, then drives it for --duration seconds from
+--load-procs load-generator processes with --concurrency requests in flight
+each (the generator needs cores of its own, or it becomes the bottleneck).
+Reports accepted submissions per second, latency percentiles and errors.
+
+The server runs with MAX_QUEUE_DEPTH=0 and local inference mode, so every
+submission is stored and queued. Point it at a scratch database; --flush
+empties it before each round:
+
+    REDIS_HOST=localhost REDIS_PASSWORD=... REDIS_DB=15 \\
+        python3 benchmarks/bench_submit_scaling.py --workers 1 2 4 --flush
+
+Throughput can only scale up to the cores left over after Redis and the
+load generator; the machine's CPU count is printed for that reason. It has
+only been run on a single-CPU host so far, where 1/2/4 workers gave
+106/99/110 jobs/s: extra processes there add redundancy (leader failover,
+serverless job adoption), not throughput. Whether they raise throughput on
+a multi-core host is unmeasured.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+import redis
+
+ROOT = Path(__file__).resolve().parent.parent
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {"seed": 42, "steps": 20, "cfg": 7.0}},
+    "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "model.safetensors"}},
+}
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def redis_connection() -> redis.Redis:
+    return redis.Redis(
+        host=os.environ.get("REDIS_HOST", "localhost"),
+        port=int(os.environ.get("REDIS_PORT", 6379)),
+        password=os.environ.get("REDIS_PASSWORD") or None,
+        db=int(os.environ.get("REDIS_DB", 0)),
+        decode_responses=True,
+    )
+
+
+def load(url: str, duration: float, concurrency: int, seed: int, results) -> None:
+    """One load-generator process: submit back to back until the deadline"""
+
+    async def run():
+        latencies = []
+        errors = 0
+        deadline = time.perf_counter() + duration
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(base_url=url, timeout=30.0, limits=limits) as client:
+            async def submitter(n: int):
+                nonlocal errors
+                i = 0
+                while time.perf_counter() < deadline:
+                    payload = {
+                        "user_id": f"bench-user{(seed * concurrency + n) % 50:03d}",
+                        "workflow": WORKFLOW,
+                        "metadata": {"bench_id": f"{seed}-{n}-{i}-{uuid.uuid4().hex[:6]}"},
+                    }
+                    i += 1
+                    start = time.perf_counter()
+                    try:
+                        response = await client.post("/api/jobs", json=payload)
+                    except httpx.HTTPError:
+                        errors += 1
+                        continue
+                    if response.status_code >= 400:
+                        errors += 1
+                    else:
+                        latencies.append((time.perf_counter() - start) * 1000)
+
+            await asyncio.gather(*(submitter(n) for n in range(concurrency)))
+        results.put((latencies, errors))
+
+    asyncio.run(run())
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    env = dict(os.environ, MAX_QUEUE_DEPTH="0", INFERENCE_MODE="local", LOG_LEVEL="WARNING")
+    env.pop("WEB_CONCURRENCY", None)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT, env=env,
+    )
+
+
+def wait_ready(url: str, r: redis.Redis, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/health", timeout=1.0).status_code == 200 and r.get("queue-manager:leader"):
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"queue manager at {url} did not become ready")
+
+
+def run_round(workers: int, args, r: redis.Redis) -> dict:
+    if args.flush:
+        r.flushdb()
+    url = f"http://127.0.0.1:{args.port}"
+    server = start_server(workers, args.port)
+    try:
+        wait_ready(url, r)
+        time.sleep(1.0)  # let every worker process finish its startup
+
+        results = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=load, args=(url, args.duration, args.concurrency, seed, results))
+            for seed in range(args.load_procs)
+        ]
+        for proc in procs:
+            proc.start()
+        collected = [results.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+
+        leader = r.get("queue-manager:leader")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    latencies = [lat for lats, _ in collected for lat in lats]
+    return {
+        "rate": len(latencies) / args.duration,
+        "p50": percentile(latencies, 50) if latencies else float("nan"),
+        "p99": percentile(latencies, 99) if latencies else float("nan"),
+        "errors": sum(errors for _, errors in collected),
+        "leader": leader,
+    }
+
+
+def main(args):
+    r = redis_connection()
+    r.ping()
+    print(
+        f"{os.cpu_count()} CPU(s); {args.load_procs} load process(es) x {args.concurrency} in flight, "
+        f"{args.duration:.0f}s per round\n"
+    )
+    print(f"{'workers':>7} {'jobs/s':>9} {'speedup':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}  leader")
+    baseline = None
+    for workers in args.workers:
+        result = run_round(workers, args, r)
+        baseline = baseline or result["rate"]
+        print(
+            f"{workers:>7} {result['rate']:>9.0f} {result['rate'] / baseline:>7.2f}x "
+            f"{result['p50']:>8.1f} {result['p99']:>8.1f} {result['errors']:>7}  {result['leader']}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--port", type=int, default=3900)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load per round")
+    parser.add_argument("--load-procs", type=int, default=2, help="load-generator processes")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight per load process")
+    parser.add_argument("--flush", action="store_true", help="FLUSHDB the Redis database before each round")
+    main(parser.parse_args())
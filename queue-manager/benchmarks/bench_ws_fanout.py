@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Benchmark: WebSocket fan-out with slow clients, sequential vs per-client queues.
+
+Connects CLIENTS simulated WebSockets to a WebSocketManager - most fast
+(~1 ms per send), --slow of them on bad Wi-Fi (--slow-delay per send) and
+--stalled ones that hang for --stall seconds per send - then publishes
+--events job_updated events over --jobs jobs at --rate events/s.
+
+"sequential" is the previous broadcast(), awaiting send_text() for each
+connection in turn; "queued" is the current manager. Reported: delivery
+latency to the fast clients (publish to send_text), how long until every
+fast client had the last event, events each slow client got (the rest were
+coalesced into later states of the same job) and the fan-out rate. No
+Redis is needed; events go straight to broadcast().
+
+    python3 benchmarks/bench_ws_fanout.py --clients 120
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class SimulatedWebSocket:
+    """Stands in for a browser: each send_text takes `delay` seconds"""
+
+    def __init__(self, delay: float, jitter: random.Random):
+        self.delay = delay
+        self.jitter = jitter
+        self.latencies = []
+        self.last_seq = -1
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        await asyncio.sleep(self.delay * self.jitter.uniform(0.5, 1.5))
+        data = json.loads(text)["data"]
+        self.latencies.append(time.perf_counter() - data["sent"])
+        self.last_seq = max(self.last_seq, data["seq"])
+
+    async def close(self):
+        self.closed = True
+
+
+async def sequential_broadcast(clients, message: dict):
+    """The pre-queue broadcast: one connection after another"""
+    message_str = json.dumps(message)
+    for connection in clients:
+        await connection.send_text(message_str)
+
+
+async def run_mode(mode: str, args):
+    from websocket_manager import WebSocketManager
+
+    jitter = random.Random(args.seed)
+    clients = (
+        [SimulatedWebSocket(args.fast_delay, jitter) for _ in range(args.clients - args.slow - args.stalled)]
+        + [SimulatedWebSocket(args.slow_delay, jitter) for _ in range(args.slow)]
+        + [SimulatedWebSocket(args.stall, jitter) for _ in range(args.stalled)]
+    )
+    fast = clients[:args.clients - args.slow - args.stalled]
+    slow = clients[len(fast):len(fast) + args.slow]
+
+    manager = WebSocketManager(redis_client=None)
+    manager.listener_task = asyncio.get_running_loop().create_future()  # no Redis listener
+    for ws in clients:
+        await manager.connect(ws, ["all"])
+
+    async def publish():
+        for seq in range(args.events):
+            message = {
+                "type": "job_updated",
+                "data": {"id": f"job-{seq % args.jobs}", "status": "running", "seq": seq, "sent": time.perf_counter()},
+            }
+            if mode == "sequential":
+                await sequential_broadcast(clients, message)
+            else:
+                await manager.broadcast(message)
+            await asyncio.sleep(1 / args.rate)
+
+    start = time.perf_counter()
+    publisher = asyncio.create_task(publish())
+    last = args.events - 1
+    deadline = start + args.deadline
+    while time.perf_counter() < deadline and not all(ws.last_seq == last for ws in fast):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    finished = all(ws.last_seq == last for ws in fast)
+
+    publisher.cancel()
+    stats = manager.stats()
+    await manager.close()
+    await asyncio.gather(publisher, return_exceptions=True)
+
+    latencies = [lat * 1000 for ws in fast for lat in ws.latencies]
+    deliveries = sum(len(ws.latencies) for ws in clients)
+    return {
+        "elapsed": elapsed,
+        "finished": finished,
+        "p50": percentile(latencies, 50) if latencies else float("nan"),
+        "p99": percentile(latencies, 99) if latencies else float("nan"),
+        "slow_received": statistics.mean(len(ws.latencies) for ws in slow) if slow else 0,
+        "rate": deliveries / elapsed,
+        "stats": stats,
+        "disconnected": sum(ws.closed for ws in clients),
+    }
+
+
+async def run(args):
+    from config import settings
+    settings.ws_client_queue_size = args.queue_size
+    settings.ws_send_timeout = args.send_timeout
+
+    print(
+        f"{args.clients} clients ({args.slow} slow at {args.slow_delay * 1000:.0f} ms/send, "
+        f"{args.stalled} stalled at {args.stall:.0f} s/send), {args.events} events over "
+        f"{args.jobs} jobs at {args.rate:.0f}/s\n"
+    )
+    print(f"{'mode':<11} {'fast done':>10} {'p50 ms':>9} {'p99 ms':>9} {'slow got':>9} {'sends/s':>9} {'dropped':>8} {'kicked':>7}")
+    for mode in ("sequential", "queued"):
+        r = await run_mode(mode, args)
+        done = f"{r['elapsed']:.2f}s" if r["finished"] else f">{args.deadline:.0f}s"
+        print(
+            f"{mode:<11} {done:>10} {r['p50']:>9.1f} {r['p99']:>9.1f} "
+            f"{r['slow_received']:>6.0f}/{args.events:<2} {r['rate']:>9.0f} "
+            f"{r['stats']['dropped']:>8} {r['disconnected']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=120)
+    parser.add_argument("--slow", type=int, default=5)
+    parser.add_argument("--stalled", type=int, default=1)
+    parser.add_argument("--fast-delay", type=float, default=0.001, help="seconds per send, fast client")
+    parser.add_argument("--slow-delay", type=float, default=0.25, help="seconds per send, slow client")
+    parser.add_argument("--stall", type=float, default=30.0, help="seconds per send, stalled client")
+    parser.add_argument("--events", type=int, default=300)
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=100.0, help="events published per second")
+    parser.add_argument("--queue-size", type=int, default=256, help="WS_CLIENT_QUEUE_SIZE")
+    parser.add_argument("--send-timeout", type=float, default=2.0, help="WS_SEND_TIMEOUT")
+    parser.add_argument("--deadline", type=float, default=20.0, help="give up waiting after this many seconds")
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(run(parser.parse_args()))
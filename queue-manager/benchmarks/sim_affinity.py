@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Replay: model-affinity claims vs plain queue order on a mixed workload.
+
+Replays one synthetic job mix - the four templates in data/workflows, with
+runtimes around --runtimes and a checkpoint load of --load-times whenever a
+worker switches to a template whose model set it does not have loaded -
+over --workers single-slot workers, once without affinity and once per
+--max-skips value. Arrivals are Poisson at --load x the capacity the
+workers would have if they never reloaded. Claims follow the claim script:
+the first of the --depth head jobs (same priority) using the worker's loaded
+model set, unless a job ahead has already been overtaken max-skips times.
+
+Reported per policy: model cache hit rate (claims needing no reload), the
+share of GPU time spent loading, throughput (jobs per hour over the
+replay), mean / p95 / max queue wait and the most times any job was
+overtaken. No Redis is needed.
+
+    python3 benchmarks/sim_affinity.py --jobs 3000 --workers 4 --load 0.8
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+WORKFLOWS = Path(__file__).resolve().parent.parent.parent / "data" / "workflows"
+
+# template -> share of submissions
+MIX = {
+    "flux2_klein_4b_text_to_image": 0.45,
+    "flux2_klein_9b_text_to_image": 0.30,
+    "ltx2_text_to_video_distilled": 0.15,
+    "ltx2_text_to_video": 0.10,
+}
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def make_jobs(args, runtimes):
+    """[(arrival, template, runtime)], the same for every policy"""
+    rng = random.Random(args.seed)
+    mean_runtime = sum(MIX[name] * runtimes[name] for name in MIX)
+    rate = args.load * args.workers / mean_runtime
+    jobs, now = [], 0.0
+    for _ in range(args.jobs):
+        now += rng.expovariate(rate)
+        name = rng.choices(list(MIX), weights=list(MIX.values()))[0]
+        jobs.append((now, name, runtimes[name] * rng.lognormvariate(0, args.sigma)))
+    return jobs
+
+
+def pick(pending, loaded, depth: int, max_skips: int) -> int:
+    """Index of the pending job a worker with `loaded` models claims (as CLAIM_JOBS_SCRIPT)"""
+    if not loaded or depth < 2 or max_skips <= 0:
+        return 0
+    for i, job in enumerate(pending[:depth]):
+        if job["skips"] >= max_skips:
+            break
+        if job["models"] == loaded:
+            for skipped in pending[:i]:
+                skipped["skips"] += 1
+            return i
+    return 0
+
+
+def replay(jobs, models, load_times, max_skips: int, args):
+    pending = []
+    idle = list(range(args.workers))
+    loaded = [None] * args.workers
+    finishing = []  # heap of (end, worker)
+    waits, overtaken = [], []
+    hits = loading = busy = 0.0
+    end = 0.0
+
+    def start(now):
+        nonlocal hits, loading, busy
+        while pending and idle:
+            worker = idle.pop()
+            job = pending.pop(pick(pending, loaded[worker], args.depth, max_skips))
+            reload = 0.0 if loaded[worker] == job["models"] else load_times[job["name"]]
+            hits += reload == 0.0
+            loading += reload
+            busy += reload + job["runtime"]
+            loaded[worker] = job["models"]
+            waits.append(now - job["arrival"])
+            overtaken.append(job["skips"])
+            heapq.heappush(finishing, (now + reload + job["runtime"], worker))
+
+    def finish_until(limit):
+        nonlocal end
+        while finishing and finishing[0][0] <= limit:
+            end, worker = heapq.heappop(finishing)
+            idle.append(worker)
+            start(end)
+
+    for arrival, name, runtime in jobs:
+        finish_until(arrival)
+        pending.append({"arrival": arrival, "name": name, "models": models[name], "runtime": runtime, "skips": 0})
+        start(arrival)
+    finish_until(float("inf"))
+
+    return {
+        "hit_rate": hits / len(jobs),
+        "loading": loading / busy,
+        "throughput": len(jobs) / end * 3600,
+        "mean": statistics.mean(waits),
+        "p95": percentile(waits, 95),
+        "max": max(waits),
+        "overtaken": max(overtaken),
+    }
+
+
+def main(args):
+    from runtime_stats import model_set, runtime_class
+
+    runtimes = dict(zip(MIX, args.runtimes))
+    load_times = dict(zip(MIX, args.load_times))
+    models = {
+        name: model_set(runtime_class(json.loads((WORKFLOWS / f"{name}.json").read_text())))
+        for name in MIX
+    }
+    jobs = make_jobs(args, runtimes)
+
+    print(f"{len(jobs)} jobs on {args.workers} workers at {args.load:.0%} load (before reloads), depth {args.depth}")
+    for name in MIX:
+        print(f"  {name:<32} {MIX[name]:>4.0%}  ~{runtimes[name]:.0f}s run, {load_times[name]:.0f}s load")
+    print()
+    print(f"{'policy':<18} {'hit rate':>8} {'loading':>8} {'jobs/h':>8} {'gain':>7} "
+          f"{'mean s':>8} {'p95 s':>8} {'max s':>8} {'overtaken':>9}")
+
+    baseline = None
+    for max_skips in [0] + args.max_skips:
+        label = "queue order" if not max_skips else f"affinity, skips {max_skips}"
+        r = replay(jobs, models, load_times, max_skips, args)
+        baseline = baseline or r["throughput"]
+        print(
+            f"{label:<18} {r['hit_rate']:>8.1%} {r['loading']:>8.1%} {r['throughput']:>8.0f} "
+            f"{r['throughput'] / baseline - 1:>+7.1%} {r['mean']:>8.1f} {r['p95']:>8.1f} "
+            f"{r['max']:>8.1f} {r['overtaken']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=3000)
+    parser.add_argument("--workers", type=int, default=4, help="single-slot GPU workers")
+    parser.add_argument("--load", type=float, default=0.8, help="arrival rate as a fraction of capacity")
+    parser.add_argument("--runtimes", type=float, nargs=4, default=[8, 15, 60, 240],
+                        help="mean seconds per template, in the order of the mix")
+    parser.add_argument("--load-times", type=float, nargs=4, default=[15, 25, 45, 45],
+                        help="seconds to load each template's models after a switch")
+    parser.add_argument("--sigma", type=float, default=0.25, help="lognormal spread of runtimes")
+    parser.add_argument("--depth", type=int, default=16, help="AFFINITY_SCAN_DEPTH")
+    parser.add_argument("--max-skips", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="AFFINITY_MAX_SKIPS values to replay")
+    parser.add_argument("--seed", type=int, default=7)
+    main(parser.parse_args())
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Replay: queue waits and wait-estimate accuracy, fifo vs shortest_expected.
+
+Replays one synthetic job mix - the four templates in data/workflows with
+noisy (lognormal, --sigma) runtimes around --runtimes - through a queue
+served by --slots concurrent slots, once per policy: fifo, then
+shortest_expected at each --weights value. Arrivals are Poisson at
+--load x capacity. Runtime predictions are learned online exactly as the
+queue manager does it (runtime_class, runtime_levels, ewma_update,
+pick_prediction), starting from no statistics, and pending jobs are
+ordered by queue_score.
+
+Reported per policy: mean / p95 / max queue wait for each template, and the
+error of the estimated_wait_time a job would be given at submission - the
+old position x AVERAGE_JOB_DURATION / slots estimate and the statistics
+based one (remaining predicted runtime of the running jobs plus that of the
+jobs ahead). No Redis is needed.
+
+    python3 benchmarks/sim_scheduling.py --jobs 5000 --slots 4 --load 0.9
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+WORKFLOWS = Path(__file__).resolve().parent.parent.parent / "data" / "workflows"
+
+# template -> share of submissions
+MIX = {
+    "flux2_klein_4b_text_to_image": 0.45,
+    "flux2_klein_9b_text_to_image": 0.30,
+    "ltx2_text_to_video_distilled": 0.15,
+    "ltx2_text_to_video": 0.10,
+}
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def make_jobs(args, runtimes):
+    """[(arrival, template, runtime)], the same for every policy"""
+    rng = random.Random(args.seed)
+    mean_runtime = sum(MIX[name] * runtimes[name] for name in MIX)
+    rate = args.load * args.slots / mean_runtime
+    jobs, now = [], 0.0
+    for _ in range(args.jobs):
+        now += rng.expovariate(rate)
+        name = rng.choices(list(MIX), weights=list(MIX.values()))[0]
+        jobs.append((now, name, runtimes[name] * rng.lognormvariate(0, args.sigma)))
+    return jobs
+
+
+def replay(jobs, classes, mode: str, args):
+    from config import settings
+    from runtime_stats import ewma_update, pick_prediction, queue_score, runtime_levels
+
+    stats = {}
+    pending = []  # heap of (score, seq, job)
+    running = {}  # seq -> (started, predicted)
+    finishing = []  # heap of (end, seq)
+    waits = {name: [] for name in MIX}
+    naive_error, stats_error = [], []
+    eta = {}
+
+    def predict(name):
+        levels = [stats.get(level) for level in runtime_levels(classes[name])]
+        return pick_prediction(levels, settings.runtime_min_samples, float(settings.average_job_duration))
+
+    def start(now):
+        while pending and len(running) < args.slots:
+            _, seq, (arrival, name, runtime, predicted) = heapq.heappop(pending)
+            waits[name].append(now - arrival)
+            naive, estimated = eta.pop(seq)
+            naive_error.append(abs(naive - (now - arrival)))
+            stats_error.append(abs(estimated - (now - arrival)))
+            running[seq] = (now, predicted, name, runtime)
+            heapq.heappush(finishing, (now + runtime, seq))
+
+    for seq, (arrival, name, runtime) in enumerate(jobs):
+        while finishing and finishing[0][0] <= arrival:
+            end, done = heapq.heappop(finishing)
+            _, _, done_name, done_runtime = running.pop(done)
+            for level in runtime_levels(classes[done_name]):
+                stats[level] = ewma_update(stats.get(level), done_runtime, settings.runtime_stats_alpha)
+            start(end)
+
+        predicted = predict(name)
+        score = queue_score(0, arrival, predicted, mode)
+        ahead = [job[3] for s, _, job in pending if s <= score]
+        in_flight = sum(max(p - (arrival - started), 0) for started, p, _, _ in running.values())
+        eta[seq] = (
+            len(ahead) * settings.average_job_duration / args.slots,
+            (in_flight + sum(ahead)) / args.slots if len(running) >= args.slots else 0.0,
+        )
+        heapq.heappush(pending, (score, seq, (arrival, name, runtime, predicted)))
+        start(arrival)
+
+    while finishing:
+        end, done = heapq.heappop(finishing)
+        running.pop(done)
+        start(end)
+
+    return waits, naive_error, stats_error
+
+
+def main(args):
+    from config import settings
+    from runtime_stats import runtime_class
+
+    runtimes = dict(zip(MIX, args.runtimes))
+    classes = {
+        name: runtime_class(json.loads((WORKFLOWS / f"{name}.json").read_text()))
+        for name in MIX
+    }
+    settings.average_job_duration = args.average_job_duration
+    jobs = make_jobs(args, runtimes)
+
+    print(f"{len(jobs)} jobs on {args.slots} slots at {args.load:.0%} load, runtime sigma {args.sigma}")
+    for name in MIX:
+        print(f"  {name:<32} {MIX[name]:>4.0%}  ~{runtimes[name]:.0f}s  class {classes[name]}")
+    print()
+    print(f"{'policy':<22} {'template':<32} {'mean s':>8} {'p95 s':>8} {'max s':>8}")
+
+    policies = [("fifo", "fifo", None)] + [
+        (f"shortest_expected x{weight:g}", "shortest_expected", weight) for weight in args.weights
+    ]
+    summary = []
+    for label, mode, weight in policies:
+        if weight is not None:
+            settings.shortest_expected_weight = weight
+        waits, naive_error, stats_error = replay(jobs, classes, mode, args)
+        for name in MIX:
+            print(
+                f"{label:<22} {name:<32} {statistics.mean(waits[name]):>8.1f} "
+                f"{percentile(waits[name], 95):>8.1f} {max(waits[name]):>8.1f}"
+            )
+        everything = [wait for values in waits.values() for wait in values]
+        print(f"{label:<22} {'(all)':<32} {statistics.mean(everything):>8.1f} "
+              f"{percentile(everything, 95):>8.1f} {max(everything):>8.1f}\n")
+        summary.append((label, statistics.mean(naive_error), statistics.mean(stats_error),
+                        percentile(stats_error, 95)))
+
+    print(f"{'policy':<22} {'ETA error: average_job_duration':>32} {'statistics':>11} {'p95':>8}")
+    for label, naive, estimated, p95 in summary:
+        print(f"{label:<22} {naive:>31.1f}s {estimated:>10.1f}s {p95:>7.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=5000)
+    parser.add_argument("--slots", type=int, default=4, help="concurrent job slots across the workers")
+    parser.add_argument("--load", type=float, default=0.9, help="arrival rate as a fraction of capacity")
+    parser.add_argument("--runtimes", type=float, nargs=4, default=[8, 15, 60, 240],
+                        help="mean seconds per template, in the order of the mix")
+    parser.add_argument("--sigma", type=float, default=0.25, help="lognormal spread of runtimes")
+    parser.add_argument("--weights", type=float, nargs="+", default=[0.5, 1, 2, 4],
+                        help="SHORTEST_EXPECTED_WEIGHT values to replay")
+    parser.add_argument("--average-job-duration", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=7)
+    main(parser.parse_args())
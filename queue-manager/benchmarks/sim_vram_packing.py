@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Replay: packing jobs onto GPUs by static, workflow-graph and learned VRAM.
+
+Replays one synthetic job mix - the four templates in data/workflows, each
+with a true peak VRAM drawn around --true-peaks (lognormal, --sigma) and a
+runtime around --runtimes - over --gpus workers of --gpu-mb, once per
+policy for the estimate a job is packed by:
+
+- static:   the worker's old VRAM_ESTIMATES entry for the model
+- workflow: vram_estimator.estimate_workflow_vram on the template
+- profile:  the workflow estimate until vram_profile_min_samples peaks of
+            the template are known, then their vram_profile_percentile
+            (vram_profiles.vram_percentile over the same EWMA the queue
+            manager keeps), with the profiled margin
+
+Workers take pending jobs in order while the estimates in flight fit their
+budget (GPU minus the 2 GB safety margin, as WORKER_VRAM_BUDGET_MB=0 does).
+Before running a job the worker checks estimate + margin against the GPU's
+actual free memory (check_vram_sufficient) and fails the job if it does not
+fit - a rejection; a job that starts while the true peaks on the GPU exceed
+its memory runs out of memory and fails - an OOM. Reported per policy:
+completed jobs per hour, OOMs, rejections and the mean jobs per GPU.
+No Redis is needed.
+
+    python3 benchmarks/sim_vram_packing.py --jobs 3000 --gpus 2
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+WORKFLOWS = Path(__file__).resolve().parent.parent.parent / "data" / "workflows"
+
+# template -> share of submissions
+MIX = {
+    "flux2_klein_4b_text_to_image": 0.45,
+    "flux2_klein_9b_text_to_image": 0.30,
+    "ltx2_text_to_video_distilled": 0.15,
+    "ltx2_text_to_video": 0.10,
+}
+STATIC = {  # comfyui-worker VRAM_ESTIMATES
+    "flux2_klein_4b_text_to_image": 8192,
+    "flux2_klein_9b_text_to_image": 18432,
+    "ltx2_text_to_video_distilled": 12288,
+    "ltx2_text_to_video": 24576,
+}
+SAFETY_MARGIN_MB = 2048  # VRAM_SAFETY_MARGIN_MB
+PROFILED_MARGIN_MB = 512  # VRAM_PROFILED_MARGIN_MB
+
+
+def make_jobs(args, runtimes, peaks):
+    """[(template, runtime, true peak MB)], the same for every policy"""
+    rng = random.Random(args.seed)
+    jobs = []
+    for _ in range(args.jobs):
+        name = rng.choices(list(MIX), weights=list(MIX.values()))[0]
+        jobs.append((name, runtimes[name] * rng.lognormvariate(0, 0.25),
+                     peaks[name] * rng.lognormvariate(0, args.sigma)))
+    return jobs
+
+
+def replay(jobs, policy: str, graph, args):
+    """Every job is pending from the start: how fast the GPUs drain the queue"""
+    from config import settings
+    from runtime_stats import ewma_update
+    from vram_profiles import vram_percentile
+
+    profiles = {}
+    budget = args.gpu_mb - SAFETY_MARGIN_MB
+    running = [{} for _ in range(args.gpus)]  # per GPU: seq -> (estimate, true peak)
+    finishing = []  # heap of (end, seq, gpu, completed, template)
+    pending = list(jobs)
+    now = area = 0.0
+    seq = done = ooms = rejected = 0
+
+    def estimate(name):
+        if policy == "static":
+            return STATIC[name], SAFETY_MARGIN_MB
+        stats = profiles.get(name)
+        if policy == "profile" and stats and stats["n"] >= settings.vram_profile_min_samples:
+            return vram_percentile(stats, settings.vram_profile_percentile), PROFILED_MARGIN_MB
+        return graph[name], SAFETY_MARGIN_MB
+
+    def fill(gpu):
+        nonlocal seq, ooms, rejected
+        i = 0
+        while i < min(len(pending), args.depth) and len(running[gpu]) < args.slots:
+            name, runtime, peak = pending[i]
+            need, margin = estimate(name)
+            if sum(job[0] for job in running[gpu].values()) + need > budget:
+                i += 1
+                continue
+            pending.pop(i)
+            in_use = sum(job[1] for job in running[gpu].values())
+            if need + margin > args.gpu_mb - in_use:
+                rejected += 1  # check_vram_sufficient fails the job
+                continue
+            completed = in_use + peak <= args.gpu_mb
+            ooms += not completed  # out of memory part-way: half its GPU time lost
+            seq += 1
+            running[gpu][seq] = (need, peak)
+            heapq.heappush(finishing, (now + (runtime if completed else runtime / 2), seq, gpu, completed, name))
+
+    for gpu in range(args.gpus):
+        fill(gpu)
+    while finishing:
+        end, job_seq, gpu, completed, name = heapq.heappop(finishing)
+        area += sum(len(on_gpu) for on_gpu in running) * (end - now)
+        now = end
+        _, peak = running[gpu].pop(job_seq)
+        if completed:
+            done += 1  # the worker reports its peak (sampled, or its ComfyUI instance's memory)
+            profiles[name] = ewma_update(profiles.get(name), peak, settings.vram_profile_alpha)
+        fill(gpu)
+
+    return {
+        "jobs_per_hour": done / now * 3600 if now else 0.0,
+        "ooms": ooms,
+        "rejected": rejected,
+        "done": done,
+        "per_gpu": area / now / args.gpus if now else 0.0,
+    }
+
+
+def main(args):
+    from vram_estimator import estimate_workflow_vram
+
+    runtimes = dict(zip(MIX, args.runtimes))
+    peaks = dict(zip(MIX, args.true_peaks))
+    graph = {
+        name: estimate_workflow_vram(json.loads((WORKFLOWS / f"{name}.json").read_text()))["estimated_vram"]
+        for name in MIX
+    }
+    jobs = make_jobs(args, runtimes, peaks)
+
+    print(f"{len(jobs)} jobs queued at once on {args.gpus} x {args.gpu_mb} MB, true peak sigma {args.sigma}")
+    print(f"  {'template':<32} {'share':>5} {'true MB':>8} {'static':>7} {'workflow':>9}")
+    for name in MIX:
+        print(f"  {name:<32} {MIX[name]:>5.0%} {peaks[name]:>8.0f} {STATIC[name]:>7} {graph[name]:>9}")
+    print()
+    print(f"{'policy':<10} {'completed':>9} {'jobs/h':>8} {'OOM':>6} {'rejected':>9} {'jobs/GPU':>9}")
+    for policy in ("static", "workflow", "profile"):
+        r = replay(jobs, policy, graph, args)
+        print(f"{policy:<10} {r['done']:>9} {r['jobs_per_hour']:>8.0f} {r['ooms']:>6} "
+              f"{r['rejected']:>9} {r['per_gpu']:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=3000)
+    parser.add_argument("--gpus", type=int, default=2)
+    parser.add_argument("--gpu-mb", type=int, default=143771, help="memory per GPU (default: H200)")
+    parser.add_argument("--runtimes", type=float, nargs=4, default=[8, 15, 60, 240],
+                        help="mean seconds per template, in the order of the mix")
+    parser.add_argument("--true-peaks", type=float, nargs=4, default=[14500, 19500, 47000, 31000],
+                        help="mean true peak MB per template, in the order of the mix")
+    parser.add_argument("--sigma", type=float, default=0.05, help="lognormal spread of true peaks")
+    parser.add_argument("--slots", type=int, default=4, help="jobs a GPU runs side by side (ComfyUI instances)")
+    parser.add_argument("--depth", type=int, default=16, help="pending jobs a claim looks through")
+    parser.add_argument("--seed", type=int, default=7)
+    main(parser.parse_args())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Report: workflow-graph VRAM estimates for the bundled templates.
+
+Runs vram_estimator.estimate_workflow_vram on every template in
+data/workflows and prints, per template, the estimated peak and its parts
+(resident weights, text encoder, sampling activations, VAE decode), the
+model files found with their role and size, what the jobs were packed at
+before (vram_default_estimate_mb, or the worker's VRAM_ESTIMATES entry for
+the model had the client named it), and how many such jobs one GPU of
+--gpu-mb would take at each. Also the time one estimate adds to a
+submission. Sizes are guessed from file names unless --models-path points
+at a model directory. No Redis needed.
+
+Usage:
+    python3 benchmarks/vram_estimate_report.py [--gpu-mb 143771] [--models-path /models]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+WORKFLOWS_DIR = Path(__file__).resolve().parents[2] / "data" / "workflows"
+SAFETY_MARGIN_MB = 2048  # the worker's default VRAM_SAFETY_MARGIN_MB
+
+# Template -> the comfyui-worker VRAM_ESTIMATES entry for its model (MB)
+STATIC_ESTIMATES = {
+    "flux2_klein_4b_text_to_image": ("flux2-klein-4b", 8192),
+    "flux2_klein_9b_text_to_image": ("flux2-klein-9b", 18432),
+    "ltx2_text_to_video": ("ltx2-19b", 24576),
+    "ltx2_text_to_video_distilled": ("ltx2-distilled", 12288),
+}
+
+
+def main(args):
+    from config import settings
+    from vram_estimator import estimate_workflow_vram
+
+    settings.vram_models_path = args.models_path
+    budget = args.gpu_mb - SAFETY_MARGIN_MB
+    print(f"GPU {args.gpu_mb} MB, {budget} MB for jobs after the {SAFETY_MARGIN_MB} MB safety margin; "
+          f"sizes from {args.models_path or 'file names'}\n")
+    print(f"{'template':<32} {'estimate':>9} {'weights':>8} {'encoder':>8} {'sampling':>9} {'decode':>7} "
+          f"{'tokens':>7} {'static':>7} {'jobs/GPU now':>13} {'static':>7} {'default':>8}")
+
+    for path in sorted(WORKFLOWS_DIR.glob("[!.]*.json")):
+        workflow = json.loads(path.read_text())
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            estimate = estimate_workflow_vram(workflow)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        name = path.stem
+        if estimate is None:
+            print(f"{name:<32} {'-':>9}  (no model loaders: packed at the "
+                  f"{settings.vram_default_estimate_mb} MB default)")
+            continue
+        _, static = STATIC_ESTIMATES.get(name, (None, settings.vram_default_estimate_mb))
+        print(
+            f"{name:<32} {estimate['estimated_vram']:>9} {estimate['weights_mb']:>8} "
+            f"{estimate['text_encoder_mb']:>8} {estimate['sampling_mb']:>9} {estimate['decode_mb']:>7} "
+            f"{estimate['tokens']:>7} {static:>7} {budget // estimate['estimated_vram']:>13} "
+            f"{budget // static:>7} {budget // settings.vram_default_estimate_mb:>8}"
+        )
+        for model, (role, size) in estimate["models"].items():
+            print(f"    {role:<13} {size:>7} MB  {model}")
+        print(f"    {elapsed * 1e6:.0f} us per estimate")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gpu-mb", type=int, default=143771, help="GPU memory (default: H200, 141 GB)")
+    parser.add_argument("--models-path", default="", help="model directory to read file sizes from")
+    parser.add_argument("--repeat", type=int, default=200, help="estimates timed per template")
+    main(parser.parse_args())
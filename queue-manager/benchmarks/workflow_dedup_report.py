@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Report: Redis payload bytes for workflows, one full copy per job vs the
+content-addressed chunk store (workflow_store.py).
+
+Simulates a workshop: USERS users each submit JOBS jobs from every bundled
+template in data/workflows, each job with its own prompt text and seed (the
+parts users actually change). Sizes are the stored JSON payloads; per-key
+Redis overhead (~50-100 bytes) is not included.
+
+Usage:
+    python3 benchmarks/workflow_dedup_report.py [--users 20] [--jobs 5]
+"""
+import argparse
+import copy
+import json
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from workflow_store import split_workflow  # noqa: E402
+
+WORKFLOWS_DIR = Path(__file__).resolve().parents[2] / "data" / "workflows"
+PROMPT_NODE_TYPES = {"PrimitiveStringMultiline", "CLIPTextEncode"}
+SEED_MIN = 2 ** 31
+
+
+def personalise(workflow: dict, prompt: str, rng: random.Random) -> dict:
+    """Apply the edits a user makes to a template: new prompt, new seed"""
+    workflow = copy.deepcopy(workflow)
+    subgraph_ids = {
+        sg.get("id") for sg in workflow.get("definitions", {}).get("subgraphs", [])
+    }
+    for node in workflow.get("nodes", []):
+        widgets = node.get("widgets_values")
+        if not isinstance(widgets, list):
+            continue
+        is_prompt_node = node.get("type") in PROMPT_NODE_TYPES or node.get("type") in subgraph_ids
+        for i, value in enumerate(widgets):
+            if is_prompt_node and isinstance(value, str) and (value == "" or " " in value):
+                widgets[i] = prompt
+                is_prompt_node = False  # only the first text widget is the prompt
+            elif isinstance(value, int) and not isinstance(value, bool) and value >= SEED_MIN:
+                widgets[i] = rng.randrange(SEED_MIN, 2 ** 50)
+    return workflow
+
+
+def main(users: int, jobs: int):
+    rng = random.Random(42)
+    templates = sorted(p for p in WORKFLOWS_DIR.glob("*.json") if not p.name.startswith("."))
+    if not templates:
+        sys.exit(f"No workflows found in {WORKFLOWS_DIR}")
+
+    print(f"{users} users x {jobs} jobs x {len(templates)} templates\n")
+    print(f"{'template':<40} {'jobs':>5} {'full copies':>13} {'dedup store':>13} {'saving':>7}")
+
+    total_old = total_new = 0
+    for path in templates:
+        template = json.loads(path.read_text())
+        old_bytes = 0
+        chunks = {}
+        manifest_bytes = 0
+        count = 0
+
+        for user in range(users):
+            for job in range(jobs):
+                prompt = f"user{user:03d} idea #{job}: a {rng.choice(['red', 'blue', 'green'])} fox"
+                workflow = personalise(template, prompt, rng)
+                old_bytes += len(json.dumps(workflow))
+
+                manifest, job_chunks = split_workflow(workflow)
+                chunks.update(job_chunks)
+                manifest_bytes += len(json.dumps(manifest))
+                count += 1
+
+        new_bytes = manifest_bytes + sum(len(data) for data in chunks.values())
+        total_old += old_bytes
+        total_new += new_bytes
+        saving = 100 * (1 - new_bytes / old_bytes) if old_bytes else 0.0
+        print(f"{path.name:<40} {count:>5} {old_bytes:>13,} {new_bytes:>13,} {saving:>6.1f}%")
+
+    saving = 100 * (1 - total_new / total_old) if total_old else 0.0
+    print(f"{'TOTAL':<40} {'':>5} {total_old:>13,} {total_new:>13,} {saving:>6.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--jobs", type=int, default=5)
+    args = parser.parse_args()
+    main(args.users, args.jobs)
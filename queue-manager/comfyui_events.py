@@ -0,0 +1,192 @@
+"""
+ComfyUI WebSocket event stream (asyncio) for serverless completion tracking
+
+ComfyUI pushes execution events over /ws?clientId=... to the client that
+queued a prompt, ending with executing(node=None) once the prompt's history
+entry is written. ServerlessRunner queues every prompt with this stream's
+client_id and awaits wait() instead of sleeping between /history polls, so a
+finished generation is picked up immediately.
+
+Events only help when the socket reaches the container that runs the prompt.
+Behind the serverless load balancer it may not, and the socket may not be
+available at all, so /history stays the source of truth: wait() returns
+early when the stream drops, and callers keep polling at the normal interval
+until an event for the prompt has actually been seen.
+
+Events are parsed exactly as by the worker's comfyui-worker/comfyui_events.py
+(the two services ship separately): the same prompt states, error text and
+pruning. Cancelling a serverless job cancels its task, so there is no
+CANCELLED state here.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+try:
+    from websockets.asyncio.client import connect
+    from websockets.exceptions import WebSocketException
+except ImportError:
+    # Optional: without websockets completion is detected by polling /history
+    connect = None
+    WebSocketException = Exception
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_MAX_DELAY = 30  # seconds
+MAX_TRACKED_PROMPTS = 1000
+
+RUNNING = "running"
+DONE = "done"  # executing node=None: history entry is written
+ERROR = "error"
+INTERRUPTED = "interrupted"
+FINISHED = (DONE, ERROR, INTERRUPTED)
+
+
+def ws_url_for(base_url: str) -> str:
+    """http(s)://host[/prefix] -> ws(s)://host[/prefix]/ws"""
+    parts = urlsplit(base_url.rstrip('/'))
+    scheme = "wss" if parts.scheme == "https" else "ws"
+    return urlunsplit((scheme, parts.netloc, parts.path + "/ws", "", ""))
+
+
+def describe_error(data: Dict[str, Any]) -> str:
+    """Readable message from an execution_error payload"""
+    where = data.get("node_type") or "workflow"
+    if data.get("node_id"):
+        where = f"{where} (node {data['node_id']})"
+    message = data.get("exception_message") or "Unknown error"
+    if data.get("exception_type"):
+        message = f"{data['exception_type']}: {message}"
+    return f"{where}: {message.strip()}"
+
+
+class ComfyUIEventStream:
+    """Background WebSocket listener tracking prompt progress for one endpoint"""
+
+    def __init__(self, base_url: str, headers: Optional[Dict[str, str]] = None, client_id: Optional[str] = None):
+        self.client_id = client_id or uuid.uuid4().hex
+        self.ws_url = ws_url_for(base_url)
+        self.headers = headers or {}
+        self._prompts: Dict[str, Dict[str, Any]] = {}
+        self._finished: Dict[str, asyncio.Event] = {}
+        self._lost = asyncio.Event()  # set while disconnected
+        self._lost.set()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return not self._lost.is_set()
+
+    def start(self) -> bool:
+        """Start listening; False if websockets is not installed"""
+        if connect is None:
+            logger.warning("websockets not installed - serverless completion falls back to /history polling")
+            return False
+        if not self._task:
+            self._task = asyncio.create_task(self._run(), name="comfyui-events")
+        return True
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def state(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """Latest known state of a prompt (status, node, progress, outputs; None if no event seen yet)"""
+        state = self._prompts.get(prompt_id)
+        return dict(state) if state else None
+
+    async def wait(self, prompt_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Wait until the prompt finishes, the stream disconnects or the timeout
+        runs out, and return its state.
+        """
+        state = self._prompts.get(prompt_id)
+        if self.connected and not (state and state["status"] in FINISHED):
+            finished = self._finished.setdefault(prompt_id, asyncio.Event())
+            waiters = [asyncio.ensure_future(finished.wait()), asyncio.ensure_future(self._lost.wait())]
+            try:
+                await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+        return self.state(prompt_id)
+
+    def forget(self, prompt_id: str) -> None:
+        self._prompts.pop(prompt_id, None)
+        self._finished.pop(prompt_id, None)
+
+    async def _run(self) -> None:
+        delay = 1
+        while True:
+            try:
+                async with connect(
+                    f"{self.ws_url}?clientId={self.client_id}",
+                    additional_headers=self.headers,
+                    open_timeout=10,
+                    max_size=None  # preview images arrive as large binary frames
+                ) as ws:
+                    self._lost.clear()
+                    delay = 1
+                    logger.info(f"ComfyUI event stream connected: {self.ws_url}")
+                    async for message in ws:
+                        if isinstance(message, str):
+                            self._handle(message)
+            except (OSError, asyncio.TimeoutError, WebSocketException) as e:
+                logger.warning(f"ComfyUI event stream unavailable ({e}); polling /history, retry in {delay}s")
+            finally:
+                self._lost.set()
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def _handle(self, raw: str) -> None:
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return
+        kind = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+
+        state = self._prompts.setdefault(prompt_id, {"status": RUNNING})
+        state["updated"] = time.monotonic()
+
+        if kind == "executing":
+            if data.get("node") is not None:
+                state["node"] = data["node"]
+            elif state["status"] == RUNNING:
+                state["status"] = DONE
+        elif kind == "progress":
+            state["node"] = data.get("node", state.get("node"))
+            state["progress"] = (data.get("value"), data.get("max"))
+        elif kind == "executed":
+            state.setdefault("outputs", {})[data.get("node")] = data.get("output")
+        elif kind == "execution_error":
+            state["status"] = ERROR
+            state["error"] = describe_error(data)
+        elif kind == "execution_interrupted":
+            state["status"] = INTERRUPTED
+
+        if state["status"] in FINISHED:
+            self._finished.setdefault(prompt_id, asyncio.Event()).set()
+
+        if len(self._prompts) > MAX_TRACKED_PROMPTS:
+            self._prune()
+
+    def _prune(self) -> None:
+        """Drop the oldest finished prompts (runners normally forget() them)"""
+        finished = sorted(
+            (state["updated"], prompt_id)
+            for prompt_id, state in self._prompts.items()
+            if state["status"] in FINISHED
+        )
+        for _, prompt_id in finished[:len(self._prompts) - MAX_TRACKED_PROMPTS]:
+            self.forget(prompt_id)
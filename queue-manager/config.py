@@ -13,12 +13,26 @@ class Settings(BaseSettings):
     redis_port: int = 6379
     redis_password: str
     redis_db: int = 0
+    redis_max_connections: int = 50  # pooled connections per process (~1 per request in flight)
+    redis_pool_timeout: float = 1.0  # seconds a request waits for a pooled connection before a 503
 
     # Queue Configuration
     queue_mode: str = "fifo"
     enable_priority: bool = True
-    job_timeout: int = 3600  # seconds
+    job_timeout: int = 3600  # seconds, for jobs claimed without a lease
+    job_lease_ttl: int = 30  # seconds a leased job survives without a renewal from its worker
+    job_max_attempts: int = 3  # claims before a job whose leases keep expiring is dead-lettered
+    job_max_releases: int = 10  # hand-backs (no VRAM to start it) before a job is dead-lettered (0 = no limit)
     max_queue_depth: int = 100
+    average_job_duration: int = 60  # seconds, assumed until runtime statistics exist
+    runtime_stats_alpha: float = 0.2  # weight of the newest sample in the rolling runtime statistics
+    runtime_min_samples: int = 3  # samples before a template/model's own statistics are trusted
+    shortest_expected_weight: float = 1.0  # shortest_expected mode: lateness per second of predicted runtime
+    eta_scan_limit: int = 1000  # queue positions whose predicted runtimes are summed for wait estimates
+    eta_cache_ttl: float = 1.0  # seconds one scan of the queue serves wait estimates for (0 = scan per request)
+    affinity_scan_depth: int = 16  # pending jobs searched for one using a worker's loaded models (0 = off)
+    affinity_max_skips: int = 4  # times a job may be overtaken for model affinity before it must be taken
+    max_queue_wait: int = 0  # refuse submissions whose projected wait exceeds this (seconds, 0 = off)
 
     # Inference Mode: "local" | "redis" | "serverless"
     # - local: GPU on same machine, workers poll Redis queue
@@ -45,6 +59,17 @@ class Settings(BaseSettings):
     # Verda API Key (required for serverless auth)
     serverless_api_key: Optional[str] = None
 
+    # Serverless jobs run in background tasks (POST /api/jobs answers 202)
+    serverless_max_concurrent: int = 200  # generations talking to the endpoint at once
+    serverless_poll_interval: float = 2.0  # seconds between /history polls per job
+    serverless_max_wait: int = 600  # cold start + model load + inference
+    serverless_events: bool = True  # track completion over ComfyUI's /ws, /history as fallback
+    serverless_history_safety_interval: float = 15.0  # /history re-check while awaiting events
+    serverless_lease_ttl: float = 30.0  # seconds before another replica adopts a job whose owner went quiet
+    serverless_sfs_outputs_path: str = "/mnt/sfs/outputs"  # where the serverless container saves outputs
+    serverless_output_transfer: str = "link"  # link (hardlink/reflink, else in-kernel copy) | copy | reference (API only: /view cannot serve it)
+    serverless_download_concurrency: int = 8  # outputs fetched at once (SFS transfers and /view downloads)
+
     # Worker configuration (for local/redis modes)
     num_workers: int = 1
 
@@ -75,12 +100,26 @@ class Settings(BaseSettings):
     # Server Configuration
     host: str = "0.0.0.0"
     port: int = 3000
+    leader_lease_ttl: float = 15.0  # seconds before another replica takes over housekeeping
     log_level: str = "INFO"
     debug: bool = False
 
     # Worker Configuration
     worker_heartbeat_timeout: int = 60  # seconds
     worker_poll_interval: int = 1  # seconds
+    worker_long_poll_max: int = 30  # seconds a next-job request may park (keep < heartbeat timeout)
+    worker_max_batch: int = 16  # most jobs one next-jobs call may claim
+    vram_default_estimate_mb: int = 8192  # assumed for jobs without metadata.estimated_vram
+    vram_estimate_workflows: bool = True  # estimate metadata.estimated_vram from the workflow at submission
+    vram_models_path: str = ""  # model directory (read-only mount) to size model files from; "" = guess from names
+    vram_profile_alpha: float = 0.1  # weight of the newest peak in a workflow signature's VRAM profile
+    vram_profile_min_samples: int = 3  # peaks before a signature's profile replaces the workflow estimate
+    vram_profile_percentile: float = 95.0  # percentile of the learned peaks used as estimated_vram
+
+    # WebSocket fan-out
+    ws_client_queue_size: int = 256  # pending updates per client before the oldest is dropped
+    ws_send_timeout: float = 10.0  # seconds a send may stall before the client is dropped
+    ws_max_topics: int = 100  # subscriptions per client
 
     # Storage paths
     outputs_path: str = "/outputs"
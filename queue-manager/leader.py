@@ -0,0 +1,74 @@
+"""
+Leader election between queue manager replicas
+
+The queue manager may run as several uvicorn workers or containers sharing
+one Redis. Request handling and WebSocket fan-out need no coordination
+(state lives in Redis, events arrive through pub/sub on every replica), but
+cluster-wide housekeeping such as the stale-job sweep should run once, not
+once per process. One replica holds the LEADER_LEASE key (SET NX PX with
+its instance id) and renews it every ttl/3; if it dies the key expires and
+another replica takes over within about one TTL.
+
+Leadership is advisory: tasks gated on is_leader must stay safe to run
+twice, since a replica stalled past the TTL can briefly overlap the next
+leader.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Optional
+
+from config import settings
+from redis_client import RedisBusyError, RedisClient
+
+logger = logging.getLogger(__name__)
+
+
+def instance_id() -> str:
+    """Identifier for this process, unique across replicas and restarts"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaderElection:
+    """Keeps trying to hold the leader lease; is_leader says whether we do"""
+
+    def __init__(self, redis_client: RedisClient, owner: str, ttl: Optional[float] = None):
+        self.redis_client = redis_client
+        self.owner = owner
+        self.ttl = ttl or settings.leader_lease_ttl
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.create_task(self._run(), name="leader-election")
+
+    async def stop(self) -> None:
+        """Stop campaigning and hand the lease over straight away"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            await self.redis_client.release_lease(RedisClient.LEADER_LEASE, self.owner)
+            self.is_leader = False
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self.is_leader:
+                    held = await self.redis_client.renew_leases([RedisClient.LEADER_LEASE], self.owner, self.ttl)
+                    leader = bool(held)
+                else:
+                    leader = await self.redis_client.acquire_lease(RedisClient.LEADER_LEASE, self.owner, self.ttl)
+            except RedisBusyError as e:
+                # Requests hold every pooled connection: keep the current role
+                # and try again next round (the lease outlives two misses)
+                logger.warning(f"Leader lease check skipped: {e}")
+                leader = self.is_leader
+            if leader != self.is_leader:
+                logger.info(f"{'Became' if leader else 'Lost'} queue manager leader ({self.owner})")
+            self.is_leader = leader
+            await asyncio.sleep(self.ttl / 3)
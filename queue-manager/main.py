@@ -6,29 +6,40 @@ Supports three inference modes:
 - local: GPU on same machine, workers poll Redis queue
 - redis: Remote GPU via Tailscale, workers poll Redis queue
 - serverless: Direct HTTP to Verda Serverless (auto-scaling)
+
+Any number of processes (uvicorn --workers / WEB_CONCURRENCY, or several
+containers) can serve the same Redis: each keeps its own connections and
+relays pub/sub events to its own WebSocket clients. Stale-job cleanup runs
+on the elected leader only, and serverless jobs are leased to one replica
+at a time (see leader.py, serverless_runner.py).
 """
+import json
 import logging
 import asyncio
 import httpx
 from datetime import datetime, timezone
-from typing import List, Optional
+from typing import Dict, List, Optional
 from contextlib import asynccontextmanager
 from pathlib import Path
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, BackgroundTasks
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, BackgroundTasks, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 
 from models import (
-    Job, JobSubmitRequest, JobCompletionRequest, JobFailureRequest,
-    JobResponse, QueueStatus, HealthCheck, JobStatus, QueueMode, JobPriority
+    Job, JobSubmitRequest, JobCompletionRequest, JobFailureRequest, JobLeaseRenewalRequest,
+    JobResponse, QueueStatus, HealthCheck, JobStatus, QueueMode, JobPriority, WorkerStatus
 )
 from config import settings
-from redis_client import RedisClient
+from redis_client import RedisClient, JobNotOwnedError, JobNotRunningError, RedisBusyError
+from runtime_stats import model_set
 from websocket_manager import WebSocketManager
+from leader import LeaderElection, instance_id
+from serverless_runner import ServerlessRunner, SERVERLESS_WORKER_ID
 
-# HTTP client for serverless mode
+# HTTP client and background job runner for serverless mode
 serverless_client: Optional[httpx.AsyncClient] = None
+serverless_runner: Optional[ServerlessRunner] = None
 
 # Configure logging
 logging.basicConfig(
@@ -40,20 +51,25 @@ logger = logging.getLogger(__name__)
 # Global instances
 redis_client: Optional[RedisClient] = None
 ws_manager: Optional[WebSocketManager] = None
+leader: Optional[LeaderElection] = None
 app_start_time: datetime = datetime.now(timezone.utc)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager"""
-    global redis_client, ws_manager, serverless_client
+    global redis_client, ws_manager, leader, serverless_client, serverless_runner
 
-    # Startup
-    logger.info(f"Starting {settings.app_name} v{settings.app_version}")
+    # Startup (runs in every worker process / replica)
+    instance = instance_id()
+    logger.info(f"Starting {settings.app_name} v{settings.app_version} ({instance})")
     logger.info(f"Inference mode: {settings.inference_mode}")
 
     redis_client = RedisClient()
+    await redis_client.migrate_legacy_jobs()
     ws_manager = WebSocketManager(redis_client)
+    leader = LeaderElection(redis_client, instance)
+    leader.start()
 
     # Initialize serverless client if needed
     if settings.inference_mode == "serverless":
@@ -73,13 +89,19 @@ async def lifespan(app: FastAPI):
             serverless_client = httpx.AsyncClient(
                 base_url=endpoint,
                 timeout=httpx.Timeout(300.0),  # 5 min timeout for inference
-                headers=headers
+                headers=headers,
+                limits=httpx.Limits(max_connections=settings.serverless_max_concurrent)
             )
             logger.info(f"Serverless client initialized: {endpoint}")
             logger.info(f"Active GPU: {settings.active_gpu_type}")
 
+            # Jobs accepted before a restart carry on where they left off
+            serverless_runner = ServerlessRunner(redis_client, serverless_client, instance)
+            await serverless_runner.resume()
+
     # Start background tasks
-    asyncio.create_task(cleanup_task())
+    cleanup = asyncio.create_task(cleanup_task())
+    requeue = asyncio.create_task(requeue_expired_task())
 
     logger.info("Queue Manager started successfully")
 
@@ -87,8 +109,15 @@ async def lifespan(app: FastAPI):
 
     # Shutdown
     logger.info("Shutting down Queue Manager")
+    cleanup.cancel()
+    requeue.cancel()
+    await leader.stop()
+    if serverless_runner:
+        await serverless_runner.stop()
     if serverless_client:
         await serverless_client.aclose()
+    await ws_manager.close()
+    await redis_client.close()
 
 
 # Initialize FastAPI app
@@ -131,15 +160,18 @@ async def health_check():
         endpoint = settings.active_serverless_endpoint
         endpoint_display = endpoint.split("//")[-1].split(".")[0] if "//" in endpoint else endpoint
 
+    redis_ok = await redis_client.ping()
+    capacity = await redis_client.get_worker_capacity()
+
     return HealthCheck(
-        status="healthy" if redis_client.ping() else "unhealthy",
+        status="healthy" if redis_ok else "unhealthy",
         version=settings.app_version,
         inference_mode=settings.inference_mode,
         active_gpu=settings.active_gpu_type,
         serverless_endpoint=endpoint_display,
-        redis_connected=redis_client.ping(),
-        workers_active=0,  # TODO: Track active workers
-        queue_depth=redis_client.get_queue_depth(),
+        redis_connected=redis_ok,
+        workers_active=capacity["workers"],
+        queue_depth=await redis_client.get_queue_depth(),
         uptime_seconds=int(uptime)
     )
 
@@ -149,7 +181,8 @@ async def get_queue_status():
     """Get overall queue status - optimized with batched Redis calls"""
     try:
         # Performance: Get all queue stats in single pipeline call (4→1 Redis commands)
-        stats = redis_client.get_all_queue_stats()
+        stats = await redis_client.get_all_queue_stats()
+        capacity = await redis_client.get_worker_capacity()
 
         return QueueStatus(
             mode=QueueMode(settings.queue_mode),
@@ -157,303 +190,159 @@ async def get_queue_status():
             running_jobs=stats["running"],
             completed_jobs=stats["completed"],
             failed_jobs=stats["failed"],
-            total_workers=settings.num_workers,
-            active_workers=0,  # TODO: Implement worker tracking
+            dead_letter_jobs=stats["dead_letter"],
+            total_workers=max(settings.num_workers, capacity["workers"]),
+            active_workers=capacity["workers"],
+            busy_workers=capacity["busy"],
+            free_slots=capacity["free_slots"],
             queue_depth=stats["pending"]
         )
+    except RedisBusyError:
+        raise
     except Exception as e:
         logger.error(f"Failed to get queue status: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# ============================================================================
-# Job Management Endpoints
-# ============================================================================
-
-async def poll_serverless_history(prompt_id: str, max_wait: int = 600, poll_interval: float = 2.0) -> dict:
-    """Poll serverless /api/history/{prompt_id} until execution completes.
+@app.get("/api/queue/dead-letter", response_model=List[JobResponse])
+async def list_dead_letter_jobs(limit: int = Query(100, ge=1, le=1000)):
+    """Jobs that failed because their worker kept dying (lease expired job_max_attempts times)"""
+    jobs = await redis_client.get_dead_letter_jobs(limit)
+    return [
+        JobResponse(
+            id=job.id,
+            user_id=job.user_id,
+            status=job.status,
+            priority=job.priority,
+            created_at=job.created_at,
+            started_at=job.started_at,
+            completed_at=job.completed_at,
+            worker_id=job.worker_id,
+            result=None,
+            error=job.error,
+            attempts=job.attempts
+        )
+        for job in jobs
+    ]
 
-    Serverless cold start + model loading can block HTTP for 200+ seconds.
-    With 10s per-poll timeout, we fail fast and retry often.
-    max_wait=600 covers worst case: cold start + model load + inference.
 
-    Early bail: if the server is responding (HTTP 200) but prompt_id never
-    appears in history after 120s, it's likely a load balancer routing issue
-    (GETs hitting a different container than the POST). Bail early instead
-    of waiting the full 600s.
+@app.get("/api/queue/runtime-stats")
+async def get_runtime_stats():
     """
-    if not serverless_client:
-        raise HTTPException(status_code=503, detail="Serverless client not initialized")
-
-    import time
-    start_time = time.monotonic()
-    poll_count = 0
-    empty_200_count = 0  # HTTP 200 responses where prompt_id not in history
-    MAX_EMPTY_200 = 60   # ~120s at 2s interval — bail if prompt never appears
-
-    while (time.monotonic() - start_time) < max_wait:
-        poll_count += 1
-        elapsed = time.monotonic() - start_time
-        try:
-            # 10s timeout: fail fast when server is blocked by model loading
-            response = await serverless_client.get(
-                f"/history/{prompt_id}",
-                timeout=httpx.Timeout(10.0),
-            )
-            if response.status_code == 200:
-                history = response.json()
-                if prompt_id in history:
-                    # Found — reset empty counter, process result
-                    empty_200_count = 0
-                    entry = history[prompt_id]
-                    status = entry.get("status", {})
-                    completed = status.get("completed", False)
-                    status_str = status.get("status_str", "unknown")
-
-                    # Always log when found in history (important for debugging)
-                    if poll_count <= 5 or poll_count % 15 == 0 or completed:
-                        outputs = entry.get("outputs", {})
-                        output_summary = {
-                            nid: list(nout.keys()) for nid, nout in outputs.items()
-                        }
-                        logger.info(
-                            f"History poll #{poll_count} ({elapsed:.0f}s): "
-                            f"completed={completed}, status={status_str}, "
-                            f"outputs={output_summary}"
-                        )
-                    elif poll_count % 10 == 0:
-                        logger.info(f"History poll #{poll_count} ({elapsed:.0f}s): completed={completed}, status={status_str}")
-
-                    if status_str == "error":
-                        import json
-                        messages = status.get("messages", [])
-                        logger.error(
-                            f"Serverless execution FAILED for {prompt_id} after {elapsed:.0f}s ({poll_count} polls): "
-                            f"status={json.dumps(status, default=str)[:1000]}"
-                        )
-                        for msg in messages:
-                            logger.error(f"  Error message: {json.dumps(msg, default=str)[:500]}")
-                        return entry
-
-                    if completed:
-                        logger.info(f"Execution completed after {elapsed:.0f}s ({poll_count} polls)")
-                        return entry
-                else:
-                    empty_200_count += 1
-                    if poll_count <= 3 or poll_count % 30 == 0:
-                        logger.info(f"History poll #{poll_count} ({elapsed:.0f}s): prompt_id not in history. Keys: {list(history.keys())[:5]}")
-
-                    # Early bail: server is responding but prompt never appeared
-                    if empty_200_count >= MAX_EMPTY_200:
-                        logger.error(
-                            f"Early bail: {empty_200_count} consecutive HTTP 200 responses with empty history "
-                            f"after {elapsed:.0f}s ({poll_count} polls). "
-                            f"Likely load balancer routing issue — GET /history hitting different container than POST /prompt."
-                        )
-                        raise HTTPException(
-                            status_code=502,
-                            detail=f"Serverless routing error: prompt accepted but never appeared in history after {elapsed:.0f}s. "
-                            f"Load balancer may be routing requests to different container instances."
-                        )
-            else:
-                logger.warning(f"History poll #{poll_count} ({elapsed:.0f}s): HTTP {response.status_code}")
-        except httpx.TimeoutException:
-            # Only log periodically — timeout is expected during model loading
-            if poll_count <= 2 or poll_count % 10 == 0:
-                logger.info(f"History poll #{poll_count} ({elapsed:.0f}s): timeout (server busy, likely loading model)")
-        except HTTPException:
-            raise  # Re-raise early bail
-        except Exception as e:
-            logger.warning(f"History poll #{poll_count} ({elapsed:.0f}s): error: {type(e).__name__}: {e}")
-
-        await asyncio.sleep(poll_interval)
-
-    raise HTTPException(status_code=504, detail=f"Serverless execution timed out after {max_wait}s ({poll_count} polls)")
-
-
-async def fetch_serverless_images(history_entry: dict, user_id: str) -> dict:
-    """Get output images from serverless execution and save to local outputs.
+    Rolling execution-time statistics behind predicted_runtime and the wait
+    estimates: {level: {n, mean, stddev}} for each runtime class, template,
+    model set and "all"
+    """
+    return await redis_client.get_runtime_stats()
 
-    Strategy: SFS first (shared storage), HTTP fallback (serverless /view API).
-    The serverless container saves images to /mnt/sfs/outputs/ via a startup
-    wrapper script. The QM reads them directly from SFS (same NFS mount).
-    If SFS isn't available, falls back to HTTP download via /view endpoint.
 
-    Returns ComfyUI-compatible output metadata: {node_id: {images: [...]}}
+@app.get("/api/queue/vram-profiles")
+async def get_vram_profiles():
     """
-    outputs = history_entry.get("outputs", {})
-
-    if not outputs:
-        logger.warning(f"History entry has no outputs. Top-level keys: {list(history_entry.keys())}")
-        return {}
-
-    # Prepare local output directory for this user
-    local_output_dir = Path(settings.outputs_path) / user_id
-    local_output_dir.mkdir(parents=True, exist_ok=True)
-
-    saved_outputs = {}
-    sfs_output_dir = Path("/mnt/sfs/outputs")
-
-    for node_id, node_output in outputs.items():
-        img_list = node_output.get("images", [])
-        logger.info(f"Output node {node_id}: {len(img_list)} image(s), keys={list(node_output.keys())}")
-
-        for img_info in img_list:
-            filename = img_info.get("filename")
-            subfolder = img_info.get("subfolder", "")
-            if not filename:
-                continue
-
-            saved = False
-
-            # Strategy 1: Read from SFS (shared NFS between serverless + app server)
-            sfs_path = sfs_output_dir / subfolder / filename if subfolder else sfs_output_dir / filename
-            if sfs_path.exists():
-                import shutil
-                dest = local_output_dir / filename
-                shutil.copy2(str(sfs_path), str(dest))
-                logger.info(f"SFS image: {sfs_path} -> {dest} ({dest.stat().st_size} bytes)")
-                saved = True
-
-            # Strategy 2: HTTP download from serverless /view API (fallback)
-            if not saved and serverless_client:
-                try:
-                    params = {"filename": filename, "type": img_info.get("type", "output")}
-                    if subfolder:
-                        params["subfolder"] = subfolder
-                    response = await serverless_client.get("/view", params=params, timeout=httpx.Timeout(30.0))
-                    if response.status_code == 200:
-                        dest = local_output_dir / filename
-                        dest.write_bytes(response.content)
-                        logger.info(f"HTTP image: {filename} ({len(response.content)} bytes)")
-                        saved = True
-                    else:
-                        logger.warning(f"HTTP /view failed for {filename}: HTTP {response.status_code}")
-                except Exception as e:
-                    logger.warning(f"HTTP download failed for {filename}: {e}")
-
-            if saved:
-                if node_id not in saved_outputs:
-                    saved_outputs[node_id] = {"images": []}
-                saved_outputs[node_id]["images"].append({
-                    "filename": filename,
-                    "subfolder": user_id,
-                    "type": "output",
-                })
-            else:
-                logger.error(f"Failed to retrieve image {filename} via both SFS and HTTP")
-
-    return saved_outputs
+    Peak VRAM learned from completed jobs, per workflow signature:
+    {signature: {n, mean, stddev, estimate}} - estimate (MB) is what new
+    submissions with that signature are packed by
+    """
+    return await redis_client.get_vram_profiles()
 
 
-async def submit_to_serverless(workflow: dict, user_id: str) -> dict:
-    """Submit workflow to serverless, wait for completion, fetch and save output images."""
-    if not serverless_client:
-        raise HTTPException(
-            status_code=503,
-            detail="Serverless client not initialized. Check SERVERLESS_ENDPOINT."
-        )
+# ============================================================================
+# Job Management Endpoints
+# ============================================================================
 
-    try:
-        # 1. Submit prompt to serverless ComfyUI
-        logger.info(f"Sending to serverless: {len(workflow)} nodes")
-        response = await serverless_client.post(
-            "/prompt",
-            json={"prompt": workflow, "client_id": user_id}
-        )
-        response.raise_for_status()
-        result = response.json()
-        prompt_id = result.get("prompt_id")
-        logger.info(f"Serverless prompt accepted: {prompt_id}")
-
-        if not prompt_id:
-            logger.error(f"No prompt_id in serverless response: {result}")
-            return result
-
-        # 2. Poll history until execution completes
-        logger.info(f"Polling for execution completion: {prompt_id}")
-        history_entry = await poll_serverless_history(prompt_id)
-
-        status = history_entry.get("status", {})
-        if status.get("status_str") != "success":
-            messages = status.get("messages", [])
-            logger.error(f"Execution failed: {messages}")
-            result["execution_error"] = messages
-            return result
-
-        logger.info(f"Execution completed successfully: {prompt_id}")
-
-        # 3. Fetch and save output images (SFS first, HTTP fallback)
-        saved_outputs = await fetch_serverless_images(history_entry, user_id)
-
-        if not saved_outputs:
-            logger.warning(f"No images saved for {prompt_id}")
-            result["outputs"] = history_entry.get("outputs", {})
-            return result
-
-        logger.info(f"Saved outputs for {len(saved_outputs)} node(s)")
-        result["outputs"] = saved_outputs
-        result["execution_status"] = "success"
-        return result
-
-    except httpx.TimeoutException:
-        raise HTTPException(status_code=504, detail="Serverless inference timed out")
-    except httpx.HTTPStatusError as e:
-        logger.error(f"Serverless response body: {e.response.text[:500]}")
-        raise HTTPException(status_code=e.response.status_code, detail=str(e))
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Serverless submission failed: {e}")
-        raise HTTPException(status_code=502, detail=f"Serverless error: {e}")
+async def estimate_wait_times(positions: Dict[str, Optional[int]], slots: int = 0) -> Dict[str, Optional[int]]:
+    """
+    Estimate seconds until pending jobs start from their queue positions,
+    using the predicted runtimes of the running jobs and of the jobs ahead.
+    `slots` is the live worker capacity (jobs run side by side), read from
+    the registry if not given; without heartbeating workers NUM_WORKERS is
+    assumed.
+    """
+    if all(position is None for position in positions.values()):
+        return {job_id: None for job_id in positions}
+    if not slots:
+        slots = (await redis_client.get_worker_capacity())["slots"]
+    return await redis_client.estimate_wait_times(positions, slots or settings.num_workers)
 
 
 @app.post("/api/jobs", response_model=JobResponse, status_code=201)
-async def submit_job(request: JobSubmitRequest):
+async def submit_job(request: JobSubmitRequest, response: Response):
     """Submit a new job - routes based on INFERENCE_MODE"""
     try:
-        # SERVERLESS MODE: Direct HTTP to serverless endpoint (no queue)
+        # SERVERLESS MODE: stored and accepted at once (202), executed in the background
         if settings.inference_mode == "serverless":
+            if not serverless_runner:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Serverless client not initialized. Check SERVERLESS_ENDPOINT."
+                )
             logger.info(f"Serverless job from user {request.user_id}")
 
-            # Submit directly to serverless
-            result = await submit_to_serverless(request.workflow, request.user_id)
-
-            # Create a completed job record
             job = Job(
                 user_id=request.user_id,
                 workflow=request.workflow,
                 priority=request.priority,
                 metadata=request.metadata
             )
-            job.status = JobStatus.COMPLETED
-            job.result = result
-            job.completed_at = datetime.now(timezone.utc)
+            job.status = JobStatus.RUNNING
+            job.worker_id = SERVERLESS_WORKER_ID
+            job.started_at = datetime.now(timezone.utc)
 
+            if not await redis_client.create_job(job, enqueue=False):
+                raise HTTPException(status_code=500, detail="Failed to create job")
+            serverless_runner.start(job)
+
+            response.status_code = 202
             return JobResponse(
                 id=job.id,
                 user_id=job.user_id,
                 status=job.status,
                 priority=job.priority,
                 created_at=job.created_at,
-                started_at=job.created_at,
-                completed_at=job.completed_at,
-                worker_id="serverless",
-                result=result,
+                started_at=job.started_at,
+                completed_at=None,
+                worker_id=job.worker_id,
+                result=None,
                 error=None,
-                position_in_queue=None
+                position_in_queue=None,
+                predicted_runtime=job.predicted_runtime
             )
 
         # LOCAL/REDIS MODE: Queue-based (workers poll for jobs)
         # Check queue depth limit
         if settings.max_queue_depth > 0:
-            current_depth = redis_client.get_queue_depth()
+            current_depth = await redis_client.get_queue_depth()
             if current_depth >= settings.max_queue_depth:
                 raise HTTPException(
                     status_code=429,
                     detail=f"Queue is full (max depth: {settings.max_queue_depth})"
                 )
 
+        # A job asking for more VRAM than any registered GPU can give would
+        # sit at the head of the queue forever
+        capacity = await redis_client.get_worker_capacity()
+        largest_vram = capacity["vram_capacity_mb"]
+        requested_vram = request.metadata.get("estimated_vram")
+        if largest_vram and requested_vram is not None and requested_vram > largest_vram:
+            raise HTTPException(
+                status_code=422,
+                detail=f"estimated_vram {requested_vram}MB exceeds the largest worker GPU ({largest_vram}MB)"
+            )
+
+        # Admission by live capacity: refuse work no worker could start in time
+        slots = capacity["slots"] or settings.num_workers
+        if settings.max_queue_wait > 0:
+            if not capacity["workers"]:
+                raise HTTPException(status_code=503, detail="No workers are online")
+            depth = await redis_client.get_queue_depth()
+            projected = (await estimate_wait_times({"": depth}, slots))[""]
+            if projected > settings.max_queue_wait:
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"Queue wait of ~{projected}s exceeds the limit ({settings.max_queue_wait}s)",
+                    headers={"Retry-After": str(projected - settings.max_queue_wait)}
+                )
+
         # Create job
         job = Job(
             user_id=request.user_id,
@@ -463,12 +352,11 @@ async def submit_job(request: JobSubmitRequest):
         )
 
         # Save to Redis
-        if not redis_client.create_job(job):
+        if not await redis_client.create_job(job, vram_limit=largest_vram):
             raise HTTPException(status_code=500, detail="Failed to create job")
 
         # Get queue position
-        pending_jobs = redis_client.get_pending_jobs()
-        position = next((i for i, j in enumerate(pending_jobs) if j.id == job.id), None)
+        position = await redis_client.get_queue_position(job.id)
 
         logger.info(f"Job {job.id} submitted by user {job.user_id} (mode: {settings.inference_mode})")
 
@@ -483,10 +371,12 @@ async def submit_job(request: JobSubmitRequest):
             worker_id=None,
             result=None,
             error=None,
-            position_in_queue=position
+            position_in_queue=position,
+            estimated_wait_time=(await estimate_wait_times({job.id: position}, slots))[job.id],
+            predicted_runtime=job.predicted_runtime
         )
 
-    except HTTPException:
+    except (HTTPException, RedisBusyError):
         raise
     except Exception as e:
         logger.error(f"Failed to submit job: {e}", exc_info=True)
@@ -497,15 +387,14 @@ async def submit_job(request: JobSubmitRequest):
 async def get_job(job_id: str):
     """Get job status by ID"""
     try:
-        job = redis_client.get_job(job_id)
+        job = await redis_client.get_job(job_id)
         if not job:
             raise HTTPException(status_code=404, detail="Job not found")
 
         # Calculate position in queue if pending
         position = None
         if job.status == JobStatus.PENDING:
-            pending_jobs = redis_client.get_pending_jobs()
-            position = next((i for i, j in enumerate(pending_jobs) if j.id == job_id), None)
+            position = await redis_client.get_queue_position(job_id)
 
         return JobResponse(
             id=job.id,
@@ -518,10 +407,13 @@ async def get_job(job_id: str):
             worker_id=job.worker_id,
             result=job.result,
             error=job.error,
-            position_in_queue=position
+            attempts=job.attempts,
+            position_in_queue=position,
+            estimated_wait_time=(await estimate_wait_times({job_id: position}))[job_id],
+            predicted_runtime=job.predicted_runtime
         )
 
-    except HTTPException:
+    except (HTTPException, RedisBusyError):
         raise
     except Exception as e:
         logger.error(f"Failed to get job {job_id}: {e}", exc_info=True)
@@ -537,25 +429,27 @@ async def list_jobs(
     """List jobs with optional filters"""
     try:
         if user_id:
-            jobs = redis_client.get_user_jobs(user_id)
+            jobs = await redis_client.get_user_jobs(user_id)
         else:
             # Get from all queues
-            jobs = redis_client.get_pending_jobs(limit)
+            jobs = await redis_client.get_pending_jobs(limit)
             # TODO: Add running, completed, failed
 
         # Filter by status if specified
         if status:
             jobs = [j for j in jobs if j.status == status]
 
-        # Performance: Cache position lookup to avoid O(n²) - fetch once, not per job
-        pending_jobs = redis_client.get_pending_jobs()
-        job_positions = {j.id: i for i, j in enumerate(pending_jobs)}
+        # Performance: ZRANK only the pending jobs being returned, in one pipeline
+        jobs = jobs[:limit]
+        job_positions = await redis_client.get_queue_positions(
+            [j.id for j in jobs if j.status == JobStatus.PENDING]
+        )
+        job_waits = await estimate_wait_times(job_positions)
 
         # Convert to response models
         responses = []
-        for job in jobs[:limit]:
-            # O(1) lookup instead of O(n) search
-            position = job_positions.get(job.id) if job.status == JobStatus.PENDING else None
+        for job in jobs:
+            position = job_positions.get(job.id)
 
             responses.append(JobResponse(
                 id=job.id,
@@ -568,11 +462,16 @@ async def list_jobs(
                 worker_id=job.worker_id,
                 result=job.result,
                 error=job.error,
-                position_in_queue=position
+                attempts=job.attempts,
+                position_in_queue=position,
+                estimated_wait_time=job_waits.get(job.id),
+                predicted_runtime=job.predicted_runtime
             ))
 
         return responses
 
+    except RedisBusyError:
+        raise
     except Exception as e:
         logger.error(f"Failed to list jobs: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e)) from e
@@ -582,18 +481,23 @@ async def list_jobs(
 async def cancel_job(job_id: str):
     """Cancel a job"""
     try:
-        job = redis_client.get_job(job_id)
+        job = await redis_client.get_job(job_id, with_result=False)
         if not job:
             raise HTTPException(status_code=404, detail="Job not found")
 
         if job.status == JobStatus.RUNNING:
-            # Mark as cancelled, worker will handle cleanup
-            job.status = JobStatus.CANCELLED
-            redis_client.update_job(job)
-            logger.info(f"Job {job_id} marked for cancellation")
+            # Out of running at once; the worker (or serverless runner) sees
+            # its lease gone, interrupts ComfyUI and frees the slot
+            try:
+                if not await redis_client.cancel_running_job(job_id):
+                    raise HTTPException(status_code=404, detail="Job not found")
+            except JobNotRunningError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if serverless_runner:
+                serverless_runner.cancel(job_id)
         elif job.status == JobStatus.PENDING:
             # Remove from queue
-            redis_client.delete_job(job_id)
+            await redis_client.delete_job(job_id)
             logger.info(f"Job {job_id} cancelled and removed from queue")
         else:
             raise HTTPException(
@@ -603,7 +507,7 @@ async def cancel_job(job_id: str):
 
         return None
 
-    except HTTPException:
+    except (HTTPException, RedisBusyError):
         raise
     except Exception as e:
         logger.error(f"Failed to cancel job {job_id}: {e}", exc_info=True)
@@ -614,7 +518,7 @@ async def cancel_job(job_id: str):
 async def update_job_priority(job_id: str, priority: JobPriority):
     """Update job priority (admin/instructor only)"""
     try:
-        job = redis_client.get_job(job_id)
+        job = await redis_client.get_job(job_id, with_result=False)
         if not job:
             raise HTTPException(status_code=404, detail="Job not found")
 
@@ -626,17 +530,16 @@ async def update_job_priority(job_id: str, priority: JobPriority):
 
         # Update priority
         job.priority = priority
-        redis_client.update_job(job)
+        await redis_client.update_job(job)
 
         # Re-score in queue
-        score = redis_client._get_priority_score(job)
-        redis_client.redis.zadd(redis_client.QUEUE_PENDING, {job_id: score})
+        await redis_client.update_job_priority(job)
 
         logger.info(f"Updated job {job_id} priority to {priority}")
 
         return {"status": "success", "job_id": job_id, "priority": priority}
 
-    except HTTPException:
+    except (HTTPException, RedisBusyError):
         raise
     except Exception as e:
         logger.error(f"Failed to update job {job_id} priority: {e}", exc_info=True)
@@ -647,52 +550,191 @@ async def update_job_priority(job_id: str, priority: JobPriority):
 # Worker Endpoints
 # ============================================================================
 
+def worker_job_payload(job: Job) -> dict:
+    """The job fields a worker needs to run it"""
+    return {
+        "id": job.id,
+        "workflow": job.workflow,
+        "user_id": job.user_id,
+        "metadata": job.metadata,
+        "models": model_set(job.runtime_class)
+    }
+
+
 @app.get("/api/workers/next-job")
-async def get_next_job(worker_id: str):
-    """Get next job for worker to process"""
+async def get_next_job(worker_id: str, wait: float = 0, leases: bool = False, models: Optional[str] = None):
+    """
+    Get next job for worker to process.
+
+    With wait > 0 the request long-polls: if the queue is empty it is parked
+    for up to `wait` seconds (capped at WORKER_LONG_POLL_MAX) and answers as
+    soon as a job is enqueued. With leases=true the job is leased to the
+    worker, which must renew it through /api/workers/renew-leases. `models`
+    is the model set the worker has loaded (the "models" of its last job):
+    a job near the head using the same models is preferred, sparing a
+    checkpoint reload.
+    """
     try:
         # Update worker heartbeat
-        redis_client.update_worker_heartbeat(worker_id)
+        await redis_client.update_worker_heartbeat(worker_id)
 
-        # Get next job based on queue mode
+        # Claim next job based on queue mode (atomically moved to running)
         queue_mode = QueueMode(settings.queue_mode)
-        job = redis_client.get_next_job(queue_mode)
+        wait = min(max(wait, 0.0), float(settings.worker_long_poll_max))
+        job = await redis_client.wait_for_job(worker_id, queue_mode, timeout=wait, lease=leases, models=models)
 
         if not job:
             return {"job": None}
 
-        # Move to running
-        redis_client.move_job_to_running(job.id, worker_id)
-
         logger.info(f"Assigned job {job.id} to worker {worker_id}")
 
-        return {
-            "job": {
-                "id": job.id,
-                "workflow": job.workflow,
-                "user_id": job.user_id,
-                "metadata": job.metadata
-            }
-        }
+        return {"job": worker_job_payload(job)}
 
+    except RedisBusyError:
+        raise
     except Exception as e:
         logger.error(f"Failed to get next job for worker {worker_id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 
+@app.get("/api/workers/next-jobs")
+async def get_next_jobs(
+    worker_id: str,
+    max_jobs: int = Query(1, alias="max", ge=1),
+    vram_budget: int = Query(0, ge=0),
+    wait: float = 0,
+    leases: bool = False,
+    models: Optional[str] = None
+):
+    """
+    Claim up to `max` jobs at once for a worker that runs jobs concurrently.
+
+    Jobs are claimed atomically, in queue order, while their
+    metadata.estimated_vram fits in `vram_budget` MB (0 = no VRAM limit).
+    `wait`, `leases` and `models` work as on /api/workers/next-job.
+    """
+    try:
+        await redis_client.update_worker_heartbeat(worker_id)
+
+        queue_mode = QueueMode(settings.queue_mode)
+        wait = min(max(wait, 0.0), float(settings.worker_long_poll_max))
+        jobs = await redis_client.wait_for_jobs(
+            worker_id,
+            queue_mode,
+            max_jobs=min(max_jobs, settings.worker_max_batch),
+            vram_budget=vram_budget,
+            timeout=wait,
+            lease=leases,
+            models=models
+        )
+
+        if jobs:
+            logger.info(f"Assigned jobs {[job.id for job in jobs]} to worker {worker_id}")
+
+        return {"jobs": [worker_job_payload(job) for job in jobs]}
+
+    except RedisBusyError:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to get next jobs for worker {worker_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+async def lease_report(worker_id: str, job_ids: List[str]) -> dict:
+    """
+    Renew a worker's job leases. `lost` lists the jobs it no longer holds
+    and should abandon; `cancelled` those of them cancelled by their user.
+    """
+    renewed = await redis_client.renew_job_leases(worker_id, job_ids)
+    if renewed is None:
+        raise HTTPException(status_code=503, detail="Could not renew leases")
+
+    lost = [job_id for job_id in job_ids if job_id not in set(renewed)]
+    cancelled = []
+    if lost:
+        statuses = await redis_client.get_job_statuses(lost)
+        cancelled = [job_id for job_id in lost if statuses.get(job_id) == JobStatus.CANCELLED.value]
+        logger.warning(f"Worker {worker_id} no longer holds jobs {lost} (cancelled: {cancelled})")
+    return {"renewed": renewed, "lost": lost, "cancelled": cancelled, "lease_ttl": settings.job_lease_ttl}
+
+
+@app.post("/api/workers/renew-leases")
+async def renew_job_leases(worker_id: str, request: JobLeaseRenewalRequest):
+    """
+    Extend the leases on the jobs a worker is running (claimed with
+    leases=true). Workers call this every few seconds; a job whose lease is
+    not renewed for JOB_LEASE_TTL seconds is requeued. `lost` lists jobs the
+    worker no longer holds (requeued or cancelled) - it should stop working
+    on them.
+    """
+    try:
+        await redis_client.update_worker_heartbeat(worker_id)
+        return await lease_report(worker_id, request.job_ids)
+
+    except (HTTPException, RedisBusyError):
+        raise
+    except Exception as e:
+        logger.error(f"Failed to renew leases for worker {worker_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+@app.post("/api/workers/heartbeat")
+async def worker_heartbeat(status: WorkerStatus):
+    """
+    Register a worker and its live capacity. Workers post their status every
+    few seconds from a background thread; one missing for
+    WORKER_HEARTBEAT_TIMEOUT seconds drops out of the registry. The leases
+    on current_job_ids are renewed as on /api/workers/renew-leases. A worker
+    driving several GPUs sends one heartbeat: totals, and each GPU's share
+    under devices.
+    """
+    try:
+        if not await redis_client.record_worker_heartbeat(status):
+            raise HTTPException(status_code=503, detail="Could not record heartbeat")
+
+        return await lease_report(status.worker_id, status.current_job_ids)
+
+    except (HTTPException, RedisBusyError):
+        raise
+    except Exception as e:
+        logger.error(f"Failed to record heartbeat of worker {status.worker_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+@app.get("/api/workers", response_model=List[WorkerStatus])
+async def list_workers():
+    """Workers that sent a heartbeat within WORKER_HEARTBEAT_TIMEOUT seconds"""
+    return await redis_client.get_workers()
+
+
+@app.delete("/api/workers/{worker_id}", status_code=204)
+async def deregister_worker(worker_id: str):
+    """Take a worker out of the registry (sent on clean shutdown)"""
+    if not await redis_client.remove_worker(worker_id):
+        raise HTTPException(status_code=404, detail="Worker not found")
+    logger.info(f"Worker {worker_id} deregistered")
+
+
 @app.post("/api/workers/complete-job")
-async def complete_job(job_id: str, request: JobCompletionRequest):
-    """Mark job as completed - with validated result payload"""
+async def complete_job(job_id: str, request: JobCompletionRequest, worker_id: Optional[str] = None):
+    """
+    Mark job as completed - with validated result payload. 409 if the job
+    was cancelled or already finished, or if the worker passing its
+    worker_id no longer holds it (lease expired).
+    """
     try:
         # Validation happens automatically via Pydantic model
-        if not redis_client.move_job_to_completed(job_id, request.result):
+        if not await redis_client.move_job_to_completed(job_id, request.result, worker_id):
             raise HTTPException(status_code=404, detail="Job not found")
 
         logger.info(f"Job {job_id} completed successfully")
         return {"status": "success", "job_id": job_id}
 
-    except HTTPException:
+    except (HTTPException, RedisBusyError):
         raise
+    except (JobNotOwnedError, JobNotRunningError) as e:
+        logger.warning(f"Rejected completion: {e}")
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         # Pydantic validation error
         logger.warning(f"Invalid result payload for job {job_id}: {e}")
@@ -703,18 +745,21 @@ async def complete_job(job_id: str, request: JobCompletionRequest):
 
 
 @app.post("/api/workers/fail-job")
-async def fail_job(job_id: str, request: JobFailureRequest):
-    """Mark job as failed - with validated error message"""
+async def fail_job(job_id: str, request: JobFailureRequest, worker_id: Optional[str] = None):
+    """Mark job as failed - with validated error message (409 as on complete-job)"""
     try:
         # Validation happens automatically via Pydantic model
-        if not redis_client.move_job_to_failed(job_id, request.error):
+        if not await redis_client.move_job_to_failed(job_id, request.error, worker_id):
             raise HTTPException(status_code=404, detail="Job not found")
 
         logger.error(f"Job {job_id} failed: {request.error}")
         return {"status": "success", "job_id": job_id}
 
-    except HTTPException:
+    except (HTTPException, RedisBusyError):
         raise
+    except (JobNotOwnedError, JobNotRunningError) as e:
+        logger.warning(f"Rejected failure report: {e}")
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         # Pydantic validation error
         logger.warning(f"Invalid error message for job {job_id}: {e}")
@@ -724,20 +769,67 @@ async def fail_job(job_id: str, request: JobFailureRequest):
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 
+@app.post("/api/workers/release-job")
+async def release_job(job_id: str, worker_id: str):
+    """
+    Hand a claimed job back unrun (the worker cannot start it now, e.g. not
+    enough free VRAM): it returns to its place in the queue and the attempt
+    is not counted. After JOB_MAX_RELEASES hand-backs it is failed and
+    dead-lettered instead (outcome "dead_letter"). 409 as on complete-job.
+    """
+    try:
+        outcome = await redis_client.release_job(job_id, worker_id)
+        if not outcome:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return {"status": "success", "job_id": job_id, "outcome": outcome}
+
+    except (HTTPException, RedisBusyError):
+        raise
+    except (JobNotOwnedError, JobNotRunningError) as e:
+        logger.warning(f"Rejected release: {e}")
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to release job {job_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
 # ============================================================================
 # WebSocket Endpoint
 # ============================================================================
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time updates"""
-    await ws_manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, topics: str = ""):
+    """
+    WebSocket endpoint for real-time updates.
+
+    Clients receive events only for the topics they subscribe to:
+    user:{user_id}, job:{job_id}, queue (aggregate queue_status) or all.
+    Subscribe on connect with ?topics=user:alice,queue or at any time with
+    {"action": "subscribe" | "unsubscribe", "topics": [...]}; each is
+    answered with {"type": "subscriptions", "topics": [...]}. Job events
+    carry id, user_id, status and whichever fields changed.
+    """
+    await ws_manager.connect(websocket, [t for t in topics.split(",") if t])
     try:
         while True:
             # Keep connection alive and handle incoming messages
             data = await websocket.receive_text()
-            # Echo back for ping/pong
-            await websocket.send_text(f"pong: {data}")
+            try:
+                request = json.loads(data)
+            except ValueError:
+                request = None
+            if isinstance(request, dict) and request.get("action") in ("subscribe", "unsubscribe"):
+                requested = request.get("topics")
+                if not isinstance(requested, list):
+                    requested = []
+                if request["action"] == "subscribe":
+                    current = await ws_manager.subscribe(websocket, requested)
+                else:
+                    current = ws_manager.unsubscribe(websocket, requested)
+                ws_manager.send_to(websocket, json.dumps({"type": "subscriptions", "topics": current}))
+            else:
+                # Echo back for ping/pong
+                ws_manager.send_to(websocket, f"pong: {data}")
     except WebSocketDisconnect:
         ws_manager.disconnect(websocket)
         logger.info("WebSocket client disconnected")
@@ -748,19 +840,43 @@ async def websocket_endpoint(websocket: WebSocket):
 # ============================================================================
 
 async def cleanup_task():
-    """Background task to cleanup stale jobs"""
+    """Background task to cleanup stale jobs (on the leader replica only)"""
     while True:
         try:
             await asyncio.sleep(60)  # Run every minute
-            redis_client.cleanup_stale_jobs(settings.job_timeout)
+            if leader.is_leader:
+                await redis_client.cleanup_stale_jobs(settings.job_timeout)
         except Exception as e:
             logger.error(f"Cleanup task error: {e}")
 
 
+async def requeue_expired_task():
+    """Background task to requeue jobs whose worker stopped renewing their lease (leader only)"""
+    while True:
+        try:
+            await asyncio.sleep(settings.job_lease_ttl / 3)
+            if leader.is_leader:
+                await redis_client.requeue_expired_jobs()
+        except Exception as e:
+            logger.error(f"Requeue task error: {e}")
+
+
 # ============================================================================
 # Error Handlers
 # ============================================================================
 
+@app.exception_handler(RedisBusyError)
+async def redis_busy_handler(request, exc):
+    # Every pooled Redis connection is in use: shed the request rather than
+    # queue it behind the ones already waiting
+    logger.warning(f"Shed {request.method} {request.url.path}: {exc}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Queue manager is busy, retry shortly"},
+        headers={"Retry-After": "1"}
+    )
+
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     # Log full traceback with request context for debugging
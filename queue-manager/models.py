@@ -3,6 +3,7 @@ Data models for the Queue Manager
 """
 import re
 import json
+import math
 from datetime import datetime, timezone
 from enum import Enum
 from typing import Optional, Dict, Any, List
@@ -31,6 +32,7 @@ class QueueMode(str, Enum):
     FIFO = "fifo"  # First In, First Out
     ROUND_ROBIN = "round_robin"  # Fair distribution per user
     PRIORITY = "priority"  # Priority-based (with fallback to FIFO)
+    SHORTEST_EXPECTED = "shortest_expected"  # Shortest predicted runtime first, with aging
 
 
 class JobPriority(int, Enum):
@@ -45,7 +47,10 @@ class Job(BaseModel):
     """Job model representing a ComfyUI workflow execution"""
     id: str = Field(default_factory=lambda: str(uuid4()))
     user_id: str = Field(..., description="User who submitted the job")
-    workflow: Dict[str, Any] = Field(..., description="ComfyUI workflow JSON")
+    workflow: Optional[Dict[str, Any]] = Field(
+        default=None,
+        description="ComfyUI workflow JSON (stored separately, loaded on demand)"
+    )
     status: JobStatus = Field(default=JobStatus.PENDING)
     priority: JobPriority = Field(default=JobPriority.NORMAL)
 
@@ -56,7 +61,11 @@ class Job(BaseModel):
 
     # Execution details
     worker_id: Optional[str] = None
+    attempts: int = 0  # times claimed by a worker (leased jobs are retried up to job_max_attempts)
     result: Optional[Dict[str, Any]] = None
+    runtime_class: Optional[str] = None  # "<template>|<models>" (see runtime_stats)
+    predicted_runtime: Optional[float] = None  # seconds, from that class's statistics at submission
+    signature: Optional[str] = None  # "<runtime class>@<output shape>": VRAM profile key (see vram_profiles)
     error: Optional[str] = None
 
     # Metadata
@@ -119,7 +128,7 @@ class JobSubmitRequest(BaseModel):
     @field_validator('metadata')
     @classmethod
     def validate_metadata(cls, v: Dict[str, Any]) -> Dict[str, Any]:
-        """Validate metadata size"""
+        """Validate metadata size; estimated_vram becomes whole MB"""
         if not v:
             return v
 
@@ -132,6 +141,18 @@ class JobSubmitRequest(BaseModel):
                 f"metadata size ({metadata_size} bytes) exceeds maximum ({MAX_METADATA_SIZE_BYTES} bytes)"
             )
 
+        # The claim script and workers budget by this figure: store it as the
+        # number they would both read ("24.5" -> 25), not a string either
+        # side could parse differently
+        if v.get("estimated_vram") is not None:
+            try:
+                vram = float(v["estimated_vram"])
+            except (TypeError, ValueError):
+                raise ValueError("metadata.estimated_vram must be a number of MB")
+            if not math.isfinite(vram) or vram < 0:
+                raise ValueError("metadata.estimated_vram must be a non-negative number of MB")
+            v["estimated_vram"] = math.ceil(vram)
+
         return v
 
 
@@ -175,6 +196,11 @@ class JobFailureRequest(BaseModel):
         return v.strip()
 
 
+class JobLeaseRenewalRequest(BaseModel):
+    """Request model for renewing job leases (worker endpoint)"""
+    job_ids: List[str] = Field(default_factory=list, max_length=256, description="Jobs the worker is still running")
+
+
 class JobResponse(BaseModel):
     """Response model for job queries"""
     id: str
@@ -187,6 +213,8 @@ class JobResponse(BaseModel):
     worker_id: Optional[str]
     result: Optional[Dict[str, Any]]
     error: Optional[str]
+    attempts: int = 0
+    predicted_runtime: Optional[float] = None  # seconds
     position_in_queue: Optional[int] = None
     estimated_wait_time: Optional[int] = None  # seconds
 
@@ -198,21 +226,45 @@ class QueueStatus(BaseModel):
     running_jobs: int
     completed_jobs: int
     failed_jobs: int
+    dead_letter_jobs: int = 0
     total_workers: int
     active_workers: int
+    busy_workers: int = 0
+    free_slots: int = 0
     queue_depth: int
 
 
+class DeviceStatus(BaseModel):
+    """One GPU of a worker, with its own claim loop (a share of the WorkerStatus totals)"""
+    gpu_id: int = Field(..., ge=0)
+    current_job_ids: List[str] = Field(default_factory=list, max_length=256)
+    gpu_memory_used: Optional[int] = None  # MB
+    gpu_memory_total: Optional[int] = None  # MB
+    slots: int = Field(1, ge=0)
+    free_slots: int = Field(0, ge=0)
+    vram_free_mb: int = Field(0, ge=0)
+    vram_capacity_mb: Optional[int] = Field(None, ge=0)  # most VRAM one job can get: the budget, else GPU total
+    loaded_models: Optional[str] = Field(None, max_length=1000)
+
+
 class WorkerStatus(BaseModel):
-    """Worker status information"""
-    worker_id: str
+    """Worker status information (sent by workers as their heartbeat)"""
+    worker_id: str = Field(..., min_length=1, max_length=100)
     status: str  # idle, busy, offline
     current_job_id: Optional[str] = None
-    jobs_completed: int
-    last_heartbeat: datetime
-    provider: str  # Inference provider name (e.g., "local", "verda", "runpod")
+    current_job_ids: List[str] = Field(default_factory=list, max_length=256)  # all jobs in flight
+    jobs_completed: int = 0
+    jobs_failed: int = 0
+    last_heartbeat: Optional[datetime] = None  # stamped by the queue manager
+    provider: str = "local"  # Inference provider name (e.g., "local", "verda", "runpod")
     gpu_memory_used: Optional[int] = None  # MB
     gpu_memory_total: Optional[int] = None  # MB
+    slots: int = Field(1, ge=0)  # jobs the worker runs side by side
+    free_slots: int = Field(0, ge=0)
+    vram_free_mb: int = Field(0, ge=0)  # VRAM left for new jobs (budget or GPU free)
+    vram_capacity_mb: Optional[int] = Field(None, ge=0)  # most VRAM one job can get on any of its GPUs
+    loaded_models: Optional[str] = Field(None, max_length=1000)  # model set of its last job (runtime_stats.model_set)
+    devices: List[DeviceStatus] = Field(default_factory=list, max_length=64)  # per GPU; the fields above are totals
 
 
 class WebSocketMessage(BaseModel):
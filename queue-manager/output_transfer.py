@@ -0,0 +1,143 @@
+"""
+Moving serverless outputs from shared storage into OUTPUTS_PATH
+
+The serverless container writes its outputs to SFS (serverless_sfs_outputs_path,
+mounted read-only here); the queue manager makes them available under
+OUTPUTS_PATH/<user>. A 4K video copied byte by byte through Python costs a
+second full write of the file and, done inside a coroutine, stalls every
+request and WebSocket on the event loop for the duration. transfer_file()
+is meant for asyncio.to_thread and avoids the copy where it can:
+
+- link (default): a hardlink when source and destination share a
+  filesystem, else a reflink (FICLONE, copy-on-write on btrfs/XFS), else an
+  in-kernel copy - copy_file_range, or sendfile on kernels/filesystems
+  without it - so the data never passes through user space
+- copy: always the in-kernel copy (an independent file, even on one filesystem)
+- reference: nothing is transferred; the job result records the SFS path
+  (output entry storage "sfs", path). For API clients that read SFS
+  themselves only: the file is not under OUTPUTS_PATH, so /view cannot
+  serve it
+
+Files are written under a temporary name in the destination directory and
+renamed into place, so a reader never sees a partial output. Filesystem
+pairs where linking failed once are remembered and not tried again. Only
+errors saying the operation is unsupported there fall through to the next
+method; permission and other errors propagate.
+"""
+import errno
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LINK = "link"
+COPY = "copy"
+REFERENCE = "reference"
+TRANSFER_MODES = (LINK, COPY, REFERENCE)
+
+FICLONE = 0x40049409  # linux/fs.h: _IOW(0x94, 9, int)
+CHUNK = 64 * 1024 * 1024  # bytes per copy_file_range/sendfile call
+
+# (source device, destination device) pairs without hardlink/reflink support
+_no_hardlink: Set[Tuple[int, int]] = set()
+_no_reflink: Set[Tuple[int, int]] = set()
+
+# Errors meaning "this filesystem or kernel can't do that", not a bad file
+_UNSUPPORTED = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOSYS, errno.EINVAL}
+
+
+def _reflink(src: Path, tmp: Path) -> None:
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "reflink needs fcntl")
+    with open(src, "rb") as source, open(tmp, "wb") as target:
+        fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+
+
+def _kernel_copy(src: Path, tmp: Path) -> str:
+    """Copy src to tmp inside the kernel; returns the mechanism that finished the job"""
+    with open(src, "rb") as source, open(tmp, "wb") as target:
+        size = os.fstat(source.fileno()).st_size
+        copied = 0
+        method = "copy_file_range"
+        if hasattr(os, "copy_file_range"):
+            try:
+                while copied < size:
+                    sent = os.copy_file_range(
+                        source.fileno(), target.fileno(), min(CHUNK, size - copied), copied, copied
+                    )
+                    if not sent:
+                        break
+                    copied += sent
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+        if copied < size:
+            method = "sendfile"
+            os.lseek(target.fileno(), copied, os.SEEK_SET)
+            try:
+                while copied < size:
+                    sent = os.sendfile(target.fileno(), source.fileno(), copied, min(CHUNK, size - copied))
+                    if not sent:
+                        break
+                    copied += sent
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+        if copied < size:
+            method = "copy"
+            source.seek(copied)
+            target.seek(copied)
+            shutil.copyfileobj(source, target, CHUNK)
+    shutil.copystat(src, tmp)
+    return method
+
+
+def transfer_file(src: Path, dest: Path, mode: str = LINK) -> Optional[str]:
+    """
+    Make src available as dest (blocking - run it in a thread). Returns how:
+    "hardlink", "reflink", "copy_file_range", "sendfile", "copy" or
+    "reference" (mode reference: left in place). None if src does not exist.
+    """
+    try:
+        source = os.stat(src)
+    except FileNotFoundError:
+        return None
+    if mode == REFERENCE:
+        return REFERENCE
+
+    tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex[:8]}.part")
+    devices = (source.st_dev, os.stat(dest.parent).st_dev)
+    try:
+        method = None
+        if mode == LINK and devices not in _no_hardlink:
+            try:
+                os.link(src, tmp)
+                method = "hardlink"
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                _no_hardlink.add(devices)
+        if method is None and mode == LINK and devices not in _no_reflink:
+            try:
+                _reflink(src, tmp)
+                shutil.copystat(src, tmp)
+                method = "reflink"
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                _no_reflink.add(devices)
+        if method is None:
+            method = _kernel_copy(src, tmp)
+        os.replace(tmp, dest)
+        return method
+    finally:
+        tmp.unlink(missing_ok=True)
@@ -1,36 +1,112 @@
 """
 Redis client for job queue management
+
+Built on redis.asyncio so FastAPI handlers never block the event loop
+while waiting on Redis.
 """
+import asyncio
 import json
 import logging
+import time
 from typing import Optional, List, Dict, Any
 from datetime import datetime, timezone
-from redis import Redis
-from redis.exceptions import RedisError, WatchError
-from models import Job, JobStatus, QueueMode
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.exceptions import ConnectionError as RedisConnectionError, RedisError, WatchError
+from models import Job, JobStatus, QueueMode, WorkerStatus
 from config import settings
+from workflow_store import WorkflowStore
+from runtime_stats import RuntimeStats, runtime_class, queue_score
+from vram_estimator import submission_estimate
+from vram_profiles import VRAMProfiles, workflow_signature
+from redis_scripts import (
+    CLAIM_JOBS_SCRIPT, ENQUEUE_JOB_SCRIPT, DEQUEUE_JOB_SCRIPT, RENEW_LEASES_SCRIPT, RELEASE_LEASE_SCRIPT,
+    RENEW_JOB_LEASES_SCRIPT, EXPIRE_JOB_LEASE_SCRIPT, RELEASE_JOB_SCRIPT, WORKER_HEARTBEAT_SCRIPT,
+    REMOVE_WORKER_SCRIPT, WORKER_CAPACITY_SCRIPT, QUEUE_WORK_AHEAD_SCRIPT
+)
 
 logger = logging.getLogger(__name__)
 
 
+class JobNotOwnedError(Exception):
+    """A worker reported on a job it no longer holds (its lease ran out)"""
+
+
+class JobNotRunningError(Exception):
+    """A job was finished or cancelled after it had left running (e.g. a completion after a cancel)"""
+
+
+class RedisBusyError(Exception):
+    """
+    Every pooled Redis connection stayed in use for redis_pool_timeout
+    seconds. Not a RedisError, so the fallbacks for a failing Redis (empty
+    stats, "failed to create job") do not hide it: the API answers 503.
+    """
+
+
+class SheddingConnectionPool(BlockingConnectionPool):
+    """BlockingConnectionPool raising RedisBusyError once its wait runs out"""
+
+    async def get_connection(self, *args, **kwargs):
+        try:
+            return await super().get_connection(*args, **kwargs)
+        except RedisConnectionError as e:
+            if isinstance(e.__cause__, asyncio.TimeoutError):
+                raise RedisBusyError(
+                    f"No Redis connection free within {self.timeout}s ({self.max_connections} in use)"
+                ) from e
+            raise
+
+
 class RedisClient:
     """Redis client wrapper for job queue operations"""
 
     # Redis key patterns
+    # job:{id} is a hash of the small mutable fields (status, timestamps,
+    # worker, error, metadata); the workflow manifest and result blob live in
+    # their own keys and are only read when a caller asks for them.
+    # Workflow content itself is deduplicated in the WorkflowStore.
     JOB_KEY = "job:{job_id}"
+    JOB_MANIFEST_KEY = "job:{job_id}:manifest"
+    JOB_WORKFLOW_KEY = "job:{job_id}:workflow"  # Pre-dedup full workflow
+    JOB_RESULT_KEY = "job:{job_id}:result"
+    LEGACY_JOB_STATE_KEY = "job:{job_id}:state"  # Pre-split claim overlay
     QUEUE_PENDING = "queue:pending"
+    USER_PENDING_PREFIX = "queue:pending:user:"  # Per-user pending queue (fair share)
+    QUEUE_FAIR_SHARE = "queue:fair_share"  # Users with pending jobs, scored by jobs served
+    QUEUE_NOTIFY = "queue:notify"  # Wake-up tokens for long-polling workers
     QUEUE_RUNNING = "queue:running"
     QUEUE_COMPLETED = "queue:completed"
     QUEUE_FAILED = "queue:failed"
+    QUEUE_LEASES = "queue:leases"  # Running job -> lease expiry, for workers that renew
+    QUEUE_DEAD_LETTER = "queue:dead_letter"  # Jobs failed after exhausting their lease attempts or releases
     USER_JOBS = "user:{user_id}:jobs"
     USER_COMPLETED_COUNT = "user:{user_id}:completed"
-    WORKER_STATUS = "worker:{worker_id}:status"
+    USER_SERVED_COUNT = "user:{user_id}:served"  # Jobs dispatched to workers
+    WORKER_STATUS = "worker:{worker_id}:status"  # Last heartbeat's WorkerStatus (registry)
+    WORKERS_ACTIVE = "workers:active"  # Registered workers scored by last heartbeat
+    WORKERS_CAPACITY = "workers:capacity"  # Running totals over the registered workers
+    WORKERS_VRAM_CAPACITY = "workers:vram_capacity"  # Worker -> most VRAM (MB) one job can get there
     WORKER_HEARTBEAT = "worker:{worker_id}:heartbeat"
     PUBSUB_CHANNEL = "queue:updates"
+    # Replica coordination (see redis_scripts): the leader runs cluster-wide
+    # housekeeping, a serverless lease marks the replica driving that job
+    LEADER_LEASE = "queue-manager:leader"
+    SERVERLESS_LEASE = "serverless:lease:{job_id}"
+    # Job fields carried by pub/sub events (never workflow, result or metadata)
+    JOB_EVENT_FIELDS = (
+        "id", "user_id", "status", "priority", "created_at", "started_at",
+        "completed_at", "worker_id", "error"
+    )
+
+    # Longest single BLPOP while a worker long-polls; must stay under the
+    # 10s socket_timeout so a parked request never trips it
+    LONG_POLL_SLICE = 5.0
 
     def __init__(self):
         """Initialize Redis connection with timeouts and connection pooling"""
-        self.redis = Redis(
+        # Requests past the pool limit wait up to redis_pool_timeout for a
+        # free connection, then get a 503 (RedisBusyError) to retry
+        self.redis = Redis.from_pool(SheddingConnectionPool(
             host=settings.redis_host,
             port=settings.redis_port,
             password=settings.redis_password,
@@ -40,75 +116,163 @@ class RedisClient:
             socket_timeout=10,  # 10s max for any Redis command (redis-py 7.x compatible)
             socket_keepalive=True,
             health_check_interval=30,
-            max_connections=50  # Connection pool limit
-        )
+            max_connections=settings.redis_max_connections,
+            timeout=settings.redis_pool_timeout,
+        ))
+        self._claim_jobs = self.redis.register_script(CLAIM_JOBS_SCRIPT)
+        self._enqueue_job = self.redis.register_script(ENQUEUE_JOB_SCRIPT)
+        self._dequeue_job = self.redis.register_script(DEQUEUE_JOB_SCRIPT)
+        self._renew_leases = self.redis.register_script(RENEW_LEASES_SCRIPT)
+        self._release_lease = self.redis.register_script(RELEASE_LEASE_SCRIPT)
+        self._renew_job_leases = self.redis.register_script(RENEW_JOB_LEASES_SCRIPT)
+        self._expire_job_lease = self.redis.register_script(EXPIRE_JOB_LEASE_SCRIPT)
+        self._release_job = self.redis.register_script(RELEASE_JOB_SCRIPT)
+        self._worker_heartbeat = self.redis.register_script(WORKER_HEARTBEAT_SCRIPT)
+        self._remove_worker = self.redis.register_script(REMOVE_WORKER_SCRIPT)
+        self._worker_capacity = self.redis.register_script(WORKER_CAPACITY_SCRIPT)
+        self._work_ahead = self.redis.register_script(QUEUE_WORK_AHEAD_SCRIPT)
+        self._work_ahead_lock = asyncio.Lock()
+        self._work_ahead_scan: Optional[tuple] = None  # (monotonic time, script result)
+        self.workflows = WorkflowStore(self.redis)
+        self.runtimes = RuntimeStats(self.redis)
+        self.profiles = VRAMProfiles(self.redis)
         logger.info(
             f"Connected to Redis at {settings.redis_host}:{settings.redis_port} "
-            f"(socket_timeout=10s, max_connections=50)"
+            f"(socket_timeout=10s, max_connections={settings.redis_max_connections})"
         )
 
-    def ping(self) -> bool:
+    async def ping(self) -> bool:
         """Check Redis connection"""
         try:
-            return self.redis.ping()
+            return await self.redis.ping()
         except RedisError as e:
             logger.error(f"Redis ping failed: {e}")
             return False
 
+    async def close(self) -> None:
+        """Close all pooled connections"""
+        await self.redis.aclose()
+
     # ========================================================================
     # Job Operations
     # ========================================================================
 
-    def create_job(self, job: Job) -> bool:
-        """Create a new job and add to pending queue"""
+    async def create_job(self, job: Job, enqueue: bool = True, vram_limit: int = 0) -> bool:
+        """
+        Create a new job and add to pending queue.
+
+        With enqueue=False the job is dispatched elsewhere (serverless): it
+        goes straight to the running queue and is never offered to workers.
+        A VRAM estimate made here (profile or workflow graph) is capped at
+        vram_limit MB (0 = no cap), the most any worker's GPU can give.
+        """
+        manifest = None
         try:
-            job_key = self.JOB_KEY.format(job_id=job.id)
-            job_data = job.model_dump_json()
+            # Runtime class, workflow signature and the workflow-graph VRAM estimate
+            if job.runtime_class is None:
+                job.runtime_class = runtime_class(job.workflow, job.metadata)
+            estimate = None
+            if settings.vram_estimate_workflows:
+                if settings.vram_models_path:  # may walk the model directory
+                    estimate = await asyncio.to_thread(submission_estimate, job.workflow)
+                else:
+                    estimate = submission_estimate(job.workflow)
+            if job.signature is None:
+                job.signature = workflow_signature(job.runtime_class, estimate)
+
+            # The learned VRAM profile and runtime statistics, in one round trip
+            pipe = self.redis.pipeline(transaction=False)
+            if job.metadata.get("estimated_vram") is None:
+                self.profiles.queue_predict(pipe, job.signature)
+            if job.predicted_runtime is None:
+                self.runtimes.queue_predict(pipe, job.runtime_class, job.signature)
+            learned_stats = iter(await pipe.execute())
+
+            # Peak VRAM to pack the job by: what this signature's jobs measured,
+            # else the graph estimate (unless the client gave one)
+            if job.metadata.get("estimated_vram") is None:
+                learned = self.profiles.prediction(next(learned_stats))
+                if learned is not None:
+                    job.metadata.update(estimated_vram=learned, vram_source="profile")
+                elif estimate is not None:
+                    job.metadata.update(estimated_vram=estimate["estimated_vram"], vram_source="workflow")
+                if vram_limit and job.metadata.get("estimated_vram", 0) > vram_limit:
+                    job.metadata["estimated_vram"] = vram_limit
+
+            # Runtime prediction, for wait estimates and shortest_expected scoring
+            if job.predicted_runtime is None:
+                job.predicted_runtime = round(self.runtimes.prediction(next(learned_stats)), 2)
+
+            # Workflow content goes to the shared chunk store; the job keeps the manifest
+            manifest = await self.workflows.put(job.workflow)
 
-            # Store job data
-            self.redis.set(job_key, job_data)
+            pipe = self.redis.pipeline()
 
-            # Add to pending queue with priority score
-            score = self._get_priority_score(job)
-            self.redis.zadd(self.QUEUE_PENDING, {job.id: score})
+            # Store job fields and workflow manifest separately
+            fields = {k: v for k, v in self._job_fields(job).items() if v is not None}
+            pipe.hset(self.JOB_KEY.format(job_id=job.id), mapping=fields)
+            pipe.set(self.JOB_MANIFEST_KEY.format(job_id=job.id), json.dumps(manifest))
+
+            if enqueue:
+                # Add to pending queues (global + per-user) with priority score
+                score = self._get_priority_score(job)
+                await self._enqueue_job(
+                    keys=[self.QUEUE_PENDING, self.QUEUE_FAIR_SHARE, self.QUEUE_NOTIFY],
+                    args=[job.id, score, job.user_id, self.USER_PENDING_PREFIX],
+                    client=pipe
+                )
+            else:
+                started_at = job.started_at or datetime.now(timezone.utc)
+                pipe.zadd(self.QUEUE_RUNNING, {job.id: started_at.timestamp()})
 
             # Track user jobs
             user_jobs_key = self.USER_JOBS.format(user_id=job.user_id)
-            self.redis.sadd(user_jobs_key, job.id)
+            pipe.sadd(user_jobs_key, job.id)
 
-            # Publish event
-            self._publish_event("job_created", job.model_dump())
+            # Publish event (with the job's writes, rather than a round trip of its own)
+            pipe.publish(self.PUBSUB_CHANNEL, self._event_message("job_created", self._job_event(job)))
+
+            await pipe.execute()
 
             logger.info(f"Created job {job.id} for user {job.user_id}")
             return True
 
         except RedisError as e:
             logger.error(f"Failed to create job {job.id}: {e}")
+            if manifest:
+                try:
+                    await self.workflows.release(manifest)
+                except RedisError:
+                    pass
             return False
 
-    def get_job(self, job_id: str) -> Optional[Job]:
-        """Retrieve job by ID"""
-        try:
-            job_key = self.JOB_KEY.format(job_id=job_id)
-            job_data = self.redis.get(job_key)
-
-            if job_data:
-                return Job.model_validate_json(job_data)
-            return None
-
-        except (RedisError, ValueError) as e:
-            logger.error(f"Failed to get job {job_id}: {e}")
-            return None
-
-    def update_job(self, job: Job) -> bool:
-        """Update job data"""
+    async def get_job(
+        self,
+        job_id: str,
+        with_workflow: bool = False,
+        with_result: bool = True
+    ) -> Optional[Job]:
+        """Retrieve job by ID (the workflow blob is only fetched on request)"""
+        jobs = await self._get_jobs([job_id], with_workflow, with_result)
+        return jobs[0] if jobs else None
+
+    async def update_job(self, job: Job) -> bool:
+        """Update job fields (and result, if set); the workflow is immutable"""
         try:
             job_key = self.JOB_KEY.format(job_id=job.id)
-            job_data = job.model_dump_json()
-            self.redis.set(job_key, job_data)
+            fields = self._job_fields(job)
+            cleared = [name for name, value in fields.items() if value is None]
+
+            pipe = self.redis.pipeline()
+            pipe.hset(job_key, mapping={k: v for k, v in fields.items() if v is not None})
+            if cleared:
+                pipe.hdel(job_key, *cleared)
+            if job.result is not None:
+                pipe.set(self.JOB_RESULT_KEY.format(job_id=job.id), json.dumps(job.result))
+            await pipe.execute()
 
             # Publish update event
-            self._publish_event("job_updated", job.model_dump())
+            await self._publish_event("job_updated", self._job_event(job))
 
             logger.debug(f"Updated job {job.id}")
             return True
@@ -117,29 +281,57 @@ class RedisClient:
             logger.error(f"Failed to update job {job.id}: {e}")
             return False
 
-    def delete_job(self, job_id: str) -> bool:
+    async def update_job_metadata(self, job_id: str, metadata: Dict[str, Any]) -> bool:
+        """Replace a job's metadata without touching its other fields"""
+        try:
+            await self.redis.hset(self.JOB_KEY.format(job_id=job_id), "metadata", json.dumps(metadata))
+            return True
+        except RedisError as e:
+            logger.error(f"Failed to update metadata of job {job_id}: {e}")
+            return False
+
+    async def delete_job(self, job_id: str) -> bool:
         """Delete a job"""
         try:
-            job = self.get_job(job_id)
-            if not job:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hget(self.JOB_KEY.format(job_id=job_id), "user_id")
+            pipe.get(self.JOB_MANIFEST_KEY.format(job_id=job_id))
+            user_id, manifest = await pipe.execute()
+            if user_id is None:
                 return False
 
+            pipe = self.redis.pipeline()
+
             # Remove from all queues
-            self.redis.zrem(self.QUEUE_PENDING, job_id)
-            self.redis.zrem(self.QUEUE_RUNNING, job_id)
-            self.redis.zrem(self.QUEUE_COMPLETED, job_id)
-            self.redis.zrem(self.QUEUE_FAILED, job_id)
+            await self._dequeue_job(
+                keys=[self.QUEUE_PENDING, self.QUEUE_FAIR_SHARE],
+                args=[job_id, user_id, self.USER_PENDING_PREFIX],
+                client=pipe
+            )
+            pipe.zrem(self.QUEUE_RUNNING, job_id)
+            pipe.zrem(self.QUEUE_LEASES, job_id)
+            pipe.zrem(self.QUEUE_COMPLETED, job_id)
+            pipe.zrem(self.QUEUE_FAILED, job_id)
+            pipe.zrem(self.QUEUE_DEAD_LETTER, job_id)
 
             # Remove from user jobs
-            user_jobs_key = self.USER_JOBS.format(user_id=job.user_id)
-            self.redis.srem(user_jobs_key, job_id)
+            pipe.srem(self.USER_JOBS.format(user_id=user_id), job_id)
 
             # Delete job data
-            job_key = self.JOB_KEY.format(job_id=job_id)
-            self.redis.delete(job_key)
+            pipe.delete(
+                self.JOB_KEY.format(job_id=job_id),
+                self.JOB_MANIFEST_KEY.format(job_id=job_id),
+                self.JOB_WORKFLOW_KEY.format(job_id=job_id),
+                self.JOB_RESULT_KEY.format(job_id=job_id)
+            )
+            await pipe.execute()
+
+            # Drop this job's references to shared workflow chunks
+            if manifest:
+                await self.workflows.release(json.loads(manifest))
 
             # Publish event
-            self._publish_event("job_deleted", {"job_id": job_id})
+            await self._publish_event("job_deleted", {"job_id": job_id, "user_id": user_id})
 
             logger.info(f"Deleted job {job_id}")
             return True
@@ -148,112 +340,230 @@ class RedisClient:
             logger.error(f"Failed to delete job {job_id}: {e}")
             return False
 
+    async def get_jobs(self, job_ids: List[str], with_result: bool = True) -> List[Job]:
+        """Retrieve several jobs (without workflows) in one round-trip"""
+        return await self._get_jobs(job_ids, with_workflow=False, with_result=with_result)
+
+    async def _get_jobs(
+        self,
+        job_ids: List[str],
+        with_workflow: bool = False,
+        with_result: bool = True
+    ) -> List[Job]:
+        """Load several jobs in one pipeline round-trip, skipping missing ones"""
+        if not job_ids:
+            return []
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for job_id in job_ids:
+                pipe.hgetall(self.JOB_KEY.format(job_id=job_id))
+                if with_workflow:
+                    pipe.get(self.JOB_MANIFEST_KEY.format(job_id=job_id))
+                    pipe.get(self.JOB_WORKFLOW_KEY.format(job_id=job_id))
+                if with_result:
+                    pipe.get(self.JOB_RESULT_KEY.format(job_id=job_id))
+            replies = iter(await pipe.execute())
+
+            jobs = []
+            for job_id in job_ids:
+                fields = next(replies)
+                manifest, workflow = (next(replies), next(replies)) if with_workflow else (None, None)
+                result = next(replies) if with_result else None
+                if not fields:
+                    continue
+                try:
+                    job = self._job_from_fields(fields, workflow, result)
+                    if manifest:
+                        job.workflow = await self.workflows.get(json.loads(manifest))
+                    jobs.append(job)
+                except ValueError as e:
+                    logger.error(f"Failed to parse job {job_id}: {e}")
+            return jobs
+
+        except RedisError as e:
+            logger.error(f"Failed to get jobs {job_ids[:5]}: {e}")
+            return []
+
     # ========================================================================
     # Queue Operations
     # ========================================================================
 
-    def get_next_job(self, queue_mode: QueueMode = QueueMode.FIFO) -> Optional[Job]:
-        """
-        Get next job from queue based on mode.
-        Uses atomic operations to prevent race conditions between workers.
-        """
-        try:
-            if queue_mode == QueueMode.FIFO or queue_mode == QueueMode.PRIORITY:
-                # Atomic pop - zpopmin is atomic by design
-                result = self.redis.zpopmin(self.QUEUE_PENDING)
-                if result:
-                    job_id = result[0][0]
-                    return self.get_job(job_id)
-
-            elif queue_mode == QueueMode.ROUND_ROBIN:
-                # Use optimistic locking to prevent race conditions
-                max_attempts = 5
-                for attempt in range(max_attempts):
-                    try:
-                        # Get candidate job ID
-                        job_id = self._get_round_robin_job()
-                        if not job_id:
-                            return None
-
-                        # Use WATCH/MULTI/EXEC for atomic removal
-                        pipe = self.redis.pipeline()
-                        pipe.watch(self.QUEUE_PENDING)
-
-                        # Check if job still exists in queue
-                        score = pipe.zscore(self.QUEUE_PENDING, job_id)
-                        if score is None:
-                            # Job was already taken by another worker, retry
-                            pipe.unwatch()
-                            continue
-
-                        # Atomic removal
-                        pipe.multi()
-                        pipe.zrem(self.QUEUE_PENDING, job_id)
-                        pipe.execute()
-
-                        # Successfully removed, return the job
-                        return self.get_job(job_id)
-
-                    except WatchError:
-                        # Another worker modified the queue, retry
-                        logger.debug(f"Round-robin race detected (attempt {attempt + 1}/{max_attempts}), retrying...")
-                        continue
-
-                # Max attempts reached
-                logger.warning(f"Failed to get round-robin job after {max_attempts} attempts (high contention)")
-                return None
-
-            return None
+    async def claim_next_job(
+        self,
+        worker_id: str,
+        queue_mode: QueueMode = QueueMode.FIFO,
+        lease: bool = False
+    ) -> Optional[Job]:
+        """
+        Claim the next job for a worker based on queue mode.
 
-        except RedisError as e:
-            logger.error(f"Failed to get next job: {e}")
-            return None
+        Selection, status stamp and the move to the running queue happen in
+        one Lua script, so a job is never lost between queues and the whole
+        claim costs a single round trip. Round robin picks the user with the
+        fewest jobs served from the fair-share set (O(log U)).
 
-    def move_job_to_running(self, job_id: str, worker_id: str) -> bool:
-        """Move job from pending to running"""
+        With lease=True the job gets a job_lease_ttl lease the worker must
+        keep renewing (renew_job_leases), or it is requeued.
+        """
+        jobs = await self.claim_next_jobs(worker_id, queue_mode, lease=lease)
+        return jobs[0] if jobs else None
+
+    async def claim_next_jobs(
+        self,
+        worker_id: str,
+        queue_mode: QueueMode = QueueMode.FIFO,
+        max_jobs: int = 1,
+        vram_budget: int = 0,
+        lease: bool = False,
+        models: Optional[str] = None
+    ) -> List[Job]:
+        """
+        Atomically claim up to max_jobs jobs whose metadata.estimated_vram
+        (settings.vram_default_estimate_mb if unset) fits in vram_budget MB
+        (0 = no limit). Jobs are taken in queue order; the first job that
+        does not fit ends the batch so it is not starved by smaller ones.
+
+        `models` is the model set the worker has loaded (runtime_stats.model_set);
+        outside round-robin mode a job near the head using it is preferred,
+        within settings.affinity_scan_depth and settings.affinity_max_skips.
+        """
+        selector = "fair" if queue_mode == QueueMode.ROUND_ROBIN else "head"
         try:
-            job = self.get_job(job_id)
-            if not job:
-                return False
-
-            job.status = JobStatus.RUNNING
-            job.started_at = datetime.now(timezone.utc)
-            job.worker_id = worker_id
-
-            self.update_job(job)
+            return await self._claim(
+                worker_id, selector, max_jobs=max_jobs, vram_budget=vram_budget, lease=lease, models=models
+            )
+        except RedisError as e:
+            logger.error(f"Failed to claim next job for worker {worker_id}: {e}")
+            return []
 
-            # Move between queues
-            score = datetime.now(timezone.utc).timestamp()
-            self.redis.zadd(self.QUEUE_RUNNING, {job_id: score})
+    async def wait_for_job(
+        self,
+        worker_id: str,
+        queue_mode: QueueMode = QueueMode.FIFO,
+        timeout: float = 0,
+        lease: bool = False,
+        models: Optional[str] = None
+    ) -> Optional[Job]:
+        """Claim the next job, parking for up to `timeout` seconds if none is pending"""
+        jobs = await self.wait_for_jobs(worker_id, queue_mode, timeout=timeout, lease=lease, models=models)
+        return jobs[0] if jobs else None
+
+    async def wait_for_jobs(
+        self,
+        worker_id: str,
+        queue_mode: QueueMode = QueueMode.FIFO,
+        max_jobs: int = 1,
+        vram_budget: int = 0,
+        timeout: float = 0,
+        lease: bool = False,
+        models: Optional[str] = None
+    ) -> List[Job]:
+        """
+        Claim jobs like claim_next_jobs, parking for up to `timeout` seconds
+        if nothing can be claimed.
+
+        Every enqueue pushes a token onto queue:notify; a parked caller BLPOPs
+        it and claims straight away, so a new job starts within a round trip
+        instead of on the worker's next poll. Tokens pushed while nobody waits
+        only cost a spare claim attempt later, and one pushed between a failed
+        claim and the BLPOP is still there when the BLPOP starts, so no wake-up
+        is lost. A caller woken for a job that is over its VRAM budget passes
+        the token on to the next parked worker and returns empty-handed.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        token = None
+        while True:
+            jobs = await self.claim_next_jobs(worker_id, queue_mode, max_jobs, vram_budget, lease, models)
+            remaining = deadline - loop.time()
+            if jobs or remaining <= 0:
+                return jobs
+            try:
+                if token and vram_budget > 0 and await self.redis.zcard(self.QUEUE_PENDING):
+                    await self.redis.rpush(self.QUEUE_NOTIFY, token)
+                    return []
+                # BLPOP timeout 0 means forever - never let rounding get there
+                popped = await self.redis.blpop(
+                    [self.QUEUE_NOTIFY], timeout=max(min(remaining, self.LONG_POLL_SLICE), 0.01)
+                )
+                token = popped[1] if popped else None
+            except RedisError as e:
+                logger.error(f"Long-poll wait failed for worker {worker_id}: {e}")
+                return []
+
+    async def _claim(
+        self,
+        worker_id: str,
+        selector: str = "head",
+        job_id: str = "",
+        max_jobs: int = 1,
+        vram_budget: int = 0,
+        lease: bool = False,
+        models: Optional[str] = None
+    ) -> List[Job]:
+        """Run the claim script ('head' of queue, 'fair' share, or a specific 'id')"""
+        now = datetime.now(timezone.utc)
+        lease_expiry = now.timestamp() + settings.job_lease_ttl if lease else 0
+        claimed = await self._claim_jobs(
+            keys=[self.QUEUE_PENDING, self.QUEUE_RUNNING, self.QUEUE_FAIR_SHARE, self.QUEUE_LEASES],
+            args=[
+                selector, job_id, JobStatus.RUNNING.value, now.isoformat(), worker_id,
+                now.timestamp(), self.PUBSUB_CHANNEL, WorkflowStore.CHUNK_KEY_PREFIX,
+                self.USER_PENDING_PREFIX, max_jobs, vram_budget,
+                settings.vram_default_estimate_mb, lease_expiry,
+                "" if models in (None, "", "-") else models,
+                settings.affinity_scan_depth, settings.affinity_max_skips
+            ]
+        )
 
-            logger.info(f"Job {job_id} started by worker {worker_id}")
+        jobs = []
+        for claimed_id, fields, manifest, payload in claimed:
+            job = self._job_from_fields(dict(zip(fields[::2], fields[1::2])))
+            if manifest:
+                job.workflow = self.workflows.assemble(json.loads(manifest), payload)
+            elif payload and payload[0]:
+                job.workflow = json.loads(payload[0])
+            jobs.append(job)
+            logger.info(f"Job {claimed_id} started by worker {worker_id}")
+        return jobs
+
+    async def update_job_priority(self, job: Job) -> bool:
+        """Re-score a pending job in the global and per-user queues"""
+        try:
+            score = self._get_priority_score(job)
+            pipe = self.redis.pipeline()
+            pipe.zadd(self.QUEUE_PENDING, {job.id: score}, xx=True)
+            pipe.zadd(self.USER_PENDING_PREFIX + job.user_id, {job.id: score}, xx=True)
+            await pipe.execute()
             return True
-
         except RedisError as e:
-            logger.error(f"Failed to move job {job_id} to running: {e}")
+            logger.error(f"Failed to re-score job {job.id}: {e}")
             return False
 
-    def move_job_to_completed(self, job_id: str, result: Dict[str, Any]) -> bool:
-        """Move job from running to completed"""
+    async def move_job_to_completed(
+        self,
+        job_id: str,
+        result: Dict[str, Any],
+        worker_id: Optional[str] = None
+    ) -> bool:
+        """
+        Move job from running to completed. With worker_id, raises
+        JobNotOwnedError unless that worker still holds the job; raises
+        JobNotRunningError if it was cancelled or finished meanwhile.
+        """
+        now = datetime.now(timezone.utc)
+        fields = {
+            "status": JobStatus.COMPLETED.value,
+            "completed_at": now.isoformat()
+        }
         try:
-            job = self.get_job(job_id)
-            if not job:
+            job = await self._finish_job(job_id, worker_id, fields, self.QUEUE_COMPLETED, now, result)
+            if job is None:
                 return False
+            user_id = job["user_id"]
 
-            job.status = JobStatus.COMPLETED
-            job.completed_at = datetime.now(timezone.utc)
-            job.result = result
-
-            self.update_job(job)
-
-            # Move between queues
-            self.redis.zrem(self.QUEUE_RUNNING, job_id)
-            score = datetime.now(timezone.utc).timestamp()
-            self.redis.zadd(self.QUEUE_COMPLETED, {job_id: score})
-
-            # Increment user completed count
-            user_count_key = self.USER_COMPLETED_COUNT.format(user_id=job.user_id)
-            self.redis.incr(user_count_key)
+            await self._publish_event("job_updated", {"id": job_id, "user_id": user_id, **fields})
+            await self._record_runtime(job_id, job, result, now)
 
             logger.info(f"Job {job_id} completed")
             return True
@@ -262,23 +572,51 @@ class RedisClient:
             logger.error(f"Failed to move job {job_id} to completed: {e}")
             return False
 
-    def move_job_to_failed(self, job_id: str, error: str) -> bool:
-        """Move job from running to failed"""
+    async def _record_runtime(
+        self,
+        job_id: str,
+        job: Dict[str, Optional[str]],
+        result: Dict[str, Any],
+        now: datetime
+    ) -> None:
+        """Feed a completed job's execution time and peak VRAM into the statistics"""
+        result = result if isinstance(result, dict) else {}
+        peak = result.get("peak_vram_mb")
         try:
-            job = self.get_job(job_id)
-            if not job:
-                return False
-
-            job.status = JobStatus.FAILED
-            job.completed_at = datetime.now(timezone.utc)
-            job.error = error
+            if job.get("signature") and isinstance(peak, (int, float)) and not isinstance(peak, bool) and peak > 0:
+                await self.profiles.record(job["signature"], float(peak))
+
+            seconds = result.get("execution_time")
+            if not isinstance(seconds, (int, float)) or isinstance(seconds, bool):
+                if not job.get("started_at"):
+                    return
+                seconds = (now - datetime.fromisoformat(job["started_at"])).total_seconds()
+            if seconds <= 0:
+                return
+            await self.runtimes.record(
+                job.get("runtime_class") or runtime_class(None), float(seconds), job.get("signature")
+            )
+        except RedisError as e:
+            logger.warning(f"Failed to record runtime of job {job_id}: {e}")
 
-            self.update_job(job)
+    async def move_job_to_failed(self, job_id: str, error: str, worker_id: Optional[str] = None) -> bool:
+        """
+        Move job from running to failed. Raises JobNotOwnedError and
+        JobNotRunningError as move_job_to_completed does.
+        """
+        now = datetime.now(timezone.utc)
+        fields = {
+            "status": JobStatus.FAILED.value,
+            "completed_at": now.isoformat(),
+            "error": error
+        }
+        try:
+            job = await self._finish_job(job_id, worker_id, fields, self.QUEUE_FAILED, now)
+            if job is None:
+                return False
+            user_id = job["user_id"]
 
-            # Move between queues
-            self.redis.zrem(self.QUEUE_RUNNING, job_id)
-            score = datetime.now(timezone.utc).timestamp()
-            self.redis.zadd(self.QUEUE_FAILED, {job_id: score})
+            await self._publish_event("job_updated", {"id": job_id, "user_id": user_id, **fields})
 
             logger.error(f"Job {job_id} failed: {error}")
             return True
@@ -287,15 +625,194 @@ class RedisClient:
             logger.error(f"Failed to move job {job_id} to failed: {e}")
             return False
 
-    def get_queue_depth(self, queue: str = QUEUE_PENDING) -> int:
+    async def cancel_running_job(self, job_id: str) -> bool:
+        """
+        Cancel a running job: it leaves running and its lease (worker or
+        serverless) at once, so the worker sees it as lost on its next
+        heartbeat and a late completion is refused. Raises
+        JobNotRunningError if the job finished first.
+        """
+        now = datetime.now(timezone.utc)
+        fields = {
+            "status": JobStatus.CANCELLED.value,
+            "completed_at": now.isoformat()
+        }
+        try:
+            job = await self._finish_job(job_id, None, fields, None, now)
+            if job is None:
+                return False
+            user_id = job["user_id"]
+            # A serverless job's runner notices on its next lease renewal
+            await self.redis.delete(self.SERVERLESS_LEASE.format(job_id=job_id))
+
+            await self._publish_event("job_updated", {"id": job_id, "user_id": user_id, **fields})
+
+            logger.info(f"Job {job_id} cancelled while running")
+            return True
+
+        except RedisError as e:
+            logger.error(f"Failed to cancel job {job_id}: {e}")
+            return False
+
+    async def _finish_job(
+        self,
+        job_id: str,
+        worker_id: Optional[str],
+        fields: Dict[str, str],
+        queue: Optional[str],
+        now: datetime,
+        result: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Optional[str]]]:
+        """
+        Stamp a job's final fields and move it from running (and its lease)
+        to `queue`, if any; returns its user_id, runtime_class, signature
+        and started_at, None if the job does not exist. The job hash is WATCHed
+        so the owner and status checks cannot race a lease expiry or a cancel.
+        """
+        job_key = self.JOB_KEY.format(job_id=job_id)
+        async with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(job_key)
+                    user_id, owner, status, job_class, signature, started_at = await pipe.hmget(
+                        job_key, "user_id", "worker_id", "status", "runtime_class", "signature", "started_at"
+                    )
+                    if user_id is None:
+                        return None
+                    if worker_id is not None and owner != worker_id:
+                        raise JobNotOwnedError(f"Job {job_id} is no longer held by worker {worker_id}")
+                    if status != JobStatus.RUNNING.value:
+                        raise JobNotRunningError(f"Job {job_id} is already {status}")
+
+                    pipe.multi()
+                    pipe.hset(job_key, mapping=fields)
+                    if result is not None:
+                        pipe.set(self.JOB_RESULT_KEY.format(job_id=job_id), json.dumps(result))
+
+                    # Move between queues
+                    pipe.zrem(self.QUEUE_RUNNING, job_id)
+                    pipe.zrem(self.QUEUE_LEASES, job_id)
+                    if queue:
+                        pipe.zadd(queue, {job_id: now.timestamp()})
+
+                    if queue == self.QUEUE_COMPLETED:
+                        # Increment user completed count
+                        pipe.incr(self.USER_COMPLETED_COUNT.format(user_id=user_id))
+                    await pipe.execute()
+                    return {
+                        "user_id": user_id,
+                        "runtime_class": job_class,
+                        "signature": signature,
+                        "started_at": started_at,
+                    }
+                except WatchError:
+                    continue  # job changed meanwhile (e.g. lease expired): check again
+
+    async def get_queue_depth(self, queue: str = QUEUE_PENDING) -> int:
         """Get number of jobs in queue"""
         try:
-            return self.redis.zcard(queue)
+            return await self.redis.zcard(queue)
         except RedisError as e:
             logger.error(f"Failed to get queue depth: {e}")
             return 0
 
-    def get_all_queue_stats(self) -> Dict[str, int]:
+    async def get_queue_position(self, job_id: str) -> Optional[int]:
+        """Get 0-based position of a pending job (O(log N) via ZRANK)"""
+        try:
+            return await self.redis.zrank(self.QUEUE_PENDING, job_id)
+        except RedisError as e:
+            logger.error(f"Failed to get queue position for {job_id}: {e}")
+            return None
+
+    async def get_queue_positions(self, job_ids: List[str]) -> Dict[str, Optional[int]]:
+        """Get positions for several jobs in a single pipeline round-trip"""
+        if not job_ids:
+            return {}
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for job_id in job_ids:
+                pipe.zrank(self.QUEUE_PENDING, job_id)
+            return dict(zip(job_ids, await pipe.execute()))
+        except RedisError as e:
+            logger.error(f"Failed to get queue positions: {e}")
+            return {job_id: None for job_id in job_ids}
+
+    async def _queued_work(self) -> List[float]:
+        """
+        QUEUE_WORK_AHEAD_SCRIPT over the first eta_scan_limit positions.
+        One scan is shared for eta_cache_ttl seconds: every poll and submit
+        would otherwise read the predicted runtime of up to eta_scan_limit
+        pending and running jobs. Concurrent callers wait for the scan in
+        flight instead of starting their own.
+        """
+        async with self._work_ahead_lock:
+            cached = self._work_ahead_scan
+            if cached and time.monotonic() - cached[0] < settings.eta_cache_ttl:
+                return cached[1]
+            work = [float(value) for value in await self._work_ahead(
+                keys=[self.QUEUE_PENDING, self.QUEUE_RUNNING],
+                args=[settings.eta_scan_limit, settings.average_job_duration,
+                      datetime.now(timezone.utc).timestamp()]
+            )]
+            self._work_ahead_scan = (time.monotonic(), work)
+            return work
+
+    async def estimate_wait_times(
+        self,
+        positions: Dict[str, Optional[int]],
+        slots: int
+    ) -> Dict[str, Optional[int]]:
+        """
+        Seconds until each pending job (by queue position) should start: the
+        remaining predicted runtime of the running jobs plus that of every
+        job ahead of it, spread over `slots` concurrent slots. The prefix
+        sums come from a scan reused for eta_cache_ttl seconds (see
+        _queued_work); past eta_scan_limit, or past the end of the queue
+        when it was scanned, the tail is extrapolated at the mean predicted
+        runtime of the scanned jobs.
+        """
+        if all(position is None for position in positions.values()):
+            return {job_id: None for job_id in positions}
+        slots = max(slots, 1)
+        try:
+            work = await self._queued_work()
+        except RedisError as e:
+            logger.error(f"Failed to estimate wait times: {e}")
+            return {
+                job_id: None if position is None else int(position * settings.average_job_duration / slots)
+                for job_id, position in positions.items()
+            }
+
+        running, ahead = work[0], work[1:]
+        scanned = len(ahead) - 1
+        mean = ahead[-1] / scanned if scanned else float(settings.average_job_duration)
+        estimates: Dict[str, Optional[int]] = {}
+        for job_id, position in positions.items():
+            if position is None:
+                estimates[job_id] = None
+            elif position <= scanned:
+                estimates[job_id] = int((running + ahead[position]) / slots)
+            else:
+                estimates[job_id] = int((running + ahead[-1] + (position - scanned) * mean) / slots)
+        return estimates
+
+    async def get_runtime_stats(self) -> Dict[str, Dict[str, float]]:
+        """Rolling runtime statistics per level (see runtime_stats)"""
+        try:
+            return await self.runtimes.snapshot()
+        except RedisError as e:
+            logger.error(f"Failed to read runtime stats: {e}")
+            return {}
+
+    async def get_vram_profiles(self) -> Dict[str, Dict[str, float]]:
+        """Learned peak VRAM per workflow signature (see vram_profiles)"""
+        try:
+            return await self.profiles.snapshot()
+        except RedisError as e:
+            logger.error(f"Failed to read VRAM profiles: {e}")
+            return {}
+
+    async def get_all_queue_stats(self) -> Dict[str, int]:
         """
         Get all queue statistics in a single Redis pipeline call.
         Performance: 4 commands → 1 round-trip (75% reduction in network overhead)
@@ -306,43 +823,45 @@ class RedisClient:
             pipe.zcard(self.QUEUE_RUNNING)
             pipe.zcard(self.QUEUE_COMPLETED)
             pipe.zcard(self.QUEUE_FAILED)
-            results = pipe.execute()
+            pipe.zcard(self.QUEUE_DEAD_LETTER)
+            results = await pipe.execute()
 
             return {
                 "pending": results[0],
                 "running": results[1],
                 "completed": results[2],
                 "failed": results[3],
+                "dead_letter": results[4],
             }
         except RedisError as e:
             logger.error(f"Failed to get queue stats: {e}")
-            return {"pending": 0, "running": 0, "completed": 0, "failed": 0}
+            return {"pending": 0, "running": 0, "completed": 0, "failed": 0, "dead_letter": 0}
 
-    def get_pending_jobs(self, limit: int = 100) -> List[Job]:
-        """Get list of pending jobs"""
+    async def get_pending_jobs(self, limit: int = 100) -> List[Job]:
+        """Get list of pending jobs (without workflow payloads)"""
         try:
-            job_ids = self.redis.zrange(self.QUEUE_PENDING, 0, limit - 1)
-            jobs = []
-            for job_id in job_ids:
-                job = self.get_job(job_id)
-                if job:
-                    jobs.append(job)
-            return jobs
+            job_ids = await self.redis.zrange(self.QUEUE_PENDING, 0, limit - 1)
+            return await self._get_jobs(job_ids, with_result=False)
         except RedisError as e:
             logger.error(f"Failed to get pending jobs: {e}")
             return []
 
-    def get_user_jobs(self, user_id: str) -> List[Job]:
-        """Get all jobs for a user"""
+    async def get_running_jobs(self, worker_id: Optional[str] = None, with_workflow: bool = False) -> List[Job]:
+        """Get running jobs, optionally only those held by one worker"""
+        try:
+            job_ids = await self.redis.zrange(self.QUEUE_RUNNING, 0, -1)
+            jobs = await self._get_jobs(job_ids, with_workflow=with_workflow, with_result=False)
+            return [job for job in jobs if worker_id is None or job.worker_id == worker_id]
+        except RedisError as e:
+            logger.error(f"Failed to get running jobs: {e}")
+            return []
+
+    async def get_user_jobs(self, user_id: str) -> List[Job]:
+        """Get all jobs for a user (without workflow payloads)"""
         try:
             user_jobs_key = self.USER_JOBS.format(user_id=user_id)
-            job_ids = self.redis.smembers(user_jobs_key)
-            jobs = []
-            for job_id in job_ids:
-                job = self.get_job(job_id)
-                if job:
-                    jobs.append(job)
-            return jobs
+            job_ids = await self.redis.smembers(user_jobs_key)
+            return await self._get_jobs(list(job_ids))
         except RedisError as e:
             logger.error(f"Failed to get user jobs for {user_id}: {e}")
             return []
@@ -351,107 +870,424 @@ class RedisClient:
     # Worker Operations
     # ========================================================================
 
-    def update_worker_heartbeat(self, worker_id: str) -> bool:
+    async def update_worker_heartbeat(self, worker_id: str) -> bool:
         """Update worker heartbeat timestamp"""
         try:
             key = self.WORKER_HEARTBEAT.format(worker_id=worker_id)
-            self.redis.setex(key, settings.worker_heartbeat_timeout, datetime.now(timezone.utc).isoformat())
+            await self.redis.setex(key, settings.worker_heartbeat_timeout, datetime.now(timezone.utc).isoformat())
             return True
         except RedisError as e:
             logger.error(f"Failed to update worker heartbeat for {worker_id}: {e}")
             return False
 
-    def is_worker_alive(self, worker_id: str) -> bool:
+    # Worker registry: heartbeats carry a WorkerStatus; the registry scripts
+    # keep the totals returned by get_worker_capacity up to date
+
+    def _registry_args(self) -> List[Any]:
+        cutoff = datetime.now(timezone.utc).timestamp() - settings.worker_heartbeat_timeout
+        return [cutoff, "worker:"]
+
+    async def record_worker_heartbeat(self, status: WorkerStatus) -> bool:
+        """Register a worker's status and mark it alive for worker_heartbeat_timeout"""
+        try:
+            now = datetime.now(timezone.utc)
+            status.last_heartbeat = now
+            status.current_job_id = status.current_job_id or next(iter(status.current_job_ids), None)
+            details = status.model_dump(
+                mode="json", exclude={"worker_id", "slots", "free_slots", "vram_free_mb"}, exclude_none=True
+            )
+            details["current_job_ids"] = json.dumps(details["current_job_ids"])
+            details["devices"] = json.dumps(details["devices"])
+            await self._worker_heartbeat(
+                keys=[self.WORKERS_ACTIVE, self.WORKERS_CAPACITY, self.WORKERS_VRAM_CAPACITY],
+                args=[
+                    *self._registry_args(), status.worker_id, now.timestamp(),
+                    1 if status.current_job_ids else 0, status.slots, status.free_slots, status.vram_free_mb,
+                    status.vram_capacity_mb or 0,
+                    *[item for pair in details.items() for item in pair]
+                ]
+            )
+            # Plain liveness key, as set by next-job polls
+            await self.update_worker_heartbeat(status.worker_id)
+            return True
+        except RedisError as e:
+            logger.error(f"Failed to record heartbeat of worker {status.worker_id}: {e}")
+            return False
+
+    async def remove_worker(self, worker_id: str) -> bool:
+        """Take a worker out of the registry (it is shutting down)"""
+        try:
+            return bool(await self._remove_worker(
+                keys=[self.WORKERS_ACTIVE, self.WORKERS_CAPACITY, self.WORKERS_VRAM_CAPACITY], args=[*self._registry_args(), worker_id]
+            ))
+        except RedisError as e:
+            logger.error(f"Failed to remove worker {worker_id}: {e}")
+            return False
+
+    async def get_worker_capacity(self) -> Dict[str, int]:
+        """
+        Totals over the live workers: workers, busy (running at least one
+        job), slots, free_slots and vram_free_mb; and vram_capacity_mb, the
+        most VRAM one job can get on any of them (0 if unknown). O(log n)
+        apart from pruning workers that have gone quiet since the last call.
+        """
+        capacity = dict.fromkeys(
+            ("workers", "busy", "slots", "free_slots", "vram_free_mb", "vram_capacity_mb"), 0
+        )
+        try:
+            totals = await self._worker_capacity(
+                keys=[self.WORKERS_ACTIVE, self.WORKERS_CAPACITY, self.WORKERS_VRAM_CAPACITY], args=self._registry_args()
+            )
+            capacity.update({name: int(float(value)) for name, value in zip(totals[::2], totals[1::2])})
+        except RedisError as e:
+            logger.error(f"Failed to read worker capacity: {e}")
+        return capacity
+
+    async def get_workers(self) -> List[WorkerStatus]:
+        """Status of every live worker, most recent heartbeat first"""
+        try:
+            cutoff = datetime.now(timezone.utc).timestamp() - settings.worker_heartbeat_timeout
+            worker_ids = await self.redis.zrevrangebyscore(self.WORKERS_ACTIVE, "+inf", f"({cutoff}")
+            pipe = self.redis.pipeline(transaction=False)
+            for worker_id in worker_ids:
+                pipe.hgetall(self.WORKER_STATUS.format(worker_id=worker_id))
+            workers = []
+            for worker_id, fields in zip(worker_ids, await pipe.execute()):
+                if not fields:
+                    continue
+                fields["current_job_ids"] = json.loads(fields.get("current_job_ids") or "[]")
+                fields["devices"] = json.loads(fields.get("devices") or "[]")
+                workers.append(WorkerStatus(worker_id=worker_id, **fields))
+            return workers
+        except (RedisError, ValueError) as e:
+            logger.error(f"Failed to list workers: {e}")
+            return []
+
+    async def get_job_statuses(self, job_ids: List[str]) -> Dict[str, Optional[str]]:
+        """Status of each job (None if it no longer exists) in one round-trip"""
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for job_id in job_ids:
+                pipe.hget(self.JOB_KEY.format(job_id=job_id), "status")
+            return dict(zip(job_ids, await pipe.execute()))
+        except RedisError as e:
+            logger.error(f"Failed to get job statuses: {e}")
+            return {}
+
+    async def renew_job_leases(self, worker_id: str, job_ids: List[str]) -> Optional[List[str]]:
+        """
+        Extend the leases of jobs the worker still holds by job_lease_ttl.
+        Returns those job ids (the worker has lost the others), None on a
+        Redis error so the caller can retry rather than abandon its jobs.
+        """
+        if not job_ids:
+            return []
+        try:
+            expiry = datetime.now(timezone.utc).timestamp() + settings.job_lease_ttl
+            return await self._renew_job_leases(keys=[self.QUEUE_LEASES], args=[worker_id, expiry, *job_ids])
+        except RedisError as e:
+            logger.error(f"Failed to renew job leases for worker {worker_id}: {e}")
+            return None
+
+    async def requeue_expired_jobs(self) -> Dict[str, int]:
+        """
+        Requeue running jobs whose lease ran out (their worker died or hung),
+        at their original queue position; jobs out of attempts
+        (job_max_attempts claims) go to failed and the dead-letter queue.
+        """
+        counts = {"requeued": 0, "dead_letter": 0}
+        try:
+            now = datetime.now(timezone.utc)
+            expired = await self.redis.zrangebyscore(self.QUEUE_LEASES, 0, now.timestamp())
+            if not expired:
+                return counts
+
+            jobs = {job.id: job for job in await self._get_jobs(expired, with_result=False)}
+            for job_id in expired:
+                job = jobs.get(job_id)
+                outcome = await self._expire_job_lease(
+                    keys=[
+                        self.QUEUE_LEASES, self.QUEUE_RUNNING, self.QUEUE_PENDING, self.QUEUE_FAIR_SHARE,
+                        self.QUEUE_NOTIFY, self.QUEUE_FAILED, self.QUEUE_DEAD_LETTER
+                    ],
+                    args=[
+                        job_id, now.timestamp(), now.isoformat(),
+                        self._get_priority_score(job) if job else now.timestamp(),
+                        self.USER_PENDING_PREFIX, settings.job_max_attempts, self.PUBSUB_CHANNEL
+                    ]
+                )
+                if outcome == "requeued":
+                    logger.warning(f"Lease of job {job_id} expired (worker {job.worker_id if job else '?'}); requeued")
+                elif outcome == "dead_letter":
+                    logger.error(f"Lease of job {job_id} expired after {settings.job_max_attempts} attempts; dead-lettered")
+                if outcome:
+                    counts[outcome] += 1
+            return counts
+
+        except RedisError as e:
+            logger.error(f"Failed to requeue expired jobs: {e}")
+            return counts
+
+    async def release_job(self, job_id: str, worker_id: str) -> Optional[str]:
+        """
+        Put a job the worker claimed but could not start back at its place in
+        the pending queue, without counting the attempt: "released", or
+        "dead_letter" once the job has been handed back job_max_releases
+        times. None if the job does not exist; raises JobNotOwnedError /
+        JobNotRunningError as move_job_to_completed does.
+        """
+        try:
+            job = await self.get_job(job_id, with_workflow=False, with_result=False)
+            if job is None:
+                return None
+            now = datetime.now(timezone.utc)
+            released = await self._release_job(
+                keys=[self.QUEUE_LEASES, self.QUEUE_RUNNING, self.QUEUE_PENDING, self.QUEUE_FAIR_SHARE,
+                      self.QUEUE_NOTIFY, self.QUEUE_FAILED, self.QUEUE_DEAD_LETTER],
+                args=[job_id, worker_id, now.isoformat(), self._get_priority_score(job),
+                      self.USER_PENDING_PREFIX, self.PUBSUB_CHANNEL, now.timestamp(), settings.job_max_releases]
+            )
+        except RedisError as e:
+            logger.error(f"Failed to release job {job_id}: {e}")
+            return None
+        if released == -1:
+            raise JobNotOwnedError(f"Job {job_id} is no longer held by worker {worker_id}")
+        if released == -2:
+            raise JobNotRunningError(f"Job {job_id} is no longer running")
+        if released == 2:
+            logger.warning(f"Job {job_id} dead-lettered: released {settings.job_max_releases} time(s)")
+            return "dead_letter"
+        if released:
+            logger.info(f"Job {job_id} released by worker {worker_id}; back in the queue")
+            return "released"
+        return None
+
+    async def get_dead_letter_jobs(self, limit: int = 100) -> List[Job]:
+        """Most recently dead-lettered jobs first"""
+        try:
+            job_ids = await self.redis.zrevrange(self.QUEUE_DEAD_LETTER, 0, limit - 1)
+            return await self._get_jobs(job_ids, with_result=False)
+        except RedisError as e:
+            logger.error(f"Failed to get dead-letter jobs: {e}")
+            return []
+
+    async def is_worker_alive(self, worker_id: str) -> bool:
         """Check if worker is alive based on heartbeat"""
         try:
             key = self.WORKER_HEARTBEAT.format(worker_id=worker_id)
-            return self.redis.exists(key) > 0
+            return await self.redis.exists(key) > 0
         except RedisError as e:
             logger.error(f"Failed to check worker heartbeat for {worker_id}: {e}")
             return False
 
+    # ========================================================================
+    # Leases (coordination between queue manager replicas)
+    # ========================================================================
+
+    async def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """Take a lease unless another owner holds it; True if `owner` now holds it"""
+        try:
+            if await self.redis.set(key, owner, nx=True, px=int(ttl * 1000)):
+                return True
+            return await self.redis.get(key) == owner
+        except RedisError as e:
+            logger.error(f"Failed to acquire lease {key}: {e}")
+            return False
+
+    async def renew_leases(self, keys: List[str], owner: str, ttl: float) -> Optional[List[str]]:
+        """Extend the leases `owner` still holds; returns those (None if Redis is unreachable)"""
+        if not keys:
+            return []
+        try:
+            return await self._renew_leases(keys=keys, args=[owner, int(ttl * 1000)])
+        except RedisError as e:
+            logger.error(f"Failed to renew {len(keys)} lease(s): {e}")
+            return None
+
+    async def release_lease(self, key: str, owner: str) -> bool:
+        """Give up a lease if `owner` still holds it"""
+        try:
+            return bool(await self._release_lease(keys=[key], args=[owner]))
+        except RedisError as e:
+            logger.error(f"Failed to release lease {key}: {e}")
+            return False
+
+    async def unleased(self, keys: List[str]) -> List[str]:
+        """Keys among `keys` that nobody currently holds"""
+        if not keys:
+            return []
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for key in keys:
+                pipe.exists(key)
+            return [key for key, held in zip(keys, await pipe.execute()) if not held]
+        except RedisError as e:
+            logger.error(f"Failed to check {len(keys)} lease(s): {e}")
+            return []
+
     # ========================================================================
     # Pub/Sub Operations
     # ========================================================================
 
-    def _publish_event(self, event_type: str, data: Dict[str, Any]) -> None:
+    @staticmethod
+    def _event_message(event_type: str, data: Dict[str, Any]) -> str:
+        """Pub/sub message for an event"""
+        return json.dumps({
+            "type": event_type,
+            "data": data,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        })
+
+    async def _publish_event(self, event_type: str, data: Dict[str, Any]) -> None:
         """Publish event to pub/sub channel"""
         try:
-            message = {
-                "type": event_type,
-                "data": data,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            }
-            self.redis.publish(self.PUBSUB_CHANNEL, json.dumps(message))
+            await self.redis.publish(self.PUBSUB_CHANNEL, self._event_message(event_type, data))
         except RedisError as e:
             logger.error(f"Failed to publish event {event_type}: {e}")
 
-    def subscribe_to_updates(self):
+    async def subscribe_to_updates(self):
         """Subscribe to queue updates"""
         pubsub = self.redis.pubsub()
-        pubsub.subscribe(self.PUBSUB_CHANNEL)
+        await pubsub.subscribe(self.PUBSUB_CHANNEL)
         return pubsub
 
     # ========================================================================
     # Helper Methods
     # ========================================================================
 
+    def _job_fields(self, job: Job) -> Dict[str, Optional[str]]:
+        """Flatten a job's small fields into hash values (None = unset)"""
+        data = job.model_dump(mode="json", exclude={"workflow", "result"})
+        data["metadata"] = json.dumps(data["metadata"])
+        return {name: None if value is None else str(value) for name, value in data.items()}
+
+    def _job_from_fields(
+        self,
+        fields: Dict[str, str],
+        workflow: Optional[str] = None,
+        result: Optional[str] = None
+    ) -> Job:
+        """Rebuild a Job from its hash fields and optional blobs"""
+        data: Dict[str, Any] = dict(fields)
+        data["priority"] = int(data["priority"])
+        data["metadata"] = json.loads(data.get("metadata") or "{}")
+        data["workflow"] = json.loads(workflow) if workflow else None
+        data["result"] = json.loads(result) if result else None
+        return Job.model_validate(data)
+
+    def _job_event(self, job: Job) -> Dict[str, Any]:
+        """Pub/sub payload for a job: the status fields only, never the blobs"""
+        data = job.model_dump(mode="json", include=set(self.JOB_EVENT_FIELDS))
+        return {name: value for name, value in data.items() if value is not None}
+
     def _get_priority_score(self, job: Job) -> float:
         """Calculate priority score for job (lower = higher priority)"""
-        # Priority level (0-3) * 1000000 + timestamp
-        # This ensures priority takes precedence, then FIFO within priority
-        priority_weight = job.priority.value * 1000000
-        timestamp = job.created_at.timestamp()
-        return priority_weight + timestamp
-
-    def _get_round_robin_job(self) -> Optional[str]:
-        """Get next job using round-robin logic"""
-        try:
-            # Get all pending jobs
-            pending_job_ids = self.redis.zrange(self.QUEUE_PENDING, 0, -1)
-            if not pending_job_ids:
-                return None
-
-            # Group jobs by user and count completed jobs per user
-            user_jobs: Dict[str, List[str]] = {}
-            for job_id in pending_job_ids:
-                job = self.get_job(job_id)
-                if job:
-                    if job.user_id not in user_jobs:
-                        user_jobs[job.user_id] = []
-                    user_jobs[job.user_id].append(job_id)
-
-            # Find user with fewest completed jobs
-            min_completed = float('inf')
-            selected_user = None
-
-            for user_id in user_jobs.keys():
-                count_key = self.USER_COMPLETED_COUNT.format(user_id=user_id)
-                completed = int(self.redis.get(count_key) or 0)
-                if completed < min_completed:
-                    min_completed = completed
-                    selected_user = user_id
-
-            # Return first job from selected user
-            if selected_user and user_jobs[selected_user]:
-                return user_jobs[selected_user][0]
+        # Priority level (0-3) * 1000000 + timestamp (+ weighted predicted
+        # runtime in shortest_expected mode): priority takes precedence, then
+        # FIFO within priority
+        return queue_score(
+            job.priority.value, job.created_at.timestamp(), job.predicted_runtime, settings.queue_mode
+        )
 
-            return None
+    async def migrate_legacy_jobs(self) -> int:
+        """
+        Convert jobs stored as a single JSON string at job:{id} (plus the
+        optional job:{id}:state claim overlay) to the hash + blob layout, and
+        move full job:{id}:workflow blobs into the deduplicated chunk store.
+        Also backfills the per-user fair-share queues for pending jobs.
+        Idempotent: already-migrated jobs are skipped.
+        """
+        migrated = 0
+        try:
+            async for key in self.redis.scan_iter(match="job:*", _type="string", count=500):
+                if key.count(":") != 1:
+                    continue  # job:{id}:workflow / job:{id}:result blobs
+
+                job_id = key.split(":", 1)[1]
+                state_key = self.LEGACY_JOB_STATE_KEY.format(job_id=job_id)
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.get(key)
+                pipe.hgetall(state_key)
+                job_data, state = await pipe.execute()
+                if not job_data:
+                    continue
+
+                job = Job.model_validate_json(job_data)
+                if "status" in state:
+                    job.status = JobStatus(state["status"])
+                if "started_at" in state:
+                    job.started_at = datetime.fromisoformat(state["started_at"])
+                if "worker_id" in state:
+                    job.worker_id = state["worker_id"]
+
+                manifest = await self.workflows.put(job.workflow)
+                fields = {k: v for k, v in self._job_fields(job).items() if v is not None}
+                pipe = self.redis.pipeline()
+                pipe.delete(key, state_key)
+                pipe.hset(key, mapping=fields)
+                pipe.set(self.JOB_MANIFEST_KEY.format(job_id=job_id), json.dumps(manifest))
+                if job.result is not None:
+                    pipe.set(self.JOB_RESULT_KEY.format(job_id=job_id), json.dumps(job.result))
+                await pipe.execute()
+                migrated += 1
+
+            # Full workflows stored before deduplication -> chunk store
+            async for key in self.redis.scan_iter(match="job:*:workflow", _type="string", count=500):
+                job_id = key.split(":")[1]
+                workflow = await self.redis.get(key)
+                if not workflow:
+                    continue
+
+                manifest = await self.workflows.put(json.loads(workflow))
+                pipe = self.redis.pipeline()
+                pipe.set(self.JOB_MANIFEST_KEY.format(job_id=job_id), json.dumps(manifest))
+                pipe.delete(key)
+                await pipe.execute()
+                migrated += 1
+
+            # Pending jobs queued before per-user fair-share queues existed
+            if not await self.redis.exists(self.QUEUE_FAIR_SHARE):
+                async for job_id, score in self.redis.zscan_iter(self.QUEUE_PENDING, count=500):
+                    user_id = await self.redis.hget(self.JOB_KEY.format(job_id=job_id), "user_id")
+                    if user_id:
+                        await self._enqueue_job(
+                            keys=[self.QUEUE_PENDING, self.QUEUE_FAIR_SHARE, self.QUEUE_NOTIFY],
+                            args=[job_id, score, user_id, self.USER_PENDING_PREFIX]
+                        )
+                        migrated += 1
+
+            if migrated:
+                logger.info(f"Migrated {migrated} legacy job record(s) to current storage")
+            return migrated
 
-        except RedisError as e:
-            logger.error(f"Failed to get round-robin job: {e}")
-            return None
+        except (RedisError, ValueError) as e:
+            logger.error(f"Failed to migrate legacy jobs: {e}")
+            return migrated
 
-    def cleanup_stale_jobs(self, timeout_seconds: int = 3600) -> int:
-        """Cleanup jobs that have been running too long"""
+    async def cleanup_stale_jobs(self, timeout_seconds: int = 3600) -> int:
+        """
+        Cleanup jobs that have been running too long. Jobs under a lease are
+        left alone: their worker is alive for as long as it renews, and
+        requeue_expired_jobs handles the ones whose worker is not.
+        """
         try:
             cutoff = datetime.now(timezone.utc).timestamp() - timeout_seconds
-            stale_job_ids = self.redis.zrangebyscore(self.QUEUE_RUNNING, 0, cutoff)
+            stale_job_ids = await self.redis.zrangebyscore(self.QUEUE_RUNNING, 0, cutoff)
+            if stale_job_ids:
+                pipe = self.redis.pipeline(transaction=False)
+                for job_id in stale_job_ids:
+                    pipe.zscore(self.QUEUE_LEASES, job_id)
+                leased = await pipe.execute()
+                stale_job_ids = [job_id for job_id, lease in zip(stale_job_ids, leased) if lease is None]
 
             count = 0
             for job_id in stale_job_ids:
-                self.move_job_to_failed(job_id, "Job timeout exceeded")
-                count += 1
+                try:
+                    await self.move_job_to_failed(job_id, "Job timeout exceeded")
+                    count += 1
+                except JobNotRunningError:
+                    # Cancelled by an older version, which left it in running
+                    await self.redis.zrem(self.QUEUE_RUNNING, job_id)
 
             if count > 0:
                 logger.warning(f"Cleaned up {count} stale jobs")
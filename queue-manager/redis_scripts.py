@@ -0,0 +1,530 @@
+"""
+Lua scripts for atomic queue operations
+
+Each script runs server-side in a single round trip. Job keys are derived
+inside the scripts from the same patterns RedisClient uses (job:{id},
+queue:pending:user:{user_id}, user:{user_id}:served).
+
+Fair share (round_robin mode): every user with pending jobs has a sorted set
+queue:pending:user:{user_id} (same scores as queue:pending) and a member in
+queue:fair_share scored by how many of their jobs have been dispatched. A
+round-robin claim takes the lowest-scored user and pops their head job, so
+it is O(log U + log N) regardless of queue depth. FIFO/priority claims keep
+the same structures in sync so the mode can be switched at any time.
+
+Wake-ups: every enqueue also pushes a token onto queue:notify (capped at the
+pending depth). Workers long-polling /api/workers/next-job BLPOP that list,
+so a new job wakes exactly one parked worker instead of waiting for the
+next poll. BZPOPMIN on queue:pending itself would bypass the claim script
+(fair share, status stamp, running queue), hence the separate list.
+
+Job leases: a worker that claims with leases gets each job's expiry in
+queue:leases (job id -> unix time) and must renew it while working. When a
+lease runs out the job is requeued at its old place, or moved to failed and
+queue:dead_letter once it has used up its attempts (counted per claim in the
+job hash). Completion is then no longer tied to job_timeout: a live worker
+can render for as long as it keeps renewing, a dead one loses its jobs
+within one lease TTL.
+
+Leases: replicas of the queue manager coordinate through keys holding the
+owner's instance id with a TTL (SET NX PX to take one). Renewing or
+releasing must only touch a lease the caller still holds, so both compare
+the owner first - a replica that stalled past the TTL cannot extend or
+delete a lease another replica has since taken.
+
+Worker registry: workers:active scores each worker by its last heartbeat
+and workers:capacity holds running totals (workers, busy, slots,
+free_slots, vram_free_mb) that every heartbeat adjusts by the difference
+from that worker's previous one, kept in worker:{id}:status. Workers that
+stop heartbeating are pruned - their share subtracted - by the next
+heartbeat or read, so counts cost one small HGETALL however many workers
+there are.
+"""
+
+# Add a job to the global and per-user pending queues and wake one worker.
+# KEYS[1] = pending queue, KEYS[2] = fair-share set, KEYS[3] = notify list
+# ARGV[1] = job id, ARGV[2] = score, ARGV[3] = user id,
+# ARGV[4] = per-user queue prefix
+ENQUEUE_JOB_SCRIPT = """
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('ZADD', ARGV[4] .. ARGV[3], ARGV[2], ARGV[1])
+if not redis.call('ZSCORE', KEYS[2], ARGV[3]) then
+    local served = redis.call('GET', 'user:' .. ARGV[3] .. ':served') or 0
+    redis.call('ZADD', KEYS[2], served, ARGV[3])
+end
+redis.call('LPUSH', KEYS[3], ARGV[1])
+redis.call('LTRIM', KEYS[3], 0, redis.call('ZCARD', KEYS[1]) - 1)
+return 1
+"""
+
+# Remove a pending job from the global and per-user queues.
+# KEYS[1] = pending queue, KEYS[2] = fair-share set
+# ARGV[1] = job id, ARGV[2] = user id, ARGV[3] = per-user queue prefix
+# Returns 1 if the job was pending.
+DEQUEUE_JOB_SCRIPT = """
+local removed = redis.call('ZREM', KEYS[1], ARGV[1])
+local user_queue = ARGV[3] .. ARGV[2]
+redis.call('ZREM', user_queue, ARGV[1])
+if redis.call('ZCARD', user_queue) == 0 then
+    redis.call('ZREM', KEYS[2], ARGV[2])
+end
+return removed
+"""
+
+# Atomically claim pending jobs for a worker (single round trip).
+# KEYS[1] = pending queue, KEYS[2] = running queue, KEYS[3] = fair-share set,
+# KEYS[4] = job lease set
+# ARGV[1] = selector: 'head' (lowest score), 'fair' (round robin) or 'id'
+# ARGV[2] = job id (selector 'id'), ARGV[3] = status,
+# ARGV[4] = started_at (ISO), ARGV[5] = worker id, ARGV[6] = running score,
+# ARGV[7] = pub/sub channel, ARGV[8] = workflow chunk key prefix,
+# ARGV[9] = per-user queue prefix, ARGV[10] = max jobs,
+# ARGV[11] = VRAM budget in MB (0 = unlimited),
+# ARGV[12] = VRAM assumed for jobs without metadata.estimated_vram,
+# ARGV[13] = lease expiry (unix time, 0 = claim without a lease),
+# ARGV[14] = model set the worker has loaded ('' = none),
+# ARGV[15] = affinity scan depth (0 = off), ARGV[16] = affinity max skips
+# Returns a list of {job_id, job_fields, manifest_json, chunk_values}, empty
+# if nothing was claimed. Jobs stored before deduplication have
+# manifest_json = '' and their whole workflow as the only chunk value.
+#
+# Jobs are taken in selector order while they fit the remaining budget; the
+# first one that does not fit ends the batch (it stays at the head rather than
+# being overtaken by smaller jobs indefinitely). A job needing more than the
+# whole budget can never run on this worker, so it is passed over instead
+# (in round_robin, its user is) and left for a larger GPU: otherwise it
+# would stall every claim behind it.
+#
+# Model affinity ('head' only): among the first ARGV[15] pending jobs of the
+# head's priority, the first whose model set (the runtime_class after its
+# last '|') is the one the worker has loaded is taken instead of the head,
+# saving a checkpoint reload. Every job it overtakes has its affinity_skips
+# counted; a job passed over ARGV[16] times is taken next whatever it loads,
+# so affinity delays a job by at most that many claims.
+#
+# Workflow chunks are passed through untouched (cjson would mangle 64-bit
+# seeds and empty lists); only the manifest, which holds nothing but digests,
+# and the small metadata field are decoded, and only the job:{id} hash is
+# modified.
+CLAIM_JOBS_SCRIPT = """
+local selector = ARGV[1]
+local max_jobs = tonumber(ARGV[10])
+local budget = tonumber(ARGV[11])
+local limited = budget > 0
+local whole_budget = budget
+local loaded = ARGV[14]
+local affinity_depth = tonumber(ARGV[15])
+local max_skips = tonumber(ARGV[16])
+-- Jobs (head) or users (fair) passed over as too large for this worker; they
+-- keep their place, so they are always the first `passed` in the queue
+local passed = 0
+
+local function estimated_vram(job_key)
+    local metadata = redis.call('HGET', job_key, 'metadata')
+    if metadata then
+        local ok, decoded = pcall(cjson.decode, metadata)
+        if ok and type(decoded) == 'table' and tonumber(decoded['estimated_vram']) then
+            return tonumber(decoded['estimated_vram'])
+        end
+    end
+    return tonumber(ARGV[12])
+end
+
+local function too_large(job_key)
+    return limited and estimated_vram(job_key) > whole_budget
+end
+
+-- Head job, or the first job near it using the worker's loaded models;
+-- also returns the jobs that one would overtake
+local function affinity_peek()
+    local head = redis.call('ZRANGE', KEYS[1], passed, passed + affinity_depth - 1)
+    if #head < 2 then
+        return head[1], {}
+    end
+    local band = redis.call('HGET', 'job:' .. head[1], 'priority')
+    for i, job_id in ipairs(head) do
+        local fields = redis.call('HMGET', 'job:' .. job_id, 'runtime_class', 'priority', 'affinity_skips')
+        if fields[2] ~= band or (tonumber(fields[3]) or 0) >= max_skips then
+            break
+        end
+        if fields[1] and string.match(fields[1], '|([^|]*)$') == loaded and not too_large('job:' .. job_id) then
+            return job_id, {unpack(head, 1, i - 1)}
+        end
+    end
+    return head[1], {}
+end
+
+-- Next candidate in selector order, without removing it, and the jobs it
+-- overtakes
+local function peek()
+    if selector == 'head' then
+        if loaded ~= '' and affinity_depth > 1 then
+            return affinity_peek()
+        end
+        return redis.call('ZRANGE', KEYS[1], passed, passed)[1], {}
+    elseif selector == 'fair' then
+        while true do
+            local users = redis.call('ZRANGE', KEYS[3], passed, passed)
+            if #users == 0 then
+                return nil
+            end
+            local user_queue = ARGV[9] .. users[1]
+            local head = redis.call('ZRANGE', user_queue, 0, 0)[1]
+            if not head then
+                redis.call('ZREM', KEYS[3], users[1])
+            elseif redis.call('ZSCORE', KEYS[1], head) then
+                return head, {}
+            else
+                -- stale entry (job no longer pending): drop it, try again
+                redis.call('ZREM', user_queue, head)
+            end
+        end
+    elseif redis.call('ZSCORE', KEYS[1], ARGV[2]) then
+        return ARGV[2], {}
+    end
+    return nil, {}
+end
+
+local claimed = {}
+while #claimed < max_jobs do
+    local job_id, overtaken = peek()
+    if not job_id then
+        break
+    end
+
+    local job_key = 'job:' .. job_id
+    local user_id = redis.call('HGET', job_key, 'user_id')
+    if not user_id then
+        -- orphaned queue entry (job data gone): drop it
+        redis.call('ZREM', KEYS[1], job_id)
+    elseif selector ~= 'id' and too_large(job_key) then
+        passed = passed + 1
+    else
+        if limited then
+            local vram = estimated_vram(job_key)
+            if vram > budget then
+                break
+            end
+            budget = budget - vram
+        end
+        redis.call('ZREM', KEYS[1], job_id)
+        for _, skipped in ipairs(overtaken) do
+            redis.call('HINCRBY', 'job:' .. skipped, 'affinity_skips', 1)
+        end
+
+        -- Keep fair-share bookkeeping in sync whichever way the job was picked
+        local user_queue = ARGV[9] .. user_id
+        redis.call('ZREM', user_queue, job_id)
+        if redis.call('ZCARD', user_queue) == 0 then
+            redis.call('ZREM', KEYS[3], user_id)
+        else
+            redis.call('ZINCRBY', KEYS[3], 1, user_id)
+        end
+        redis.call('INCR', 'user:' .. user_id .. ':served')
+
+        redis.call('HSET', job_key,
+            'status', ARGV[3], 'started_at', ARGV[4], 'worker_id', ARGV[5])
+        redis.call('HINCRBY', job_key, 'attempts', 1)
+        redis.call('ZADD', KEYS[2], ARGV[6], job_id)
+        if tonumber(ARGV[13]) > 0 then
+            redis.call('ZADD', KEYS[4], ARGV[13], job_id)
+        end
+        redis.call('PUBLISH', ARGV[7], cjson.encode({
+            type = 'job_updated',
+            data = {
+                id = job_id, user_id = user_id,
+                status = ARGV[3], started_at = ARGV[4], worker_id = ARGV[5]
+            },
+            timestamp = ARGV[4]
+        }))
+
+        local manifest = redis.call('GET', job_key .. ':manifest')
+        local payload
+        if manifest then
+            local chunk_keys = {}
+            for i, digest in ipairs(cjson.decode(manifest)['chunks']) do
+                chunk_keys[i] = ARGV[8] .. digest
+            end
+            payload = #chunk_keys > 0 and redis.call('MGET', unpack(chunk_keys)) or {}
+        else
+            manifest = ''
+            payload = {redis.call('GET', job_key .. ':workflow') or ''}
+        end
+        claimed[#claimed + 1] = {job_id, redis.call('HGETALL', job_key), manifest, payload}
+    end
+end
+return claimed
+"""
+
+
+# Extend leases still held by the caller.
+# KEYS = lease keys, ARGV[1] = owner, ARGV[2] = TTL in milliseconds
+# Returns the keys that were renewed (the rest were lost)
+RENEW_LEASES_SCRIPT = """
+local held = {}
+for _, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        redis.call('PEXPIRE', key, ARGV[2])
+        held[#held + 1] = key
+    end
+end
+return held
+"""
+
+# Delete a lease if the caller still holds it.
+# KEYS[1] = lease key, ARGV[1] = owner
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Extend a worker's job leases.
+# KEYS[1] = job lease set, ARGV[1] = worker id, ARGV[2] = new expiry,
+# ARGV[3..] = job ids
+# Returns the job ids renewed; the others are no longer this worker's
+# (requeued, dead-lettered, finished or cancelled).
+RENEW_JOB_LEASES_SCRIPT = """
+local renewed = {}
+for i = 3, #ARGV do
+    local job_id = ARGV[i]
+    local job = redis.call('HMGET', 'job:' .. job_id, 'worker_id', 'status')
+    if job[1] == ARGV[1] and job[2] == 'running' and redis.call('ZSCORE', KEYS[1], job_id) then
+        redis.call('ZADD', KEYS[1], 'XX', ARGV[2], job_id)
+        renewed[#renewed + 1] = job_id
+    end
+end
+return renewed
+"""
+
+# Requeue a job whose lease ran out, or dead-letter it after max attempts.
+# KEYS[1] = job lease set, KEYS[2] = running queue, KEYS[3] = pending queue,
+# KEYS[4] = fair-share set, KEYS[5] = notify list, KEYS[6] = failed queue,
+# KEYS[7] = dead-letter queue
+# ARGV[1] = job id, ARGV[2] = now (unix time), ARGV[3] = now (ISO),
+# ARGV[4] = pending score, ARGV[5] = per-user queue prefix,
+# ARGV[6] = max attempts, ARGV[7] = pub/sub channel
+# Returns 'requeued', 'dead_letter', or '' if the lease was renewed or the
+# job is no longer running (its lease is then just dropped).
+EXPIRE_JOB_LEASE_SCRIPT = """
+local job_id = ARGV[1]
+local job_key = 'job:' .. job_id
+local expiry = redis.call('ZSCORE', KEYS[1], job_id)
+if not expiry or tonumber(expiry) > tonumber(ARGV[2]) then
+    return ''
+end
+redis.call('ZREM', KEYS[1], job_id)
+
+local job = redis.call('HMGET', job_key, 'user_id', 'status', 'worker_id', 'attempts')
+local user_id, worker_id = job[1], job[3]
+local attempts = tonumber(job[4]) or 1
+if not user_id or job[2] ~= 'running' then
+    return ''
+end
+redis.call('ZREM', KEYS[2], job_id)
+
+local event = {id = job_id, user_id = user_id, attempts = attempts}
+local outcome
+if attempts < tonumber(ARGV[6]) then
+    redis.call('HSET', job_key, 'status', 'pending')
+    redis.call('HDEL', job_key, 'started_at', 'worker_id')
+    redis.call('ZADD', KEYS[3], ARGV[4], job_id)
+    redis.call('ZADD', ARGV[5] .. user_id, ARGV[4], job_id)
+    if not redis.call('ZSCORE', KEYS[4], user_id) then
+        local served = redis.call('GET', 'user:' .. user_id .. ':served') or 0
+        redis.call('ZADD', KEYS[4], served, user_id)
+    end
+    redis.call('LPUSH', KEYS[5], job_id)
+    redis.call('LTRIM', KEYS[5], 0, redis.call('ZCARD', KEYS[3]) - 1)
+    event.status = 'pending'
+    outcome = 'requeued'
+else
+    local error = 'Worker ' .. (worker_id or '?') .. ' stopped renewing its lease; gave up after ' ..
+        attempts .. ' attempt(s)'
+    redis.call('HSET', job_key, 'status', 'failed', 'completed_at', ARGV[3], 'error', error)
+    redis.call('ZADD', KEYS[6], ARGV[2], job_id)
+    redis.call('ZADD', KEYS[7], ARGV[2], job_id)
+    event.status = 'failed'
+    event.completed_at = ARGV[3]
+    event.error = error
+    outcome = 'dead_letter'
+end
+redis.call('PUBLISH', ARGV[7], cjson.encode({type = 'job_updated', data = event, timestamp = ARGV[3]}))
+return outcome
+"""
+
+# Hand a running job back to the queue unrun, at its old place (a worker
+# that cannot start it, e.g. without the VRAM for it right now). The claim
+# is undone: the attempt it counted is returned. Releases are counted in
+# the job hash instead, and a job released ARGV[8] times (0 = no limit) is
+# failed and dead-lettered rather than offered again forever.
+# KEYS[1] = job lease set, KEYS[2] = running queue, KEYS[3] = pending queue,
+# KEYS[4] = fair-share set, KEYS[5] = notify list, KEYS[6] = failed queue,
+# KEYS[7] = dead-letter queue
+# ARGV[1] = job id, ARGV[2] = worker id, ARGV[3] = now (ISO),
+# ARGV[4] = pending score, ARGV[5] = per-user queue prefix,
+# ARGV[6] = pub/sub channel, ARGV[7] = now (unix time), ARGV[8] = max releases
+# Returns 1 if released, 2 if dead-lettered, 0 if the job does not exist, -1
+# if the worker no longer holds it, -2 if it is not running.
+RELEASE_JOB_SCRIPT = """
+local job_id = ARGV[1]
+local job_key = 'job:' .. job_id
+local job = redis.call('HMGET', job_key, 'user_id', 'status', 'worker_id')
+local user_id = job[1]
+if not user_id then
+    return 0
+end
+if job[3] ~= ARGV[2] then
+    return -1
+end
+if job[2] ~= 'running' then
+    return -2
+end
+redis.call('ZREM', KEYS[1], job_id)
+redis.call('ZREM', KEYS[2], job_id)
+local releases = redis.call('HINCRBY', job_key, 'releases', 1)
+local max_releases = tonumber(ARGV[8])
+if max_releases > 0 and releases >= max_releases then
+    local error = 'Released ' .. releases .. ' time(s) by workers without the VRAM to start it'
+    redis.call('HSET', job_key, 'status', 'failed', 'completed_at', ARGV[3], 'error', error)
+    redis.call('ZADD', KEYS[6], ARGV[7], job_id)
+    redis.call('ZADD', KEYS[7], ARGV[7], job_id)
+    local event = {id = job_id, user_id = user_id, status = 'failed', completed_at = ARGV[3], error = error}
+    redis.call('PUBLISH', ARGV[6], cjson.encode({type = 'job_updated', data = event, timestamp = ARGV[3]}))
+    return 2
+end
+redis.call('HSET', job_key, 'status', 'pending')
+redis.call('HDEL', job_key, 'started_at', 'worker_id')
+if (tonumber(redis.call('HGET', job_key, 'attempts')) or 0) > 0 then
+    redis.call('HINCRBY', job_key, 'attempts', -1)
+end
+redis.call('ZADD', KEYS[3], ARGV[4], job_id)
+redis.call('ZADD', ARGV[5] .. user_id, ARGV[4], job_id)
+if not redis.call('ZSCORE', KEYS[4], user_id) then
+    local served = redis.call('GET', 'user:' .. user_id .. ':served') or 0
+    redis.call('ZADD', KEYS[4], served, user_id)
+end
+redis.call('LPUSH', KEYS[5], job_id)
+redis.call('LTRIM', KEYS[5], 0, redis.call('ZCARD', KEYS[3]) - 1)
+local event = {id = job_id, user_id = user_id, status = 'pending'}
+redis.call('PUBLISH', ARGV[6], cjson.encode({type = 'job_updated', data = event, timestamp = ARGV[3]}))
+return 1
+"""
+
+# Shared by the worker registry scripts: drop workers whose last heartbeat
+# is older than ARGV[1] and subtract their share of the capacity totals.
+# KEYS[1] = active workers, KEYS[2] = capacity totals, KEYS[3] = VRAM
+# capacities (worker -> most VRAM one job can get there, MB),
+# ARGV[2] = status key prefix
+_PRUNE_WORKERS = """
+local CAPACITY_FIELDS = {'busy', 'slots', 'free_slots', 'vram_free_mb'}
+
+local function remove_worker(worker_id)
+    local status_key = ARGV[2] .. worker_id .. ':status'
+    local old = redis.call('HMGET', status_key, unpack(CAPACITY_FIELDS))
+    for i, field in ipairs(CAPACITY_FIELDS) do
+        redis.call('HINCRBY', KEYS[2], field, 0 - (tonumber(old[i]) or 0))
+    end
+    redis.call('HINCRBY', KEYS[2], 'workers', -1)
+    redis.call('ZREM', KEYS[1], worker_id)
+    redis.call('ZREM', KEYS[3], worker_id)
+    redis.call('DEL', status_key)
+end
+
+for _, worker_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])) do
+    remove_worker(worker_id)
+end
+"""
+
+# Record a worker heartbeat.
+# KEYS as _PRUNE_WORKERS; ARGV[1] = prune cutoff, ARGV[2] = status key prefix,
+# ARGV[3] = worker id, ARGV[4] = now (unix time),
+# ARGV[5..8] = busy (0/1), slots, free slots, free VRAM (MB),
+# ARGV[9] = most VRAM one job can get on the worker (MB, 0 = unknown),
+# ARGV[10..] = other status fields as name, value pairs
+WORKER_HEARTBEAT_SCRIPT = _PRUNE_WORKERS + """
+local worker_id = ARGV[3]
+local status_key = ARGV[2] .. worker_id .. ':status'
+if redis.call('ZSCORE', KEYS[1], worker_id) then
+    local old = redis.call('HMGET', status_key, unpack(CAPACITY_FIELDS))
+    for i, field in ipairs(CAPACITY_FIELDS) do
+        redis.call('HINCRBY', KEYS[2], field, tonumber(ARGV[4 + i]) - (tonumber(old[i]) or 0))
+    end
+else
+    redis.call('HINCRBY', KEYS[2], 'workers', 1)
+    for i, field in ipairs(CAPACITY_FIELDS) do
+        redis.call('HINCRBY', KEYS[2], field, ARGV[4 + i])
+    end
+end
+redis.call('ZADD', KEYS[1], ARGV[4], worker_id)
+if tonumber(ARGV[9]) > 0 then
+    redis.call('ZADD', KEYS[3], ARGV[9], worker_id)
+else
+    redis.call('ZREM', KEYS[3], worker_id)
+end
+redis.call('DEL', status_key)
+local fields = {}
+for i, field in ipairs(CAPACITY_FIELDS) do
+    fields[#fields + 1] = field
+    fields[#fields + 1] = ARGV[4 + i]
+end
+for i = 10, #ARGV do
+    fields[#fields + 1] = ARGV[i]
+end
+redis.call('HSET', status_key, unpack(fields))
+return 1
+"""
+
+# Remove a worker that is shutting down.
+# KEYS as _PRUNE_WORKERS; ARGV[1] = prune cutoff, ARGV[2] = status key prefix,
+# ARGV[3] = worker id
+REMOVE_WORKER_SCRIPT = _PRUNE_WORKERS + """
+if redis.call('ZSCORE', KEYS[1], ARGV[3]) then
+    remove_worker(ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# Capacity totals of the live workers, and the largest VRAM capacity among
+# them as vram_capacity_mb (0 if none reported one).
+# KEYS as _PRUNE_WORKERS; ARGV[1] = prune cutoff, ARGV[2] = status key prefix
+WORKER_CAPACITY_SCRIPT = _PRUNE_WORKERS + """
+local totals = redis.call('HGETALL', KEYS[2])
+local largest = redis.call('ZRANGE', KEYS[3], -1, -1, 'WITHSCORES')
+totals[#totals + 1] = 'vram_capacity_mb'
+totals[#totals + 1] = largest[2] or 0
+return totals
+"""
+
+# Work queued ahead of pending jobs, for wait estimates.
+# KEYS[1] = pending queue, KEYS[2] = running queue
+# ARGV[1] = queue positions to scan, ARGV[2] = runtime assumed for jobs
+# without predicted_runtime, ARGV[3] = now (unix time)
+# Returns {remaining work of running jobs, then prefix sums: the predicted
+# runtime of the jobs ahead of position 0, 1, ... ARGV[1]} as strings (Lua
+# numbers would be truncated to integers).
+QUEUE_WORK_AHEAD_SCRIPT = """
+local default = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+
+local function predicted(job_id)
+    return tonumber(redis.call('HGET', 'job:' .. job_id, 'predicted_runtime')) or default
+end
+
+local running = 0
+local started = redis.call('ZRANGE', KEYS[2], 0, 999, 'WITHSCORES')
+for i = 1, #started, 2 do
+    running = running + math.max(predicted(started[i]) - (now - tonumber(started[i + 1])), 0)
+end
+
+local result = {tostring(running)}
+local total = 0
+for _, job_id in ipairs(redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)) do
+    table.insert(result, tostring(total))
+    total = total + predicted(job_id)
+end
+table.insert(result, tostring(total))
+return result
+"""
@@ -0,0 +1,187 @@
+"""
+Runtime statistics and predictions for queued jobs
+
+Every completed job's execution time (the worker's result.execution_time,
+else completed_at - started_at) is folded into rolling statistics kept per
+runtime class, so wait estimates and the shortest_expected queue mode can
+use what jobs like this one actually took rather than one global guess.
+
+A job's runtime class is "<template>|<models>", derived at submission:
+- template: metadata.template if the client names one, otherwise a digest of
+  the workflow's node types (API or UI format), so every submission of the
+  same template lands in one class whatever its prompt text or seed
+- models: the model files the workflow loads (checkpoints, UNets, LoRAs,
+  ...), so the 4B and 9B variants of a template are told apart
+
+Statistics are recorded at five levels - the job's workflow signature
+(class plus output shape, see vram_profiles), the class, its template, its
+models, and all jobs - and a prediction uses the most specific level with
+runtime_min_samples samples, so a new template still gets the timing of
+other jobs on the same model. Each level is an exponentially weighted mean
+and variance (weight runtime_stats_alpha, plain averaging for the first
+samples) in the runtime:stats hash, updated by one Lua call per completion:
+recent jobs count most, so the numbers follow a GPU or model change.
+"""
+import hashlib
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+from config import settings
+from models import QueueMode
+
+logger = logging.getLogger(__name__)
+
+ALL_JOBS = "all"
+
+# A widget or input value naming a model file ("flux-2-klein-4b.safetensors")
+MODEL_FILE = re.compile(r"^[\w.\-/\\]+\.(safetensors|sft|ckpt|pt|pth|bin|gguf)$", re.IGNORECASE)
+
+# Fold one runtime sample into the statistics of each level.
+# KEYS[1] = stats hash, ARGV[1] = seconds, ARGV[2] = alpha, ARGV[3..] = levels
+# Mirrors ewma_update() below.
+RECORD_RUNTIME_SCRIPT = """
+local x = tonumber(ARGV[1])
+for i = 3, #ARGV do
+    local raw = redis.call('HGET', KEYS[1], ARGV[i])
+    local s = raw and cjson.decode(raw) or {n = 0, mean = 0, var = 0}
+    local alpha = math.max(1 / (s.n + 1), tonumber(ARGV[2]))
+    local delta = x - s.mean
+    s.mean = s.mean + alpha * delta
+    s.var = (1 - alpha) * (s.var + alpha * delta * delta)
+    s.n = s.n + 1
+    redis.call('HSET', KEYS[1], ARGV[i], cjson.encode(s))
+end
+return #ARGV - 2
+"""
+
+
+def _node_types_and_values(workflow: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    """Node types and input/widget values of an API- or UI-format workflow"""
+    types: List[str] = []
+    values: List[Any] = []
+    if isinstance(workflow.get("nodes"), list):
+        nodes = list(workflow["nodes"])
+        definitions = workflow.get("definitions")
+        if isinstance(definitions, dict):
+            for subgraph in definitions.get("subgraphs") or []:
+                nodes.extend(subgraph.get("nodes") or [])
+        for node in nodes:
+            if isinstance(node, dict):
+                types.append(str(node.get("type")))
+                values.extend(node.get("widgets_values") or [])
+    else:
+        for node in workflow.values():
+            if isinstance(node, dict) and "class_type" in node:
+                types.append(str(node["class_type"]))
+                values.extend((node.get("inputs") or {}).values())
+    return types, values
+
+
+def runtime_class(workflow: Optional[Dict[str, Any]], metadata: Optional[Dict[str, Any]] = None) -> str:
+    """The "<template>|<models>" class a job's runtime is predicted and recorded under"""
+    types, values = _node_types_and_values(workflow or {})
+    template = (metadata or {}).get("template")
+    if not isinstance(template, str) or not template:
+        template = hashlib.sha1(",".join(sorted(set(types))).encode()).hexdigest()[:12]
+    models = ",".join(sorted({v.replace("\\", "/").rsplit("/", 1)[-1] for v in values
+                              if isinstance(v, str) and MODEL_FILE.match(v)}))
+    if len(models) > 200:
+        models = hashlib.sha1(models.encode()).hexdigest()[:12]
+    return f"{template[:100]}|{models or '-'}"
+
+
+def model_set(job_class: Optional[str]) -> str:
+    """The models part of a runtime class ("-" for none), as workers advertise it for affinity"""
+    return (job_class or "").rpartition("|")[2] or "-"
+
+
+def runtime_levels(job_class: str, signature: Optional[str] = None) -> List[str]:
+    """Statistics levels for a class (and workflow signature), most specific first"""
+    template, _, models = job_class.partition("|")
+    levels = [f"class:{job_class}", f"template:{template}", f"model:{models}", ALL_JOBS]
+    return [f"signature:{signature}"] + levels if signature else levels
+
+
+def ewma_update(stats: Optional[Dict[str, float]], seconds: float, alpha: float) -> Dict[str, float]:
+    """Fold a sample into {n, mean, var} (as RECORD_RUNTIME_SCRIPT does)"""
+    stats = dict(stats or {"n": 0, "mean": 0.0, "var": 0.0})
+    weight = max(1 / (stats["n"] + 1), alpha)
+    delta = seconds - stats["mean"]
+    stats["mean"] += weight * delta
+    stats["var"] = (1 - weight) * (stats["var"] + weight * delta * delta)
+    stats["n"] += 1
+    return stats
+
+
+def pick_prediction(levels: List[Optional[Dict[str, float]]], min_samples: int, default: float) -> float:
+    """Mean of the most specific level with min_samples samples (else any samples, else default)"""
+    known = [stats for stats in levels if stats and stats.get("n")]
+    for stats in known:
+        if stats["n"] >= min_samples:
+            return stats["mean"]
+    return known[0]["mean"] if known else default
+
+
+def queue_score(priority: int, created_at: float, predicted_runtime: Optional[float], mode: str) -> float:
+    """
+    Pending-queue score (lower = sooner). Priority level first, then
+    submission time; in shortest_expected mode each second of predicted
+    runtime also counts as shortest_expected_weight seconds of lateness.
+    That static offset is the aging: a newer job only overtakes a longer
+    one while the older job has waited less than weight x the difference
+    in their runtimes, so a long video job is delayed by at most
+    weight x its own runtime however many short jobs keep arriving.
+    """
+    score = priority * 1000000 + created_at
+    if mode == QueueMode.SHORTEST_EXPECTED and predicted_runtime:
+        score += settings.shortest_expected_weight * predicted_runtime
+    return score
+
+
+class RuntimeStats:
+    """Rolling runtime statistics per runtime class, in one Redis hash"""
+
+    STATS_KEY = "runtime:stats"
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._record = redis.register_script(RECORD_RUNTIME_SCRIPT)
+
+    async def predict(self, job_class: str, signature: Optional[str] = None) -> float:
+        """Expected runtime in seconds (average_job_duration until anything is known)"""
+        return self.prediction(await self.redis.hmget(self.STATS_KEY, runtime_levels(job_class, signature)))
+
+    def queue_predict(self, pipe: Pipeline, job_class: str, signature: Optional[str] = None) -> None:
+        """Queue predict()'s read on a pipeline; its result goes to prediction()"""
+        pipe.hmget(self.STATS_KEY, runtime_levels(job_class, signature))
+
+    @staticmethod
+    def prediction(raw: List[Optional[str]]) -> float:
+        """predict() from the raw statistics of each level"""
+        levels = [json.loads(value) if value else None for value in raw]
+        return pick_prediction(levels, settings.runtime_min_samples, float(settings.average_job_duration))
+
+    async def record(self, job_class: str, seconds: float, signature: Optional[str] = None) -> None:
+        """Fold one completed job's execution time into its class's statistics"""
+        await self._record(
+            keys=[self.STATS_KEY],
+            args=[seconds, settings.runtime_stats_alpha, *runtime_levels(job_class, signature)]
+        )
+
+    async def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Every level's statistics: {level: {n, mean, stddev}}"""
+        raw = await self.redis.hgetall(self.STATS_KEY)
+        snapshot = {}
+        for level, value in sorted(raw.items()):
+            stats = json.loads(value)
+            snapshot[level] = {
+                "n": stats["n"],
+                "mean": round(stats["mean"], 2),
+                "stddev": round(max(stats["var"], 0) ** 0.5, 2),
+            }
+        return snapshot
@@ -0,0 +1,503 @@
+"""
+Background execution of serverless jobs
+
+In serverless mode POST /api/jobs stores the job in Redis (status running,
+worker "serverless") and answers 202 straight away; a ServerlessRunner task
+then submits the workflow, polls /history until the execution finishes,
+saves the output images and moves the job to completed or failed. Clients
+follow the job through GET /api/jobs/{id} or the /ws job_updated events.
+
+Prompts are queued with the client_id of a ComfyUIEventStream, so a job
+whose execution events reach us wakes as soon as ComfyUI reports it done
+rather than on its next /history poll; /history remains the fallback (and
+the only source while the socket is down or lands on another container).
+
+Each job is one coroutine, so hundreds of generations in flight cost a few
+KB each rather than a pinned request, socket and proxy thread. A semaphore
+bounds how many talk to the serverless endpoint at once. The serverless
+prompt_id is saved on the job as soon as it is known, so jobs still running
+when the queue manager restarts are picked up again by resume().
+
+With several queue manager replicas each job is driven by exactly one of
+them: a task first takes the job's SERVERLESS_LEASE (and only then runs),
+the runner renews the leases of its jobs every serverless_lease_ttl/3, and
+every replica periodically resume()s running serverless jobs nobody holds a
+lease on - so a job whose replica died or was redeployed is adopted by
+another within about one TTL and carries on from its saved prompt_id.
+Adopted jobs were queued with the other replica's event client_id and are
+tracked by /history polling alone.
+
+Cancelling a running job (DELETE /api/jobs/{id}) deletes its lease. The
+replica that took the request cancels the task straight away if it is the
+one driving it; otherwise the owner finds the lease gone on its next
+renewal. Either way the prompt is removed from the endpoint's queue, or
+interrupted if it is already executing, so no GPU time is spent on it.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+import httpx
+
+from comfyui_events import ComfyUIEventStream, FINISHED
+from config import settings
+from models import Job, JobStatus
+from output_transfer import REFERENCE, transfer_file
+from redis_client import RedisClient, JobNotRunningError
+
+logger = logging.getLogger(__name__)
+
+SERVERLESS_WORKER_ID = "serverless"
+PROMPT_ID_KEY = "serverless_prompt_id"  # job.metadata field
+EMPTY_HISTORY_BAIL = 120  # seconds of 200s without the prompt before assuming misrouting
+DOWNLOAD_CHUNK = 1024 * 1024  # bytes read from /view and written per step
+
+
+def lease_key(job_id: str) -> str:
+    return RedisClient.SERVERLESS_LEASE.format(job_id=job_id)
+
+
+class ServerlessError(Exception):
+    """Serverless execution could not be completed"""
+
+
+class ServerlessRunner:
+    """Drives serverless jobs to completion in background tasks"""
+
+    def __init__(self, redis_client: RedisClient, client: httpx.AsyncClient, owner: str):
+        self.redis_client = redis_client
+        self.client = client
+        self.owner = owner  # instance id written into the job leases
+        self.slots = asyncio.Semaphore(settings.serverless_max_concurrent)
+        self.downloads = asyncio.Semaphore(settings.serverless_download_concurrency)
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.leased: Set[str] = set()  # job ids whose lease we hold
+        self.cancelled: Set[str] = set()  # job ids whose task is being cancelled for the user
+        self.lease_task = asyncio.create_task(self._keep_leases(), name="serverless-leases")
+        self.events: Optional[ComfyUIEventStream] = None
+        if settings.serverless_events:
+            self.events = ComfyUIEventStream(str(client.base_url), dict(client.headers))
+            if not self.events.start():
+                self.events = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.tasks)
+
+    def start(self, job: Job) -> None:
+        """Run a stored serverless job in the background"""
+        if job.id in self.tasks:
+            return
+        task = asyncio.create_task(self._run(job), name=f"serverless-{job.id}")
+        self.tasks[job.id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job.id, None))
+
+    async def resume(self) -> int:
+        """Pick up running serverless jobs no replica holds a lease on (left by a dead or previous process)"""
+        running = await self.redis_client.get_running_jobs(SERVERLESS_WORKER_ID)
+        keys = [lease_key(job.id) for job in running if job.id not in self.tasks]
+        orphaned = [key.rsplit(":", 1)[1] for key in await self.redis_client.unleased(keys)]
+        resumed = 0
+        for job_id in orphaned:
+            job = await self.redis_client.get_job(job_id, with_workflow=True, with_result=False)
+            if job and job.status == JobStatus.RUNNING:
+                self.start(job)
+                resumed += 1
+        if resumed:
+            logger.info(f"Resumed {resumed} in-flight serverless job(s)")
+        return resumed
+
+    def cancel(self, job_id: str) -> bool:
+        """Abandon a job its user cancelled, interrupting its prompt; False if another replica drives it"""
+        task = self.tasks.get(job_id)
+        if not task:
+            return False
+        self.cancelled.add(job_id)
+        task.cancel()
+        return True
+
+    async def stop(self) -> None:
+        """Cancel background tasks and release their leases; the jobs stay running in Redis for resume()"""
+        tasks: Set[asyncio.Task] = set(self.tasks.values()) | {self.lease_task}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.events:
+            await self.events.stop()
+
+    async def _keep_leases(self) -> None:
+        """Renew our job leases every ttl/3, drop jobs whose lease was lost and adopt orphans every ttl"""
+        ttl = settings.serverless_lease_ttl
+        rounds = 0
+        while True:
+            await asyncio.sleep(ttl / 3)
+            try:
+                owned = list(self.leased)
+                held = await self.redis_client.renew_leases([lease_key(job_id) for job_id in owned], self.owner, ttl)
+                if held is not None:
+                    lost = list(set(owned) - {key.rsplit(":", 1)[1] for key in held})
+                    statuses = await self.redis_client.get_job_statuses(lost) if lost else {}
+                    for job_id in lost:
+                        self.leased.discard(job_id)
+                        if statuses.get(job_id) == JobStatus.CANCELLED.value:
+                            logger.info(f"Serverless job {job_id} was cancelled")
+                            self.cancel(job_id)
+                            continue
+                        # Stalled past the TTL and another replica adopted it
+                        logger.warning(f"Lost lease on serverless job {job_id}; leaving it to its new owner")
+                        task = self.tasks.get(job_id)
+                        if task:
+                            task.cancel()
+
+                rounds += 1
+                if rounds % 3 == 0:
+                    await self.resume()
+            except Exception as e:
+                logger.error(f"Serverless lease maintenance error: {e}")
+
+    async def _run(self, job: Job) -> None:
+        # Whoever takes the lease first drives the job; re-check the status
+        # afterwards in case it finished while we were deciding to adopt it
+        key = lease_key(job.id)
+        if not await self.redis_client.acquire_lease(key, self.owner, settings.serverless_lease_ttl):
+            return
+        current = await self.redis_client.get_job(job.id, with_result=False)
+        if not current or current.status != JobStatus.RUNNING:
+            await self.redis_client.release_lease(key, self.owner)
+            return
+        self.leased.add(job.id)
+
+        async with self.slots:
+            prompt_id = None
+            try:
+                prompt_id = job.metadata.get(PROMPT_ID_KEY)
+                if not prompt_id:
+                    prompt_id = await self.submit(job)
+
+                history_entry = await self.poll_history(prompt_id)
+
+                status = history_entry.get("status", {})
+                if status.get("status_str") != "success":
+                    messages = status.get("messages", [])
+                    logger.error(f"Execution failed: {messages}")
+                    await self.finish(
+                        job.id, error=f"Serverless execution failed: {json.dumps(messages, default=str)[:1000]}"
+                    )
+                    return
+
+                logger.info(f"Execution completed successfully: {prompt_id}")
+
+                # Fetch and save output images (SFS first, HTTP fallback)
+                saved_outputs = await self.fetch_images(history_entry, job.user_id)
+                result = {"prompt_id": prompt_id}
+                if saved_outputs:
+                    logger.info(f"Saved outputs for {len(saved_outputs)} node(s)")
+                    result["outputs"] = saved_outputs
+                    result["execution_status"] = "success"
+                else:
+                    logger.warning(f"No images saved for {prompt_id}")
+                    result["outputs"] = history_entry.get("outputs", {})
+
+                await self.finish(job.id, result=result)
+
+            except asyncio.CancelledError:
+                if job.id in self.cancelled and prompt_id:
+                    await self.interrupt(prompt_id)
+                raise
+            except httpx.HTTPStatusError as e:
+                logger.error(f"Serverless response body: {e.response.text[:500]}")
+                await self.finish(job.id, error=f"Serverless error: {e}")
+            except httpx.TimeoutException:
+                await self.finish(job.id, error="Serverless inference timed out")
+            except ServerlessError as e:
+                await self.finish(job.id, error=str(e))
+            except Exception as e:
+                logger.error(f"Serverless job {job.id} failed: {e}", exc_info=True)
+                await self.finish(job.id, error=f"Serverless error: {e}")
+            finally:
+                if self.events and prompt_id:
+                    self.events.forget(prompt_id)
+                self.cancelled.discard(job.id)
+                if job.id in self.leased:
+                    self.leased.discard(job.id)
+                    await self.redis_client.release_lease(key, self.owner)
+
+    async def finish(self, job_id: str, result: Optional[dict] = None, error: Optional[str] = None) -> None:
+        """Move the job to completed (or failed, given an error) unless it was cancelled meanwhile"""
+        try:
+            if error is None:
+                await self.redis_client.move_job_to_completed(job_id, result)
+            else:
+                await self.redis_client.move_job_to_failed(job_id, error)
+        except JobNotRunningError as e:
+            logger.info(f"Serverless result for job {job_id} discarded: {e}")
+
+    async def interrupt(self, prompt_id: str) -> None:
+        """
+        Stop a prompt on the serverless endpoint: drop it from the queue, or
+        interrupt it if it is the one executing. /interrupt is only sent
+        then, since older ComfyUI ignores its prompt_id and would stop
+        whichever prompt is running.
+        """
+        try:
+            await self.client.post("/queue", json={"delete": [prompt_id]}, timeout=httpx.Timeout(10.0))
+            response = await self.client.get("/queue", timeout=httpx.Timeout(10.0))
+            response.raise_for_status()
+            if any(len(item) > 1 and item[1] == prompt_id for item in response.json().get("queue_running", [])):
+                await self.client.post("/interrupt", json={"prompt_id": prompt_id}, timeout=httpx.Timeout(10.0))
+            logger.info(f"Cancelled serverless prompt {prompt_id}")
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning(f"Could not cancel serverless prompt {prompt_id}: {e}")
+
+    async def submit(self, job: Job) -> str:
+        """POST the workflow to serverless ComfyUI and record its prompt_id on the job"""
+        logger.info(f"Sending to serverless: {len(job.workflow)} nodes")
+        response = await self.client.post(
+            "/prompt",
+            json={"prompt": job.workflow, "client_id": self.events.client_id if self.events else job.user_id}
+        )
+        response.raise_for_status()
+        result = response.json()
+        prompt_id = result.get("prompt_id")
+        if not prompt_id:
+            raise ServerlessError(f"No prompt_id in serverless response: {json.dumps(result)[:500]}")
+
+        logger.info(f"Serverless prompt accepted: {prompt_id} (job {job.id})")
+        job.metadata[PROMPT_ID_KEY] = prompt_id
+        await self.redis_client.update_job_metadata(job.id, job.metadata)
+        return prompt_id
+
+    async def poll_history(self, prompt_id: str) -> dict:
+        """Poll serverless /api/history/{prompt_id} until execution completes.
+
+        Serverless cold start + model loading can block HTTP for 200+ seconds.
+        With 10s per-poll timeout, we fail fast and retry often.
+        SERVERLESS_MAX_WAIT (600s) covers worst case: cold start + model load + inference.
+
+        Early bail: if the server is responding (HTTP 200) but prompt_id never
+        appears in history after 120s, it's likely a load balancer routing issue
+        (GETs hitting a different container than the POST). Bail early instead
+        of waiting the full 600s. Execution events for the prompt prove it is
+        running where we can see it, so they suspend the bail.
+
+        Between polls the job waits on the event stream (see next_poll), so
+        completion is usually noticed within milliseconds, not poll_interval.
+        """
+        max_wait = settings.serverless_max_wait
+        poll_interval = settings.serverless_poll_interval
+        start_time = time.monotonic()
+        poll_count = 0
+        empty_200_count = 0  # HTTP 200 responses where prompt_id not in history
+        empty_since = None  # first of those responses
+
+        while (time.monotonic() - start_time) < max_wait:
+            poll_count += 1
+            elapsed = time.monotonic() - start_time
+            try:
+                # 10s timeout: fail fast when server is blocked by model loading
+                response = await self.client.get(
+                    f"/history/{prompt_id}",
+                    timeout=httpx.Timeout(10.0),
+                )
+                if response.status_code == 200:
+                    history = response.json()
+                    if prompt_id in history:
+                        # Found — reset empty counter, process result
+                        empty_200_count = 0
+                        empty_since = None
+                        entry = history[prompt_id]
+                        status = entry.get("status", {})
+                        completed = status.get("completed", False)
+                        status_str = status.get("status_str", "unknown")
+
+                        # Always log when found in history (important for debugging)
+                        if poll_count <= 5 or poll_count % 15 == 0 or completed:
+                            outputs = entry.get("outputs", {})
+                            output_summary = {
+                                nid: list(nout.keys()) for nid, nout in outputs.items()
+                            }
+                            logger.info(
+                                f"History poll #{poll_count} ({elapsed:.0f}s): "
+                                f"completed={completed}, status={status_str}, "
+                                f"outputs={output_summary}"
+                            )
+                        elif poll_count % 10 == 0:
+                            logger.info(f"History poll #{poll_count} ({elapsed:.0f}s): completed={completed}, status={status_str}")
+
+                        if status_str == "error":
+                            messages = status.get("messages", [])
+                            logger.error(
+                                f"Serverless execution FAILED for {prompt_id} after {elapsed:.0f}s ({poll_count} polls): "
+                                f"status={json.dumps(status, default=str)[:1000]}"
+                            )
+                            for msg in messages:
+                                logger.error(f"  Error message: {json.dumps(msg, default=str)[:500]}")
+                            return entry
+
+                        if completed:
+                            logger.info(f"Execution completed after {elapsed:.0f}s ({poll_count} polls)")
+                            return entry
+                    else:
+                        empty_200_count += 1
+                        if poll_count <= 3 or poll_count % 30 == 0:
+                            logger.info(f"History poll #{poll_count} ({elapsed:.0f}s): prompt_id not in history. Keys: {list(history.keys())[:5]}")
+
+                        # Early bail: server is responding but prompt never appeared
+                        if empty_since is None:
+                            empty_since = time.monotonic()
+                        seen = self.events and self.events.state(prompt_id)
+                        if not seen and time.monotonic() - empty_since >= EMPTY_HISTORY_BAIL:
+                            logger.error(
+                                f"Early bail: {empty_200_count} consecutive HTTP 200 responses with empty history "
+                                f"after {elapsed:.0f}s ({poll_count} polls). "
+                                f"Likely load balancer routing issue — GET /history hitting different container than POST /prompt."
+                            )
+                            raise ServerlessError(
+                                f"Serverless routing error: prompt accepted but never appeared in history after {elapsed:.0f}s. "
+                                f"Load balancer may be routing requests to different container instances."
+                            )
+                else:
+                    logger.warning(f"History poll #{poll_count} ({elapsed:.0f}s): HTTP {response.status_code}")
+            except httpx.TimeoutException:
+                # Only log periodically — timeout is expected during model loading
+                if poll_count <= 2 or poll_count % 10 == 0:
+                    logger.info(f"History poll #{poll_count} ({elapsed:.0f}s): timeout (server busy, likely loading model)")
+            except ServerlessError:
+                raise  # Re-raise early bail
+            except Exception as e:
+                logger.warning(f"History poll #{poll_count} ({elapsed:.0f}s): error: {type(e).__name__}: {e}")
+
+            await self.next_poll(prompt_id, poll_interval)
+
+        raise ServerlessError(f"Serverless execution timed out after {max_wait}s ({poll_count} polls)")
+
+    async def next_poll(self, prompt_id: str, poll_interval: float) -> None:
+        """Wait before the next /history read.
+
+        Once events for the prompt have been seen, wait for its finish event
+        (re-reading /history every serverless_history_safety_interval in
+        case one is lost). Until then, and without a stream, poll_interval
+        as before - cut short if the finish event arrives meanwhile.
+        """
+        state = self.events.state(prompt_id) if self.events and self.events.connected else None
+        if state and state["status"] in FINISHED:
+            await asyncio.sleep(0.2)  # Finished, history not readable yet
+        elif self.events and self.events.connected:
+            timeout = settings.serverless_history_safety_interval if state else poll_interval
+            await self.events.wait(prompt_id, timeout)
+        else:
+            await asyncio.sleep(poll_interval)
+
+    async def fetch_images(self, history_entry: dict, user_id: str) -> dict:
+        """Get output images from serverless execution and save to local outputs.
+
+        Strategy: SFS first (shared storage), HTTP fallback (serverless /view API).
+        The serverless container saves images to /mnt/sfs/outputs/ via a startup
+        wrapper script. The QM reads them directly from SFS (same NFS mount) and
+        links or copies them in a thread (see output_transfer), or with
+        SERVERLESS_OUTPUT_TRANSFER=reference only records where they are (for
+        API clients reading SFS directly: /view serves OUTPUTS_PATH only).
+        If SFS isn't available, falls back to HTTP download via /view endpoint.
+
+        Outputs are fetched concurrently, at most serverless_download_concurrency
+        at a time across all jobs.
+
+        Returns ComfyUI-compatible output metadata: {node_id: {images: [...]}}
+        """
+        outputs = history_entry.get("outputs", {})
+
+        if not outputs:
+            logger.warning(f"History entry has no outputs. Top-level keys: {list(history_entry.keys())}")
+            return {}
+
+        # Prepare local output directory for this user
+        local_output_dir = Path(settings.outputs_path) / user_id
+        await asyncio.to_thread(local_output_dir.mkdir, parents=True, exist_ok=True)
+
+        wanted = []
+        for node_id, node_output in outputs.items():
+            img_list = node_output.get("images", [])
+            logger.info(f"Output node {node_id}: {len(img_list)} image(s), keys={list(node_output.keys())}")
+            wanted.extend((node_id, img_info) for img_info in img_list if img_info.get("filename"))
+
+        entries = await asyncio.gather(
+            *(self._fetch_output(img_info, local_output_dir, user_id) for _, img_info in wanted)
+        )
+
+        saved_outputs = {}
+        for (node_id, _), entry in zip(wanted, entries):
+            if entry:
+                saved_outputs.setdefault(node_id, {"images": []})["images"].append(entry)
+        return saved_outputs
+
+    async def _fetch_output(self, img_info: dict, local_output_dir: Path, user_id: str) -> Optional[dict]:
+        """Save one output (SFS, else /view) and return its output entry, None if both failed"""
+        filename = img_info["filename"]
+        subfolder = img_info.get("subfolder", "")
+        dest = local_output_dir / filename
+        sfs_output_dir = Path(settings.serverless_sfs_outputs_path)
+
+        async with self.downloads:
+            # Strategy 1: Read from SFS (shared NFS between serverless + app server)
+            sfs_path = sfs_output_dir / subfolder / filename if subfolder else sfs_output_dir / filename
+            try:
+                method = await asyncio.to_thread(transfer_file, sfs_path, dest, settings.serverless_output_transfer)
+            except OSError as e:
+                logger.warning(f"SFS transfer failed for {sfs_path}: {e}")
+                method = None
+            if method == REFERENCE:
+                logger.info(f"SFS image: {sfs_path} (referenced in place)")
+                return {
+                    "filename": filename, "subfolder": subfolder, "type": "output",
+                    "storage": "sfs", "path": str(sfs_path),
+                }
+            if method:
+                logger.info(f"SFS image: {sfs_path} -> {dest} ({method})")
+                return {"filename": filename, "subfolder": user_id, "type": "output"}
+
+            # Strategy 2: HTTP download from serverless /view API (fallback)
+            params = {"filename": filename, "type": img_info.get("type", "output")}
+            if subfolder:
+                params["subfolder"] = subfolder
+            try:
+                size = await self._download(params, dest)
+            except Exception as e:
+                logger.warning(f"HTTP download failed for {filename}: {e}")
+                size = None
+            if size is not None:
+                logger.info(f"HTTP image: {filename} ({size} bytes)")
+                return {"filename": filename, "subfolder": user_id, "type": "output"}
+
+        logger.error(f"Failed to retrieve image {filename} via both SFS and HTTP")
+        return None
+
+    async def _download(self, params: dict, dest: Path) -> Optional[int]:
+        """
+        Stream /view into dest chunk by chunk (a temporary file renamed into
+        place when complete), so memory use does not grow with the output.
+        Returns the size, None if /view did not answer 200.
+        """
+        async with self.client.stream("GET", "/view", params=params, timeout=httpx.Timeout(30.0)) as response:
+            if response.status_code != 200:
+                logger.warning(f"HTTP /view failed for {params['filename']}: HTTP {response.status_code}")
+                return None
+            tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex[:8]}.part")
+            f = await asyncio.to_thread(open, tmp, "wb")
+            try:
+                size = 0
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK):
+                    await asyncio.to_thread(f.write, chunk)
+                    size += len(chunk)
+                await asyncio.to_thread(f.close)
+                await asyncio.to_thread(os.replace, tmp, dest)
+                return size
+            finally:
+                if not f.closed:
+                    await asyncio.to_thread(f.close)
+                await asyncio.to_thread(tmp.unlink, missing_ok=True)
+
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Tests for the asyncio ComfyUI event stream and the serverless completion
+path built on it (ServerlessRunner.poll_history / next_poll).
+
+Runs a fake ComfyUI /ws (websockets server) that the test scripts event by
+event, and a fake /history behind httpx.MockTransport. No Redis needed.
+
+Tests cover:
+- Prompt states from the event sequence: done, execution error (with the
+  node and exception in the message), interrupted
+- wait() returns as soon as the prompt finishes, or as soon as the stream
+  disconnects; without a connection it does not block
+- Finished prompts are pruned oldest first past MAX_TRACKED_PROMPTS
+- poll_history wakes on the finish event instead of the poll interval
+- With the stream gone, poll_history falls back to /history polling
+- An error reported by /history is returned as the job's history entry
+
+Run with: python3 -m pytest test_comfyui_events.py -v
+"""
+
+import asyncio
+import json
+import os
+import time
+
+import httpx
+import pytest
+
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+import comfyui_events  # noqa: E402
+from comfyui_events import ComfyUIEventStream, DONE, ERROR, INTERRUPTED, RUNNING  # noqa: E402
+from config import settings  # noqa: E402
+from serverless_runner import ServerlessRunner  # noqa: E402
+
+websockets_server = pytest.importorskip("websockets.asyncio.server")
+
+CLOSE = object()  # queued to make the fake drop the connection
+
+
+class FakeComfyUIWS:
+    """A /ws endpoint that sends whatever the test queues, to every connection"""
+
+    def __init__(self):
+        self.outbox: asyncio.Queue = asyncio.Queue()
+        self.connections = 0
+        self.server = None
+
+    async def handler(self, connection):
+        self.connections += 1
+        while True:
+            message = await self.outbox.get()
+            if message is CLOSE:
+                await connection.close()
+                return
+            await connection.send(json.dumps(message))
+
+    async def __aenter__(self):
+        self.server = await websockets_server.serve(self.handler, "127.0.0.1", 0)
+        self.url = f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+        return self
+
+    async def __aexit__(self, *exc):
+        if self.server is None:
+            return
+        for _ in range(self.connections):
+            self.outbox.put_nowait(CLOSE)  # handlers are parked on the outbox
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = None
+
+    def send(self, kind: str, **data):
+        self.outbox.put_nowait({"type": kind, "data": data})
+
+
+async def connected_stream(fake: FakeComfyUIWS) -> ComfyUIEventStream:
+    stream = ComfyUIEventStream(fake.url)
+    assert stream.start()
+    for _ in range(100):
+        if stream.connected:
+            return stream
+        await asyncio.sleep(0.02)
+    raise AssertionError("event stream never connected")
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 20))
+
+
+def test_prompt_done():
+    async def scenario():
+        async with FakeComfyUIWS() as fake:
+            stream = await connected_stream(fake)
+            fake.send("execution_start", prompt_id="p1")
+            fake.send("executing", prompt_id="p1", node="3")
+            fake.send("progress", prompt_id="p1", node="3", value=5, max=20)
+            fake.send("executed", prompt_id="p1", node="9", output={"images": [{"filename": "a.png"}]})
+            await asyncio.sleep(0.2)
+            running = stream.state("p1")
+            assert running["status"] == RUNNING
+            assert running["progress"] == (5, 20)
+
+            fake.send("executing", prompt_id="p1", node=None)
+            start = time.monotonic()
+            state = await stream.wait("p1", 5)
+            assert time.monotonic() - start < 2
+            assert state["status"] == DONE
+            assert state["outputs"] == {"9": {"images": [{"filename": "a.png"}]}}
+            await stream.stop()
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("events, status, error", [
+    (
+        [("execution_error", {"node_id": "7", "node_type": "KSampler",
+                              "exception_type": "torch.OutOfMemoryError", "exception_message": "CUDA out of memory "})],
+        ERROR, "KSampler (node 7): torch.OutOfMemoryError: CUDA out of memory",
+    ),
+    ([("execution_error", {})], ERROR, "workflow: Unknown error"),
+    ([("executing", {"node": "3"}), ("execution_interrupted", {})], INTERRUPTED, None),
+])
+def test_prompt_failures(events, status, error):
+    async def scenario():
+        async with FakeComfyUIWS() as fake:
+            stream = await connected_stream(fake)
+            for kind, data in events:
+                fake.send(kind, prompt_id="p2", **data)
+            state = await stream.wait("p2", 5)
+            assert state["status"] == status
+            assert state.get("error") == error
+            # A late executing(None) does not turn a failure into success
+            fake.send("executing", prompt_id="p2", node=None)
+            await asyncio.sleep(0.1)
+            assert stream.state("p2")["status"] == status
+            await stream.stop()
+
+    run(scenario())
+
+
+def test_wait_returns_when_the_stream_drops():
+    async def scenario():
+        async with FakeComfyUIWS() as fake:
+            stream = await connected_stream(fake)
+            fake.send("executing", prompt_id="p3", node="3")
+            asyncio.get_running_loop().call_later(0.2, fake.outbox.put_nowait, CLOSE)
+            start = time.monotonic()
+            state = await stream.wait("p3", 10)
+            assert time.monotonic() - start < 5
+            assert state["status"] == RUNNING
+            assert not stream.connected
+
+            # Disconnected: no waiting at all
+            start = time.monotonic()
+            await stream.wait("p3", 10)
+            assert time.monotonic() - start < 0.5
+            await stream.stop()
+
+    run(scenario())
+
+
+def test_finished_prompts_are_pruned_oldest_first(monkeypatch):
+    monkeypatch.setattr(comfyui_events, "MAX_TRACKED_PROMPTS", 3)
+    stream = ComfyUIEventStream("http://127.0.0.1:1")
+    stream._handle(json.dumps({"type": "executing", "data": {"prompt_id": "running", "node": "1"}}))
+    for prompt_id in ("old", "mid", "new"):
+        stream._handle(json.dumps({"type": "executing", "data": {"prompt_id": prompt_id, "node": None}}))
+    assert stream.state("old") is None
+    assert [p for p in ("running", "mid", "new") if stream.state(p)] == ["running", "mid", "new"]
+
+
+def fake_history(entries: dict):
+    """MockTransport serving /history/{id} from `entries` (prompt id -> entry or None), counting reads"""
+    reads = {"count": 0}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        prompt_id = request.url.path.rsplit("/", 1)[-1]
+        reads["count"] += 1
+        entry = entries.get(prompt_id)
+        return httpx.Response(200, json={prompt_id: entry} if entry else {})
+
+    return httpx.MockTransport(handler), reads
+
+
+def runner_for(client: httpx.AsyncClient, events) -> ServerlessRunner:
+    runner = ServerlessRunner.__new__(ServerlessRunner)  # no Redis, no lease task
+    runner.client = client
+    runner.events = events
+    return runner
+
+
+COMPLETED = {"status": {"completed": True, "status_str": "success"}, "outputs": {"9": {"images": []}}}
+
+
+def test_poll_history_wakes_on_the_finish_event(monkeypatch):
+    monkeypatch.setattr(settings, "serverless_poll_interval", 5.0)
+    monkeypatch.setattr(settings, "serverless_history_safety_interval", 30.0)
+
+    async def scenario():
+        async with FakeComfyUIWS() as fake:
+            stream = await connected_stream(fake)
+            entries = {"p4": {"status": {"completed": False, "status_str": "running"}}}
+            transport, reads = fake_history(entries)
+            async with httpx.AsyncClient(transport=transport, base_url=fake.url) as client:
+                runner = runner_for(client, stream)
+                fake.send("executing", prompt_id="p4", node="3")
+
+                def finish():
+                    entries["p4"] = COMPLETED
+                    fake.send("executing", prompt_id="p4", node=None)
+
+                asyncio.get_running_loop().call_later(0.5, finish)
+                start = time.monotonic()
+                entry = await runner.poll_history("p4")
+                assert entry == COMPLETED
+                assert time.monotonic() - start < 3  # not the 5 s poll interval
+                assert reads["count"] <= 3
+            await stream.stop()
+
+    run(scenario())
+
+
+def test_poll_history_falls_back_to_polling_without_the_stream(monkeypatch):
+    monkeypatch.setattr(settings, "serverless_poll_interval", 0.1)
+
+    async def scenario():
+        async with FakeComfyUIWS() as fake:
+            stream = await connected_stream(fake)
+            fake.send("executing", prompt_id="p5", node="3")
+            await fake.__aexit__(None, None, None)  # drops the connection for good
+            entries = {"p5": {"status": {"completed": False, "status_str": "running"}}}
+            transport, reads = fake_history(entries)
+            async with httpx.AsyncClient(transport=transport, base_url=fake.url) as client:
+                runner = runner_for(client, stream)
+                asyncio.get_running_loop().call_later(0.6, entries.update, {"p5": COMPLETED})
+                entry = await runner.poll_history("p5")
+                assert entry == COMPLETED
+                assert not stream.connected
+                assert reads["count"] >= 4  # found by polling every 0.1 s
+            await stream.stop()
+
+    asyncio.run(asyncio.wait_for(scenario(), 20))
+
+
+def test_poll_history_returns_errors(monkeypatch):
+    monkeypatch.setattr(settings, "serverless_poll_interval", 0.1)
+    failed = {"status": {"completed": False, "status_str": "error",
+                         "messages": [["execution_error", {"exception_message": "boom"}]]}}
+
+    async def scenario():
+        transport, _ = fake_history({"p6": failed})
+        async with httpx.AsyncClient(transport=transport, base_url="http://fake") as client:
+            assert await runner_for(client, None).poll_history("p6") == failed
+
+    run(scenario())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests for moving serverless outputs into OUTPUTS_PATH.
+
+Tests cover:
+- link: a hardlink on one filesystem; copy: an independent file
+- A filesystem that cannot link (EXDEV, EOPNOTSUPP...) falls through to the
+  in-kernel copy and is not tried again
+- Permission errors propagate instead of being taken for "unsupported",
+  and leave no partial file behind
+- reference: nothing written; a missing source is None
+
+Run with: python3 -m pytest test_output_transfer.py -v
+"""
+
+import errno
+import os
+
+import pytest
+
+import output_transfer
+from output_transfer import COPY, LINK, REFERENCE, transfer_file
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    monkeypatch.setattr(output_transfer, "_no_hardlink", set())
+    monkeypatch.setattr(output_transfer, "_no_reflink", set())
+    src = tmp_path / "sfs" / "out.png"
+    src.parent.mkdir()
+    src.write_bytes(b"png" * 1000)
+    (tmp_path / "outputs").mkdir()
+    return src, tmp_path / "outputs" / "out.png"
+
+
+def refuse(error: int):
+    def call(*args, **kwargs):
+        raise OSError(error, os.strerror(error))
+    return call
+
+
+def test_link_and_copy(files):
+    src, dest = files
+    assert transfer_file(src, dest, LINK) == "hardlink"
+    assert os.path.samefile(src, dest)
+
+    dest.unlink()
+    assert transfer_file(src, dest, COPY) in ("copy_file_range", "sendfile", "copy")
+    assert dest.read_bytes() == src.read_bytes()
+    assert not os.path.samefile(src, dest)
+
+
+@pytest.mark.parametrize("error", [errno.EXDEV, errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL])
+def test_unsupported_falls_through_to_a_copy(files, monkeypatch, error):
+    src, dest = files
+    monkeypatch.setattr(os, "link", refuse(error))
+    monkeypatch.setattr(output_transfer, "_reflink", refuse(error))
+    assert transfer_file(src, dest, LINK) in ("copy_file_range", "sendfile", "copy")
+    assert dest.read_bytes() == src.read_bytes()
+    assert output_transfer._no_hardlink and output_transfer._no_reflink  # not tried again
+
+
+@pytest.mark.parametrize("error", [errno.EACCES, errno.EPERM, errno.EBADF])
+def test_permission_errors_propagate(files, monkeypatch, error):
+    src, dest = files
+    monkeypatch.setattr(os, "link", refuse(error))
+    with pytest.raises(OSError) as raised:
+        transfer_file(src, dest, LINK)
+    assert raised.value.errno == error
+    assert not output_transfer._no_hardlink
+    assert os.listdir(dest.parent) == []  # no .part file left
+
+
+def test_reference_and_missing_source(files):
+    src, dest = files
+    assert transfer_file(src, dest, REFERENCE) == REFERENCE
+    assert not dest.exists()
+    assert transfer_file(src.with_name("missing.png"), dest, LINK) is None
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Tests for RedisClient's queue operations against a real Redis: the Lua
+scripts run as they do in production.
+
+Tests cover:
+- Claims take the head of the queue (priority, then submission order) and
+  stamp the job running with its workflow; the 'id' selector takes only
+  that job, and only while it is pending
+- Round-robin claims rotate over users by jobs served, and a user who
+  comes back later queues behind users served less
+- Batch claims stop at the first job over the remaining VRAM budget, in
+  either mode, so smaller jobs behind it never overtake it; a job over the
+  whole budget is passed over (round_robin: its user is) for a larger GPU
+- A job handed back job_max_releases times is dead-lettered; a submitted
+  estimate over the largest registered GPU is refused with a 422, one made
+  by the queue manager is capped there, and estimated_vram is stored as
+  whole MB
+- Wait estimates come from one scan of the queue shared for eta_cache_ttl
+  seconds, concurrent callers included; jobs past it are extrapolated
+- Model affinity takes a job using the worker's loaded models from the
+  first affinity_scan_depth jobs of the head's priority; each job passed
+  over counts an affinity skip, and one at affinity_max_skips is taken next
+- A job whose lease runs out is requeued at its old place while it has
+  attempts left, and dead-lettered (failed + dead_letter) once it has not
+- Only the worker holding a job can complete it: anyone else gets a 409
+- cleanup_stale_jobs fails long-running jobs without a lease and leaves
+  leased ones to the lease expiry
+- With every pooled connection in use past redis_pool_timeout, requests
+  are shed with a 503 and Retry-After instead of failing as a Redis error
+- Queue stats fall back to zero counts, dead_letter included, without Redis
+
+Needs Redis (REDIS_HOST, REDIS_PORT, REDIS_PASSWORD; skipped if unreachable)
+and flushes the database REDIS_TEST_DB (default 15). The stats fallback
+test runs without one.
+
+Run with: python3 -m pytest test_redis_client.py -v
+"""
+
+import asyncio
+import os
+
+import pytest
+import redis
+from fastapi import HTTPException
+from starlette.requests import Request
+
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+import main  # noqa: E402
+from config import settings  # noqa: E402
+from models import (  # noqa: E402
+    Job, JobCompletionRequest, JobPriority, JobStatus, JobSubmitRequest, QueueMode, WorkerStatus
+)
+from redis_client import RedisBusyError, RedisClient  # noqa: E402
+
+WORKFLOW = {"3": {"class_type": "KSampler", "inputs": {"seed": 1}}}
+
+
+@pytest.fixture
+def redis_db(monkeypatch):
+    """Point RedisClient at an empty test database"""
+    monkeypatch.setattr(settings, "redis_host", os.getenv("REDIS_HOST", "localhost"))
+    monkeypatch.setattr(settings, "redis_port", int(os.getenv("REDIS_PORT", "6379")))
+    monkeypatch.setattr(settings, "redis_password", os.getenv("REDIS_PASSWORD", ""))
+    monkeypatch.setattr(settings, "redis_db", int(os.getenv("REDIS_TEST_DB", "15")))
+    monkeypatch.setattr(settings, "vram_estimate_workflows", False)
+    client = redis.Redis(
+        host=settings.redis_host, port=settings.redis_port,
+        password=settings.redis_password or None, db=settings.redis_db, decode_responses=True
+    )
+    try:
+        client.ping()
+    except redis.RedisError as e:
+        pytest.skip(f"Redis not available: {e}")
+    client.flushdb()
+    yield client
+    client.flushdb()
+    client.close()
+
+
+def run(scenario):
+    """Run scenario(RedisClient) on a fresh event loop and client"""
+    async def main_():
+        client = RedisClient()
+        try:
+            return await scenario(client)
+        finally:
+            await client.close()
+
+    return asyncio.run(main_())
+
+
+async def submit(client: RedisClient, user_id: str = "alice", **fields) -> Job:
+    job = Job(user_id=user_id, workflow=WORKFLOW, **fields)
+    assert await client.create_job(job)
+    return job
+
+
+async def claim_all(client: RedisClient, worker_id: str = "worker-1", **options) -> list:
+    """Job ids claimed one at a time until nothing more is claimed"""
+    claimed = []
+    while jobs := await client.claim_next_jobs(worker_id, **options):
+        claimed.extend(job.id for job in jobs)
+    return claimed
+
+
+async def expire_leases(client: RedisClient):
+    """Make every job lease run out now"""
+    for job_id in await client.redis.zrange(RedisClient.QUEUE_LEASES, 0, -1):
+        await client.redis.zadd(RedisClient.QUEUE_LEASES, {job_id: 0})
+
+
+def test_claims_take_the_head_of_the_queue(redis_db):
+    async def scenario(client: RedisClient):
+        normal = await submit(client)
+        low = await submit(client, priority=JobPriority.LOW)
+        high = await submit(client, "bob", priority=JobPriority.HIGH)
+        later = await submit(client)
+
+        first = await client.claim_next_job("worker-1")
+        assert first.id == high.id
+        assert first.status == JobStatus.RUNNING
+        assert first.worker_id == "worker-1" and first.started_at is not None
+        assert first.attempts == 1
+        assert first.workflow == WORKFLOW
+        assert await client.redis.zrange(RedisClient.QUEUE_RUNNING, 0, -1) == [high.id]
+        assert await claim_all(client) == [normal.id, later.id, low.id]
+        assert await client.redis.zcard(RedisClient.QUEUE_FAIR_SHARE) == 0
+
+    run(scenario)
+
+
+def test_claim_by_id(redis_db):
+    async def scenario(client: RedisClient):
+        first, second = await submit(client), await submit(client, "bob")
+        assert [job.id for job in await client._claim("worker-1", "id", job_id=second.id)] == [second.id]
+        assert await client._claim("worker-2", "id", job_id=second.id) == []  # no longer pending
+        assert await client._claim("worker-2", "id", job_id="no-such-job") == []
+        assert await client.redis.zrange(RedisClient.QUEUE_PENDING, 0, -1) == [first.id]
+        # The per-user queue and fair-share entry went with it
+        assert await client.redis.zrange(RedisClient.QUEUE_FAIR_SHARE, 0, -1) == ["alice"]
+
+    run(scenario)
+
+
+def test_round_robin_rotates_over_users(redis_db):
+    async def scenario(client: RedisClient):
+        alice = [(await submit(client, "alice")).id for _ in range(3)]
+        bob = [(await submit(client, "bob")).id for _ in range(2)]
+        carol = [(await submit(client, "carol")).id]
+
+        claimed = await claim_all(client, queue_mode=QueueMode.ROUND_ROBIN)
+        assert claimed == [alice[0], bob[0], carol[0], alice[1], bob[1], alice[2]]
+        assert await client.redis.zcard(RedisClient.QUEUE_FAIR_SHARE) == 0
+
+        # Served 3, 2 and 1 jobs so far: newcomer dave goes first, alice last
+        returning = {user: (await submit(client, user)).id for user in ("alice", "bob", "carol", "dave")}
+        claimed = await claim_all(client, queue_mode=QueueMode.ROUND_ROBIN)
+        assert claimed == [returning[user] for user in ("dave", "carol", "bob", "alice")]
+
+    run(scenario)
+
+
+@pytest.mark.parametrize("queue_mode, order", [
+    # Queue order: a2 (4000) does not fit the 1000 left after a1 + b1, and
+    # c1 (2000), which would, must not overtake it
+    (QueueMode.FIFO, [["a1", "b1"], ["a2"], ["c1"], [], ["unsized"]]),
+    # Users by jobs served: carol (none yet) comes before alice's second job
+    (QueueMode.ROUND_ROBIN, [["a1", "b1"], ["c1"], ["a2"], [], ["unsized"]]),
+])
+def test_vram_budget_ends_the_batch(redis_db, queue_mode, order):
+    async def scenario(client: RedisClient):
+        async def sized(user_id: str, vram=None) -> str:
+            metadata = {"estimated_vram": vram} if vram is not None else {}
+            return (await submit(client, user_id, metadata=metadata)).id
+
+        ids = {
+            "a1": await sized("alice", 6000), "b1": await sized("bob", 6000),
+            "a2": await sized("alice", 4000), "c1": await sized("carol", 2000),
+            "unsized": await sized("bob"),  # settings.vram_default_estimate_mb (8192)
+        }
+        for budget, expected in zip((13000, 5000, 8000, 8000, 8192), order):
+            jobs = await client.claim_next_jobs("worker-1", queue_mode, max_jobs=10, vram_budget=budget)
+            assert [job.id for job in jobs] == [ids[name] for name in expected], budget
+
+    run(scenario)
+
+
+@pytest.mark.parametrize("queue_mode, small_budget_claims", [
+    # Later jobs go ahead of one no 10 GB GPU can ever run...
+    (QueueMode.FIFO, ["bob", "alice-small"]),
+    # ...in round_robin its user's later jobs stay behind it
+    (QueueMode.ROUND_ROBIN, ["bob"]),
+])
+def test_job_over_the_whole_budget_is_passed_over(redis_db, queue_mode, small_budget_claims):
+    async def scenario(client: RedisClient):
+        ids = {
+            "alice-huge": (await submit(client, "alice", metadata={"estimated_vram": 50000})).id,
+            "bob": (await submit(client, "bob", metadata={"estimated_vram": 4000})).id,
+            "alice-small": (await submit(client, "alice", metadata={"estimated_vram": 2000})).id,
+        }
+        jobs = await client.claim_next_jobs("small-gpu", queue_mode, max_jobs=10, vram_budget=10000)
+        assert [job.id for job in jobs] == [ids[name] for name in small_budget_claims]
+        assert (await client.get_job(ids["alice-huge"])).status == JobStatus.PENDING
+        # It fits a larger GPU's budget, still at the head of the queue
+        jobs = await client.claim_next_jobs("large-gpu", queue_mode, max_jobs=1, vram_budget=80000)
+        assert [job.id for job in jobs] == [ids["alice-huge"]]
+
+    run(scenario)
+
+
+def test_release_dead_letters_after_max_releases(redis_db, monkeypatch):
+    monkeypatch.setattr(settings, "job_max_releases", 3)
+
+    async def scenario(client: RedisClient):
+        submitted = await submit(client)
+        outcomes = []
+        for _ in range(3):
+            assert (await client.claim_next_job("worker-1", lease=True)).id == submitted.id
+            outcomes.append(await client.release_job(submitted.id, "worker-1"))
+        assert outcomes == ["released", "released", "dead_letter"]
+
+        job = await client.get_job(submitted.id)
+        assert job.status == JobStatus.FAILED
+        assert job.attempts == 1  # releases never counted an attempt
+        assert "Released 3 time(s)" in job.error
+        assert [j.id for j in await client.get_dead_letter_jobs()] == [submitted.id]
+        assert await client.claim_next_job("worker-2", lease=True) is None
+
+    run(scenario)
+
+
+def test_estimate_over_the_largest_gpu(redis_db, monkeypatch):
+    monkeypatch.setattr(settings, "max_queue_wait", 0)
+
+    async def scenario(client: RedisClient):
+        monkeypatch.setattr(main, "redis_client", client)
+        for worker_id, capacity in (("small", 24000), ("large", 80000)):
+            status = WorkerStatus(worker_id=worker_id, status="idle", vram_capacity_mb=capacity)
+            await client.record_worker_heartbeat(status)
+        assert (await client.get_worker_capacity())["vram_capacity_mb"] == 80000
+
+        def request(vram: int) -> JobSubmitRequest:
+            return JobSubmitRequest(user_id="alice", workflow=WORKFLOW, metadata={"estimated_vram": vram})
+
+        accepted = await main.submit_job(request(80000), main.Response())
+        assert (await client.get_job(accepted.id)).metadata["estimated_vram"] == 80000
+        with pytest.raises(HTTPException) as refused:
+            await main.submit_job(request(80001), main.Response())
+        assert refused.value.status_code == 422
+        assert await client.get_queue_depth() == 1
+
+        # The largest worker leaves: its capacity goes with it
+        await client.remove_worker("large")
+        assert (await client.get_worker_capacity())["vram_capacity_mb"] == 24000
+
+        # An estimate made here is capped rather than refused
+        monkeypatch.setattr(settings, "vram_estimate_workflows", True)
+        klein = {"1": {"class_type": "UNETLoader", "inputs": {"unet_name": "flux-2-klein-4b.safetensors"}}}
+        job = Job(user_id="alice", workflow=klein)
+        assert await client.create_job(job, vram_limit=5000)
+        assert job.metadata == {"estimated_vram": 5000, "vram_source": "workflow"}
+
+    run(scenario)
+
+
+@pytest.mark.parametrize("value, expected", [(24576, 24576), (24.5, 25), ("24.5", 25), ("8192", 8192), (None, None)])
+def test_estimated_vram_is_stored_as_whole_mb(value, expected):
+    request = JobSubmitRequest(user_id="alice", workflow=WORKFLOW, metadata={"estimated_vram": value})
+    assert request.metadata["estimated_vram"] == expected
+
+
+@pytest.mark.parametrize("value", ["8 GB", "", [1], -1, "nan", "inf"])
+def test_estimated_vram_must_be_a_number(value):
+    with pytest.raises(ValueError, match="estimated_vram"):
+        JobSubmitRequest(user_id="alice", workflow=WORKFLOW, metadata={"estimated_vram": value})
+
+
+def test_wait_estimates_share_one_scan(redis_db, monkeypatch):
+    monkeypatch.setattr(settings, "eta_cache_ttl", 60.0)
+
+    async def scenario(client: RedisClient):
+        scans = 0
+        work_ahead = client._work_ahead
+
+        async def counted(**kwargs):
+            nonlocal scans
+            scans += 1
+            return await work_ahead(**kwargs)
+
+        client._work_ahead = counted
+        jobs = [await submit(client, predicted_runtime=runtime) for runtime in (30, 60)]
+        positions = await client.get_queue_positions([job.id for job in jobs])
+        assert await client.estimate_wait_times(positions, 1) == {jobs[0].id: 0, jobs[1].id: 30}
+        assert await client.estimate_wait_times(positions, 2) == {jobs[0].id: 0, jobs[1].id: 15}
+
+        # Within eta_cache_ttl a job queued after the scan is extrapolated
+        # from it at the scanned mean, without another scan
+        later = await submit(client, predicted_runtime=10)
+        assert await client.estimate_wait_times({later.id: 2}, 1) == {later.id: 90}
+        assert await client.estimate_wait_times({later.id: 3}, 1) == {later.id: 135}
+        assert await client.estimate_wait_times({"running": None}, 1) == {"running": None}
+        assert scans == 1
+
+        # Concurrent callers share the scan in flight
+        client._work_ahead_scan = None
+        await asyncio.gather(*(client.estimate_wait_times({later.id: 2}, 1) for _ in range(10)))
+        assert scans == 2
+
+        monkeypatch.setattr(settings, "eta_cache_ttl", 0)
+        assert await client.estimate_wait_times({later.id: 2}, 1) == {later.id: 90}
+        assert scans == 3
+
+    run(scenario)
+
+
+def test_model_affinity_peek(redis_db, monkeypatch):
+    monkeypatch.setattr(settings, "affinity_scan_depth", 4)
+    monkeypatch.setattr(settings, "affinity_max_skips", 2)
+
+    async def scenario(client: RedisClient):
+        async def loading(models: str, **fields) -> str:
+            return (await submit(client, runtime_class=f"txt2img|{models}", **fields)).id
+
+        urgent = await loading("ltx.safetensors", priority=JobPriority.HIGH)
+        video = await loading("ltx.safetensors")
+        images = [await loading("flux.safetensors") for _ in range(2)]
+        sdxl = [await loading("sdxl.safetensors") for _ in range(4)]
+        far = await loading("flux.safetensors")
+
+        async def claim(models: str) -> str:
+            return (await client.claim_next_jobs("worker-1", models=models))[0].id
+
+        # Only the head's priority band is searched
+        assert await claim("flux.safetensors") == urgent
+        # Both flux jobs overtake the video job, counting its skips...
+        assert [await claim("flux.safetensors") for _ in range(2)] == images
+        assert await client.redis.hget(f"job:{video}", "affinity_skips") == "2"
+        # ...until it has been passed over affinity_max_skips times
+        assert await claim("flux.safetensors") == video
+        # The last flux job is fifth in line, past affinity_scan_depth
+        assert await claim("flux.safetensors") == sdxl[0]
+        assert await client.redis.hget(f"job:{sdxl[0]}", "affinity_skips") is None
+        assert await claim("flux.safetensors") == far  # now within reach
+        assert [await client.redis.hget(f"job:{job_id}", "affinity_skips") for job_id in sdxl[1:]] == ["1"] * 3
+
+    run(scenario)
+
+
+def test_expired_lease_requeues_the_job(redis_db, monkeypatch):
+    monkeypatch.setattr(settings, "job_max_attempts", 3)
+
+    async def scenario(client: RedisClient):
+        first, second = await submit(client), await submit(client)
+        claimed = await client.claim_next_job("worker-1", lease=True)
+        assert claimed.id == first.id
+
+        await expire_leases(client)
+        assert await client.requeue_expired_jobs() == {"requeued": 1, "dead_letter": 0}
+
+        job = await client.get_job(first.id)
+        assert job.status == JobStatus.PENDING
+        assert job.worker_id is None and job.started_at is None
+        assert job.attempts == 1
+        # Back ahead of the job queued after it
+        assert await client.redis.zrange(RedisClient.QUEUE_PENDING, 0, -1) == [first.id, second.id]
+        assert await client.redis.zcard(RedisClient.QUEUE_RUNNING) == 0
+        assert (await client.claim_next_job("worker-2", lease=True)).id == first.id
+
+    run(scenario)
+
+
+def test_expired_lease_at_max_attempts_dead_letters_the_job(redis_db, monkeypatch):
+    monkeypatch.setattr(settings, "job_max_attempts", 2)
+
+    async def scenario(client: RedisClient):
+        submitted = await submit(client)
+        outcomes = []
+        for worker_id in ("worker-1", "worker-2"):
+            assert (await client.claim_next_job(worker_id, lease=True)).id == submitted.id
+            await expire_leases(client)
+            outcomes.append(await client.requeue_expired_jobs())
+        assert outcomes == [{"requeued": 1, "dead_letter": 0}, {"requeued": 0, "dead_letter": 1}]
+
+        job = await client.get_job(submitted.id)
+        assert job.status == JobStatus.FAILED
+        assert job.attempts == 2
+        assert "worker-2" in job.error and "2 attempt(s)" in job.error
+        assert [j.id for j in await client.get_dead_letter_jobs()] == [submitted.id]
+        stats = await client.get_all_queue_stats()
+        assert (stats["pending"], stats["running"], stats["failed"], stats["dead_letter"]) == (0, 0, 1, 1)
+        assert await client.claim_next_job("worker-3", lease=True) is None
+
+    run(scenario)
+
+
+def test_completion_from_another_worker_is_refused(redis_db, monkeypatch):
+    async def scenario(client: RedisClient):
+        monkeypatch.setattr(main, "redis_client", client)
+        submitted = await submit(client)
+        await client.claim_next_job("worker-1", lease=True)
+        request = JobCompletionRequest(result={"status": "completed"})
+
+        with pytest.raises(HTTPException) as refused:
+            await main.complete_job(submitted.id, request, worker_id="worker-2")
+        assert refused.value.status_code == 409
+        assert (await client.get_job(submitted.id)).status == JobStatus.RUNNING
+
+        assert await main.complete_job(submitted.id, request, worker_id="worker-1") == {
+            "status": "success", "job_id": submitted.id
+        }
+        assert (await client.get_job(submitted.id)).status == JobStatus.COMPLETED
+        with pytest.raises(HTTPException) as again:
+            await main.complete_job(submitted.id, request, worker_id="worker-1")
+        assert again.value.status_code == 409
+
+    run(scenario)
+
+
+def test_cleanup_skips_leased_jobs(redis_db):
+    async def scenario(client: RedisClient):
+        leased, unleased = await submit(client), await submit(client)
+        assert (await client.claim_next_job("renewing-worker", lease=True)).id == leased.id
+        assert (await client.claim_next_job("old-worker")).id == unleased.id
+        # Both have been running for far longer than the timeout
+        await client.redis.zadd(RedisClient.QUEUE_RUNNING, {leased.id: 0, unleased.id: 0})
+
+        assert await client.cleanup_stale_jobs(timeout_seconds=3600) == 1
+        assert (await client.get_job(leased.id)).status == JobStatus.RUNNING
+        failed = await client.get_job(unleased.id)
+        assert failed.status == JobStatus.FAILED
+        assert failed.error == "Job timeout exceeded"
+
+    run(scenario)
+
+
+def test_exhausted_pool_answers_503(redis_db, monkeypatch):
+    monkeypatch.setattr(settings, "redis_max_connections", 1)
+    monkeypatch.setattr(settings, "redis_pool_timeout", 0.1)
+
+    async def scenario(client: RedisClient):
+        monkeypatch.setattr(main, "redis_client", client)
+        held = await client.redis.connection_pool.get_connection()
+        try:
+            # Not swallowed as a Redis failure (500, empty list): shed as busy
+            with pytest.raises(RedisBusyError):
+                await main.submit_job(JobSubmitRequest(user_id="alice", workflow=WORKFLOW), main.Response())
+            with pytest.raises(RedisBusyError):
+                await main.list_jobs()
+        finally:
+            await client.redis.connection_pool.release(held)
+        assert await client.get_queue_depth() == 0
+
+        request = Request({"type": "http", "method": "POST", "path": "/api/jobs", "headers": []})
+        response = await main.redis_busy_handler(request, RedisBusyError("busy"))
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+
+    run(scenario)
+
+
+def test_queue_stats_without_redis(monkeypatch):
+    monkeypatch.setattr(settings, "redis_host", "127.0.0.1")
+    monkeypatch.setattr(settings, "redis_port", 1)  # nothing listens there
+
+    async def scenario(client: RedisClient):
+        return await client.get_all_queue_stats()
+
+    # Every count main.get_queue_status reads, zeroed
+    assert run(scenario) == {"pending": 0, "running": 0, "completed": 0, "failed": 0, "dead_letter": 0}
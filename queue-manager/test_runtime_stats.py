@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Tests for runtime classes, the rolling runtime statistics and the
+shortest_expected queue score.
+
+Tests cover:
+- ewma_update: plain averaging for the first samples, then weight alpha,
+  with the matching (population) variance
+- RECORD_RUNTIME_SCRIPT folds samples exactly as ewma_update does (needs
+  Redis, skipped if unreachable)
+- pick_prediction: most specific level with enough samples, else any
+  samples, else the default
+- queue_score: priority first; in shortest_expected mode a short job only
+  overtakes a long one until the long one has waited weight x the
+  difference in runtimes
+- runtime_class: same template whatever the prompt or seed, models
+  normalised, UI-format workflows and metadata.template
+
+Run with: python3 -m pytest test_runtime_stats.py -v
+"""
+
+import hashlib
+import json
+import os
+
+import pytest
+import redis
+
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+from config import settings  # noqa: E402
+from models import QueueMode  # noqa: E402
+from runtime_stats import (  # noqa: E402
+    RECORD_RUNTIME_SCRIPT, ewma_update, model_set, pick_prediction, queue_score, runtime_class, runtime_levels
+)
+
+
+@pytest.mark.parametrize("samples, alpha, expected", [
+    ([10], 0.2, {"n": 1, "mean": 10, "var": 0}),
+    # Plain mean and population variance while 1/(n+1) > alpha
+    ([10, 20], 0.2, {"n": 2, "mean": 15, "var": 25}),
+    ([10, 20, 30], 0.2, {"n": 3, "mean": 20, "var": 200 / 3}),
+    ([10, 20, 30, 40, 50], 0.2, {"n": 5, "mean": 30, "var": 200}),
+    # Then the newest sample weighs alpha: 50 here, not the mean's 33.3
+    ([0, 0, 100], 0.5, {"n": 3, "mean": 50, "var": 2500}),
+    ([0, 0, 100, 100], 0.5, {"n": 4, "mean": 75, "var": 1875}),
+])
+def test_ewma_update(samples, alpha, expected):
+    stats = None
+    for seconds in samples:
+        stats = ewma_update(stats, seconds, alpha)
+    assert stats == pytest.approx(expected)
+
+
+def test_record_script_matches_ewma_update():
+    client = redis.Redis(
+        host=os.getenv("REDIS_HOST", "localhost"), port=int(os.getenv("REDIS_PORT", "6379")),
+        password=os.getenv("REDIS_PASSWORD") or None, db=int(os.getenv("REDIS_TEST_DB", "15"))
+    )
+    try:
+        client.ping()
+    except redis.RedisError as e:
+        pytest.skip(f"Redis not available: {e}")
+    key = "test:runtime:stats"
+    client.delete(key)
+    try:
+        expected = None
+        for seconds in (12.5, 30, 8, 41.25, 19, 22):
+            expected = ewma_update(expected, seconds, 0.3)
+            client.eval(RECORD_RUNTIME_SCRIPT, 1, key, seconds, 0.3, "class:a|-", "all")
+        for level in ("class:a|-", "all"):
+            assert json.loads(client.hget(key, level)) == pytest.approx(expected)
+    finally:
+        client.delete(key)
+        client.close()
+
+
+@pytest.mark.parametrize("levels, min_samples, expected", [
+    ([None, None, None], 3, 60.0),  # nothing known: the default
+    ([{"n": 5, "mean": 10}, {"n": 50, "mean": 20}], 3, 10),  # most specific trusted level
+    ([{"n": 2, "mean": 10}, {"n": 50, "mean": 20}], 3, 20),  # too few samples: a broader level
+    ([None, {"n": 3, "mean": 30}, {"n": 9, "mean": 20}], 3, 30),  # missing levels are skipped
+    ([{"n": 1, "mean": 10}, {"n": 2, "mean": 20}], 3, 10),  # none trusted: most specific known
+    ([{"n": 0, "mean": 0}, None], 3, 60.0),
+])
+def test_pick_prediction(levels, min_samples, expected):
+    assert pick_prediction(levels, min_samples, 60.0) == expected
+
+
+def test_runtime_levels():
+    assert runtime_levels("abc|flux.safetensors") == [
+        "class:abc|flux.safetensors", "template:abc", "model:flux.safetensors", "all"
+    ]
+    assert runtime_levels("abc|-", "abc|-@512x512x1x1")[0] == "signature:abc|-@512x512x1x1"
+
+
+@pytest.mark.parametrize("mode, short_submitted, short_first", [
+    # shortest_expected (weight 1): a 10 s job submitted after a 600 s one
+    # overtakes it until the long one has waited 590 s
+    (QueueMode.SHORTEST_EXPECTED, 100, True),
+    (QueueMode.SHORTEST_EXPECTED, 589, True),
+    (QueueMode.SHORTEST_EXPECTED, 591, False),
+    (QueueMode.SHORTEST_EXPECTED, 5000, False),
+    # Other modes ignore predicted runtimes
+    (QueueMode.FIFO, 1, False),
+    (QueueMode.PRIORITY, 1, False),
+])
+def test_shortest_expected_aging(monkeypatch, mode, short_submitted, short_first):
+    monkeypatch.setattr(settings, "shortest_expected_weight", 1.0)
+    long_job = queue_score(2, 0, 600, mode)
+    short_job = queue_score(2, short_submitted, 10, mode)
+    assert (short_job < long_job) == short_first
+
+
+def test_priority_outranks_runtime():
+    urgent_long = queue_score(0, 10_000, 3600, QueueMode.SHORTEST_EXPECTED)
+    normal_short = queue_score(2, 0, 1, QueueMode.SHORTEST_EXPECTED)
+    assert urgent_long < normal_short
+
+
+def klein(seed: int, prompt: str, unet: str = "flux-2-klein-4b.safetensors") -> dict:
+    return {
+        "1": {"class_type": "UNETLoader", "inputs": {"unet_name": unet}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": prompt}},
+        "3": {"class_type": "KSampler", "inputs": {"seed": seed, "model": ["1", 0]}},
+    }
+
+
+@pytest.mark.parametrize("workflow, metadata, expected", [
+    (klein(1, "a cat"), None, "{digest}|flux-2-klein-4b.safetensors"),
+    (klein(2, "a dog"), None, "{digest}|flux-2-klein-4b.safetensors"),
+    (klein(1, "a cat", "models\\unet\\flux-2-klein-9b.safetensors"), None, "{digest}|flux-2-klein-9b.safetensors"),
+    (klein(1, "a cat"), {"template": "klein-t2i"}, "klein-t2i|flux-2-klein-4b.safetensors"),
+    ({"nodes": [{"type": "KSampler", "widgets_values": [1, "sdxl.ckpt"]}]}, None, "{ui}|sdxl.ckpt"),
+    ({}, None, "{empty}|-"),
+    (None, None, "{empty}|-"),
+])
+def test_runtime_class(workflow, metadata, expected):
+    def digest(*types):
+        return hashlib.sha1(",".join(sorted(types)).encode()).hexdigest()[:12]
+
+    expected = expected.format(
+        digest=digest("UNETLoader", "CLIPTextEncode", "KSampler"), ui=digest("KSampler"), empty=digest()
+    )
+    assert runtime_class(workflow, metadata) == expected
+    assert model_set(expected) == expected.rpartition("|")[2]
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Tests for the workflow-graph VRAM estimate made at submission.
+
+Tests cover:
+- model_size_mb: parameter count x precision from the file name, role
+  defaults, LoRAs never sized by their base model's "19b", and the real
+  file size when the model directory is mounted
+- estimate_workflow_vram: resident weights plus the largest of text
+  encoding, sampling and decoding, for image and video graphs in API and
+  UI format; muted/bypassed nodes ignored; a file loaded in two roles
+  counted once; None without model files
+- submission_estimate never raises
+
+Run with: python3 -m pytest test_vram_estimator.py -v
+"""
+
+import os
+
+import pytest
+
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+import vram_estimator  # noqa: E402
+from config import settings  # noqa: E402
+from vram_estimator import OVERHEAD_MB, estimate_workflow_vram, model_size_mb, submission_estimate  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def no_model_directory(monkeypatch):
+    monkeypatch.setattr(settings, "vram_models_path", None)
+    monkeypatch.setattr(vram_estimator, "_index", {})
+    monkeypatch.setattr(vram_estimator, "_indexed_at", 0.0)
+
+
+@pytest.mark.parametrize("name, role, expected", [
+    ("flux-2-klein-4b.safetensors", "diffusion", 7629),  # 4B x bf16
+    ("flux-2-klein-9b-fp8.safetensors", "diffusion", 8583),  # 9B x 1 byte
+    ("ltx-2-19b-dev-fp8mixed.safetensors", "diffusion", 20837),  # 19B x 1 byte x 1.15
+    ("qwen_3_4b_fp4.safetensors", "text_encoder", 1907),  # 4B x 0.5 byte
+    ("gemma_3_12B_it.safetensors", "text_encoder", 22888),
+    ("sd3.5b-q8.gguf", "diffusion", 3337),  # fractional count
+    ("my_model.safetensors", "diffusion", 8192),  # no count: role default
+    ("ae.safetensors", "vae", 320),
+    ("ltx-2-19b-ic-lora.safetensors", "lora", 1024),  # "19b" is the base model's
+])
+def test_model_size_from_name(name, role, expected):
+    assert model_size_mb(name, role) == expected
+
+
+def test_model_size_from_disk(monkeypatch, tmp_path):
+    (tmp_path / "unet").mkdir()
+    with open(tmp_path / "unet" / "flux-2-klein-4b.safetensors", "wb") as file:
+        file.truncate(3 * 2 ** 30)  # sparse: 3 GB on paper
+    monkeypatch.setattr(settings, "vram_models_path", str(tmp_path))
+    assert model_size_mb("flux-2-klein-4b.safetensors", "diffusion") == 3072
+    assert model_size_mb("missing-4b.safetensors", "diffusion") == 7629  # not on disk: by name
+
+
+def klein_image(width: int = 1024, height: int = 1024, batch: int = 1) -> dict:
+    return {
+        "1": {"class_type": "UNETLoader", "inputs": {"unet_name": "flux-2-klein-4b.safetensors"}},
+        "2": {"class_type": "CLIPLoader", "inputs": {"clip_name": "qwen_3_4b_fp4.safetensors"}},
+        "3": {"class_type": "VAELoader", "inputs": {"vae_name": "ae.safetensors"}},
+        "4": {"class_type": "EmptyFlux2LatentImage", "inputs": {"width": width, "height": height, "batch_size": batch}},
+        "5": {"class_type": "KSampler", "inputs": {"seed": 1, "model": ["1", 0], "latent_image": ["4", 0]}},
+    }
+
+
+def ltx_video(width: int, height: int, length: int) -> dict:
+    return {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "ltx-2-19b-dev-fp8.safetensors"}},
+        "2": {"class_type": "LoraLoaderModelOnly", "inputs": {"lora_name": "ltx-2-19b-distilled-lora.safetensors"}},
+        "3": {"class_type": "EmptyLTXVLatentVideo", "inputs": {"width": width, "height": height, "length": length, "batch_size": 1}},
+    }
+
+
+LTX_WEIGHTS = 18119 + 1024  # 19B x fp8, plus a default-sized LoRA
+
+
+@pytest.mark.parametrize("workflow, expected", [
+    # 1024x1024 Klein: 64x64 tokens; the 4B diffusion weights stay resident
+    # and the fp4 text encoder outweighs sampling and decoding (VAE + 1 MP)
+    (klein_image(), {
+        "estimated_vram": 7629 + 1907 + OVERHEAD_MB, "weights_mb": 7629, "text_encoder_mb": 1907,
+        "sampling_mb": 1433, "decode_mb": 1578, "tokens": 4096, "shape": "1024x1024x1x1",
+    }),
+    # A batch of 4 multiplies tokens and decode: sampling is now the largest
+    (klein_image(batch=4), {
+        "estimated_vram": 7629 + 5734 + OVERHEAD_MB, "weights_mb": 7629, "text_encoder_mb": 1907,
+        "sampling_mb": 5734, "decode_mb": 5353, "tokens": 16384, "shape": "1024x1024x1x4",
+    }),
+    # 97 frames of 768x512 LTX: 13 latent frames of 24x16 tokens; decode
+    # works on at most 4 latent frames at a time
+    (ltx_video(768, 512, 97), {
+        "estimated_vram": LTX_WEIGHTS + 1887 + OVERHEAD_MB, "weights_mb": LTX_WEIGHTS, "text_encoder_mb": 0,
+        "sampling_mb": 1747, "decode_mb": 1887, "tokens": 4992, "shape": "768x512x97x1",
+    }),
+])
+def test_estimate(workflow, expected):
+    estimate = estimate_workflow_vram(workflow)
+    assert {key: estimate[key] for key in expected} == expected
+
+
+def test_ui_format_skips_muted_nodes_and_unused_subgraphs():
+    subgraph = {"id": "sub-1", "nodes": [{"type": "UNETLoader", "widgets_values": ["flux-2-klein-9b-fp8.safetensors", "default"]}]}
+    unused = {"id": "sub-2", "nodes": [{"type": "UNETLoader", "widgets_values": ["huge-70b.safetensors", "default"]}]}
+    workflow = {
+        "nodes": [
+            {"type": "sub-1", "mode": 0},
+            {"type": "sub-2", "mode": 4},  # bypassed: its subgraph never runs
+            {"type": "CheckpointLoaderSimple", "mode": 2, "widgets_values": ["sdxl-3b.safetensors"]},  # muted
+            {"type": "EmptyLatentImage", "mode": 0, "widgets_values": [512, 768, 2]},
+        ],
+        "definitions": {"subgraphs": [subgraph, unused]},
+    }
+    estimate = estimate_workflow_vram(workflow)
+    assert estimate["models"] == {"flux-2-klein-9b-fp8.safetensors": ["diffusion", 8583]}
+    assert estimate["shape"] == "512x768x1x2"
+    assert estimate["tokens"] == 64 * 96 * 2  # EmptyLatentImage: 8x compression
+
+
+def test_file_in_two_roles_counts_once_as_resident():
+    workflow = {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sdxl.safetensors"}},
+        "2": {"class_type": "VAELoader", "inputs": {"vae_name": "sdxl.safetensors"}},
+    }
+    estimate = estimate_workflow_vram(workflow)
+    assert estimate["models"] == {"sdxl.safetensors": ["diffusion", 8192]}
+    assert estimate["weights_mb"] == 8192
+
+
+@pytest.mark.parametrize("workflow", [
+    None,
+    {},
+    {"1": {"class_type": "KSampler", "inputs": {"seed": 1}}},
+    {"nodes": [{"type": "Note", "widgets_values": ["flux-2-klein-4b.safetensors"]}]},  # not a loader
+])
+def test_no_model_files_no_estimate(workflow):
+    assert estimate_workflow_vram(workflow) is None
+
+
+def test_submission_estimate_never_raises():
+    assert submission_estimate({"1": {"class_type": "UNETLoader", "inputs": None}}) is None
+    assert submission_estimate({"nodes": "not-a-list", "1": 5}) is None
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests for the learned peak-VRAM profiles.
+
+Tests cover:
+- vram_percentile: mean + z x stddev, percentile clamped to 1-99.9,
+  rounded up, negative variance treated as none
+- workflow_signature: runtime class plus output shape
+- A profile is only used from vram_profile_min_samples samples on; until
+  then submissions keep the workflow-graph estimate (vram_source
+  "workflow"), and a client's own estimated_vram always wins
+
+The profile tests need Redis (REDIS_HOST, REDIS_PORT, REDIS_PASSWORD;
+skipped if unreachable) and flush the database REDIS_TEST_DB (default 15).
+
+Run with: python3 -m pytest test_vram_profiles.py -v
+"""
+
+import os
+
+import pytest
+
+os.environ.setdefault("REDIS_PASSWORD", "")
+
+from config import settings  # noqa: E402
+from models import Job  # noqa: E402
+from redis_client import RedisClient  # noqa: E402
+from test_redis_client import redis_db, run  # noqa: E402,F401
+from vram_profiles import vram_percentile, workflow_signature  # noqa: E402
+
+
+@pytest.mark.parametrize("stats, percentile, expected", [
+    ({"n": 5, "mean": 10000, "var": 0}, 95, 10000),  # no spread: the mean
+    ({"n": 5, "mean": 10000, "var": 250000}, 50, 10000),  # median
+    ({"n": 5, "mean": 10000, "var": 250000}, 95, 10823),  # + 1.645 x 500, rounded up
+    ({"n": 5, "mean": 10000, "var": 250000}, 99, 11164),
+    ({"n": 5, "mean": 10000, "var": 250000}, 100, 11546),  # clamped to 99.9
+    ({"n": 5, "mean": 10000, "var": 250000}, 0, 8837),  # clamped to 1
+    ({"n": 5, "mean": 10000.2, "var": -1e-9}, 95, 10001),  # float noise below zero
+])
+def test_vram_percentile(stats, percentile, expected):
+    assert vram_percentile(stats, percentile) == expected
+
+
+@pytest.mark.parametrize("estimate, expected", [
+    ({"shape": "1024x1024x1x1"}, "abc|flux.safetensors@1024x1024x1x1"),
+    (None, "abc|flux.safetensors@-"),
+])
+def test_workflow_signature(estimate, expected):
+    assert workflow_signature("abc|flux.safetensors", estimate) == expected
+
+
+WORKFLOW = {
+    "1": {"class_type": "UNETLoader", "inputs": {"unet_name": "flux-2-klein-4b.safetensors"}},
+    "2": {"class_type": "EmptyFlux2LatentImage", "inputs": {"width": 1024, "height": 1024, "batch_size": 1}},
+}
+
+
+@pytest.mark.parametrize("peaks, expected_vram, expected_source", [
+    ([], None, "workflow"),
+    ([9000], None, "workflow"),
+    ([9000, 9400], None, "workflow"),  # one short of vram_profile_min_samples
+    ([9000, 9400, 9200], 9469, "profile"),  # mean 9200 + 1.645 x stddev 163.3
+    ([9000] * 5, 9000, "profile"),
+])
+def test_profile_replaces_the_estimate_from_min_samples(redis_db, monkeypatch, peaks, expected_vram, expected_source):
+    monkeypatch.setattr(settings, "vram_estimate_workflows", True)
+    monkeypatch.setattr(settings, "vram_profile_min_samples", 3)
+    monkeypatch.setattr(settings, "vram_profile_percentile", 95)
+    monkeypatch.setattr(settings, "vram_profile_alpha", 0.2)
+
+    async def scenario(client: RedisClient):
+        async def submit(**metadata) -> Job:
+            job = Job(user_id="alice", workflow=WORKFLOW, metadata=metadata)
+            assert await client.create_job(job)
+            return job
+
+        signature = (await submit()).signature
+        assert signature.endswith("@1024x1024x1x1")
+        for peak in peaks:
+            await client.profiles.record(signature, peak)
+        assert await client.profiles.predict(signature) == expected_vram
+
+        job = await submit()
+        assert job.metadata["vram_source"] == expected_source
+        if expected_vram is not None:
+            assert job.metadata["estimated_vram"] == expected_vram
+        # A client's own figure is never replaced
+        assert (await submit(estimated_vram=20000)).metadata == {"estimated_vram": 20000}
+
+    run(scenario)
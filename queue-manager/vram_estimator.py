@@ -0,0 +1,240 @@
+"""
+Peak VRAM estimate for a submitted ComfyUI workflow
+
+Jobs without metadata.estimated_vram used to be packed onto GPUs at
+vram_default_estimate_mb (8 GB) whatever they ran - far too little for an
+LTX-2 video, several times too much for a small image model. At submission
+the queue manager walks the workflow instead (API or UI format; bypassed
+and muted nodes, and subgraphs only instantiated by them, are skipped):
+
+- loader nodes (UNETLoader, CheckpointLoaderSimple, CLIP/text encoder, VAE,
+  LoRA and upscale model loaders) give the model files and their role; a
+  file's size is read from vram_models_path when the model directory is
+  mounted, else guessed from its name (parameter count x precision, e.g.
+  "flux-2-klein-9b-fp8" = 9B x 1 byte)
+- empty latent/image nodes (or width/height/length/batch_size inputs) give
+  the resolution, frame count and batch size, turned into latent tokens
+  with the compression of the model family
+
+Peak VRAM is modelled on how ComfyUI runs a graph: diffusion weights (with
+LoRAs and latent upscalers) stay resident, while text encoding, sampling
+activations and VAE decoding happen one after another, so only the largest
+of them adds to the weights. A fixed overhead covers the CUDA context and
+workspace. These are deliberately rough numbers: once jobs with the same
+signature have completed, their measured peaks take over (vram_profiles),
+and jobs can still set metadata.estimated_vram themselves.
+"""
+import logging
+import math
+import os
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import settings
+from runtime_stats import MODEL_FILE
+
+logger = logging.getLogger(__name__)
+
+OVERHEAD_MB = 1024  # CUDA context, cuBLAS/attention workspace, allocator slack
+ACTIVATION_MB_PER_TOKEN = 0.35  # sampling activations per latent token (batch included)
+DECODE_MB_PER_MEGAPIXEL = 1200  # VAE decode per output megapixel and latent frame
+DECODE_MAX_LATENT_FRAMES = 4  # video VAEs decode a few latent frames at a time
+MIXED_PRECISION_FACTOR = 1.15  # "fp8mixed"/"fp4_mixed": some layers kept in bf16
+
+# Loader node type -> role of the files it loads
+LOADER_ROLES = {
+    "UNETLoader": "diffusion",
+    "UnetLoaderGGUF": "diffusion",
+    "CheckpointLoaderSimple": "diffusion",
+    "CheckpointLoader": "diffusion",
+    "ImageOnlyCheckpointLoader": "diffusion",
+    "CLIPLoader": "text_encoder",
+    "DualCLIPLoader": "text_encoder",
+    "TripleCLIPLoader": "text_encoder",
+    "QuadrupleCLIPLoader": "text_encoder",
+    "CLIPLoaderGGUF": "text_encoder",
+    "LTXAVTextEncoderLoader": "text_encoder",
+    "CLIPVisionLoader": "text_encoder",
+    "VAELoader": "vae",
+    "LTXVAudioVAELoader": "vae",
+    "LoraLoader": "lora",
+    "LoraLoaderModelOnly": "lora",
+    "LatentUpscaleModelLoader": "upscaler",
+    "UpscaleModelLoader": "upscaler",
+    "ControlNetLoader": "lora",
+}
+
+# A file loaded in several roles counts once, in the one that stays resident longest
+ROLE_ORDER = ("diffusion", "lora", "upscaler", "vae", "text_encoder")
+RESIDENT_ROLES = ("diffusion", "lora", "upscaler")
+
+# Size of a file whose name gives no parameter count, by role
+DEFAULT_SIZE_MB = {"diffusion": 8192, "text_encoder": 4096, "vae": 320, "lora": 1024, "upscaler": 1024}
+
+# Latent node type -> (widget order, spatial compression, temporal compression)
+LATENT_NODES = {
+    "EmptyLatentImage": (("width", "height", "batch_size"), 8, 1),
+    "EmptySD3LatentImage": (("width", "height", "batch_size"), 16, 1),
+    "EmptyFlux2LatentImage": (("width", "height", "batch_size"), 16, 1),
+    "EmptyHunyuanLatentVideo": (("width", "height", "length", "batch_size"), 16, 4),
+    "EmptyMochiLatentVideo": (("width", "height", "length", "batch_size"), 16, 6),
+    "EmptyCosmosLatentVideo": (("width", "height", "length", "batch_size"), 16, 8),
+    "EmptyLTXVLatentVideo": (("width", "height", "length", "batch_size"), 32, 8),
+    "WanImageToVideo": (("width", "height", "length", "batch_size"), 16, 4),
+    "EmptyImage": (("width", "height", "batch_size"), None, None),
+}
+DEFAULT_COMPRESSION = (16, 4)  # spatial, temporal - when no latent node says otherwise
+
+PARAMS = re.compile(r"(?<![\d.])(\d+(?:\.\d+)?)b(?![a-z])", re.IGNORECASE)
+PRECISION_BYTES = (("fp4", 0.5), ("nf4", 0.5), ("q4", 0.5), ("fp8", 1.0), ("int8", 1.0), ("q8", 1.0))
+
+_index: Dict[str, int] = {}  # file name -> bytes under vram_models_path
+_indexed_at = 0.0
+INDEX_REFRESH = 300  # seconds before a file missing from the index triggers a rescan
+
+
+def _active_nodes(workflow: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any], List[Any]]]:
+    """(type, named inputs, widget values) of the nodes that will run"""
+    if not isinstance(workflow.get("nodes"), list):
+        for node in workflow.values():
+            if isinstance(node, dict) and "class_type" in node:
+                inputs = node.get("inputs") or {}
+                yield str(node["class_type"]), inputs, list(inputs.values())
+        return
+
+    definitions = workflow.get("definitions")
+    subgraphs = {
+        subgraph.get("id"): subgraph.get("nodes") or []
+        for subgraph in ((definitions or {}).get("subgraphs") or [] if isinstance(definitions, dict) else [])
+        if isinstance(subgraph, dict)
+    }
+    pending, seen = [workflow["nodes"]], set()
+    while pending:
+        for node in pending.pop():
+            if not isinstance(node, dict) or node.get("mode") in (2, 4):  # muted, bypassed
+                continue
+            node_type = str(node.get("type"))
+            if node_type in subgraphs:
+                if node_type not in seen:
+                    seen.add(node_type)
+                    pending.append(subgraphs[node_type])
+                continue
+            values = node.get("widgets_values") or []
+            if isinstance(values, dict):
+                values = list(values.values())
+            yield node_type, {}, values
+
+
+def _size_from_index(name: str) -> Optional[int]:
+    """Bytes of a model file under vram_models_path, if mounted"""
+    global _indexed_at
+    if not settings.vram_models_path:
+        return None
+    if name not in _index and time.monotonic() - _indexed_at > INDEX_REFRESH:
+        _indexed_at = time.monotonic()
+        found = {}
+        for root, _, files in os.walk(settings.vram_models_path, followlinks=True):
+            for file in files:
+                if MODEL_FILE.match(file):
+                    try:
+                        found.setdefault(file, os.stat(os.path.join(root, file)).st_size)
+                    except OSError:
+                        pass
+        _index.clear()
+        _index.update(found)
+    return _index.get(name)
+
+
+def model_size_mb(name: str, role: str) -> int:
+    """Size of a model file in MB: from disk when mounted, else from its name"""
+    size = _size_from_index(name)
+    if size is not None:
+        return int(size / 2 ** 20)
+    params = PARAMS.search(name) if role != "lora" else None  # a LoRA's "19b" names its base model
+    if not params:
+        return DEFAULT_SIZE_MB[role]
+    lowered = name.lower()
+    bytes_per_param = next((b for tag, b in PRECISION_BYTES if tag in lowered), 2.0)
+    if "mixed" in lowered:
+        bytes_per_param *= MIXED_PRECISION_FACTOR
+    return int(float(params.group(1)) * 1e9 * bytes_per_param / 2 ** 20)
+
+
+def _number(value: Any) -> Optional[int]:
+    return int(value) if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0 else None
+
+
+def estimate_workflow_vram(workflow: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Estimated peak VRAM of a workflow and how it was arrived at, or None if
+    it loads no model files (nothing to estimate from).
+
+    Returns {"estimated_vram", "weights_mb", "text_encoder_mb",
+    "sampling_mb", "decode_mb", "tokens", "shape", "models": {file: [role,
+    MB]}}; shape is "<width>x<height>x<frames>x<batch>" of the output.
+    """
+    files: Dict[str, str] = {}
+    width = height = 0
+    frames = batch = 1
+    compression = None
+    for node_type, inputs, values in _active_nodes(workflow or {}):
+        role = LOADER_ROLES.get(node_type)
+        if role is None and "Loader" in node_type:
+            role = "lora"  # unknown loaders: adapters, control nets, ...
+        if role:
+            for value in values:
+                if isinstance(value, str) and MODEL_FILE.match(value):
+                    name = value.replace("\\", "/").rsplit("/", 1)[-1]
+                    current = files.get(name)
+                    if current is None or ROLE_ORDER.index(role) < ROLE_ORDER.index(current):
+                        files[name] = role
+
+        order, spatial, temporal = LATENT_NODES.get(node_type, ((), None, None))
+        dims = dict(zip(order, values)) if order else {}
+        if inputs:
+            dims.update({key: inputs.get(key) for key in ("width", "height", "length", "batch_size")})
+        w, h = _number(dims.get("width")), _number(dims.get("height"))
+        if w and h:
+            if w * h > width * height:
+                width, height = w, h
+            frames = max(frames, _number(dims.get("length")) or 1)
+            batch = max(batch, _number(dims.get("batch_size")) or 1)
+        if spatial and (compression is None or spatial > compression[0]):
+            compression = (spatial, temporal)
+
+    if not files:
+        return None
+
+    models = {name: [role, model_size_mb(name, role)] for name, role in sorted(files.items())}
+    by_role = {role: sum(mb for r, mb in models.values() if r == role) for role in ROLE_ORDER}
+    weights = sum(by_role[role] for role in RESIDENT_ROLES)
+
+    spatial, temporal = compression or DEFAULT_COMPRESSION
+    latent_frames = 1 + (frames - 1) // temporal
+    tokens = math.ceil(width / spatial) * math.ceil(height / spatial) * latent_frames * batch
+    sampling = int(tokens * ACTIVATION_MB_PER_TOKEN)
+    decode = by_role["vae"] + int(
+        width * height / 1e6 * DECODE_MB_PER_MEGAPIXEL * min(latent_frames, DECODE_MAX_LATENT_FRAMES) * batch
+    )
+    peak = weights + max(by_role["text_encoder"], sampling, decode) + OVERHEAD_MB
+
+    return {
+        "estimated_vram": peak,
+        "weights_mb": weights,
+        "text_encoder_mb": by_role["text_encoder"],
+        "sampling_mb": sampling,
+        "decode_mb": decode,
+        "tokens": tokens,
+        "shape": f"{width}x{height}x{frames}x{batch}",
+        "models": models,
+    }
+
+
+def submission_estimate(workflow: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """estimate_workflow_vram for create_job: an odd graph must never fail a submission"""
+    try:
+        return estimate_workflow_vram(workflow)
+    except Exception as e:
+        logger.warning(f"VRAM estimate failed: {e}")
+        return None
@@ -0,0 +1,92 @@
+"""
+Learned peak-VRAM profiles per workflow signature
+
+Workers report the most VRAM a job used (result.peak_vram_mb: how far the
+GPU's use rose above its reading when the job started, sampled while the
+job ran alone on it). Each report is folded into rolling
+statistics for the job's workflow signature - "<runtime class>@<shape>",
+the template and model files of runtime_stats plus the output shape
+("<width>x<height>x<frames>x<batch>") - since the same template at 4K needs
+far more than at 720p, while prompt text and seed make no difference.
+
+The statistics are an exponentially weighted mean and variance (weight
+vram_profile_alpha, the RECORD_RUNTIME_SCRIPT update), so old samples decay
+and a profile follows a model or ComfyUI upgrade. Once a signature has
+vram_profile_min_samples samples, submissions get metadata.estimated_vram =
+its vram_profile_percentile (normal approximation: mean + z x stddev) and
+metadata.vram_source = "profile", in place of the workflow-graph guess:
+the claim script packs jobs onto GPUs by that figure, and workers admit
+them with VRAM_PROFILED_MARGIN_MB instead of the fixed
+VRAM_SAFETY_MARGIN_MB. Models ComfyUI kept loaded from an earlier job are
+in the baseline, so a job reusing them reports only what it added.
+"""
+import json
+import math
+from statistics import NormalDist
+from typing import Any, Dict, Optional
+
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+from config import settings
+from runtime_stats import RECORD_RUNTIME_SCRIPT
+
+
+def workflow_signature(job_class: str, estimate: Optional[Dict[str, Any]]) -> str:
+    """The signature a job's VRAM profile (and most specific runtime statistics) live under"""
+    return f"{job_class}@{estimate['shape'] if estimate else '-'}"
+
+
+def vram_percentile(stats: Dict[str, float], percentile: float) -> int:
+    """MB below which `percentile` % of peaks fall, from {n, mean, var}"""
+    z = NormalDist().inv_cdf(min(max(percentile, 1.0), 99.9) / 100)
+    return math.ceil(stats["mean"] + z * max(stats["var"], 0) ** 0.5)
+
+
+class VRAMProfiles:
+    """Rolling peak-VRAM statistics per workflow signature, in one Redis hash"""
+
+    PROFILES_KEY = "vram:profiles"
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._record = redis.register_script(RECORD_RUNTIME_SCRIPT)
+
+    async def predict(self, signature: str) -> Optional[int]:
+        """Learned peak VRAM (MB) for a signature, None until it has enough samples"""
+        return self.prediction(await self.redis.hget(self.PROFILES_KEY, signature))
+
+    def queue_predict(self, pipe: Pipeline, signature: str) -> None:
+        """Queue predict()'s read on a pipeline; its result goes to prediction()"""
+        pipe.hget(self.PROFILES_KEY, signature)
+
+    @staticmethod
+    def prediction(raw: Optional[str]) -> Optional[int]:
+        """predict() from the raw profile"""
+        if not raw:
+            return None
+        stats = json.loads(raw)
+        if stats["n"] < settings.vram_profile_min_samples:
+            return None
+        return vram_percentile(stats, settings.vram_profile_percentile)
+
+    async def record(self, signature: str, peak_mb: float) -> None:
+        """Fold one completed job's peak VRAM into its signature's profile"""
+        await self._record(
+            keys=[self.PROFILES_KEY],
+            args=[peak_mb, settings.vram_profile_alpha, signature]
+        )
+
+    async def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Every profile: {signature: {n, mean, stddev, estimate}}"""
+        raw = await self.redis.hgetall(self.PROFILES_KEY)
+        snapshot = {}
+        for signature, value in sorted(raw.items()):
+            stats = json.loads(value)
+            snapshot[signature] = {
+                "n": stats["n"],
+                "mean": round(stats["mean"]),
+                "stddev": round(max(stats["var"], 0) ** 0.5),
+                "estimate": vram_percentile(stats, settings.vram_profile_percentile),
+            }
+        return snapshot
@@ -1,115 +1,389 @@
 """
 WebSocket Manager for real-time queue updates
+
+Each client gets a ClientConnection: a bounded outbound queue drained by
+its own writer task, so broadcast() never waits on a socket and one slow
+browser cannot hold up the others. Job events queued for a client that has
+not sent them yet are coalesced into the latest state of that job; past
+ws_client_queue_size pending messages the oldest is dropped, and a client
+whose send stalls for ws_send_timeout is disconnected.
+
+Clients subscribe to topics - user:{user_id}, job:{job_id}, queue or all -
+and an index from topic to sockets routes each event only to interested
+clients. Job events are cut down to id, user_id, status and the fields that
+changed since the previous event for that job.
 """
 import json
 import logging
 import asyncio
-from typing import List, Set
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+from itertools import count
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 from fastapi import WebSocket
+from config import settings
+from models import Job, JobStatus
 from redis_client import RedisClient
 
 logger = logging.getLogger(__name__)
 
+PUBSUB_IDLE_PING = 15  # seconds of silence before checking the subscription is alive
+PUBSUB_BASE_BACKOFF = 1  # seconds; doubles per failed reconnect
+PUBSUB_MAX_BACKOFF = 30
+
+JOB_EVENTS = ("job_created", "job_updated", "job_deleted")
+TOPIC_ALL = "all"  # every job event (dashboards)
+TOPIC_QUEUE = "queue"  # aggregate queue_status messages
+ALWAYS_SENT = ("id", "user_id", "status")  # in every job delta
+TERMINAL_STATUSES = (JobStatus.COMPLETED.value, JobStatus.FAILED.value, JobStatus.CANCELLED.value)
+MAX_TRACKED_JOBS = 10000  # job states kept for computing deltas
+QUEUE_STATS_INTERVAL = 1.0  # seconds between queue_status messages, at most
+
+
+class ClientConnection:
+    """One WebSocket client: bounded outbound queue plus its writer task"""
+
+    def __init__(self, websocket: WebSocket, manager: "WebSocketManager", max_pending: int):
+        self.websocket = websocket
+        self.manager = manager
+        self.max_pending = max_pending
+        # key -> (message, serialized); job events are keyed by job id
+        self.pending: "OrderedDict[Any, Tuple[Optional[dict], Optional[str]]]" = OrderedDict()
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.topics: Set[str] = set()
+        self._sequence = count()
+        self.writer = asyncio.create_task(self._write())
+
+    def enqueue(self, message: Optional[dict], text: Optional[str], key: Any = None) -> None:
+        """Queue a message without blocking; coalesce or drop instead of waiting"""
+        if key is not None and key in self.pending:
+            previous, _ = self.pending[key]
+            self.pending[key] = (coalesce(previous, message), None)
+            self.coalesced += 1
+            return
+
+        if len(self.pending) >= self.max_pending:
+            self.pending.popitem(last=False)
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                logger.warning(f"WebSocket client falling behind: {self.dropped} update(s) dropped")
+        self.pending[key if key is not None else next(self._sequence)] = (message, text)
+        self.ready.set()
+
+    async def _write(self) -> None:
+        try:
+            while True:
+                await self.ready.wait()
+                while self.pending:
+                    _, (message, text) = self.pending.popitem(last=False)
+                    if text is None:
+                        text = json.dumps(message)
+                    await asyncio.wait_for(self.websocket.send_text(text), settings.ws_send_timeout)
+                    self.sent += 1
+                self.ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning(f"WebSocket send stalled for {settings.ws_send_timeout}s; disconnecting slow client")
+            await self._drop()
+        except Exception as e:
+            logger.error(f"Failed to send to WebSocket: {e}")
+            await self._drop()
+
+    async def _drop(self) -> None:
+        self.manager.disconnect(self.websocket)
+        try:
+            await asyncio.wait_for(self.websocket.close(), settings.ws_send_timeout)
+        except Exception:
+            pass
+
+
+def coalesce(previous: Optional[dict], latest: Optional[dict]) -> Optional[dict]:
+    """Fold two queued events for the same job into one carrying its latest state"""
+    if previous is None or latest is None or latest["type"] == "job_deleted":
+        return latest
+    if previous["type"] == "job_deleted":
+        return latest
+    return {
+        **latest,
+        # The client has not seen job_created yet: still announce it as created
+        "type": previous["type"] if previous["type"] == "job_created" else latest["type"],
+        "data": {**previous.get("data", {}), **latest.get("data", {})},
+    }
+
+
+def coalesce_key(message: dict) -> Optional[str]:
+    """Job events coalesce per job, queue stats into the latest; the rest as is"""
+    if message.get("type") in JOB_EVENTS:
+        data = message.get("data") or {}
+        job_id = data.get("id") or data.get("job_id")
+        if job_id:
+            return f"job:{job_id}"
+    if message.get("type") == "queue_status":
+        return TOPIC_QUEUE
+    return None
+
+
+def valid_topic(topic: Any) -> bool:
+    if not isinstance(topic, str) or len(topic) > 128:
+        return False
+    if topic in (TOPIC_QUEUE, TOPIC_ALL):
+        return True
+    kind, _, name = topic.partition(":")
+    return kind in ("user", "job") and bool(name)
+
+
+def job_summary(job: Job) -> Dict[str, Any]:
+    """Slim job state sent to subscribers: status fields, no workflow/result/metadata"""
+    data = job.model_dump(mode="json", include=set(RedisClient.JOB_EVENT_FIELDS))
+    return {name: value for name, value in data.items() if value is not None}
+
 
 class WebSocketManager:
-    """Manages WebSocket connections and broadcasts queue updates"""
+    """Manages WebSocket connections and routes queue updates by topic"""
 
     def __init__(self, redis_client: RedisClient):
         self.redis_client = redis_client
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        # topic -> subscribed sockets
+        self.subscribers: Dict[str, Set[WebSocket]] = defaultdict(set)
+        # job id -> fields last broadcast, to send only what changed
+        self.job_states: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
         self.pubsub = None
         self.listener_task = None
+        self.queue_stats_task = None
+        self._queue_changed = asyncio.Event()
 
-    async def connect(self, websocket: WebSocket):
-        """Accept new WebSocket connection"""
+    async def connect(self, websocket: WebSocket, topics: Iterable[str] = ()):
+        """Accept new WebSocket connection, optionally subscribed to topics"""
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections[websocket] = ClientConnection(websocket, self, settings.ws_client_queue_size)
         logger.info(f"WebSocket connected. Total connections: {len(self.active_connections)}")
+        if topics:
+            await self.subscribe(websocket, topics)
 
         # Start listener if not already running
         if not self.listener_task:
             self.listener_task = asyncio.create_task(self._listen_to_redis())
+            self.queue_stats_task = asyncio.create_task(self._publish_queue_stats())
 
     def disconnect(self, websocket: WebSocket):
         """Remove WebSocket connection"""
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        connection = self.active_connections.pop(websocket, None)
+        if connection is None:
+            return
+        for topic in connection.topics:
+            self._remove_subscriber(topic, websocket)
+        if connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
         logger.info(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
 
+    async def subscribe(self, websocket: WebSocket, topics: Iterable[str]) -> List[str]:
+        """
+        Subscribe a client to topics - user:{user_id}, job:{job_id}, queue
+        (aggregate stats) or all (every job event). Sends the current state
+        of each newly watched job and of the queue. Returns the client's
+        topics; invalid ones and those past ws_max_topics are ignored.
+        """
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            return []
+        added = []
+        for topic in topics:
+            if topic in connection.topics or not valid_topic(topic):
+                continue
+            if len(connection.topics) >= settings.ws_max_topics:
+                break
+            connection.topics.add(topic)
+            self.subscribers[topic].add(websocket)
+            added.append(topic)
+
+        job_ids = [topic[len("job:"):] for topic in added if topic.startswith("job:")]
+        if job_ids:
+            jobs = await self.redis_client.get_jobs(job_ids, with_result=False)
+            for job in jobs:
+                connection.enqueue({"type": "job_state", "data": job_summary(job)}, None, f"job:{job.id}")
+        if TOPIC_QUEUE in added:
+            self._queue_changed.set()
+        return sorted(connection.topics)
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str]) -> List[str]:
+        """Drop topics from a client's subscriptions; returns what is left"""
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            return []
+        for topic in topics:
+            if topic in connection.topics:
+                connection.topics.discard(topic)
+                self._remove_subscriber(topic, websocket)
+        return sorted(connection.topics)
+
+    def _remove_subscriber(self, topic: str, websocket: WebSocket) -> None:
+        sockets = self.subscribers.get(topic)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                del self.subscribers[topic]
+
     async def broadcast(self, message: dict):
-        """Broadcast message to all connected clients"""
-        if not self.active_connections:
-            return
+        """Route a pub/sub event to the clients subscribed to it (never waits on a socket)"""
+        if message.get("type") in JOB_EVENTS:
+            self._queue_changed.set()
+            message = self._job_delta(message)
+            data = message["data"]
+            topics = (TOPIC_ALL, f"user:{data.get('user_id')}", f"job:{data.get('id')}")
+        else:
+            topics = (TOPIC_ALL,)
 
-        message_str = json.dumps(message)
-        disconnected = []
+        recipients = set()
+        for topic in topics:
+            recipients.update(self.subscribers.get(topic, ()))
+        self._send(recipients, message)
 
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message_str)
-            except Exception as e:
-                logger.error(f"Failed to send to WebSocket: {e}")
-                disconnected.append(connection)
+    def _send(self, recipients: Iterable[WebSocket], message: dict) -> None:
+        message_str = None
+        key = coalesce_key(message)
+        for websocket in recipients:
+            connection = self.active_connections.get(websocket)
+            if connection:
+                if message_str is None:
+                    message_str = json.dumps(message)
+                connection.enqueue(message, message_str, key)
+
+    def _job_delta(self, message: dict) -> dict:
+        """
+        Slim a job event down to id, user_id, status and the fields that
+        changed since the last event for that job.
+        """
+        data = dict(message.get("data") or {})
+        job_id = data.get("id") or data.get("job_id")
+        if not job_id:
+            return message
+        data["id"] = job_id
+        data.pop("job_id", None)
+
+        previous = self.job_states.pop(job_id, {})
+        if message["type"] == "job_deleted":
+            data.setdefault("user_id", previous.get("user_id"))
+            return {**message, "data": data}
+
+        delta = {
+            name: value for name, value in data.items()
+            if name in ALWAYS_SENT or previous.get(name) != value
+        }
+        for name in ALWAYS_SENT:
+            if delta.get(name) is None and previous.get(name) is not None:
+                delta[name] = previous[name]
 
-        # Remove disconnected clients
-        for connection in disconnected:
-            self.disconnect(connection)
+        if data.get("status") not in TERMINAL_STATUSES:
+            self.job_states[job_id] = {**previous, **data}
+            while len(self.job_states) > MAX_TRACKED_JOBS:
+                self.job_states.popitem(last=False)
+        return {**message, "data": delta}
+
+    async def _publish_queue_stats(self) -> None:
+        """Send queue_status to 'queue' subscribers after job events, at most every QUEUE_STATS_INTERVAL"""
+        while True:
+            await self._queue_changed.wait()
+            self._queue_changed.clear()
+            if self.subscribers.get(TOPIC_QUEUE):
+                stats = await self.redis_client.get_all_queue_stats()
+                self._send(list(self.subscribers.get(TOPIC_QUEUE, ())), {
+                    "type": "queue_status",
+                    "data": stats,
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                })
+            await asyncio.sleep(QUEUE_STATS_INTERVAL)
+
+    def send_to(self, websocket: WebSocket, text: str) -> None:
+        """Queue a text frame for one client, in order with its broadcasts"""
+        connection = self.active_connections.get(websocket)
+        if connection:
+            connection.enqueue(None, text)
+
+    def stats(self) -> Dict[str, int]:
+        """Fan-out counters summed over connected clients"""
+        connections = list(self.active_connections.values())
+        return {
+            "connections": len(connections),
+            "topics": len(self.subscribers),
+            "pending": sum(len(c.pending) for c in connections),
+            "sent": sum(c.sent for c in connections),
+            "coalesced": sum(c.coalesced for c in connections),
+            "dropped": sum(c.dropped for c in connections),
+        }
+
+    async def close(self):
+        """Stop the Redis listener and the client writers"""
+        for websocket in list(self.active_connections):
+            self.disconnect(websocket)
+        for task in (self.listener_task, self.queue_stats_task):
+            if task:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self.listener_task = self.queue_stats_task = None
 
     async def _listen_to_redis(self):
         """
         Listen to Redis pub/sub and broadcast updates.
-        Implements automatic reconnection with exponential backoff.
+
+        Awaits the subscription socket, so the task sleeps until a message
+        arrives. After PUBSUB_IDLE_PING seconds of silence it PINGs through
+        the subscription; no reply by the next idle timeout means the
+        connection is dead. Any failure reconnects with exponential backoff
+        capped at PUBSUB_MAX_BACKOFF - real-time updates resume by themselves
+        once Redis is back.
         """
-        max_retries = 5
-        retry_count = 0
-        base_delay = 2  # seconds
+        attempt = 0
 
-        try:
-            while retry_count < max_retries:
-                try:
-                    self.pubsub = self.redis_client.subscribe_to_updates()
+        while True:
+            try:
+                self.pubsub = await self.redis_client.subscribe_to_updates()
+                if attempt:
+                    logger.info(f"Redis pub/sub listener reconnected after {attempt} failed attempt(s)")
+                else:
                     logger.info("Started Redis pub/sub listener")
-                    retry_count = 0  # Reset on successful connection
-
-                    while True:
-                        # Non-blocking poll: wait up to 0.1s for a message,
-                        # then yield to the event loop so health checks etc. work
-                        message = self.pubsub.get_message(timeout=0.1)
-                        if message and message['type'] == 'message':
-                            try:
-                                data = json.loads(message['data'])
-                                await self.broadcast(data)
-                            except json.JSONDecodeError as e:
-                                logger.error(f"Failed to decode Redis message: {e}")
-                        await asyncio.sleep(0.01)
-
-                except Exception as e:
-                    retry_count += 1
-                    delay = base_delay ** retry_count  # Exponential backoff: 2s, 4s, 8s, 16s, 32s
-
-                    if retry_count >= max_retries:
-                        logger.error(
-                            f"Redis listener failed after {max_retries} attempts. "
-                            f"Real-time updates disabled. Error: {e}"
-                        )
-                        self.listener_task = None
-                        break
-
-                    logger.warning(
-                        f"Redis listener error (attempt {retry_count}/{max_retries}): {e}. "
-                        f"Retrying in {delay}s..."
+                attempt = 0
+                awaiting_pong = False
+
+                while True:
+                    message = await self.pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=PUBSUB_IDLE_PING
                     )
-                    await asyncio.sleep(delay)
-
-            # If we exit the loop, listener has failed
-            if retry_count >= max_retries:
-                logger.critical("WebSocket real-time updates permanently disabled due to Redis connection failure")
-
-        finally:
-            # Resource cleanup: Close pubsub connection
-            if self.pubsub:
-                try:
-                    self.pubsub.close()
-                    logger.info("Redis pub/sub connection closed")
-                except Exception as e:
-                    logger.error(f"Error closing pubsub connection: {e}")
+                    if message is None:
+                        if awaiting_pong:
+                            raise ConnectionError(f"No PING reply from Redis within {PUBSUB_IDLE_PING}s")
+                        await self.pubsub.ping()
+                        awaiting_pong = True
+                        continue
+
+                    awaiting_pong = False
+                    if message['type'] == 'message':
+                        try:
+                            data = json.loads(message['data'])
+                            await self.broadcast(data)
+                        except json.JSONDecodeError as e:
+                            logger.error(f"Failed to decode Redis message: {e}")
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                attempt += 1
+                delay = min(PUBSUB_BASE_BACKOFF * 2 ** (attempt - 1), PUBSUB_MAX_BACKOFF)
+                logger.warning(
+                    f"Redis listener error (attempt {attempt}): {e} - "
+                    f"real-time updates paused, retrying in {delay}s..."
+                )
+                await asyncio.sleep(delay)
+
+            finally:
+                # Resource cleanup: Close pubsub connection
+                if self.pubsub:
+                    try:
+                        await self.pubsub.aclose()
+                    except Exception as e:
+                        logger.error(f"Error closing pubsub connection: {e}")
+                    self.pubsub = None
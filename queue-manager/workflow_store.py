@@ -0,0 +1,197 @@
+"""
+Content-addressed workflow storage with node-level deduplication
+
+Workshop users submit near-identical template workflows that differ in one
+prompt node. Instead of storing every workflow whole, each workflow is split
+into chunks (one per node, one per subgraph definition, plus the remaining
+skeleton), each chunk is stored once under its SHA-256 and reference
+counted, and a job keeps only a small manifest of chunk digests.
+
+Supported shapes:
+- API format: {node_id: {"class_type": ..., "inputs": ...}} -> one chunk per node
+- UI format: {"nodes": [...], "links": [...], "definitions": {"subgraphs": [...]}}
+  -> one chunk per node, one per subgraph, one for everything else
+- Anything else is stored as a single chunk
+"""
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+# Increment refs for chunks that already exist; report the ones that don't.
+# KEYS[1] = refs hash, ARGV[1] = chunk key prefix, ARGV[2..] = digests
+ACQUIRE_CHUNKS_SCRIPT = """
+local missing = {}
+for i = 2, #ARGV do
+    if redis.call('EXISTS', ARGV[1] .. ARGV[i]) == 1 then
+        redis.call('HINCRBY', KEYS[1], ARGV[i], 1)
+    else
+        table.insert(missing, ARGV[i])
+    end
+end
+return missing
+"""
+
+# Store chunks reported missing by ACQUIRE (another writer may have won the
+# race, in which case SET NX is a no-op and we only take a reference).
+# KEYS[1] = refs hash, ARGV[1] = chunk key prefix, ARGV[2..] = digest, data pairs
+STORE_CHUNKS_SCRIPT = """
+for i = 2, #ARGV, 2 do
+    redis.call('SET', ARGV[1] .. ARGV[i], ARGV[i + 1], 'NX')
+    redis.call('HINCRBY', KEYS[1], ARGV[i], 1)
+end
+return 1
+"""
+
+# Drop one reference per digest, deleting chunks nobody uses any more.
+# KEYS[1] = refs hash, ARGV[1] = chunk key prefix, ARGV[2..] = digests
+RELEASE_CHUNKS_SCRIPT = """
+local freed = 0
+for i = 2, #ARGV do
+    if redis.call('HINCRBY', KEYS[1], ARGV[i], -1) <= 0 then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+        redis.call('DEL', ARGV[1] .. ARGV[i])
+        freed = freed + 1
+    end
+end
+return freed
+"""
+
+
+def _encode(value: Any) -> str:
+    """Canonical JSON so equal content always hashes the same"""
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def _digest(data: str) -> str:
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _is_api_format(workflow: Dict[str, Any]) -> bool:
+    return bool(workflow) and all(
+        isinstance(node, dict) and "class_type" in node for node in workflow.values()
+    )
+
+
+def split_workflow(workflow: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Split a workflow into a manifest and content-addressed chunks.
+
+    Returns:
+        (manifest, chunks) where chunks maps digest -> canonical JSON and the
+        manifest lists every digest under "chunks" (unique, in order).
+    """
+    chunks: Dict[str, str] = {}
+
+    def add(value: Any) -> str:
+        data = _encode(value)
+        digest = _digest(data)
+        chunks.setdefault(digest, data)
+        return digest
+
+    if _is_api_format(workflow):
+        manifest: Dict[str, Any] = {
+            "format": "api",
+            "nodes": {node_id: add(node) for node_id, node in workflow.items()},
+        }
+    elif isinstance(workflow.get("nodes"), list):
+        skeleton = {k: v for k, v in workflow.items() if k != "nodes"}
+        manifest = {"format": "ui", "nodes": [add(node) for node in workflow["nodes"]]}
+
+        definitions = skeleton.get("definitions")
+        if isinstance(definitions, dict) and isinstance(definitions.get("subgraphs"), list):
+            manifest["subgraphs"] = [add(subgraph) for subgraph in definitions["subgraphs"]]
+            skeleton["definitions"] = {k: v for k, v in definitions.items() if k != "subgraphs"}
+
+        manifest["skeleton"] = add(skeleton)
+    else:
+        manifest = {"format": "raw", "root": add(workflow)}
+
+    manifest["version"] = MANIFEST_VERSION
+    manifest["chunks"] = list(chunks)
+    return manifest, chunks
+
+
+def join_workflow(manifest: Dict[str, Any], chunks: Dict[str, str]) -> Dict[str, Any]:
+    """Rebuild a workflow from its manifest and chunk data (digest -> JSON)"""
+    def load(digest: str) -> Any:
+        return json.loads(chunks[digest])
+
+    fmt = manifest["format"]
+    if fmt == "api":
+        return {node_id: load(digest) for node_id, digest in manifest["nodes"].items()}
+
+    if fmt == "ui":
+        workflow = load(manifest["skeleton"])
+        if "subgraphs" in manifest:
+            definitions = workflow.setdefault("definitions", {})
+            definitions["subgraphs"] = [load(digest) for digest in manifest["subgraphs"]]
+        workflow["nodes"] = [load(digest) for digest in manifest["nodes"]]
+        return workflow
+
+    return load(manifest["root"])
+
+
+class WorkflowStore:
+    """Reference-counted chunk store shared by all jobs"""
+
+    CHUNK_KEY_PREFIX = "workflow:chunk:"
+    REFS_KEY = "workflow:refs"
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._acquire = redis.register_script(ACQUIRE_CHUNKS_SCRIPT)
+        self._store = redis.register_script(STORE_CHUNKS_SCRIPT)
+        self._release = redis.register_script(RELEASE_CHUNKS_SCRIPT)
+
+    async def put(self, workflow: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Store a workflow and take one reference on each of its chunks.
+        Only chunks not already in Redis are sent over the wire.
+
+        Returns the manifest to keep on the job.
+        """
+        manifest, chunks = split_workflow(workflow)
+        missing = await self._acquire(
+            keys=[self.REFS_KEY], args=[self.CHUNK_KEY_PREFIX, *manifest["chunks"]]
+        )
+        if missing:
+            args: List[str] = [self.CHUNK_KEY_PREFIX]
+            for digest in missing:
+                args.extend((digest, chunks[digest]))
+            await self._store(keys=[self.REFS_KEY], args=args)
+
+        logger.debug(
+            f"Stored workflow: {len(manifest['chunks'])} chunk(s), {len(missing)} new"
+        )
+        return manifest
+
+    async def release(self, manifest: Dict[str, Any]) -> int:
+        """Drop a job's references; returns the number of chunks freed"""
+        if not manifest.get("chunks"):
+            return 0
+        return await self._release(
+            keys=[self.REFS_KEY], args=[self.CHUNK_KEY_PREFIX, *manifest["chunks"]]
+        )
+
+    async def get(self, manifest: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Load a workflow by manifest (None if a chunk has gone missing)"""
+        digests = manifest["chunks"]
+        values = await self.redis.mget([self.CHUNK_KEY_PREFIX + d for d in digests]) if digests else []
+        return self.assemble(manifest, values)
+
+    def assemble(self, manifest: Dict[str, Any], values: List[Optional[str]]) -> Optional[Dict[str, Any]]:
+        """Join a manifest with chunk values fetched in manifest["chunks"] order"""
+        chunks = dict(zip(manifest["chunks"], values))
+        missing = [digest for digest, data in chunks.items() if data is None]
+        if missing:
+            logger.error(f"Workflow chunks missing from store: {missing[:3]}")
+            return None
+        return join_workflow(manifest, chunks)
@@ -369,7 +369,7 @@ if [ "${INFERENCE_MODE}" = "serverless" ]; then
 fi
 
 # Validate queue mode
-VALID_MODES=("fifo" "round_robin" "priority")
+VALID_MODES=("fifo" "round_robin" "priority" "shortest_expected")
 if [[ " ${VALID_MODES[*]} " =~ " ${QUEUE_MODE} " ]]; then
     pass_test "Queue mode valid: ${QUEUE_MODE}"
 else